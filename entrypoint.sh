@@ -9,9 +9,12 @@ if [ -n "${DB_HOST}" ]; then
   done
 fi
 
-# Apply migrations and collect static files
-python manage.py migrate --noinput
-python manage.py collectstatic --noinput
+# Apply migrations and collect static files (worker ตั้ง RUN_MIGRATIONS=0 ไว้ ไม่ให้ชนกับ web)
+if [ "${RUN_MIGRATIONS:-1}" = "1" ]; then
+  python manage.py migrate --noinput
+  python manage.py createcachetable
+  python manage.py collectstatic --noinput
+fi
 
 # Start application
 exec "$@"
@@ -0,0 +1,35 @@
+# gunicorn.conf.py (gunicorn อ่านไฟล์นี้เองอัตโนมัติเมื่อรันจาก /code)
+#
+# RAG_PRELOAD_MODEL=1 -> โหลด app + embedding model ใน master ครั้งเดียว แล้ว fork worker
+# หน่วยความจำของ model จะถูกแชร์แบบ copy-on-write แทนที่จะมีคนละก้อนทุก worker
+import gc
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "3"))
+preload_app = os.getenv("RAG_PRELOAD_MODEL", "0") == "1"
+# ASGI (mysite.asgi:application): view AI เป็น async -> รอ Gemini ได้หลายตัวพร้อมกันโดยไม่จอง worker
+# ตั้ง GUNICORN_WORKER_CLASS=sync ถ้าจะกลับไปรัน mysite.wsgi:application แบบเดิม
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "uvicorn_worker.UvicornWorker")
+# sync worker ถือ request ไว้ตลอดที่ stream คำตอบ AI -> ให้เวลาพอสำหรับ generation ยาวๆ
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+
+
+def when_ready(server):
+    if not server.cfg.preload_app:
+        return
+    from plotcraft.rag_service import rag_service
+
+    rag_service.warmup()
+    # ย้าย object ที่มีอยู่ทั้งหมดออกจาก GC -> GC ใน worker จะไม่ไปแตะหน้า memory ที่แชร์กันอยู่
+    gc.freeze()
+    server.log.info("RAG embedding model preloaded in master (pid %s)", os.getpid())
+
+
+def post_fork(server, worker):
+    # ไม่ preload -> app ยังไม่ถูก import ใน master ไม่มีอะไรที่ fork ติดมาให้ reset
+    if not server.cfg.preload_app:
+        return
+    from plotcraft.rag_service import after_fork
+
+    after_fork()
@@ -151,3 +151,119 @@ LOGOUT_REDIRECT_URL = 'plotcraft:landing'
 # django-tailwind settings
 TAILWIND_APP_NAME = 'theme'
 TAILWIND_CSS_PATH = 'css/dist/styles.css'
+
+# cache กลางที่ทุก gunicorn worker เห็นร่วมกัน (ตารางสร้างด้วย manage.py createcachetable ใน entrypoint.sh)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'plotcraft_cache',
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '20000'))},
+    }
+}
+
+# ==================== RAG (AI Assistant) ====================
+# โหลด embedding model ใน gunicorn master ครั้งเดียวแล้วแชร์ให้ worker (ดู gunicorn.conf.py)
+RAG_PRELOAD_MODEL = os.getenv('RAG_PRELOAD_MODEL', '0') == '1'
+RAG_TORCH_THREADS = int(os.getenv('RAG_TORCH_THREADS', '1'))
+
+# 'local' = torch ใน process เอง, 'onnx' = ONNX int8 หรือ fp32 ตามที่ export ไว้ (manage.py rag_export_onnx),
+# 'remote' = ใช้ embedding server (manage.py embedding_server)
+RAG_EMBEDDING_BACKEND = os.getenv('RAG_EMBEDDING_BACKEND', 'local')
+RAG_ONNX_MODEL_DIR = os.getenv('RAG_ONNX_MODEL_DIR', str(BASE_DIR / 'models' / 'minilm-onnx'))
+RAG_ONNX_THREADS = int(os.getenv('RAG_ONNX_THREADS', '1'))
+RAG_EMBEDDING_URL = os.getenv('RAG_EMBEDDING_URL', 'http://127.0.0.1:8765')
+RAG_EMBEDDING_TIMEOUT = float(os.getenv('RAG_EMBEDDING_TIMEOUT', '30'))
+RAG_EMBEDDING_SERVER_BACKEND = os.getenv('RAG_EMBEDDING_SERVER_BACKEND', 'local')
+RAG_EMBEDDING_SERVER_MAX_BATCH = int(os.getenv('RAG_EMBEDDING_SERVER_MAX_BATCH', '64'))
+RAG_EMBEDDING_SERVER_WINDOW_MS = float(os.getenv('RAG_EMBEDDING_SERVER_WINDOW_MS', '10'))
+
+# ที่เก็บ vector: 'chroma_http' = container chroma_db (CHROMA_HOST/CHROMA_PORT),
+# 'chroma_persistent' = ChromaDB ฝังใน process, 'flat' = NumPy flat index (ไม่ต้องมี network/chromadb)
+RAG_VECTOR_STORE = os.getenv('RAG_VECTOR_STORE', 'chroma_http')
+RAG_VECTOR_STORE_PATH = os.getenv('RAG_VECTOR_STORE_PATH', str(BASE_DIR / 'vector_store'))
+# 'none' = collection เดียวรวมทุกคน (ค่าเดิม), 'user' = 1 collection ต่อผู้เขียน
+# เปิด 'user' บนระบบที่มีข้อมูลแล้ว ต้องรัน manage.py rag_reshard ทันที ไม่งั้นแชทค้น embedding เดิมไม่เจอ
+RAG_SHARDING = os.getenv('RAG_SHARDING', 'none')
+
+# คิว index เบื้องหลัง (ดู plotcraft/rag_queue.py และ manage.py rag_worker)
+RAG_QUEUE_BATCH_SIZE = int(os.getenv('RAG_QUEUE_BATCH_SIZE', '20'))
+# save ซ้ำภายในกี่วินาทีจะถูกรวมเป็นงานเดียว (ทำเฉพาะเวอร์ชันล่าสุด) แต่รอรวมแล้วไม่เกิน MAX
+RAG_QUEUE_DEBOUNCE_SECONDS = float(os.getenv('RAG_QUEUE_DEBOUNCE_SECONDS', '10'))
+RAG_QUEUE_DEBOUNCE_MAX_SECONDS = float(os.getenv('RAG_QUEUE_DEBOUNCE_MAX_SECONDS', '120'))
+RAG_QUEUE_POLL_SECONDS = float(os.getenv('RAG_QUEUE_POLL_SECONDS', '1'))
+RAG_QUEUE_LEASE_SECONDS = int(os.getenv('RAG_QUEUE_LEASE_SECONDS', '300'))
+RAG_QUEUE_MAX_ATTEMPTS = int(os.getenv('RAG_QUEUE_MAX_ATTEMPTS', '8'))
+RAG_QUEUE_RETRY_BASE_SECONDS = float(os.getenv('RAG_QUEUE_RETRY_BASE_SECONDS', '5'))
+RAG_QUEUE_RETRY_MAX_SECONDS = float(os.getenv('RAG_QUEUE_RETRY_MAX_SECONDS', '600'))
+
+# cache ของ embedding (ตาราง EmbeddingCacheEntry + LRU ใน process)
+RAG_EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('RAG_EMBEDDING_CACHE_MAX_ENTRIES', '100000'))
+RAG_EMBEDDING_CACHE_MEMORY_ENTRIES = int(os.getenv('RAG_EMBEDDING_CACHE_MEMORY_ENTRIES', '2000'))
+
+# แชทพี่บก.: LRU ของ embedding คำถาม (ต่อ process) + cache ผลค้นหา context (ถูกล้างเมื่อเนื้อหานิยายเปลี่ยน)
+RAG_QUERY_CACHE_ENTRIES = int(os.getenv('RAG_QUERY_CACHE_ENTRIES', '1000'))
+RAG_RETRIEVAL_CACHE_SECONDS = int(os.getenv('RAG_RETRIEVAL_CACHE_SECONDS', '120'))
+
+# Context ของแชท: ดึง candidate กี่อัน แล้วคัดให้อยู่ในงบ token (โควตา = สัดส่วนของงบที่แต่ละประเภทใช้ได้สูงสุด)
+RAG_CONTEXT_CANDIDATES = int(os.getenv('RAG_CONTEXT_CANDIDATES', '12'))
+RAG_CONTEXT_TOKEN_BUDGET = int(os.getenv('RAG_CONTEXT_TOKEN_BUDGET', '1200'))
+RAG_CONTEXT_QUOTAS = os.getenv('RAG_CONTEXT_QUOTAS', 'character=0.35,scene=0.35,content=0.6')
+
+# สรุปตอน/เรื่องย่อสะสม (ดู plotcraft/summaries.py): รอให้หยุดเขียนกี่วินาทีค่อยสรุป,
+# รวมสรุปตอนเข้าเรื่องย่อครั้งละกี่ตอน, และงบ token ของเรื่องย่อใน prompt แชท/ร่างฉาก
+RAG_SUMMARY_DEBOUNCE_SECONDS = float(os.getenv('RAG_SUMMARY_DEBOUNCE_SECONDS', '300'))
+RAG_SUMMARY_DEBOUNCE_MAX_SECONDS = float(os.getenv('RAG_SUMMARY_DEBOUNCE_MAX_SECONDS', '1800'))
+RAG_SUMMARY_FOLD_CHAPTERS = int(os.getenv('RAG_SUMMARY_FOLD_CHAPTERS', '8'))
+RAG_SUMMARY_TOKEN_BUDGET = int(os.getenv('RAG_SUMMARY_TOKEN_BUDGET', '600'))
+
+# ห้องแชทพี่บก. (ดู plotcraft/chat_sessions.py): เก็บ turn ล่าสุดกี่อันแบบคำต่อคำ, รวม turn เก่าเข้า summary ครั้งละกี่อัน,
+# และงบ token ของประวัติแชทใน prompt
+RAG_CHAT_RECENT_TURNS = int(os.getenv('RAG_CHAT_RECENT_TURNS', '4'))
+RAG_CHAT_FOLD_TURNS = int(os.getenv('RAG_CHAT_FOLD_TURNS', '6'))
+RAG_CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv('RAG_CHAT_HISTORY_TOKEN_BUDGET', '800'))
+
+# การหั่นเนื้อหาตอนเป็น chunk (MiniLM รับได้ ~128 token ≈ 400 ตัวอักษรไทย) MAX_CHARS รวม OVERLAP แล้ว
+RAG_CHUNK_MAX_CHARS = int(os.getenv('RAG_CHUNK_MAX_CHARS', '400'))
+RAG_CHUNK_MIN_CHARS = int(os.getenv('RAG_CHUNK_MIN_CHARS', '200'))
+RAG_CHUNK_OVERLAP_CHARS = int(os.getenv('RAG_CHUNK_OVERLAP_CHARS', '80'))
+
+# ด่านเรียก Gemini (ดู plotcraft/llm_gateway.py) ค่าต่อ process: จำนวนพร้อมกัน (sync กับ async นับแยก), รอคิวได้นานเท่าไร,
+# timeout ต่อครั้ง / deadline รวม retry, retry กี่ครั้ง และ circuit breaker (สัดส่วน error ใน window -> พักกี่วินาที)
+RAG_LLM_MAX_CONCURRENCY = int(os.getenv('RAG_LLM_MAX_CONCURRENCY', '8'))
+RAG_LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv('RAG_LLM_QUEUE_TIMEOUT_SECONDS', '10'))
+RAG_LLM_TIMEOUT_SECONDS = float(os.getenv('RAG_LLM_TIMEOUT_SECONDS', '45'))
+RAG_LLM_DEADLINE_SECONDS = float(os.getenv('RAG_LLM_DEADLINE_SECONDS', '90'))
+RAG_LLM_MAX_ATTEMPTS = int(os.getenv('RAG_LLM_MAX_ATTEMPTS', '3'))
+RAG_LLM_RETRY_BASE_SECONDS = float(os.getenv('RAG_LLM_RETRY_BASE_SECONDS', '1'))
+RAG_LLM_BREAKER_WINDOW_SECONDS = float(os.getenv('RAG_LLM_BREAKER_WINDOW_SECONDS', '60'))
+RAG_LLM_BREAKER_MIN_CALLS = int(os.getenv('RAG_LLM_BREAKER_MIN_CALLS', '5'))
+RAG_LLM_BREAKER_FAILURE_RATIO = float(os.getenv('RAG_LLM_BREAKER_FAILURE_RATIO', '0.5'))
+RAG_LLM_BREAKER_COOLDOWN_SECONDS = float(os.getenv('RAG_LLM_BREAKER_COOLDOWN_SECONDS', '30'))
+
+# เวลาอ่านโดยประมาณของตอน (ดู plotcraft/chapter_stats.py): จำนวนคำที่อ่านได้ต่อนาที
+CHAPTER_WORDS_PER_MINUTE = int(os.getenv('CHAPTER_WORDS_PER_MINUTE', '200'))
+
+# ช่องค้นหารวม (ดู plotcraft/search_index.py): ผลต่อหมวดต่อหน้า, cache ผลหน้าแรกของคำค้นเดิมต่อผู้ใช้นานเท่าไร
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', '6'))
+SEARCH_CACHE_SECONDS = int(os.getenv('SEARCH_CACHE_SECONDS', '120'))
+# mode=semantic/hybrid: จำนวน candidate จากแต่ละฝั่ง และค่า k ของ reciprocal rank fusion
+SEARCH_SEMANTIC_CANDIDATES = int(os.getenv('SEARCH_SEMANTIC_CANDIDATES', '30'))
+SEARCH_RRF_K = int(os.getenv('SEARCH_RRF_K', '60'))
+
+# ร่างฉากจาก AI: ฉากไม่เปลี่ยน -> ใช้ร่างเดิมได้นานเท่านี้, lock กันร่างซ้อนข้าม worker
+RAG_DRAFT_CACHE_SECONDS = int(os.getenv('RAG_DRAFT_CACHE_SECONDS', str(7 * 24 * 3600)))
+RAG_DRAFT_LOCK_SECONDS = int(os.getenv('RAG_DRAFT_LOCK_SECONDS', '120'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'plotcraft': {
+            'handlers': ['console'],
+            'level': os.getenv('PLOTCRAFT_LOG_LEVEL', 'INFO'),
+        },
+    },
+}
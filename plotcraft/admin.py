@@ -13,6 +13,10 @@ from .models import (
 	Scene,
 	Timeline,
 	TimelineEvent,
+	RagIndexJob,
+	ChapterSummary,
+	NovelSummary,
+	ChatSession,
 )
 
 
@@ -77,6 +81,27 @@ class TimelineEventAdmin(admin.ModelAdmin):
 	search_fields = ('title', 'time_label')
 
 
+class RagIndexJobAdmin(admin.ModelAdmin):
+	list_display = ('entity_type', 'entity_id', 'action', 'status', 'attempts', 'coalesced', 'available_at')
+	list_filter = ('status', 'entity_type', 'action')
+	search_fields = ('last_error',)
+
+
+class ChapterSummaryAdmin(admin.ModelAdmin):
+	list_display = ('chapter', 'model_name', 'updated_at')
+	search_fields = ('summary',)
+
+
+class NovelSummaryAdmin(admin.ModelAdmin):
+	list_display = ('novel', 'model_name', 'updated_at')
+	search_fields = ('summary',)
+
+
+class ChatSessionAdmin(admin.ModelAdmin):
+	list_display = ('title', 'user', 'novel', 'turn_count', 'summarized_turns', 'updated_at')
+	search_fields = ('title', 'summary')
+
+
 # Register models
 admin.site.register(User, UserAdmin)
 admin.site.register(Profile)
@@ -89,4 +114,7 @@ admin.site.register(Item, ItemAdmin)
 admin.site.register(Scene, SceneAdmin)
 admin.site.register(Timeline, TimelineAdmin)
 admin.site.register(TimelineEvent, TimelineEventAdmin)
-
+admin.site.register(RagIndexJob, RagIndexJobAdmin)
+admin.site.register(ChapterSummary, ChapterSummaryAdmin)
+admin.site.register(NovelSummary, NovelSummaryAdmin)
+admin.site.register(ChatSession, ChatSessionAdmin)
@@ -0,0 +1,139 @@
+# plotcraft/bulk_delete.py
+"""
+ลบนิยาย/บัญชีแบบเร็ว (แทน novel.delete() / user.delete() ตรงๆ)
+
+Collector ของ Django จะโหลดทุกตอน/ตัวละคร/ฉากขึ้นมาในหน่วยความจำ เพราะมี post_delete (signals.py)
+แล้วแต่ละแถวก็ฝากงานลบเข้าคิวทีละแถว -> นักเขียนที่มีหลายพันตอนลบทีกินเวลาเป็นนาที
+
+ที่นี่ลบแถวลูกเองด้วย DELETE ... WHERE pk IN (...) ทีละ batch ใน transaction เดียว (ไม่ผ่าน signal)
+แล้วฝากงานลบใน vector store ไว้ "งานเดียว" ต่อนิยาย/บัญชี (ลบด้วย where novel_id / ทิ้งทั้ง shard)
+"""
+from django.db import connection, transaction
+
+from .models import (
+    Chapter, ChapterSummary, Character, ChatSession, ChatTurn, Item, Location, Novel, NovelSummary, RagIndexJob, Scene,
+    SearchDocument, Timeline, TimelineEvent,
+)
+from .rag_queue import enqueue_purge
+from .search_index import invalidate, remove_objects
+
+BATCH_SIZE = 1000
+
+
+def delete_novel(novel):
+    """ ลบนิยายพร้อมตอน/ตัวละคร/ฉากทั้งหมด """
+    with transaction.atomic():
+        _delete_contents(
+            chapters=Chapter.objects.filter(novel=novel),
+            characters=Character.objects.filter(project=novel),
+            scenes=Scene.objects.filter(project=novel),
+        )
+        RagIndexJob.objects.filter(entity_type='novel_summary', entity_id=novel.pk).delete()
+        # สถานที่/ไอเท็ม/timeline ไม่ถูกลบ (SET_NULL ผ่าน UPDATE ที่ไม่ส่ง signal) -> ปลด novel_id ใน search index เอง
+        SearchDocument.objects.filter(novel_id=novel.pk).exclude(entity_type='novel').update(novel_id=None)
+        invalidate(novel.author_id)
+        enqueue_purge('novel', novel.pk, novel.author_id)
+        novel.delete()
+
+
+def delete_account(user):
+    """ ลบบัญชีพร้อมข้อมูลทุกอย่างของผู้ใช้ """
+    with transaction.atomic():
+        novels = Novel.objects.filter(author=user)
+        locations = Location.objects.filter(created_by=user)
+        _delete_contents(
+            chapters=Chapter.objects.filter(novel__in=novels),
+            # Character.location เป็น CASCADE -> ตัวละคร (ของใครก็ตาม) ที่อยู่ในสถานที่ของ user นี้ก็หายไปด้วย
+            characters=(
+                Character.objects.filter(project__in=novels) | Character.objects.filter(created_by=user)
+                | Character.objects.filter(location__in=locations)
+            ),
+            scenes=Scene.objects.filter(project__in=novels) | Scene.objects.filter(created_by=user),
+        )
+        RagIndexJob.objects.filter(entity_type='novel_summary', entity_id__in=novels.values('pk')).delete()
+        _delete_catalog(
+            novels=novels,
+            locations=locations,
+            items=Item.objects.filter(created_by=user),
+            timelines=Timeline.objects.filter(created_by=user),
+        )
+        _delete_in_batches(SearchDocument.objects.filter(owner=user))
+        enqueue_purge('user', user.pk, user.pk)
+        # ที่เหลือ (profile, project, ห้องแชท) มีไม่มากและไม่มี signal ให้ Collector จัดการตามปกติ
+        user.delete()
+
+
+def _delete_contents(chapters, characters, scenes):
+    """ ลบตามลำดับที่ FK ยอมให้ลบ: ตาราง M2M -> ตั้ง SET_NULL -> ฉาก -> ตัวละคร -> สรุปตอน -> ตอน """
+    scene_ids = scenes.values('pk')
+    character_ids = characters.values('pk')
+
+    # งานในคิวของแถวที่กำลังจะหายไป ไม่ต้องทำแล้ว
+    for entity_type, ids in (('chapter', chapters.values('pk')), ('character', character_ids), ('scene', scene_ids)):
+        RagIndexJob.objects.filter(entity_type=entity_type, entity_id__in=ids).delete()
+    remove_objects('character', character_ids)
+    remove_objects('scene', scene_ids)
+
+    _delete_in_batches(Scene.characters.through.objects.filter(scene_id__in=scene_ids))
+    _delete_in_batches(Scene.items.through.objects.filter(scene_id__in=scene_ids))
+    _delete_in_batches(Scene.characters.through.objects.filter(character_id__in=character_ids))
+    _delete_in_batches(Character.relationships.through.objects.filter(from_character_id__in=character_ids))
+    _delete_in_batches(Character.relationships.through.objects.filter(to_character_id__in=character_ids))
+    _delete_in_batches(Character.resides_in.through.objects.filter(character_id__in=character_ids))
+    _delete_in_batches(Character.timeline_events.through.objects.filter(character_id__in=character_ids))
+
+    TimelineEvent.objects.filter(related_scene_id__in=scene_ids).update(related_scene=None)
+    Scene.objects.filter(pov_character_id__in=character_ids).update(pov_character=None)
+    Item.objects.filter(owner_id__in=character_ids).update(owner=None)
+
+    _delete_in_batches(scenes)
+    _delete_in_batches(characters)
+    _delete_in_batches(ChapterSummary.objects.filter(chapter_id__in=chapters.values('pk')))
+    _delete_in_batches(chapters)
+
+
+def _delete_catalog(novels, locations, items, timelines):
+    """ ลบนิยาย/สถานที่/ไอเท็ม/timeline หลังแถวลูกใน _delete_contents หายไปแล้ว (ไม่ผ่าน signal)
+        ของผู้ใช้อื่นที่อ้างถึงแถวเหล่านี้ผ่าน SET_NULL -> UPDATE เป็น NULL แบบเดียวกับที่ Collector ทำ """
+    novel_ids = novels.values('pk')
+    location_ids = locations.values('pk')
+    item_ids = items.values('pk')
+    events = TimelineEvent.objects.filter(timeline__in=timelines)
+
+    _delete_in_batches(Scene.items.through.objects.filter(item_id__in=item_ids))
+    _delete_in_batches(Character.resides_in.through.objects.filter(location_id__in=location_ids))
+    _delete_in_batches(TimelineEvent.characters.through.objects.filter(timelineevent_id__in=events.values('pk')))
+
+    Scene.objects.filter(location_id__in=location_ids).update(location=None)
+    Item.objects.filter(location_id__in=location_ids).update(location=None)
+    for model in (Location, Item):
+        model.objects.filter(project_id__in=novel_ids).update(project=None)
+    Timeline.objects.filter(related_project_id__in=novel_ids).update(related_project=None)
+    SearchDocument.objects.filter(novel_id__in=novel_ids).update(novel_id=None)
+
+    _delete_in_batches(events)
+    _delete_in_batches(timelines)
+    _delete_in_batches(items)
+    _delete_in_batches(locations)
+    _delete_in_batches(NovelSummary.objects.filter(novel_id__in=novel_ids))
+    sessions = ChatSession.objects.filter(novel_id__in=novel_ids)
+    _delete_in_batches(ChatTurn.objects.filter(session__in=sessions))
+    _delete_in_batches(sessions)
+    _delete_in_batches(novels)
+
+
+def _delete_in_batches(queryset, batch_size=BATCH_SIZE):
+    """ DELETE ตรงๆ ทีละ batch ของ pk (ไม่โหลด object ไม่ส่ง signal) """
+    model = queryset.model
+    table = connection.ops.quote_name(model._meta.db_table)
+    pk_column = connection.ops.quote_name(model._meta.pk.column)
+    ids_queryset = queryset.order_by().values_list('pk', flat=True)
+    deleted = 0
+    with connection.cursor() as cursor:
+        while True:
+            ids = list(ids_queryset[:batch_size])
+            if not ids:
+                return deleted
+            placeholders = ", ".join(["%s"] * len(ids))
+            cursor.execute(f"DELETE FROM {table} WHERE {pk_column} IN ({placeholders})", ids)
+            deleted += len(ids)
@@ -0,0 +1,104 @@
+# plotcraft/chapter_stats.py
+"""
+สถิติของตอน (จำนวนตัวอักษร / จำนวนคำ / เวลาอ่านโดยประมาณ) คำนวณครั้งเดียวตอน save แล้วเก็บลงคอลัมน์
+ยอดรวมของนิยาย (Novel.chapter_count / char_count / word_count / reading_minutes) บวก/ลบเฉพาะส่วนต่าง
+ของตอนที่เปลี่ยน -> หน้า list/รายละเอียดนิยายไม่ต้องโหลด content ของทุกตอนมานับ
+
+คำภาษาไทยไม่เว้นวรรค นับด้วยการตัดคำของ pythainlp (engine newmm)
+import ตอนนับครั้งแรก (โหลดพจนานุกรมช้า ไม่ให้ web/worker ที่ยังไม่ได้นับคำต้องรอตอนเริ่ม)
+"""
+import math
+import re
+from collections import namedtuple
+
+from django.conf import settings
+from django.db.models import Count, F, Sum
+
+from .chunking import html_to_text
+from .models import Chapter, Novel
+
+_WORD = re.compile(r'\w', re.UNICODE)
+_SPACE = re.compile(r'\s+')
+
+STAT_FIELDS = ('char_count', 'word_count', 'reading_minutes')
+ChapterStats = namedtuple('ChapterStats', STAT_FIELDS)
+EMPTY = ChapterStats(0, 0, 0)
+
+_tokenize = None
+
+
+def _thai_tokenizer():
+    """ word_tokenize ของ pythainlp (โหลดครั้งแรกที่ใช้) """
+    global _tokenize
+    if _tokenize is None:
+        from pythainlp.tokenize import word_tokenize
+        _tokenize = word_tokenize
+    return _tokenize
+
+
+def count_words(text):
+    """ จำนวนคำ (ตัดคำไทยด้วย newmm ไม่นับช่องว่าง/เครื่องหมายวรรคตอน) """
+    tokens = _thai_tokenizer()(text, engine='newmm', keep_whitespace=False)
+    return sum(1 for token in tokens if _WORD.search(token))
+
+
+def compute(content):
+    """ content (HTML จาก editor) -> ChapterStats """
+    text = html_to_text(content)
+    if not text:
+        return EMPTY
+    words = count_words(text)
+    return ChapterStats(
+        char_count=len(_SPACE.sub("", text)),
+        word_count=words,
+        reading_minutes=math.ceil(words / settings.CHAPTER_WORDS_PER_MINUTE) if words else 0,
+    )
+
+
+def stats_of(chapter):
+    return ChapterStats(*(getattr(chapter, field) for field in STAT_FIELDS))
+
+
+def apply(chapter):
+    """ คำนวณใหม่ลงตัว object (เรียกก่อน save) """
+    for field, value in zip(STAT_FIELDS, compute(chapter.content)):
+        setattr(chapter, field, value)
+
+
+def _negate(stats):
+    return ChapterStats(*(-value for value in stats))
+
+
+def _add_to_novel(novel_id, stats, chapters=0):
+    """ บวกส่วนต่าง (ติดลบได้) เข้ายอดรวมของนิยายด้วย UPDATE เดียว """
+    changes = {field: F(field) + value for field, value in zip(STAT_FIELDS, stats) if value}
+    if chapters:
+        changes['chapter_count'] = F('chapter_count') + chapters
+    if changes:
+        Novel.objects.filter(pk=novel_id).update(**changes)
+
+
+def saved(previous, chapter):
+    """ previous = (novel_id, ChapterStats) ก่อน save (None = ตอนใหม่) -> ปรับยอดรวมตามส่วนต่าง """
+    current = stats_of(chapter)
+    if previous is None:
+        _add_to_novel(chapter.novel_id, current, chapters=1)
+        return
+    novel_id, before = previous
+    if novel_id != chapter.novel_id:
+        _add_to_novel(novel_id, _negate(before), chapters=-1)
+        _add_to_novel(chapter.novel_id, current, chapters=1)
+    else:
+        _add_to_novel(novel_id, ChapterStats(*(now - then for now, then in zip(current, before))))
+
+
+def deleted(chapter):
+    _add_to_novel(chapter.novel_id, _negate(stats_of(chapter)), chapters=-1)
+
+
+def recount_novel(novel_id):
+    """ คำนวณยอดรวมใหม่จากคอลัมน์ของทุกตอน (ซ่อมกรณีแก้ DB ตรงๆ) ไม่โหลด content """
+    totals = Chapter.objects.filter(novel_id=novel_id).aggregate(
+        chapter_count=Count('id'), **{field: Sum(field) for field in STAT_FIELDS}
+    )
+    Novel.objects.filter(pk=novel_id).update(**{field: value or 0 for field, value in totals.items()})
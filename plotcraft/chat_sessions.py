@@ -0,0 +1,142 @@
+# plotcraft/chat_sessions.py
+"""
+ห้องแชทกับพี่บก. ที่จำบทสนทนาได้ โดยขนาด prompt ต่อ turn แทบไม่โตตามความยาวของห้อง
+
+prompt ของแต่ละ turn = summary ของบทสนทนาเก่า + turn ล่าสุด RAG_CHAT_RECENT_TURNS อันแบบคำต่อคำ
+เมื่อมี turn ที่ยังไม่ได้สรุปเกิน RECENT + RAG_CHAT_FOLD_TURNS -> ฝากงาน chat_summary ให้ worker
+รวม turn เก่าชุดนั้นเข้า summary (เรียก LLM นอก request ผู้ใช้ไม่ต้องรอ)
+ระหว่างที่ worker ยังไม่ทำ ประวัติที่ส่งเข้า prompt ก็ยังถูกตัดให้อยู่ใน RAG_CHAT_HISTORY_TOKEN_BUDGET
+"""
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .context_assembler import estimate_tokens, truncate_tokens
+from .models import ChatSession, ChatTurn, Novel
+from .rag_queue import enqueue_task
+
+SUMMARY_WORDS = 150
+TITLE_LENGTH = 60
+
+
+def open_session(user_id, session_id=None, novel_id=None, first_message=""):
+    """ ห้องเดิมของผู้ใช้คนนี้ (session_id) หรือสร้างห้องใหม่ผูกกับนิยาย (ถ้าเป็นของผู้ใช้จริง)
+        session_id ที่ไม่ใช่ของผู้ใช้ -> ChatSession.DoesNotExist """
+    if session_id:
+        return ChatSession.objects.get(pk=session_id, user_id=user_id)
+    if novel_id and not Novel.objects.filter(pk=novel_id, author_id=user_id).exists():
+        novel_id = None
+    return ChatSession.objects.create(user_id=user_id, novel_id=novel_id, title=first_message[:TITLE_LENGTH])
+
+
+def history_text(session):
+    """ ประวัติสำหรับใส่ prompt: summary + turn ที่ยังไม่ได้สรุป (ใหม่สุดก่อน จนเต็มงบ) """
+    budget = settings.RAG_CHAT_HISTORY_TOKEN_BUDGET
+    summary = truncate_tokens(session.summary, budget // 3) if session.summary else ""
+    remaining = budget - (estimate_tokens(summary) if summary else 0)
+
+    # ดึงแค่พอสำหรับรอบ fold หนึ่งรอบ (ถ้า worker ตามไม่ทัน turn ที่เก่ากว่านั้นจะถูกตัดทิ้งจาก prompt อยู่ดี)
+    limit = settings.RAG_CHAT_RECENT_TURNS + settings.RAG_CHAT_FOLD_TURNS
+    turns = (
+        ChatTurn.objects.filter(session_id=session.pk, id__gt=session.summary_until_id)
+        .order_by('-id')
+        .values_list('message', 'reply')[:limit]
+    )
+    lines = []
+    for message, reply in turns:
+        text = f"น้อง: {message}\nพี่บก.: {reply}"
+        tokens = estimate_tokens(text)
+        if tokens > remaining:
+            if not lines:
+                lines.append(truncate_tokens(text, remaining))
+            break
+        lines.append(text)
+        remaining -= tokens
+    lines.reverse()
+
+    if summary:
+        lines.insert(0, f"(สรุปที่คุยกันก่อนหน้านี้) {summary}")
+    return "\n".join(lines)
+
+
+def record_turn(session, message, reply):
+    """ บันทึก turn ใหม่ แล้วฝากงานสรุปถ้า turn ที่ยังไม่ได้สรุปเยอะพอ """
+    with transaction.atomic():
+        ChatTurn.objects.create(session=session, message=message, reply=reply)
+        ChatSession.objects.filter(pk=session.pk).update(turn_count=F('turn_count') + 1, updated_at=timezone.now())
+    session.turn_count += 1
+
+    unsummarized = session.turn_count - session.summarized_turns
+    if unsummarized >= settings.RAG_CHAT_RECENT_TURNS + settings.RAG_CHAT_FOLD_TURNS:
+        enqueue_task('chat_summary', session.pk, session.user_id)
+
+
+def compact_session(session, llm):
+    """ รวม turn ที่เก่ากว่า RAG_CHAT_RECENT_TURNS อันล่าสุดเข้า summary (worker เรียก) คืนจำนวน turn ที่รวม """
+    turns = list(
+        ChatTurn.objects.filter(session_id=session.pk, id__gt=session.summary_until_id)
+        .order_by('id')
+        .only('id', 'message', 'reply')
+    )
+    folding = turns[:max(0, len(turns) - settings.RAG_CHAT_RECENT_TURNS)]
+    if not folding:
+        return 0
+
+    conversation = "\n".join(f"น้อง: {turn.message}\nพี่บก.: {turn.reply}" for turn in folding)
+    summary = str(llm.invoke(f"""
+        สรุปบทสนทนาระหว่างนักเขียน (น้อง) กับบรรณาธิการ (พี่บก.) ให้เหลือไม่เกิน {SUMMARY_WORDS} คำ
+        เก็บสิ่งที่ตกลงกันแล้ว ไอเดียที่น้องชอบ/ไม่ชอบ และคำถามที่ยังค้าง ไม่ต้องใช้ Markdown
+
+        สรุปเดิม:
+        {session.summary or "(ยังไม่มี)"}
+
+        บทสนทนาต่อจากนั้น:
+        {conversation}
+        """)).strip()
+
+    ChatSession.objects.filter(pk=session.pk).update(
+        summary=summary,
+        summary_until_id=folding[-1].pk,
+        summarized_turns=F('summarized_turns') + len(folding),
+    )
+    return len(folding)
+
+
+def list_sessions(user_id, novel_id=None, before=None, limit=20):
+    """ ห้องแชทของผู้ใช้ ใหม่สุดก่อน แบ่งหน้าด้วย cursor "<updated_at เป็น microsecond>-<id>" ของห้องสุดท้ายในหน้าก่อน
+        (keyset ไม่ใช้ OFFSET -> หน้าลึกๆ ก็เร็วเท่าหน้าแรก) """
+    sessions = ChatSession.objects.filter(user_id=user_id)
+    if novel_id:
+        sessions = sessions.filter(novel_id=novel_id)
+    if before:
+        micros, _, last_id = before.partition('-')
+        if not (micros.isdigit() and last_id.isdigit()):
+            raise ValueError(f"cursor ไม่ถูกต้อง: {before}")
+        seconds, micros = divmod(int(micros), 1_000_000)
+        updated_at = datetime.fromtimestamp(seconds, tz=dt_timezone.utc).replace(microsecond=micros)
+        sessions = sessions.filter(Q(updated_at__lt=updated_at) | Q(updated_at=updated_at, id__lt=int(last_id)))
+    rows = list(
+        sessions.order_by('-updated_at', '-id')
+        .values('id', 'title', 'novel_id', 'turn_count', 'created_at', 'updated_at')[:limit + 1]
+    )
+    next_before = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        updated_at = last['updated_at']
+        next_before = f"{int(updated_at.timestamp()) * 1_000_000 + updated_at.microsecond}-{last['id']}"
+    return rows[:limit], next_before
+
+
+def list_turns(session, before=None, limit=20):
+    """ ประวัติของห้อง ทีละหน้าจากใหม่ไปเก่า (before = id ของ turn เก่าสุดในหน้าก่อน) คืนหน้าเรียงเก่า -> ใหม่ """
+    turns = ChatTurn.objects.filter(session_id=session.pk)
+    if before:
+        turns = turns.filter(id__lt=before)
+    rows = list(turns.order_by('-id').values('id', 'message', 'reply', 'created_at')[:limit + 1])
+    next_before = rows[limit - 1]['id'] if len(rows) > limit else None
+    rows = rows[:limit]
+    rows.reverse()
+    return rows, next_before
@@ -0,0 +1,122 @@
+# plotcraft/chunking.py
+"""
+ตัดเนื้อหาตอน (HTML จาก editor) เป็น chunk ขนาดพอดีกับ embedding model
+
+MiniLM รับได้ราวๆ 128 token ส่วนที่เกินจะถูกตัดทิ้งเงียบๆ จึงต้องหั่นก่อน:
+- ตัดตามย่อหน้าก่อน ย่อหน้าที่ยาวเกินค่อยตัดตามประโยค
+- ภาษาไทยไม่มีจุดจบประโยค ใช้ "ช่องว่างระหว่างตัวอักษรไทย" เป็นรอยต่อประโยคแทน
+- ปิด chunk ที่ท้ายย่อหน้าเมื่อยาวถึง min_chars แล้ว -> แก้ย่อหน้าเดียว chunk อื่นไม่ขยับ
+- chunk ถัดไปจะมีท้ายของ chunk ก่อนหน้าติดมาด้วย (overlap) กันบริบทขาดตรงรอยต่อ
+  overlap นับรวมอยู่ใน max_chars แล้ว (ข้อความที่ส่งไป embed ไม่เกิน max_chars เสมอ)
+- id / การตัดสินว่าต้อง embed ใหม่ ดูจาก body (ไม่รวม overlap) -> แก้ท้ายย่อหน้า chunk ถัดไปไม่ต้อง embed ใหม่
+  (overlap ของ chunk นั้นจะค้างเป็นของเก่าจนกว่าเนื้อของมันเองจะถูกแก้ ยอมได้เพราะเป็นแค่บริบทเสริม)
+"""
+import html
+import re
+from collections import namedtuple
+
+from django.utils.html import strip_tags
+
+# index = ลำดับ chunk, start = offset (ตัวอักษร) ใน plain text, text = ข้อความที่ใช้ embed (รวม overlap ไม่เกิน max_chars)
+# body = เนื้อของ chunk เอง (ไม่รวม overlap) ใช้ทำ id
+Chunk = namedtuple('Chunk', ['index', 'start', 'text', 'body'])
+
+_BLOCK_TAGS = re.compile(r'<\s*(br|/p|/div|/h[1-6]|/li|/blockquote)\s*/?>', re.I)
+_PARAGRAPH = re.compile(r'[^\n]+')
+# รอยต่อประโยค: ช่องว่างหลัง . ! ? … หรือช่องว่างที่คั่นระหว่างตัวอักษรไทย
+_SENTENCE_BREAK = re.compile(r'(?<=[.!?…"”])\s+|(?<=[\u0E00-\u0E7F])\s+(?=[\u0E00-\u0E7F])')
+
+
+def html_to_text(content):
+    """ แปลง HTML จาก contenteditable เป็นข้อความธรรมดา (รักษาการขึ้นย่อหน้าไว้) """
+    text = _BLOCK_TAGS.sub('\n', content or '')
+    text = html.unescape(strip_tags(text)).replace('\xa0', ' ')
+    return text.strip()
+
+
+def _spans(pattern, text):
+    return [(m.start(), m.end()) for m in pattern.finditer(text)]
+
+
+def _sentence_spans(text, start, end):
+    spans = []
+    pos = start
+    for m in _SENTENCE_BREAK.finditer(text, start, end):
+        if m.start() > pos:
+            spans.append((pos, m.start()))
+        pos = m.end()
+    if pos < end:
+        spans.append((pos, end))
+    return spans
+
+
+def _hard_split(text, start, end, max_chars):
+    """ ประโยคที่ยาวเกิน max_chars (ไม่มีช่องว่างเลย) -> ตัดที่ช่องว่างสุดท้ายหรือตัดตรงๆ """
+    spans = []
+    while end - start > max_chars:
+        cut = text.rfind(' ', start, start + max_chars)
+        if cut <= start:
+            cut = start + max_chars
+        spans.append((start, cut))
+        start = cut
+        while start < end and text[start].isspace():
+            start += 1
+    if start < end:
+        spans.append((start, end))
+    return spans
+
+
+def _units(text, max_chars):
+    """ แตก text เป็นหน่วยย่อย (start, end, is_paragraph_end) ที่แต่ละหน่วยไม่เกิน max_chars """
+    units = []
+    for p_start, p_end in _spans(_PARAGRAPH, text):
+        if not text[p_start:p_end].strip():
+            continue
+        if p_end - p_start <= max_chars:
+            pieces = [(p_start, p_end)]
+        else:
+            pieces = []
+            for s_start, s_end in _sentence_spans(text, p_start, p_end):
+                pieces.extend(_hard_split(text, s_start, s_end, max_chars))
+        for i, (start, end) in enumerate(pieces):
+            units.append((start, end, i == len(pieces) - 1))
+    return units
+
+
+def _overlap_tail(text, overlap):
+    if overlap <= 0 or len(text) <= overlap:
+        return text if overlap > 0 else ''
+    tail = text[-overlap:]
+    space = tail.find(' ')
+    if 0 <= space < len(tail) - 1:
+        tail = tail[space + 1:]
+    return tail
+
+
+def chunk_text(text, max_chars=400, overlap=80, min_chars=200):
+    """ คืน list ของ Chunk เรียงตามตำแหน่งในเนื้อหา
+        เนื้อของแต่ละ chunk ยาวได้ max_chars - overlap - 1 (เผื่อที่ให้ overlap + ช่องว่างที่ใช้ต่อ) """
+    budget = max_chars - overlap - 1
+    if budget <= 0:
+        raise ValueError(f"overlap ({overlap}) ต้องน้อยกว่า max_chars ({max_chars})")
+    groups = []   # [(start, end)] ของแต่ละ chunk (ไม่รวม overlap)
+    current = None
+    for start, end, is_paragraph_end in _units(text, budget):
+        if current and end - current[0] > budget:
+            groups.append(current)
+            current = None
+        current = (current[0], end) if current else (start, end)
+        if is_paragraph_end and current[1] - current[0] >= min_chars:
+            groups.append(current)
+            current = None
+    if current:
+        groups.append(current)
+
+    chunks = []
+    previous = ''
+    for index, (start, end) in enumerate(groups):
+        own = text[start:end].strip()
+        tail = _overlap_tail(previous, overlap) if previous else ''
+        chunks.append(Chunk(index, start, f"{tail} {own}" if tail else own, own))
+        previous = own
+    return chunks
@@ -0,0 +1,185 @@
+# plotcraft/context_assembler.py
+"""
+ประกอบ Context สำหรับ prompt ของพี่บก. ให้อยู่ในงบ token ที่กำหนด
+
+เดิมเอาเอกสาร 3 อันแรกมาต่อกันทั้งก้อน -> ขนาด prompt แกว่งมาก (บางทีเป็นตอนทั้งตอน) Gemini ก็ช้าตาม
+ที่นี่ดึง candidate มากกว่า แล้ว:
+1. ให้คะแนน = ความใกล้ (จาก distance) x น้ำหนักตามประเภทเอกสาร
+2. ตัด chunk ที่ซ้ำกัน / ส่วนที่ซ้อนกับ chunk ข้างเคียงของตอนเดียวกัน (overlap ตอนหั่น)
+3. เลือกจากคะแนนสูงสุดลงมา จนเต็มงบรวม โดยแต่ละประเภทใช้ได้ไม่เกินโควตาของตัวเอง
+4. เรียงผลตามประเภท / ลำดับตอน ให้อ่านต่อกันได้
+"""
+import re
+from collections import namedtuple
+
+# ตัวเลขคร่าวๆ สำหรับ Gemini: อักษรไทย ~2.5 ตัว/token, อักษรอื่น ~4 ตัว/token
+# (ไม่เรียก count_tokens ของ API เพราะจะเพิ่ม round trip ทุกครั้งที่แชท)
+_THAI = re.compile(r'[\u0E00-\u0E7F]')
+
+# ลำดับการแสดงผลตามประเภท (เอกสารแต่ละอันมีหัวข้อ [ข้อมูลตัวละคร] ฯลฯ ของตัวเองอยู่แล้ว)
+SECTIONS = ('character', 'scene', 'content')
+
+# ประเภทที่ตอบคำถามแชทได้ตรงกว่า ได้คะแนนเพิ่มเล็กน้อย
+TYPE_WEIGHTS = {'character': 1.1, 'scene': 1.05, 'content': 1.0}
+
+# chunk ใหม่ที่ซ้ำกับของที่เลือกแล้วเกินสัดส่วนนี้ -> ทิ้ง
+DUPLICATE_RATIO = 0.6
+SHINGLE = 8
+MIN_TOKENS = 20
+
+AssembledContext = namedtuple('AssembledContext', ['text', 'tokens', 'stats'])
+
+
+class Candidate:
+    def __init__(self, text, metadata, distance):
+        self.metadata = metadata or {}
+        self.doc_type = self.metadata.get("type", "content")
+        self.text = compact(text)
+        self.header = ""
+        if self.doc_type == 'content' and self.text.startswith("["):
+            # "[เนื้อเรื่อง] ตอน: ..." แสดงครั้งเดียวต่อตอน ไม่ต้องนับซ้ำทุก chunk
+            self.header, _, self.text = self.text.partition("\n")
+        self.score = TYPE_WEIGHTS.get(self.doc_type, 1.0) / (1.0 + max(distance or 0.0, 0.0))
+        self.tokens = estimate_tokens(self.text)
+
+    @property
+    def source(self):
+        return self.doc_type, self.metadata.get("source_id")
+
+    def order_key(self):
+        metadata = self.metadata
+        return (metadata.get("chapter_order") or 0, str(metadata.get("source_id")), metadata.get("chunk_index") or 0)
+
+
+def estimate_tokens(text):
+    thai = len(_THAI.findall(text))
+    return int(thai / 2.5 + (len(text) - thai) / 4) + 1
+
+
+def compact(text):
+    """ ตัด indent / บรรทัดว่างของ f-string ตอนสร้างเอกสาร (เป็น token ที่เสียเปล่า) """
+    lines = (line.strip() for line in (text or "").splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def parse_quotas(value):
+    """ "character=0.3,scene=0.3,content=0.6" -> {'character': 0.3, ...} (สัดส่วนของงบรวม) """
+    quotas = {}
+    for part in (value or "").split(','):
+        if '=' in part:
+            name, share = part.split('=', 1)
+            quotas[name.strip()] = float(share)
+    return quotas
+
+
+def _shingles(text):
+    return {text[i:i + SHINGLE] for i in range(max(1, len(text) - SHINGLE + 1))}
+
+
+def _trim_overlap(before, after, limit=400):
+    """ ตัดส่วนต้นของ after ที่ซ้ำกับส่วนท้ายของ before (overlap ระหว่าง chunk ติดกัน) """
+    for size in range(min(len(before), len(after), limit), SHINGLE, -1):
+        if before.endswith(after[:size]):
+            return after[size:].lstrip()
+    return after
+
+
+def truncate_tokens(text, tokens):
+    """ ตัดข้อความให้เหลือประมาณ tokens ตัว (ตัดที่ท้ายบรรทัด/ช่องว่างถ้าทำได้) """
+    if estimate_tokens(text) <= tokens:
+        return text
+    ratio = tokens / max(estimate_tokens(text), 1)
+    cut = text[:int(len(text) * ratio)]
+    boundary = max(cut.rfind("\n"), cut.rfind(" "))
+    if boundary > len(cut) * 0.6:
+        cut = cut[:boundary]
+    return cut.rstrip() + " …"
+
+
+def assemble_context(results, budget, quotas):
+    """ results = ผลจาก vector_store.query (1 query) -> AssembledContext(text, tokens, stats) """
+    documents = (results.get("documents") or [[]])[0]
+    metadatas = (results.get("metadatas") or [[]])[0] or [{}] * len(documents)
+    distances = (results.get("distances") or [[]])[0] or [0.0] * len(documents)
+    candidates = sorted(
+        (Candidate(text, metadata, distance) for text, metadata, distance in zip(documents, metadatas, distances)),
+        key=lambda c: c.score, reverse=True,
+    )
+
+    selected = []
+    used = {}
+    shingles = []
+    headers = set()
+    total = 0
+    dropped_duplicate = dropped_budget = 0
+
+    for candidate in candidates:
+        if not candidate.text:
+            continue
+        candidate_shingles = _shingles(candidate.text)
+        if any(len(candidate_shingles & seen) / len(candidate_shingles) > DUPLICATE_RATIO for seen in shingles):
+            dropped_duplicate += 1
+            continue
+
+        if candidate.doc_type == 'content':
+            # chunk ติดกันของตอนเดียวกันมี overlap -> เก็บเฉพาะส่วนที่ยังไม่มี
+            index = candidate.metadata.get("chunk_index")
+            for other in selected:
+                if other.source != candidate.source or index is None:
+                    continue
+                if other.metadata.get("chunk_index") == index - 1:
+                    candidate.text = _trim_overlap(other.text, candidate.text)
+                elif other.metadata.get("chunk_index") == index + 1:
+                    other.text = _trim_overlap(candidate.text, other.text)
+                    total -= other.tokens - estimate_tokens(other.text)
+                    used[other.doc_type] -= other.tokens - estimate_tokens(other.text)
+                    other.tokens = estimate_tokens(other.text)
+            if not candidate.text:
+                dropped_duplicate += 1
+                continue
+            candidate.tokens = estimate_tokens(candidate.text)
+            if candidate.header and candidate.header not in headers:
+                candidate.tokens += estimate_tokens(candidate.header)
+
+        quota = int(budget * quotas.get(candidate.doc_type, 1.0))
+        room = min(budget - total, quota - used.get(candidate.doc_type, 0))
+        if room < MIN_TOKENS:
+            dropped_budget += 1
+            continue
+        if candidate.tokens > room:
+            header_tokens = candidate.tokens - estimate_tokens(candidate.text)
+            candidate.text = truncate_tokens(candidate.text, room - header_tokens)
+            candidate.tokens = estimate_tokens(candidate.text) + header_tokens
+
+        if candidate.header:
+            headers.add(candidate.header)
+        selected.append(candidate)
+        shingles.append(candidate_shingles)
+        used[candidate.doc_type] = used.get(candidate.doc_type, 0) + candidate.tokens
+        total += candidate.tokens
+
+    parts = []
+    for doc_type in SECTIONS:
+        group = sorted((c for c in selected if c.doc_type == doc_type), key=Candidate.order_key)
+        if not group:
+            continue
+        if doc_type != 'content':
+            parts.extend(c.text for c in group)
+            continue
+        shown = set()
+        for c in group:
+            if c.header and c.header not in shown:
+                shown.add(c.header)
+                parts.append(c.header)
+            parts.append(c.text)
+    parts.extend(c.text for c in selected if c.doc_type not in SECTIONS)
+
+    stats = {
+        'candidates': len(candidates),
+        'selected': len(selected),
+        'dropped_duplicate': dropped_duplicate,
+        'dropped_budget': dropped_budget,
+        'tokens_by_type': used,
+        'budget': budget,
+    }
+    return AssembledContext("\n\n".join(parts), total, stats)
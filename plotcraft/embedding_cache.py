@@ -0,0 +1,147 @@
+# plotcraft/embedding_cache.py
+"""
+Cache ของ embedding แบบถาวร (ตาราง EmbeddingCacheEntry) + LRU ในหน่วยความจำ
+
+key = sha256(ชื่อ model + ข้อความที่ normalize แล้ว) -> ข้อความเดิมไม่ต้องเข้า model ซ้ำ
+ตารางถูกจำกัดขนาดไว้ที่ max_entries โดยไล่ทิ้งแถวที่ไม่ได้ใช้นานที่สุด (last_used_at)
+"""
+import hashlib
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+
+from django.utils import timezone
+
+from .models import EmbeddingCacheEntry
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text):
+    """ ตัดช่องว่าง/ย่อหน้าที่ไม่มีผลกับความหมาย (indent ของ f-string, ขึ้นบรรทัดซ้ำ) """
+    return " ".join((text or "").split())
+
+
+def content_hash(text):
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+def _pack(vector):
+    return array('f', vector).tobytes()
+
+
+def _unpack(data):
+    vector = array('f')
+    vector.frombytes(bytes(data))
+    return vector.tolist()
+
+
+class EmbeddingCache:
+    # เช็คขนาดตาราง/ไล่ทิ้งทุกๆ กี่แถวที่เขียนเพิ่ม (ไม่ต้อง COUNT(*) ทุกครั้ง)
+    EVICT_EVERY = 500
+
+    def __init__(self, model_name, max_entries=100_000, memory_entries=2_000):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._memory_lock = threading.Lock()  # query cache ถูกเรียกจากหลาย thread (async view)
+        self._writes_since_evict = 0
+        self.hits = 0
+        self.misses = 0
+
+    def key_for(self, text):
+        raw = f"{self.model_name}\0{normalize_text(text)}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def embed_documents(self, texts, embed_fn, persist=True):
+        """ คืน embedding ตามลำดับ texts; เรียก embed_fn(list_of_texts) เฉพาะข้อความที่ไม่เคยเห็น (batch เดียว)
+            persist=False -> ใช้แค่ LRU ในหน่วยความจำ ไม่อ่าน/เขียนตาราง (เช่น ข้อความแชทของผู้ใช้) """
+        keys = [self.key_for(text) for text in texts]
+        found = {}
+
+        # 1. LRU ในหน่วยความจำ
+        with self._memory_lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+
+        # 2. ตารางใน DB
+        lookup = [key for key in set(keys) if key not in found] if persist else []
+        if lookup:
+            rows = EmbeddingCacheEntry.objects.filter(key__in=lookup).values_list('key', 'vector')
+            for key, data in rows:
+                found[key] = _unpack(data)
+                self._remember(key, found[key])
+            db_hits = [key for key in lookup if key in found]
+            if db_hits:
+                EmbeddingCacheEntry.objects.filter(key__in=db_hits).update(last_used_at=timezone.now())
+
+        # 3. ที่เหลือคือ miss -> เข้า model ทีเดียวทั้ง batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = embed_fn(list(missing.values()))
+            for key, vector in zip(missing, vectors):
+                found[key] = list(vector)
+                self._remember(key, found[key])
+            if persist:
+                self._store(missing.keys(), found)
+
+        self.misses += len(missing)
+        self.hits += len(keys) - len(missing)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text, embed_fn, persist=True):
+        return self.embed_documents([text], lambda batch: [embed_fn(batch[0])], persist=persist)[0]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0,
+            'memory_entries': len(self._memory),
+        }
+
+    def _remember(self, key, vector):
+        with self._memory_lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _store(self, keys, found):
+        now = timezone.now()
+        entries = [
+            EmbeddingCacheEntry(
+                key=key,
+                model_name=self.model_name,
+                dimensions=len(found[key]),
+                vector=_pack(found[key]),
+                last_used_at=now,
+            )
+            for key in keys
+        ]
+        EmbeddingCacheEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+        self._writes_since_evict += len(entries)
+        if self._writes_since_evict >= self.EVICT_EVERY:
+            self._writes_since_evict = 0
+            self.evict()
+
+    def evict(self):
+        """ ไล่ทิ้งแถวที่ไม่ได้ใช้นานที่สุดจนเหลือไม่เกิน max_entries """
+        excess = EmbeddingCacheEntry.objects.count() - self.max_entries
+        if excess <= 0:
+            return 0
+        stale = list(
+            EmbeddingCacheEntry.objects.order_by('last_used_at').values_list('pk', flat=True)[:excess]
+        )
+        EmbeddingCacheEntry.objects.filter(pk__in=stale).delete()
+        logger.info("Embedding cache evicted %d entries", len(stale))
+        return len(stale)
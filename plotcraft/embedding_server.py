@@ -0,0 +1,179 @@
+# plotcraft/embedding_server.py
+"""
+Embedding server ตัวเดียวที่ถือ model ไว้ให้ทุก web worker ใช้ร่วมกัน
+
+- รับ POST /embed {"texts": [...]} ผ่าน unix socket หรือ localhost HTTP
+- request ที่เข้ามาพร้อมๆ กันจากหลาย worker จะถูกรวมเป็น embed_documents ครั้งเดียว
+  (รอรวมไม่เกิน window_ms หรือจนครบ max_batch ข้อความ)
+- GET /metrics คืน queue depth, ขนาด batch และเวลาที่ใช้
+"""
+import json
+import logging
+import os
+import queue
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingBatcher:
+    def __init__(self, embed_fn, max_batch=64, window_ms=10):
+        self.embed_fn = embed_fn
+        self.max_batch = max_batch
+        self.window = window_ms / 1000
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'requests': 0,
+            'texts': 0,
+            'batches': 0,
+            'max_batch_size': 0,
+            'max_queue_depth': 0,
+            'embed_seconds': 0.0,
+            'errors': 0,
+        }
+        self._thread = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, texts):
+        future = Future()
+        self._queue.put((list(texts), future))
+        with self._stats_lock:
+            self._stats['requests'] += 1
+            self._stats['max_queue_depth'] = max(self._stats['max_queue_depth'], self._queue.qsize())
+        return future
+
+    def embed(self, texts, timeout=None):
+        return self.submit(texts).result(timeout=timeout)
+
+    def metrics(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['queue_depth'] = self._queue.qsize()
+        stats['avg_batch_size'] = round(stats['texts'] / stats['batches'], 2) if stats['batches'] else 0.0
+        stats['avg_batch_ms'] = round(stats['embed_seconds'] * 1000 / stats['batches'], 2) if stats['batches'] else 0.0
+        return stats
+
+    def _collect(self):
+        """ ดึง request แรก (รอได้ไม่จำกัด) แล้วเก็บตัวที่ตามมาภายใน window """
+        pending = [self._queue.get()]
+        size = len(pending[0][0])
+        deadline = time.monotonic() + self.window
+        while size < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            pending.append(item)
+            size += len(item[0])
+        return pending
+
+    def _run(self):
+        while True:
+            pending = self._collect()
+            texts = [text for item_texts, _ in pending for text in item_texts]
+            started = time.monotonic()
+            try:
+                vectors = self.embed_fn(texts) if texts else []
+            except Exception as e:
+                logger.exception("Embedding batch of %d texts failed", len(texts))
+                with self._stats_lock:
+                    self._stats['errors'] += 1
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+
+            elapsed = time.monotonic() - started
+            with self._stats_lock:
+                self._stats['batches'] += 1
+                self._stats['texts'] += len(texts)
+                self._stats['max_batch_size'] = max(self._stats['max_batch_size'], len(texts))
+                self._stats['embed_seconds'] += elapsed
+
+            position = 0
+            for item_texts, future in pending:
+                future.set_result([list(map(float, v)) for v in vectors[position:position + len(item_texts)]])
+                position += len(item_texts)
+
+
+class EmbeddingRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive ให้ client แต่ละ worker ใช้ connection เดิม
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._send_json(200, self.server.batcher.metrics())
+        elif self.path == '/health':
+            self._send_json(200, {'status': 'ok', 'model': self.server.model_name})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/embed':
+            self._send_json(404, {'error': 'not found'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            texts = json.loads(self.rfile.read(length))['texts']
+            if not isinstance(texts, list):
+                raise ValueError("texts must be a list")
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        try:
+            vectors = self.server.batcher.embed(texts, timeout=self.server.request_timeout)
+        except Exception as e:
+            self._send_json(500, {'error': str(e)})
+            return
+        self._send_json(200, {'embeddings': vectors, 'model': self.server.model_name})
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # unix socket ไม่มี (host, port)
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128  # ค่า default (5) ไม่พอตอนทุก worker ยิงมาพร้อมกัน
+
+    def server_bind(self):
+        # เหมือน HTTPServer.server_bind แต่ไม่มี host/port
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+class ThreadingTCPHTTPServer(ThreadingHTTPServer):
+    request_queue_size = 128
+
+
+def create_server(url, batcher, model_name, request_timeout=60):
+    parsed = urlparse(url)
+    if parsed.scheme == 'unix':
+        if os.path.exists(parsed.path):
+            os.unlink(parsed.path)
+        server = ThreadingUnixHTTPServer(parsed.path, EmbeddingRequestHandler)
+    else:
+        server = ThreadingTCPHTTPServer((parsed.hostname or '127.0.0.1', parsed.port or 8765), EmbeddingRequestHandler)
+    server.batcher = batcher
+    server.model_name = model_name
+    server.request_timeout = request_timeout
+    return server
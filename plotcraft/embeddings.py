@@ -0,0 +1,277 @@
+# plotcraft/embeddings.py
+"""
+Embedding backends ที่ RAGService เลือกใช้ตาม settings.RAG_EMBEDDING_BACKEND
+
+- "local"  : โหลด HuggingFace model ใน process นี้เอง (แบบเดิม)
+- "onnx"   : model เดียวกันแต่ export เป็น ONNX + quantize int8 (python manage.py rag_export_onnx)
+             รันด้วย onnxruntime บน CPU ไม่ต้องมี torch
+- "remote" : ส่งไปให้ embedding server (python manage.py embedding_server) ที่ถือ model ไว้ตัวเดียว
+             แล้ว batch request จากทุก worker รวมกัน
+
+ทุก backend มี interface เดียวกับ LangChain Embeddings: embed_documents(texts) / embed_query(text)
+"""
+import http.client
+import json
+import multiprocessing
+import socket
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
+
+def load_embeddings(backend=None):
+    backend = backend or settings.RAG_EMBEDDING_BACKEND
+    if backend == 'local':
+        return load_local_embeddings()
+    if backend == 'onnx':
+        return OnnxEmbeddings(settings.RAG_ONNX_MODEL_DIR, threads=settings.RAG_ONNX_THREADS)
+    if backend == 'remote':
+        return RemoteEmbeddings(settings.RAG_EMBEDDING_URL, timeout=settings.RAG_EMBEDDING_TIMEOUT)
+    raise ImproperlyConfigured(f"Unknown RAG_EMBEDDING_BACKEND: {backend!r}")
+
+
+def load_local_embeddings():
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    print("📥 Loading Embedding Model...")
+    return HuggingFaceEmbeddings(
+        model_name=EMBEDDING_MODEL_NAME,
+        model_kwargs={'device': 'cpu'},
+        encode_kwargs={'normalize_embeddings': False}
+    )
+
+
+def embedding_model_id(backend=None):
+    """ ชื่อที่ใช้เป็น key ของ embedding cache: vector จาก ONNX int8 ต่างจาก fp32 นิดหน่อย จึงห้ามปนกัน
+        (ดูจากไฟล์ที่ export ไว้จริงใน RAG_ONNX_MODEL_DIR ไม่ใช่เดาเอา) """
+    backend = backend or settings.RAG_EMBEDDING_BACKEND
+    if backend == 'remote':
+        backend = settings.RAG_EMBEDDING_SERVER_BACKEND
+    if backend == 'onnx':
+        variant = onnx_variant(settings.RAG_ONNX_MODEL_DIR)
+        return f"{EMBEDDING_MODEL_NAME}@onnx-{variant}" if variant else f"{EMBEDDING_MODEL_NAME}@onnx"
+    return EMBEDDING_MODEL_NAME
+
+
+# ==================== ONNX Runtime (int8) ====================
+
+QUANTIZED_FILE = 'model_quantized.onnx'
+FP32_FILE = 'model.onnx'
+
+
+def onnx_model_file(model_dir):
+    """ ไฟล์ที่ OnnxEmbeddings จะโหลด: ตัว quantize ถ้ามี ไม่งั้นตัว fp32 """
+    model_dir = Path(model_dir)
+    quantized = model_dir / QUANTIZED_FILE
+    return quantized if quantized.exists() else model_dir / FP32_FILE
+
+
+def onnx_variant(model_dir):
+    """ 'int8' / 'fp32' ตามไฟล์ที่จะถูกโหลดจริง (None = ยังไม่ได้ export) """
+    path = onnx_model_file(model_dir)
+    if not path.exists():
+        return None
+    return 'int8' if path.name == QUANTIZED_FILE else 'fp32'
+
+def export_onnx_model(output_dir, quantize=True, arch='avx2'):
+    """ export model เป็น ONNX แล้ว quantize แบบ dynamic int8 (ต้องมี optimum[onnxruntime] + torch ตอน export เท่านั้น) """
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    output_dir = Path(output_dir)
+    # ตัว int8 จากการ export ครั้งก่อนค้างอยู่ -> จะถูกโหลดแทนตัว fp32 ใหม่ และได้ model id ผิด
+    (output_dir / QUANTIZED_FILE).unlink(missing_ok=True)
+    model = ORTModelForFeatureExtraction.from_pretrained(EMBEDDING_MODEL_NAME, export=True)
+    model.save_pretrained(output_dir)
+    AutoTokenizer.from_pretrained(EMBEDDING_MODEL_NAME).save_pretrained(output_dir)
+
+    if quantize:
+        configs = {
+            'avx2': AutoQuantizationConfig.avx2,
+            'avx512': AutoQuantizationConfig.avx512,
+            'avx512_vnni': AutoQuantizationConfig.avx512_vnni,
+            'arm64': AutoQuantizationConfig.arm64,
+        }
+        quantizer = ORTQuantizer.from_pretrained(output_dir, file_name=FP32_FILE)
+        quantizer.quantize(
+            save_dir=output_dir,
+            quantization_config=configs[arch](is_static=False, per_channel=False),
+        )
+    return output_dir
+
+
+class OnnxEmbeddings:
+    """ MiniLM บน onnxruntime + mean pooling (ให้ผลเหมือน sentence-transformers) """
+
+    # เท่ากับ max_seq_length ของ sentence-transformers สำหรับ model นี้
+    MAX_LENGTH = 128
+
+    def __init__(self, model_dir, threads=1, batch_size=32):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_dir = Path(model_dir)
+        model_path = onnx_model_file(model_dir)
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        print(f"📥 Loading ONNX Embedding Model ({model_path.name}, {threads} threads)...")
+        self.session = ort.InferenceSession(str(model_path), options, providers=['CPUExecutionProvider'])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.batch_size = batch_size
+
+        self.tokenizer = Tokenizer.from_file(str(model_dir / 'tokenizer.json'))
+        pad_token = '<pad>'
+        config_path = model_dir / 'tokenizer_config.json'
+        if config_path.exists():
+            pad_token = json.loads(config_path.read_text(encoding='utf-8')).get('pad_token', pad_token)
+            if isinstance(pad_token, dict):  # transformers บางเวอร์ชันเก็บเป็น AddedToken
+                pad_token = pad_token['content']
+        self.tokenizer.enable_truncation(max_length=self.MAX_LENGTH)
+        self.tokenizer.enable_padding(pad_id=self.tokenizer.token_to_id(pad_token), pad_token=pad_token)
+
+    def embed_documents(self, texts):
+        import numpy as np
+
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            encoded = self.tokenizer.encode_batch(list(texts[start:start + self.batch_size]))
+            input_ids = np.array([e.ids for e in encoded], dtype=np.int64)
+            attention_mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+            feeds = {'input_ids': input_ids, 'attention_mask': attention_mask}
+            if 'token_type_ids' in self.input_names:
+                feeds['token_type_ids'] = np.zeros_like(input_ids)
+
+            hidden = self.session.run(None, feeds)[0]
+            mask = attention_mask[..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            vectors.extend(pooled.tolist())
+        return vectors
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+# ==================== Remote (embedding server) ====================
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """ HTTP ผ่าน unix socket (ไม่ต้องผ่าน TCP stack) """
+
+    def __init__(self, path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def open_connection(url, timeout=None):
+    """ url แบบ http://127.0.0.1:8765 หรือ unix:///run/plotcraft/embed.sock """
+    parsed = urlparse(url)
+    if parsed.scheme == 'unix':
+        return UnixHTTPConnection(parsed.path, timeout=timeout)
+    if parsed.scheme == 'http':
+        return http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=timeout)
+    raise ImproperlyConfigured(f"Unsupported embedding server URL: {url!r}")
+
+
+class RemoteEmbeddings:
+    """ client ของ embedding server (1 keep-alive connection ต่อ thread) """
+
+    def __init__(self, url, timeout=30):
+        self.url = url
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        return self._request('POST', '/embed', {'texts': list(texts)})['embeddings']
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def metrics(self):
+        return self._request('GET', '/metrics')
+
+    def _request(self, method, path, payload=None):
+        body = json.dumps(payload).encode('utf-8') if payload is not None else None
+        headers = {'Content-Type': 'application/json'} if body else {}
+
+        for attempt in range(2):
+            conn = getattr(self._local, 'conn', None)
+            if conn is None:
+                conn = self._local.conn = open_connection(self.url, timeout=self.timeout)
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (ConnectionError, http.client.HTTPException, OSError):
+                # server ปิด keep-alive ไปแล้ว -> ต่อใหม่แล้วลองอีกครั้ง
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise
+                continue
+
+            if response.status != 200:
+                raise RuntimeError(f"Embedding server error {response.status}: {data[:200]!r}")
+            return json.loads(data)
+
+
+# ==================== Process pool (rag_reindex) ====================
+
+_worker_embeddings = None
+
+
+def _init_worker(backend):
+    """ รันครั้งเดียวในแต่ละ process ลูก: โหลด model ของตัวเอง (โมดูลนี้ไม่ import models จึงไม่ต้อง django.setup()) """
+    global _worker_embeddings
+    _worker_embeddings = load_embeddings(backend)
+
+
+def _embed_in_worker(texts):
+    return [list(vector) for vector in _worker_embeddings.embed_documents(texts)]
+
+
+class EmbeddingPool:
+    """ แบ่ง batch ให้หลาย process embed พร้อมกัน (workers=0 -> embed ใน process นี้) """
+
+    def __init__(self, workers, fallback_fn):
+        self.workers = workers
+        self.fallback_fn = fallback_fn
+        self._executor = None
+        if workers > 0:
+            # spawn แทน fork: ลูกไม่ติด connection DB / thread pool ของ torch จาก process แม่
+            self._executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(settings.RAG_EMBEDDING_BACKEND,),
+            )
+
+    def embed(self, texts):
+        if self._executor is None:
+            return self.fallback_fn(texts)
+        size = max(1, -(-len(texts) // self.workers))
+        parts = [texts[i:i + size] for i in range(0, len(texts), size)]
+        vectors = []
+        for part in self._executor.map(_embed_in_worker, parts):
+            vectors.extend(part)
+        return vectors
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
@@ -0,0 +1,47 @@
+# plotcraft/excerpts.py
+"""
+ข้อความสั้น (excerpt) สำหรับการ์ดในหน้า list/dashboard เก็บเป็นคอลัมน์ CharField ยาวไม่เกิน EXCERPT_LENGTH
+ตัดจาก TextField ตัวแรกที่ไม่ว่างของแต่ละ model (SOURCES) ตอน save -> หน้า list ใช้ .only() (ดู projections.py)
+ไม่ต้องโหลด synopsis / background / history / content ทั้งก้อนมาแสดงแค่สองสามบรรทัด
+"""
+import re
+
+from .chunking import html_to_text
+
+EXCERPT_LENGTH = 200
+
+# model_name -> field ที่ใช้ทำ excerpt เรียงตามลำดับความสำคัญ (ใช้ตัวแรกที่มีข้อความ)
+SOURCES = {
+    'novel': ('synopsis',),
+    'character': ('background', 'personality', 'appearance', 'goals'),
+    'location': ('terrain', 'history'),
+    'item': ('abilities', 'appearance', 'history'),
+    'scene': ('content', 'outcome'),
+}
+
+_SPACE = re.compile(r'\s+')
+
+
+def sources_of(model):
+    return SOURCES.get(model._meta.model_name, ())
+
+
+def make(text, length=EXCERPT_LENGTH):
+    """ ข้อความ (หรือ HTML จาก editor) -> บรรทัดเดียว ยาวไม่เกิน length ตัวอักษร (ตัดแล้วต่อท้ายด้วย …) """
+    text = _SPACE.sub(' ', html_to_text(text))
+    if len(text) <= length:
+        return text
+    return text[:length - 1].rstrip() + '…'
+
+
+def compute(instance):
+    for field in sources_of(type(instance)):
+        excerpt = make(getattr(instance, field))
+        if excerpt:
+            return excerpt
+    return ""
+
+
+def apply(instance):
+    """ คำนวณ excerpt ใหม่ลงตัว object (เรียกก่อน save) """
+    instance.excerpt = compute(instance)
@@ -0,0 +1,359 @@
+# plotcraft/llm_gateway.py
+"""
+ด่านกลางของทุกการเรียก Gemini (RAGService.llm คืน LLMGateway ที่ห่อ GoogleGenerativeAI ไว้)
+
+เดิมเรียก llm.invoke ตรงๆ ไม่มี timeout / ไม่จำกัดจำนวน -> ตอน Gemini ช้าหรือโดน rate limit
+ทุก request ค้างรอพร้อมกันจนทั้งเว็บช้าตาม ที่นี่:
+1. จำกัดจำนวนการเรียกพร้อมกันต่อ process (RAG_LLM_MAX_CONCURRENCY) เกินแล้วรอคิวได้ไม่เกิน RAG_LLM_QUEUE_TIMEOUT_SECONDS
+   invoke (thread) กับ ainvoke/astream (event loop) มีโควตาแยกกันฝั่งละ RAG_LLM_MAX_CONCURRENCY
+   ฝั่ง async รอด้วย asyncio.Semaphore (เข้าคิวตามลำดับ ไม่ถือ lock ของ thread บน event loop)
+2. แต่ละครั้งมี timeout (RAG_LLM_TIMEOUT_SECONDS) และทั้งการเรียก (รวม retry) มี deadline (RAG_LLM_DEADLINE_SECONDS)
+3. error ชั่วคราว (timeout, 429, 5xx, เน็ตหลุด) retry แบบ exponential backoff + jitter
+4. circuit breaker: ช่วงที่ error ชั่วคราวเกินสัดส่วนที่กำหนด -> ปฏิเสธทันทีด้วย LLMUnavailable
+   (ผู้เรียกแสดงข้อความ error ภาษาไทยเดิมของตัวเอง) แล้วค่อยปล่อยให้ลองใหม่ทีละครั้งหลัง cooldown
+
+interface เหมือน LLM ของ LangChain (invoke / ainvoke / astream) โค้ดเดิมไม่ต้องรู้ว่ามีด่านนี้
+ตัวเลขทั้งหมดเป็นของ process เดียว (gunicorn worker แต่ละตัวมี gateway ของตัวเอง)
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from django.conf import settings
+
+# สถานะ HTTP ที่ถือว่าเป็นปัญหาชั่วคราวของฝั่ง Gemini (google.api_core exceptions มี .code เป็นเลข HTTP)
+TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504}
+TRANSIENT_NAMES = {'ResourceExhausted', 'ServiceUnavailable', 'DeadlineExceeded', 'InternalServerError', 'TooManyRequests'}
+
+# เก็บ sample ล่าสุดไว้คำนวณ percentile
+SAMPLES = 500
+
+logger = logging.getLogger(__name__)
+
+
+class LLMUnavailable(Exception):
+    """ gateway ไม่ยอมเรียก Gemini ตอนนี้ (breaker เปิด / คิวเต็ม / เกิน deadline) """
+
+
+def is_transient(exc):
+    if isinstance(exc, (TimeoutError, asyncio.TimeoutError, FutureTimeout, ConnectionError)):
+        return True
+    code = getattr(exc, 'code', None)
+    if isinstance(code, int) and code in TRANSIENT_STATUS:
+        return True
+    return type(exc).__name__ in TRANSIENT_NAMES
+
+
+class CircuitBreaker:
+    """ closed -> (error ชั่วคราวใน window เกิน ratio) -> open -> (ครบ cooldown) -> half-open: ปล่อยทีละ 1 ครั้ง
+        ครั้งทดลองสำเร็จ -> closed, พัง -> open ใหม่
+
+        allow() คืนตั๋ว (False = ไม่ให้เรียก) แล้วส่งตั๋วเดิมกลับมาใน record()
+        มีแค่ตั๋วของครั้งทดลองที่เปลี่ยนสถานะ open/half-open ได้ ผลของการเรียกที่ถูกปล่อยไปตอน closed
+        แต่เพิ่งจบหลัง breaker เปิด (ค้างอยู่ใน Gemini ตอนที่ตัวอื่นพัง) ไม่นับ """
+
+    def __init__(self, window, min_calls, failure_ratio, cooldown):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._outcomes = deque()
+        self._opened_at = None
+        self._probe = None
+        self._probe_started = None
+        self.trips = 0
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return 'closed'
+        return 'half_open' if time.monotonic() - self._opened_at >= self.cooldown else 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            # ครั้งทดลองที่ไม่รายงานผลกลับมา (เช่น ตายในคิว) ไม่ควรล็อก breaker ไว้ตลอดไป -> ออกตั๋วใหม่แทน
+            now = time.monotonic()
+            if state == 'half_open' and (self._probe is None or now - self._probe_started >= self.cooldown):
+                self._probe = object()
+                self._probe_started = now
+                return self._probe
+            return False
+
+    def record(self, ok, ticket=True):
+        now = time.monotonic()
+        with self._lock:
+            if self._opened_at is not None:
+                if ticket is not self._probe:
+                    # ผลค้างท่อจากก่อน breaker เปิด หรือครั้งทดลองเก่าที่หมดเวลาไปแล้ว
+                    return
+                self._probe = None
+                if ok:
+                    self._opened_at = None
+                    self._outcomes.clear()
+                else:
+                    self._opened_at = now
+                return
+
+            self._outcomes.append((now, ok))
+            while self._outcomes and self._outcomes[0][0] < now - self.window:
+                self._outcomes.popleft()
+            failures = sum(1 for _, success in self._outcomes if not success)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_ratio:
+                self._opened_at = now
+                self.trips += 1
+                logger.warning("LLM circuit breaker เปิด: พัง %d จาก %d ครั้งใน %.0f วินาที",
+                               failures, len(self._outcomes), self.window)
+
+
+class LLMGateway:
+    def __init__(self, llm):
+        self.llm = llm
+        self.max_concurrency = settings.RAG_LLM_MAX_CONCURRENCY
+        self.timeout = settings.RAG_LLM_TIMEOUT_SECONDS
+        self.deadline = settings.RAG_LLM_DEADLINE_SECONDS
+        self.queue_timeout = settings.RAG_LLM_QUEUE_TIMEOUT_SECONDS
+        self.max_attempts = max(1, settings.RAG_LLM_MAX_ATTEMPTS)
+        self.retry_base = settings.RAG_LLM_RETRY_BASE_SECONDS
+        self.breaker = CircuitBreaker(
+            window=settings.RAG_LLM_BREAKER_WINDOW_SECONDS,
+            min_calls=settings.RAG_LLM_BREAKER_MIN_CALLS,
+            failure_ratio=settings.RAG_LLM_BREAKER_FAILURE_RATIO,
+            cooldown=settings.RAG_LLM_BREAKER_COOLDOWN_SECONDS,
+        )
+
+        # slot ของ thread (invoke)
+        self._slots = threading.Condition()
+        self._in_flight = 0
+        self._waiting = 0
+        # slot ของ event loop (ainvoke/astream): Semaphore ผูกกับ loop -> แยกต่อ loop
+        # (ปกติมี loop เดียวต่อ process แต่ async_to_sync ใต้ WSGI สร้าง loop ใหม่ได้)
+        self._loop_slots = weakref.WeakKeyDictionary()
+        self._ain_flight = 0
+        self._awaiting = 0
+        # invoke แบบ sync: รันใน pool เพื่อให้ผู้เรียกเลิกรอได้ตาม timeout (slot คืนเมื่อการเรียกจริงจบ)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='llm')
+
+        self._stats_lock = threading.Lock()
+        self._counts = {'attempts': 0, 'succeeded': 0, 'failed': 0, 'retries': 0, 'timeouts': 0, 'rejected': 0}
+        self._queue_waits = deque(maxlen=SAMPLES)
+        self._latencies = deque(maxlen=SAMPLES)
+
+    # ==================== concurrency slots ====================
+
+    def _release(self):
+        with self._slots:
+            self._in_flight -= 1
+            self._slots.notify()
+
+    def _acquire(self, deadline):
+        started = time.monotonic()
+        with self._slots:
+            self._waiting += 1
+            try:
+                limit = min(started + self.queue_timeout, deadline)
+                while self._in_flight >= self.max_concurrency:
+                    remaining = limit - time.monotonic()
+                    if remaining <= 0:
+                        self._reject()
+                        raise LLMUnavailable("มีคนใช้ AI พร้อมกันเยอะเกินไป ลองใหม่อีกครั้งในอีกสักครู่")
+                    self._slots.wait(remaining)
+                self._in_flight += 1
+            finally:
+                self._waiting -= 1
+        self._queue_waits.append(time.monotonic() - started)
+
+    def _loop_semaphore(self):
+        loop = asyncio.get_running_loop()
+        semaphore = self._loop_slots.get(loop)
+        if semaphore is None:
+            semaphore = self._loop_slots[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    async def _aacquire(self, deadline):
+        """ รอ slot ของ event loop นี้ (คนที่รอก่อนได้ก่อน) คืน semaphore ไว้ใช้ตอน _arelease """
+        started = time.monotonic()
+        semaphore = self._loop_semaphore()
+        if semaphore.locked():
+            remaining = min(self.queue_timeout, deadline - started)
+            self._awaiting += 1
+            try:
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                await asyncio.wait_for(semaphore.acquire(), remaining)
+            except asyncio.TimeoutError:
+                self._reject()
+                raise LLMUnavailable("มีคนใช้ AI พร้อมกันเยอะเกินไป ลองใหม่อีกครั้งในอีกสักครู่")
+            finally:
+                self._awaiting -= 1
+        else:
+            await semaphore.acquire()
+        self._ain_flight += 1
+        self._queue_waits.append(time.monotonic() - started)
+        return semaphore
+
+    def _arelease(self, semaphore):
+        self._ain_flight -= 1
+        semaphore.release()
+
+    # ==================== calls ====================
+
+    def invoke(self, prompt, **kwargs):
+        deadline = time.monotonic() + self.deadline
+        for attempt in range(1, self.max_attempts + 1):
+            ticket = self._admit()
+            self._acquire(deadline)
+            started = time.monotonic()
+            future = self._pool.submit(self.llm.invoke, prompt, **kwargs)
+            future.add_done_callback(lambda _: self._release())
+            try:
+                result = future.result(timeout=self._attempt_timeout(deadline))
+            except Exception as e:
+                self._failed(e, attempt, deadline, started, ticket)
+                time.sleep(self._backoff(attempt, deadline))
+                continue
+            self._succeeded(started, ticket)
+            return result
+
+    async def ainvoke(self, prompt, **kwargs):
+        deadline = time.monotonic() + self.deadline
+        for attempt in range(1, self.max_attempts + 1):
+            ticket = self._admit()
+            semaphore = await self._aacquire(deadline)
+            started = time.monotonic()
+            error = None
+            try:
+                result = await asyncio.wait_for(self.llm.ainvoke(prompt, **kwargs), self._attempt_timeout(deadline))
+            except Exception as e:
+                error = e
+            finally:
+                # คืน slot ก่อนรอ backoff
+                self._arelease(semaphore)
+            if error is None:
+                self._succeeded(started, ticket)
+                return result
+            self._failed(error, attempt, deadline, started, ticket)
+            await asyncio.sleep(self._backoff(attempt, deadline))
+
+    async def astream(self, prompt, **kwargs):
+        """ retry ได้เฉพาะก่อนได้ท่อนแรก (ส่งข้อความไปให้ผู้ใช้แล้วเริ่มใหม่ไม่ได้)
+            หลังได้ท่อนแรก timeout ใช้กับช่วงรอแต่ละท่อน ไม่ใช่ทั้ง stream (คำตอบยาวๆ ไม่ถูกตัดกลางทาง) """
+        deadline = time.monotonic() + self.deadline
+        for attempt in range(1, self.max_attempts + 1):
+            ticket = self._admit()
+            semaphore = await self._aacquire(deadline)
+            started = time.monotonic()
+            first_timeout = self._attempt_timeout(deadline)
+            stream = self.llm.astream(prompt, **kwargs)
+            received = False
+            error = None
+            try:
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(anext(stream), self.timeout if received else first_timeout)
+                    except StopAsyncIteration:
+                        break
+                    received = True
+                    yield chunk
+            except Exception as e:
+                if received:
+                    # ส่งไปแล้วบางส่วน -> retry ไม่ได้ บันทึกแล้วโยนต่อให้ผู้เรียกจัดการ
+                    self._record_failure(e, started, ticket)
+                    raise
+                error = e
+            finally:
+                # client หลุด (GeneratorExit / CancelledError) ก็มาถึงตรงนี้ -> คืน slot และปิด stream ต้นทางเสมอ
+                self._arelease(semaphore)
+                if hasattr(stream, 'aclose'):
+                    await stream.aclose()
+            if error is None:
+                self._succeeded(started, ticket)
+                return
+            self._failed(error, attempt, deadline, started, ticket)
+            await asyncio.sleep(self._backoff(attempt, deadline))
+
+    # ==================== bookkeeping ====================
+
+    def _admit(self):
+        """ คืนตั๋วของ breaker ไว้ส่งกลับตอนบันทึกผลของครั้งนี้ """
+        ticket = self.breaker.allow()
+        if not ticket:
+            self._reject()
+            raise LLMUnavailable("ระบบ AI ขัดข้องชั่วคราว ลองใหม่อีกครั้งในอีกสักครู่")
+        self._count('attempts')
+        return ticket
+
+    def _attempt_timeout(self, deadline):
+        # ครั้งนี้รอได้ไม่เกิน timeout ต่อครั้ง และไม่เกินเวลาที่เหลือของ deadline รวม
+        return max(0.1, min(self.timeout, deadline - time.monotonic()))
+
+    def _failed(self, exc, attempt, deadline, started, ticket):
+        """ บันทึกความล้มเหลว แล้วโยนต่อถ้า retry ไม่ได้ / ไม่คุ้ม """
+        self._record_failure(exc, started, ticket)
+        transient = is_transient(exc)
+        if not transient or attempt >= self.max_attempts:
+            raise exc
+        if time.monotonic() + self._backoff_floor(attempt) >= deadline:
+            raise exc
+        self._count('retries')
+
+    def _record_failure(self, exc, started, ticket):
+        self._latencies.append(time.monotonic() - started)
+        self._count('failed')
+        if isinstance(exc, (TimeoutError, asyncio.TimeoutError, FutureTimeout)):
+            self._count('timeouts')
+        # error ถาวร (เช่น prompt ผิด) ไม่ได้แปลว่า Gemini มีปัญหา -> ไม่นับใน breaker
+        self.breaker.record(not is_transient(exc), ticket)
+
+    def _succeeded(self, started, ticket):
+        self._latencies.append(time.monotonic() - started)
+        self._count('succeeded')
+        self.breaker.record(True, ticket)
+
+    def _backoff_floor(self, attempt):
+        return self.retry_base * (2 ** (attempt - 1)) * 0.5
+
+    def _backoff(self, attempt, deadline):
+        delay = self.retry_base * (2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+        return max(0.0, min(delay, deadline - time.monotonic()))
+
+    def _reject(self):
+        self._count('rejected')
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._counts[name] += 1
+
+    def metrics(self):
+        """ ตัวเลขของ process นี้ (แสดงใน /api/rag/metrics/ ใต้ 'llm') หน่วยเวลาเป็นวินาที """
+        with self._stats_lock:
+            counts = dict(self._counts)
+        return {
+            **counts,
+            'in_flight': self._in_flight + self._ain_flight,
+            'waiting': self._waiting + self._awaiting,
+            'max_concurrency': self.max_concurrency,
+            'breaker': self.breaker.state,
+            'breaker_trips': self.breaker.trips,
+            'queue_wait': _percentiles(self._queue_waits),
+            'latency': _percentiles(self._latencies),
+        }
+
+
+def _percentiles(samples):
+    values = sorted(samples)
+    if not values:
+        return {'p50': 0.0, 'p95': 0.0, 'max': 0.0}
+
+    def pick(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))], 3)
+
+    return {'p50': pick(0.5), 'p95': pick(0.95), 'max': round(values[-1], 3)}
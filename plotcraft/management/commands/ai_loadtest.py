@@ -0,0 +1,146 @@
+import json
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = ("load test: วัด latency ของหน้า CRUD ตอนว่าง เทียบกับตอนที่มีงาน AI ค้างอยู่ N งาน "
+            "(ยิงไปที่ server ที่รันอยู่ เช่น docker compose up)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help="base URL ของ server")
+        parser.add_argument('--user', required=True, help="username ที่ใช้ login (สร้าง session ให้อัตโนมัติ)")
+        parser.add_argument('--generations', type=int, default=8, help="จำนวนงาน AI ที่ยิงค้างไว้พร้อมกัน")
+        parser.add_argument('--endpoint', choices=['chat', 'chat-stream', 'scene', 'scene-stream'], default='chat')
+        parser.add_argument('--scene', type=int, help="scene id (ต้องใช้กับ --endpoint scene / scene-stream)")
+        parser.add_argument('--crud-paths', default='/home/,/notes/', help="หน้า CRUD ที่ใช้วัด คั่นด้วย ,")
+        parser.add_argument('--requests', type=int, default=50, help="จำนวน request CRUD ต่อรอบ")
+        parser.add_argument('--ramp', type=float, default=2.0, help="วินาทีที่รอให้งาน AI เริ่มค้างก่อนวัดรอบที่ 2")
+
+    def handle(self, *args, **options):
+        if options['endpoint'].startswith('scene') and not options['scene']:
+            raise CommandError("--endpoint scene ต้องระบุ --scene")
+
+        self.base_url = options['url'].rstrip('/')
+        self.cookie = f"{settings.SESSION_COOKIE_NAME}={self.create_session(options['user'])}"
+        crud_paths = [path.strip() for path in options['crud_paths'].split(',') if path.strip()]
+
+        self.stdout.write(f"🧪 Baseline: {options['requests']} CRUD requests, no AI load")
+        baseline = self.measure_crud(crud_paths, options['requests'])
+
+        stop = threading.Event()
+        generation_latencies = []
+        generation_errors = []
+        threads = [
+            threading.Thread(
+                target=self.generation_loop,
+                args=(options, stop, generation_latencies, generation_errors),
+                daemon=True,
+            )
+            for _ in range(options['generations'])
+        ]
+        self.stdout.write(f"🔥 Starting {len(threads)} concurrent '{options['endpoint']}' generations")
+        for thread in threads:
+            thread.start()
+        time.sleep(options['ramp'])
+
+        loaded = self.measure_crud(crud_paths, options['requests'])
+        stop.set()
+        self.stdout.write("⏳ Waiting for in-flight generations to finish...")
+        for thread in threads:
+            thread.join()
+
+        self.report("CRUD (idle)", baseline)
+        self.report(f"CRUD ({len(threads)} generations in flight)", loaded)
+        self.report("AI generations", {'latencies': generation_latencies, 'errors': len(generation_errors)})
+        if baseline['latencies'] and loaded['latencies']:
+            ratio = self.percentile(loaded['latencies'], 95) / max(self.percentile(baseline['latencies'], 95), 0.001)
+            self.stdout.write(f"📈 CRUD p95 under load = {ratio:.2f}x idle p95")
+        if generation_errors:
+            self.stdout.write(self.style.WARNING(f"⚠️ first generation error: {generation_errors[0]}"))
+
+    def create_session(self, username):
+        """ สร้าง session ที่ login แล้วให้ user นี้ (ไม่ต้องผ่านหน้า login/CSRF) """
+        try:
+            user = get_user_model().objects.get(username=username)
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"ไม่พบ user '{username}'")
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        return session.session_key
+
+    def request(self, method, path, payload=None, timeout=300):
+        body = json.dumps(payload).encode('utf-8') if payload is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        req.add_header('Cookie', self.cookie)
+        if body is not None:
+            req.add_header('Content-Type', 'application/json')
+        started = time.perf_counter()
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            response.read()  # อ่านจนจบ (รวมถึง stream SSE)
+            status = response.status
+        return status, (time.perf_counter() - started) * 1000
+
+    def measure_crud(self, paths, count):
+        latencies = []
+        errors = 0
+        for i in range(count):
+            try:
+                status, elapsed = self.request('GET', paths[i % len(paths)], timeout=60)
+            except (urllib.error.URLError, OSError):
+                errors += 1
+                continue
+            if status == 200:
+                latencies.append(elapsed)
+            else:
+                errors += 1
+        return {'latencies': latencies, 'errors': errors}
+
+    def generation_loop(self, options, stop, latencies, errors):
+        endpoint = options['endpoint']
+        if endpoint.startswith('chat'):
+            path = '/api/chat/stream/' if endpoint == 'chat-stream' else '/api/chat/general/'
+            payload = {'message': 'ช่วยคิดไอเดียฉากต่อไปให้หน่อย'}
+        else:
+            path = f"/api/generate-scene/{options['scene']}/"
+            if endpoint == 'scene-stream':
+                path += 'stream/'
+            payload = {}
+
+        while not stop.is_set():
+            try:
+                status, elapsed = self.request('POST', path, payload)
+            except (urllib.error.URLError, OSError) as e:
+                errors.append(str(e))
+                time.sleep(0.5)
+                continue
+            if status == 200:
+                latencies.append(elapsed)
+            else:
+                errors.append(f"HTTP {status}")
+
+    def percentile(self, values, pct):
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+    def report(self, label, result):
+        latencies = result['latencies']
+        if not latencies:
+            self.stdout.write(f"{label:<40} no successful requests ({result['errors']} errors)")
+            return
+        self.stdout.write(
+            f"{label:<40} n={len(latencies):<5} p50={statistics.median(latencies):8.1f} ms  "
+            f"p95={self.percentile(latencies, 95):8.1f} ms  max={max(latencies):8.1f} ms  errors={result['errors']}"
+        )
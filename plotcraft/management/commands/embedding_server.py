@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from plotcraft.embedding_server import EmbeddingBatcher, create_server
+from plotcraft.embeddings import embedding_model_id, load_embeddings
+
+
+class Command(BaseCommand):
+    help = "รัน embedding server ตัวเดียวที่ batch request จากทุก web worker (ใช้คู่กับ RAG_EMBEDDING_BACKEND=remote)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bind', default=settings.RAG_EMBEDDING_URL,
+            help="เช่น http://127.0.0.1:8765 หรือ unix:///run/plotcraft/embed.sock",
+        )
+        parser.add_argument(
+            '--backend', choices=['local', 'onnx'], default=settings.RAG_EMBEDDING_SERVER_BACKEND,
+            help="model ที่ server ใช้ (ต้องตรงกับ RAG_EMBEDDING_SERVER_BACKEND ของ client)",
+        )
+        parser.add_argument('--max-batch', type=int, default=settings.RAG_EMBEDDING_SERVER_MAX_BATCH)
+        parser.add_argument('--window-ms', type=float, default=settings.RAG_EMBEDDING_SERVER_WINDOW_MS)
+
+    def handle(self, *args, **options):
+        embeddings = load_embeddings(options['backend'])
+        batcher = EmbeddingBatcher(
+            embeddings.embed_documents,
+            max_batch=options['max_batch'],
+            window_ms=options['window_ms'],
+        )
+        server = create_server(options['bind'], batcher, embedding_model_id(options['backend']))
+
+        self.stdout.write(f"🧠 Embedding server listening on {options['bind']} "
+                          f"(max batch {options['max_batch']}, window {options['window_ms']} ms)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        self.stdout.write("👋 Embedding server stopped")
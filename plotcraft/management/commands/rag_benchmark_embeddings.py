@@ -0,0 +1,103 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from plotcraft.chunking import chunk_text, html_to_text
+from plotcraft.embeddings import load_embeddings
+from plotcraft.models import Chapter
+
+
+class Command(BaseCommand):
+    help = "เทียบความเร็วและความแม่นของ embedding backend (เช่น local torch vs onnx) ด้วยเนื้อหาตอนจริงใน DB"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backends', default='local,onnx', help="รายชื่อ backend คั่นด้วย , (ตัวแรกคือ baseline)")
+        parser.add_argument('--limit', type=int, default=500, help="จำนวน chunk สูงสุดที่ใช้ทดสอบ")
+        parser.add_argument('--queries', type=int, default=50, help="จำนวน query สำหรับวัด latency/ความตรงกันของผลค้นหา")
+        parser.add_argument('--batch-size', type=int, default=32)
+        parser.add_argument('--top-k', type=int, default=5)
+        parser.add_argument('--novel', type=int, help="ใช้เฉพาะนิยายเรื่องนี้")
+
+    def handle(self, *args, **options):
+        import numpy as np
+
+        texts = self.load_texts(options['limit'], options['novel'])
+        if len(texts) < 2:
+            raise CommandError("ต้องมีเนื้อหาตอนใน DB อย่างน้อย 2 chunk")
+        # query = ประโยคต้นๆ ของ chunk (จำลองคำถามสั้นๆ ที่ผู้ใช้พิมพ์)
+        queries = [text[:80] for text in texts[::max(1, len(texts) // options['queries'])]][:options['queries']]
+        self.stdout.write(f"📚 {len(texts)} chunks, {len(queries)} queries")
+
+        results = {}
+        for backend in options['backends'].split(','):
+            embeddings = load_embeddings(backend.strip())
+            embeddings.embed_documents(texts[:options['batch_size']])  # warm up
+
+            started = time.perf_counter()
+            vectors = []
+            for start in range(0, len(texts), options['batch_size']):
+                vectors.extend(embeddings.embed_documents(texts[start:start + options['batch_size']]))
+            elapsed = time.perf_counter() - started
+
+            latencies = []
+            query_vectors = []
+            for query in queries:
+                t0 = time.perf_counter()
+                query_vectors.append(embeddings.embed_query(query))
+                latencies.append((time.perf_counter() - t0) * 1000)
+
+            results[backend] = {
+                'docs': self.normalize(np.array(vectors, dtype=np.float32)),
+                'queries': self.normalize(np.array(query_vectors, dtype=np.float32)),
+                'throughput': len(texts) / elapsed,
+                'p50': statistics.median(latencies),
+                'p99': float(np.percentile(latencies, 99)),
+            }
+
+        baseline_name = next(iter(results))
+        baseline = results[baseline_name]
+        k = min(options['top_k'], len(texts))
+        self.stdout.write(f"\n{'backend':<10} {'sent/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'cos':>7} {'top-' + str(k):>7}")
+        for name, result in results.items():
+            cosine = float((result['docs'] * baseline['docs']).sum(axis=1).mean())
+            agreement = self.topk_agreement(baseline, result, k)
+            self.stdout.write(
+                f"{name:<10} {result['throughput']:>10.1f} {result['p50']:>9.2f} {result['p99']:>9.2f} "
+                f"{cosine:>7.4f} {agreement:>7.3f}"
+            )
+        self.stdout.write(f"\n(cos / top-{k} = ความใกล้เคียงกับ baseline '{baseline_name}')")
+
+    def load_texts(self, limit, novel_id):
+        chapters = Chapter.objects.exclude(content='').only('content')
+        if novel_id:
+            chapters = chapters.filter(novel_id=novel_id)
+        texts = []
+        for chapter in chapters.iterator():
+            texts.extend(
+                chunk.text for chunk in chunk_text(
+                    html_to_text(chapter.content),
+                    max_chars=settings.RAG_CHUNK_MAX_CHARS,
+                    overlap=settings.RAG_CHUNK_OVERLAP_CHARS,
+                    min_chars=settings.RAG_CHUNK_MIN_CHARS,
+                )
+            )
+            if len(texts) >= limit:
+                break
+        return texts[:limit]
+
+    @staticmethod
+    def normalize(matrix):
+        import numpy as np
+
+        return matrix / np.clip(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-9, None)
+
+    @staticmethod
+    def topk_agreement(baseline, result, k):
+        """ สัดส่วนเฉลี่ยของผลค้นหา top-k ที่ตรงกับ baseline """
+        import numpy as np
+
+        expected = np.argsort(-(baseline['queries'] @ baseline['docs'].T), axis=1)[:, :k]
+        actual = np.argsort(-(result['queries'] @ result['docs'].T), axis=1)[:, :k]
+        return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(expected, actual)]))
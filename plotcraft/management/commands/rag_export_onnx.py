@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from plotcraft.embeddings import export_onnx_model
+
+
+class Command(BaseCommand):
+    help = "Export embedding model เป็น ONNX + quantize int8 สำหรับ RAG_EMBEDDING_BACKEND=onnx"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.RAG_ONNX_MODEL_DIR)
+        parser.add_argument(
+            '--arch', choices=['avx2', 'avx512', 'avx512_vnni', 'arm64'], default='avx2',
+            help="ชุดคำสั่ง CPU ที่ใช้ตอน quantize (avx2 ใช้ได้กับ x86 แทบทุกเครื่อง)",
+        )
+        parser.add_argument('--no-quantize', action='store_true', help="export แบบ fp32 อย่างเดียว")
+
+    def handle(self, *args, **options):
+        output = export_onnx_model(options['output'], quantize=not options['no_quantize'], arch=options['arch'])
+        self.stdout.write(self.style.SUCCESS(f"✅ Exported ONNX model to {output}"))
@@ -0,0 +1,38 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from plotcraft.rag_reconcile import Reconciler
+from plotcraft.rag_reindex import SOURCES
+
+
+class Command(BaseCommand):
+    help = ("เทียบ vector store กับ DB แล้วซ่อมเฉพาะส่วนที่ไม่ตรง (missing / stale / misplaced / orphan) "
+            "เหมาะกับรันทุกคืนแทนการ reindex ทั้งหมด")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--type', choices=list(SOURCES), action='append',
+                            help="เฉพาะประเภทนี้ (ใส่ซ้ำได้) ไม่ใส่ = ทุกประเภท")
+        parser.add_argument('--batch-size', type=int, default=500, help="จำนวนเอกสารที่อ่าน/ซ่อมต่อรอบ")
+        parser.add_argument('--dry-run', action='store_true', help="รายงานอย่างเดียว ไม่ซ่อม")
+        parser.add_argument('--json', action='store_true', help="พิมพ์สถิติเป็น JSON (สำหรับ cron/monitoring)")
+
+    def handle(self, *args, **options):
+        from plotcraft.rag_service import rag_service
+
+        reconciler = Reconciler(rag_service, batch_size=options['batch_size'], dry_run=options['dry_run'])
+        results = [reconciler.run(doc_type) for doc_type in options['type'] or list(SOURCES)]
+
+        if options['json']:
+            self.stdout.write(json.dumps(results))
+            return
+
+        verb = "found" if options['dry_run'] else "repaired"
+        for stats in results:
+            self.stdout.write(
+                f"🔎 {stats['type']:<10} db={stats['db_docs']:<6} store={stats['store_docs']:<6} "
+                f"missing={stats['missing']} stale={stats['stale']} misplaced={stats['misplaced']} "
+                f"orphans={stats['orphans']} drift={stats['drift_ratio']:.2%} ({stats['seconds']} s)"
+            )
+        total = sum(stats['drift'] for stats in results)
+        self.stdout.write(self.style.SUCCESS(f"✅ Reconcile done: {verb} {total} drifted docs"))
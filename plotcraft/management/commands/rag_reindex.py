@@ -0,0 +1,79 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from plotcraft.embeddings import EmbeddingPool
+from plotcraft.rag_reindex import SOURCES, Checkpoint, Reindexer
+
+
+class Command(BaseCommand):
+    help = ("สร้าง vector index ใหม่จาก DB (หลังเปลี่ยน embedding model หรือ volume ของ ChromaDB หาย) "
+            "ถ้าหยุดกลางทาง รันคำสั่งเดิมอีกครั้งจะทำต่อจาก checkpoint")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--type', choices=list(SOURCES), action='append',
+                            help="เฉพาะประเภทนี้ (ใส่ซ้ำได้) ไม่ใส่ = ทุกประเภท")
+        parser.add_argument('--user', type=int, help="เฉพาะข้อมูลของ user id นี้")
+        parser.add_argument('--novel', type=int, help="เฉพาะข้อมูลของนิยาย id นี้")
+        parser.add_argument('--batch-size', type=int, default=256, help="จำนวนเอกสารที่ embed/upsert ต่อรอบ")
+        parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                            help="จำนวน process ที่ใช้ embed (0 = embed ใน process นี้)")
+        parser.add_argument('--checkpoint', default=str(settings.BASE_DIR / '.rag_reindex.json'),
+                            help="ไฟล์จดความคืบหน้า")
+        parser.add_argument('--restart', action='store_true', help="ไม่สนใจ checkpoint เดิม เริ่มใหม่ทั้งหมด")
+        parser.add_argument('--dry-run', action='store_true', help="นับแถว/เอกสารอย่างเดียว ไม่ embed ไม่เขียน")
+
+    def handle(self, *args, **options):
+        from plotcraft.rag_service import rag_service
+
+        doc_types = options['type'] or list(SOURCES)
+        scope = {
+            'types': doc_types,
+            'user': options['user'],
+            'novel': options['novel'],
+            'embedding_backend': settings.RAG_EMBEDDING_BACKEND,
+            'sharding': settings.RAG_SHARDING,
+        }
+        checkpoint = Checkpoint(None if options['dry_run'] else options['checkpoint'], scope)
+        if options['restart']:
+            checkpoint.clear()
+        elif checkpoint.positions:
+            self.stdout.write(f"↩️ Resuming from checkpoint: {checkpoint.positions}")
+
+        workers = 0 if options['dry_run'] else options['workers']
+        # workers=0 -> ใช้ model ของ rag_service (โหลดเมื่อมีข้อความที่ต้อง embed จริงเท่านั้น)
+        pool = EmbeddingPool(workers, lambda texts: rag_service.embeddings.embed_documents(texts))
+        reindexer = Reindexer(
+            rag_service, pool, checkpoint,
+            batch_size=options['batch_size'], dry_run=options['dry_run'], log=self.stdout.write,
+        )
+
+        started = time.perf_counter()
+        try:
+            for doc_type in doc_types:
+                self.stdout.write(f"📚 Reindexing {doc_type}...")
+                reindexer.run(doc_type, user_id=options['user'], novel_id=options['novel'])
+        finally:
+            pool.close()
+        elapsed = time.perf_counter() - started
+
+        if not options['dry_run']:
+            checkpoint.clear()
+        self.report(reindexer.stats, elapsed, workers, options['dry_run'])
+
+    def report(self, stats, elapsed, workers, dry_run):
+        docs_per_second = stats['documents'] / elapsed if elapsed else 0.0
+        label = "Dry run" if dry_run else "Reindex done"
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {label}: {stats['rows']} rows -> {stats['documents']} docs in {elapsed:.1f} s "
+            f"({docs_per_second:.1f} docs/s)"
+        ))
+        if not dry_run:
+            cached = stats['documents'] - stats['embedded']
+            embedder = f"{workers} processes" if workers else "in-process"
+            self.stdout.write(
+                f"   embedded {stats['embedded']} ({cached} from cache, {embedder}) in {stats['embed_seconds']:.1f} s, "
+                f"vector store writes {stats['write_seconds']:.1f} s"
+            )
@@ -0,0 +1,69 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = ("ย้ายเอกสารใน vector store ไปอยู่ shard ที่ถูกต้องตาม RAG_SHARDING "
+            "(ใช้ embedding เดิม ไม่ต้อง embed ใหม่)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="จำนวนเอกสารที่อ่าน/เขียนต่อรอบ")
+        parser.add_argument('--dry-run', action='store_true', help="นับอย่างเดียว ไม่ย้ายจริง")
+        parser.add_argument('--drop-empty', action='store_true', help="ลบ collection ที่ว่างหลังย้ายเสร็จ")
+
+    def handle(self, *args, **options):
+        from plotcraft.rag_service import rag_service
+
+        client = rag_service.vector_client
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        total_moved = 0
+
+        for name in client.list_stores():
+            store = client.store(name)
+            moved_ids = []
+            per_target = defaultdict(int)
+            offset = 0
+            while True:
+                page = store.get(
+                    include=["documents", "metadatas", "embeddings"], limit=batch_size, offset=offset
+                )
+                if not len(page["ids"]):
+                    break
+                offset += len(page["ids"])
+
+                # จัดกลุ่มตาม shard ปลายทาง แล้ว upsert ทีละกลุ่ม
+                groups = defaultdict(lambda: {"ids": [], "embeddings": [], "documents": [], "metadatas": []})
+                for i, doc_id in enumerate(page["ids"]):
+                    metadata = page["metadatas"][i] or {}
+                    target = rag_service.shard_name(metadata.get("owner_id"))
+                    if target == name:
+                        continue
+                    group = groups[target]
+                    group["ids"].append(doc_id)
+                    group["embeddings"].append(page["embeddings"][i])
+                    group["documents"].append(page["documents"][i])
+                    group["metadatas"].append(metadata)
+
+                for target, group in groups.items():
+                    per_target[target] += len(group["ids"])
+                    moved_ids.extend(group["ids"])
+                    if not dry_run:
+                        rag_service.store_for_shard(target).upsert(**group)
+
+            # ลบจากที่เดิมหลังอ่านครบแล้ว (ลบระหว่างอ่านจะทำให้ offset เลื่อน)
+            if not dry_run:
+                for start in range(0, len(moved_ids), batch_size):
+                    store.delete(ids=moved_ids[start:start + batch_size])
+
+            total_moved += len(moved_ids)
+            self.stdout.write(f"📦 {name}: {offset} docs, {len(moved_ids)} to move -> {len(per_target)} shards")
+
+            if options['drop_empty'] and not dry_run and store.count() == 0:
+                client.drop_store(name)
+                rag_service.reset_connections()
+                self.stdout.write(f"🗑️ dropped empty {name}")
+
+        verb = "would move" if dry_run else "moved"
+        self.stdout.write(self.style.SUCCESS(f"✅ Reshard done: {verb} {total_moved} docs"))
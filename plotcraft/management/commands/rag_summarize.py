@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from plotcraft.models import Novel
+
+
+class Command(BaseCommand):
+    help = ("สร้าง/อัปเดตสรุปตอนและเรื่องย่อสะสมทันที (ปกติ worker ทำให้เองหลังแก้ตอน) "
+            "ใช้ตอนเปิดใช้ครั้งแรกกับนิยายที่มีอยู่แล้ว")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help="เฉพาะนิยายของ user id นี้")
+        parser.add_argument('--novel', type=int, help="เฉพาะนิยาย id นี้")
+
+    def handle(self, *args, **options):
+        from plotcraft.rag_service import rag_service
+
+        novels = Novel.objects.order_by('pk')
+        if options['user']:
+            novels = novels.filter(author_id=options['user'])
+        if options['novel']:
+            novels = novels.filter(pk=options['novel'])
+
+        calls = 0
+        for novel_id in novels.values_list('pk', flat=True).iterator():
+            stats = rag_service.refresh_story_summary(novel_id)
+            if stats is None:
+                self.stderr.write("⚠️ No LLM available (GOOGLE_API_KEY), nothing summarized")
+                return
+            calls += stats['llm_calls']
+        self.stdout.write(self.style.SUCCESS(f"✅ Summaries up to date ({calls} LLM calls)"))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from plotcraft import rag_queue
+
+
+class Command(BaseCommand):
+    help = "Worker ที่ดึงงานจากคิว RagIndexJob ไป embed และบันทึกลง ChromaDB"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help="ทำงานที่ค้างอยู่จนคิวว่างแล้วจบ (ไม่ต้องรอรับงานใหม่)",
+        )
+
+    def handle(self, *args, **options):
+        from plotcraft.rag_service import rag_service
+
+        self.stdout.write("🛠️ RAG worker started")
+        try:
+            rag_queue.run_worker(rag_service, once=options['once'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write("👋 RAG worker stopped")
@@ -0,0 +1,154 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from plotcraft.bulk_delete import delete_account
+from plotcraft.models import Character, Item, Location, Novel, Scene, Timeline, TimelineEvent, User
+from plotcraft.search_index import overview, reindex
+
+BENCH_USERNAME = 'search_benchmark'
+
+# คำสำหรับสุ่มสร้างข้อความ (ไทยปนอังกฤษเหมือนข้อมูลจริง)
+WORDS = (
+    "ดาบ มังกร ราชา เจ้าหญิง ป่า ภูเขา ทะเล ปราสาท เวทมนตร์ สงคราม อาณาจักร หมู่บ้าน พ่อค้า นักรบ "
+    "ความลับ คำสาป ตำนาน แหวน มงกุฎ หอคอย แม่น้ำ ทะเลทราย จักรวรรดิ กบฏ ทรยศ ความรัก แค้น "
+    "phoenix shadow crystal empire guild knight arcane relic storm ember"
+).split()
+
+
+class Command(BaseCommand):
+    help = ("เทียบ latency ของช่องค้นหารวม: แบบเดิม (OR __icontains ทุกช่อง 6 ตาราง) vs search index "
+            "โดยสร้างข้อมูลสุ่มจำนวนมากให้ผู้ใช้ทดสอบชั่วคราว")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000, help="จำนวนแถวต่อประเภท (ตัวละคร/ฉาก/สถานที่/...)")
+        parser.add_argument('--words', type=int, default=120, help="จำนวนคำโดยประมาณต่อช่องข้อความยาว")
+        parser.add_argument('--queries', type=int, default=30)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keep', action='store_true', help="ไม่ลบข้อมูลทดสอบหลังวัดเสร็จ (รันซ้ำได้เร็วขึ้น)")
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        user, created = User.objects.get_or_create(username=BENCH_USERNAME)
+        if created or not Novel.objects.filter(author=user).exists():
+            started = time.perf_counter()
+            self.seed(user, options['rows'], options['words'])
+            self.stdout.write(f"🌱 Seeded {options['rows']} rows per type in {time.perf_counter() - started:.1f}s")
+        started = time.perf_counter()
+        counts = reindex(owner_id=user.pk)
+        self.stdout.write(f"📚 Indexed {sum(counts.values())} documents in {time.perf_counter() - started:.1f}s")
+
+        queries = [self.random.choice(WORDS) for _ in range(options['queries'] // 2)]
+        queries += [" ".join(self.random.sample(WORDS, 2)) for _ in range(options['queries'] - len(queries))]
+        queries.append("ไม่มีคำนี้ในข้อมูลแน่นอน")
+
+        results = {'legacy': self.measure(lambda q: self.legacy_search(user, q), queries)}
+        results['index'] = self.measure(lambda q: self.indexed_search(user, q), queries)
+
+        self.stdout.write(f"\n{'impl':<8} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+        for name, latencies in results.items():
+            self.stdout.write(
+                f"{name:<8} {statistics.median(latencies):>9.1f} {self.percentile(latencies, 0.95):>9.1f} "
+                f"{max(latencies):>9.1f}"
+            )
+        speedup = statistics.median(results['legacy']) / max(statistics.median(results['index']), 1e-6)
+        self.stdout.write(self.style.SUCCESS(f"\n✅ index p50 is {speedup:.1f}x faster than legacy"))
+
+        if not options['keep']:
+            delete_account(user)
+            self.stdout.write("🧹 Removed benchmark data")
+
+    def measure(self, run, queries):
+        run(queries[0])  # warm up
+        latencies = []
+        for query in queries:
+            started = time.perf_counter()
+            run(query)
+            latencies.append((time.perf_counter() - started) * 1000)
+        return latencies
+
+    @staticmethod
+    def percentile(values, ratio):
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * ratio))]
+
+    @staticmethod
+    def legacy_search(user, query):
+        """ querysets เดิมของ views.global_search (template เรียก .count แล้ววนแสดงทุกแถว) """
+        querysets = [
+            Novel.objects.filter(Q(title__icontains=query) | Q(synopsis__icontains=query), author=user),
+            Character.objects.filter(
+                Q(name__icontains=query) | Q(background__icontains=query) | Q(personality__icontains=query)
+                | Q(appearance__icontains=query) | Q(alias__icontains=query),
+                created_by=user,
+            ),
+            Scene.objects.filter(Q(title__icontains=query) | Q(content__icontains=query), created_by=user),
+            TimelineEvent.objects.filter(
+                Q(title__icontains=query) | Q(description__icontains=query), timeline__created_by=user
+            ),
+            Location.objects.filter(
+                Q(name__icontains=query) | Q(history__icontains=query) | Q(terrain__icontains=query)
+                | Q(climate__icontains=query) | Q(ecosystem__icontains=query) | Q(myths__icontains=query)
+                | Q(culture__icontains=query) | Q(politics__icontains=query) | Q(economy__icontains=query)
+                | Q(language__icontains=query),
+                created_by=user,
+            ),
+            Item.objects.filter(
+                Q(name__icontains=query) | Q(appearance__icontains=query) | Q(history__icontains=query)
+                | Q(abilities__icontains=query) | Q(limitations__icontains=query),
+                created_by=user,
+            ),
+        ]
+        for queryset in querysets:
+            queryset.count()
+            list(queryset)
+
+    @staticmethod
+    def indexed_search(user, query):
+        """ จำนวน + หน้าแรกทุกหมวดของหน้าค้นหา (ไม่ใช้ cache เพื่อวัดเวลา query จริง) """
+        overview(user.pk, query, use_cache=False)
+
+    def text(self, words):
+        return " ".join(self.random.choice(WORDS) for _ in range(words))
+
+    def seed(self, user, rows, words):
+        short = max(3, words // 10)
+        novels = Novel.objects.bulk_create(
+            Novel(author=user, title=self.text(3), synopsis=self.text(words)) for _ in range(max(1, rows // 100))
+        )
+        timeline = Timeline.objects.create(created_by=user, title="Benchmark", related_project=novels[0])
+        Character.objects.bulk_create(
+            (Character(
+                created_by=user, project=self.random.choice(novels), name=self.text(2), alias=self.text(2),
+                appearance=self.text(short), personality=self.text(short), background=self.text(words),
+            ) for _ in range(rows)),
+            batch_size=500,
+        )
+        Scene.objects.bulk_create(
+            (Scene(
+                created_by=user, project=self.random.choice(novels), title=self.text(3),
+                goal=self.text(short), conflict=self.text(short), content=self.text(words * 3),
+            ) for _ in range(rows)),
+            batch_size=500,
+        )
+        TimelineEvent.objects.bulk_create(
+            (TimelineEvent(timeline=timeline, title=self.text(3), description=self.text(words)) for _ in range(rows)),
+            batch_size=500,
+        )
+        Location.objects.bulk_create(
+            (Location(
+                created_by=user, name=self.text(2), terrain=self.text(short), climate=self.text(short),
+                history=self.text(words), myths=self.text(short), culture=self.text(short),
+            ) for _ in range(rows)),
+            batch_size=500,
+        )
+        Item.objects.bulk_create(
+            (Item(
+                created_by=user, name=self.text(2), abilities=self.text(short), appearance=self.text(short),
+                history=self.text(words),
+            ) for _ in range(rows)),
+            batch_size=500,
+        )
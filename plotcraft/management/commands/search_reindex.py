@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from plotcraft.search_index import reindex
+
+
+class Command(BaseCommand):
+    help = ("สร้าง search index ของช่องค้นหารวมใหม่ทั้งหมด (ปกติ signals อัปเดตให้เองตอน save) "
+            "ใช้ตอนเปิดใช้ครั้งแรก หรือหลังแก้ข้อมูลด้วย SQL/bulk update ที่ไม่ผ่าน signal")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help="เฉพาะข้อมูลของ user id นี้")
+
+    def handle(self, *args, **options):
+        counts = reindex(owner_id=options['user'])
+        summary = ", ".join(f"{entity_type}={count}" for entity_type, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f"✅ Indexed {sum(counts.values())} documents ({summary})"))
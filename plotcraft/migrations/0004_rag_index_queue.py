@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plotcraft', '0003_rename_is_published_chapter_is_finished'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RagIndexJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entity_type', models.CharField(max_length=20)),
+                ('entity_id', models.BigIntegerField()),
+                ('action', models.CharField(choices=[('index', 'Index'), ('delete', 'Delete')], default='index', max_length=10)),
+                ('status', models.CharField(choices=[('pending', 'รอทำ'), ('failed', 'ล้มเหลว (เกินจำนวนครั้งที่ลองใหม่)')], default='pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('enqueued_at', models.DateTimeField()),
+                ('available_at', models.DateTimeField(help_text='เวลาที่ worker หยิบงานนี้ได้ (ใช้เลื่อนเวลาตอน retry)')),
+                ('locked_until', models.DateTimeField(blank=True, help_text='worker จองงานไว้ถึงเวลานี้', null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'available_at'], name='plotcraft_r_status_c45df7_idx')],
+                'constraints': [models.UniqueConstraint(fields=('entity_type', 'entity_id'), name='unique_rag_job_per_entity')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plotcraft', '0005_embedding_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ragindexjob',
+            name='owner_id',
+            field=models.BigIntegerField(blank=True, help_text='เจ้าของข้อมูล (ใช้หา shard ตอนลบ เพราะ object หายไปแล้ว)', null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plotcraft', '0006_rag_job_owner'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ragindexjob',
+            name='coalesced',
+            field=models.PositiveIntegerField(default=0, help_text='จำนวน save ที่ถูกรวมเข้ามาในงานนี้ (index ที่ประหยัดไปได้)'),
+        ),
+        migrations.AddField(
+            model_name='ragindexjob',
+            name='first_enqueued_at',
+            field=models.DateTimeField(blank=True, help_text='save ครั้งแรกของรอบนี้ (debounce รอได้ไม่เกิน RAG_QUEUE_DEBOUNCE_MAX_SECONDS)', null=True),
+        ),
+        migrations.AlterField(
+            model_name='ragindexjob',
+            name='available_at',
+            field=models.DateTimeField(help_text='เวลาที่ worker หยิบงานนี้ได้ (ใช้เลื่อนเวลาตอน retry / debounce)'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plotcraft', '0007_rag_job_debounce'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChapterSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('summary', models.TextField(blank=True)),
+                ('model_name', models.CharField(max_length=100)),
+                ('chapter_updated_at', models.DateTimeField(blank=True, help_text='updated_at ของตอนตอนที่ตรวจล่าสุด (ไม่เปลี่ยน = ไม่ต้องโหลดเนื้อหามา hash)', null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('chapter', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='summary', to='plotcraft.chapter')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='NovelSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('summary', models.TextField(blank=True)),
+                ('steps', models.JSONField(default=list)),
+                ('model_name', models.CharField(max_length=100)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('novel', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='story_summary', to='plotcraft.novel')),
+            ],
+        ),
+    ]
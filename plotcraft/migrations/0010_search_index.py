@@ -0,0 +1,135 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:25
+
+import html
+import re
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils.html import strip_tags
+
+# FULLTEXT ต่อช่อง (ใช้คิดคะแนนแบบถ่วงน้ำหนัก) + ทั้งสามช่องรวมกัน (ใช้ใน WHERE)
+# ngram parser ตัดคำเป็นชิ้นละ ngram_token_size ตัวอักษร -> ภาษาไทยที่ไม่เว้นวรรคก็ค้นได้
+FULLTEXT_INDEXES = {
+    'searchdoc_title_ft': 'title',
+    'searchdoc_keywords_ft': 'keywords',
+    'searchdoc_body_ft': 'body',
+    'searchdoc_all_ft': 'title, keywords, body',
+}
+
+
+BATCH_SIZE = 500
+
+# สำเนาของ search_index.SOURCES ณ ตอนสร้าง migration (migration ห้าม import โค้ดที่ยังแก้ต่อได้)
+# entity_type -> (model, owner, novel, parent, title, keywords, body)
+BACKFILL_SOURCES = {
+    'novel': ('Novel', 'author_id', 'id', None, 'title', (), ('synopsis',)),
+    'character': (
+        'Character', 'created_by_id', 'project_id', None, 'name', ('alias', 'role', 'occupation', 'species'),
+        ('appearance', 'personality', 'background', 'goals', 'strengths', 'weaknesses', 'skills', 'notes'),
+    ),
+    'scene': ('Scene', 'created_by_id', 'project_id', None, 'title', ('goal', 'conflict', 'outcome'), ('content',)),
+    'timeline_event': (
+        'TimelineEvent', 'timeline__created_by_id', 'timeline__related_project_id', 'timeline_id',
+        'title', ('time_label',), ('description',),
+    ),
+    'location': (
+        'Location', 'created_by_id', 'project_id', None, 'name', ('world_type',),
+        ('terrain', 'climate', 'ecosystem', 'history', 'myths', 'politics', 'economy', 'culture', 'language'),
+    ),
+    'item': (
+        'Item', 'created_by_id', 'project_id', None, 'name', ('category',),
+        ('abilities', 'limitations', 'appearance', 'history'),
+    ),
+}
+
+_BLOCK_TAGS = re.compile(r'<\s*(br|/p|/div|/h[1-6]|/li|/blockquote)\s*/?>', re.I)
+
+
+def _plain(value):
+    text = _BLOCK_TAGS.sub('\n', str(value or ''))
+    return html.unescape(strip_tags(text)).replace('\xa0', ' ').strip()
+
+
+def _value(obj, path):
+    for name in path.split('__'):
+        if obj is None:
+            return None
+        obj = getattr(obj, name)
+    return obj
+
+
+def backfill_documents(apps, schema_editor):
+    """ สร้าง SearchDocument ให้ข้อมูลที่มีอยู่แล้ว (ไม่งั้นค้นอะไรก็ไม่เจอจนกว่าจะรัน search_reindex เอง) """
+    SearchDocument = apps.get_model('plotcraft', 'SearchDocument')
+    for entity_type, (model_name, owner, novel, parent, title, keywords, body) in BACKFILL_SOURCES.items():
+        objects = apps.get_model('plotcraft', model_name).objects.order_by('pk')
+        if '__' in owner:
+            objects = objects.select_related(owner.rsplit('__', 1)[0])
+        batch = []
+        for obj in objects.iterator(chunk_size=BATCH_SIZE):
+            owner_id = _value(obj, owner)
+            if owner_id is None:
+                continue
+            batch.append(SearchDocument(
+                owner_id=owner_id,
+                entity_type=entity_type,
+                entity_id=obj.pk,
+                novel_id=_value(obj, novel),
+                parent_id=_value(obj, parent) if parent else None,
+                title=str(getattr(obj, title) or "")[:255],
+                keywords="\n".join(filter(None, (_plain(getattr(obj, field)) for field in keywords))),
+                body="\n".join(filter(None, (_plain(getattr(obj, field)) for field in body))),
+            ))
+            if len(batch) >= BATCH_SIZE:
+                SearchDocument.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            SearchDocument.objects.bulk_create(batch)
+
+
+def add_fulltext_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    table = schema_editor.quote_name('plotcraft_searchdocument')
+    for name, columns in FULLTEXT_INDEXES.items():
+        schema_editor.execute(f"ALTER TABLE {table} ADD FULLTEXT INDEX {name} ({columns}) WITH PARSER ngram")
+
+
+def drop_fulltext_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    table = schema_editor.quote_name('plotcraft_searchdocument')
+    for name in FULLTEXT_INDEXES:
+        schema_editor.execute(f"ALTER TABLE {table} DROP INDEX {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plotcraft', '0009_chat_sessions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entity_type', models.CharField(max_length=20)),
+                ('entity_id', models.BigIntegerField()),
+                ('novel_id', models.BigIntegerField(blank=True, null=True)),
+                ('parent_id', models.BigIntegerField(blank=True, help_text='object แม่ที่ใช้สร้างลิงก์ (timeline ของเหตุการณ์)', null=True)),
+                ('title', models.CharField(max_length=255)),
+                ('keywords', models.TextField(blank=True)),
+                ('body', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', 'entity_type'], name='plotcraft_s_owner_i_462787_idx')],
+                'constraints': [models.UniqueConstraint(fields=('entity_type', 'entity_id'), name='unique_search_document')],
+            },
+        ),
+        migrations.RunPython(add_fulltext_indexes, drop_fulltext_indexes),
+        migrations.RunPython(backfill_documents, migrations.RunPython.noop),
+    ]
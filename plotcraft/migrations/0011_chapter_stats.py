@@ -0,0 +1,101 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:33
+
+import html
+import math
+import re
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.utils.html import strip_tags
+
+BATCH_SIZE = 200
+STAT_FIELDS = ('char_count', 'word_count', 'reading_minutes')
+
+# สำเนาของ chunking.html_to_text / chapter_stats.compute ณ ตอนสร้าง migration
+# (migration ห้าม import โค้ดที่ยังแก้ต่อได้ ไม่งั้นรันย้อนหลังแล้วได้ค่าต่างไปหรือพัง)
+_BLOCK_TAGS = re.compile(r'<\s*(br|/p|/div|/h[1-6]|/li|/blockquote)\s*/?>', re.I)
+_WORD = re.compile(r'\w', re.UNICODE)
+_SPACE = re.compile(r'\s+')
+
+
+def compute(content):
+    text = _BLOCK_TAGS.sub('\n', content or '')
+    text = html.unescape(strip_tags(text)).replace('\xa0', ' ').strip()
+    if not text:
+        return (0, 0, 0)
+    from pythainlp.tokenize import word_tokenize
+
+    words = sum(1 for token in word_tokenize(text, engine='newmm', keep_whitespace=False) if _WORD.search(token))
+    minutes = math.ceil(words / settings.CHAPTER_WORDS_PER_MINUTE) if words else 0
+    return (len(_SPACE.sub("", text)), words, minutes)
+
+
+def backfill_stats(apps, schema_editor):
+    """ นับสถิติของตอนที่มีอยู่แล้วทีละ batch แล้วรวมเป็นยอดของนิยาย """
+    Chapter = apps.get_model('plotcraft', 'Chapter')
+    Novel = apps.get_model('plotcraft', 'Novel')
+    batch = []
+    for chapter in Chapter.objects.only('id', 'content').iterator(chunk_size=BATCH_SIZE):
+        for field, value in zip(STAT_FIELDS, compute(chapter.content)):
+            setattr(chapter, field, value)
+        batch.append(chapter)
+        if len(batch) >= BATCH_SIZE:
+            Chapter.objects.bulk_update(batch, STAT_FIELDS)
+            batch = []
+    if batch:
+        Chapter.objects.bulk_update(batch, STAT_FIELDS)
+
+    totals = Chapter.objects.values('novel_id').annotate(
+        chapters=Count('id'), **{f'total_{field}': Sum(field) for field in STAT_FIELDS}
+    )
+    for row in totals.iterator():
+        Novel.objects.filter(pk=row['novel_id']).update(
+            chapter_count=row['chapters'], **{field: row[f'total_{field}'] or 0 for field in STAT_FIELDS}
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plotcraft', '0010_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chapter',
+            name='char_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='จำนวนตัวอักษร (ไม่นับช่องว่าง)'),
+        ),
+        migrations.AddField(
+            model_name='chapter',
+            name='reading_minutes',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='เวลาอ่านโดยประมาณ (นาที)'),
+        ),
+        migrations.AddField(
+            model_name='chapter',
+            name='word_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='จำนวนคำ'),
+        ),
+        migrations.AddField(
+            model_name='novel',
+            name='chapter_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='novel',
+            name='char_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='novel',
+            name='reading_minutes',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='novel',
+            name='word_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_stats, migrations.RunPython.noop),
+    ]
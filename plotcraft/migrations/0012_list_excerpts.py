@@ -0,0 +1,89 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:35
+
+import html
+import re
+
+from django.db import migrations, models
+from django.utils.html import strip_tags
+
+BATCH_SIZE = 200
+EXCERPT_LENGTH = 200
+
+# สำเนาของ excerpts.SOURCES / excerpts.make ณ ตอนสร้าง migration (migration ห้าม import โค้ดที่ยังแก้ต่อได้)
+SOURCES = {
+    'novel': ('synopsis',),
+    'character': ('background', 'personality', 'appearance', 'goals'),
+    'location': ('terrain', 'history'),
+    'item': ('abilities', 'appearance', 'history'),
+    'scene': ('content', 'outcome'),
+}
+
+_BLOCK_TAGS = re.compile(r'<\s*(br|/p|/div|/h[1-6]|/li|/blockquote)\s*/?>', re.I)
+_SPACE = re.compile(r'\s+')
+
+
+def make(value):
+    text = _BLOCK_TAGS.sub('\n', value or '')
+    text = _SPACE.sub(' ', html.unescape(strip_tags(text)).replace('\xa0', ' ').strip())
+    if len(text) <= EXCERPT_LENGTH:
+        return text
+    return text[:EXCERPT_LENGTH - 1].rstrip() + '…'
+
+
+def compute(obj, sources):
+    for field in sources:
+        excerpt = make(getattr(obj, field))
+        if excerpt:
+            return excerpt
+    return ""
+
+
+def backfill_excerpts(apps, schema_editor):
+    """ ตัด excerpt ให้แถวที่มีอยู่แล้ว (โหลดเฉพาะ field ต้นทาง) ทีละ batch """
+    for model_name, sources in SOURCES.items():
+        model = apps.get_model('plotcraft', model_name)
+        batch = []
+        for obj in model.objects.only('id', *sources).iterator(chunk_size=BATCH_SIZE):
+            obj.excerpt = compute(obj, sources)
+            batch.append(obj)
+            if len(batch) >= BATCH_SIZE:
+                model.objects.bulk_update(batch, ['excerpt'])
+                batch = []
+        if batch:
+            model.objects.bulk_update(batch, ['excerpt'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plotcraft', '0011_chapter_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='character',
+            name='excerpt',
+            field=models.CharField(blank=True, editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='excerpt',
+            field=models.CharField(blank=True, editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='location',
+            name='excerpt',
+            field=models.CharField(blank=True, editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='novel',
+            name='excerpt',
+            field=models.CharField(blank=True, editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='scene',
+            name='excerpt',
+            field=models.CharField(blank=True, editable=False, max_length=200),
+        ),
+        migrations.RunPython(backfill_excerpts, migrations.RunPython.noop),
+    ]
@@ -101,6 +101,16 @@ class Novel(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # ยอดรวมของทุกตอน บวก/ลบส่วนต่างทีละตอนตอน save/ลบ (ดู plotcraft/chapter_stats.py) หน้า list ไม่ต้องโหลดเนื้อหา
+    # (IntegerField ไม่ใช่ Positive: UPDATE แบบ F() - n บนคอลัมน์ UNSIGNED ของ MySQL error ถ้าผลติดลบชั่วคราว)
+    chapter_count = models.IntegerField(default=0, editable=False)
+    char_count = models.IntegerField(default=0, editable=False)
+    word_count = models.IntegerField(default=0, editable=False)
+    reading_minutes = models.IntegerField(default=0, editable=False)
+
+    # ข้อความสั้นสำหรับการ์ดในหน้า list ตัดจาก synopsis ตอน save (ดู plotcraft/excerpts.py)
+    excerpt = models.CharField(max_length=200, blank=True, editable=False)
+
     def __str__(self):
         return self.title
 
@@ -117,6 +127,11 @@ class Chapter(models.Model):
     is_draft = models.BooleanField(default=True, verbose_name="ฉบับร่าง (ไม่ส่งออก)")
     is_finished = models.BooleanField(default=False, verbose_name="เสร็จสมบูรณ์ (พร้อมส่งออก)")
 
+    # คำนวณจาก content ตอน save (ดู plotcraft/chapter_stats.py)
+    char_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="จำนวนตัวอักษร (ไม่นับช่องว่าง)")
+    word_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="จำนวนคำ")
+    reading_minutes = models.PositiveIntegerField(default=0, editable=False, verbose_name="เวลาอ่านโดยประมาณ (นาที)")
+
     class Meta:
         ordering = ['order', 'created_at']
 
@@ -178,6 +193,9 @@ class Character(models.Model):
         related_name='created_characters'
     )
 
+    # ข้อความสั้นสำหรับการ์ดในหน้า list (ดู plotcraft/excerpts.py)
+    excerpt = models.CharField(max_length=200, blank=True, editable=False)
+
     def __str__(self):
         return self.name
 
@@ -212,6 +230,9 @@ class Location(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # ข้อความสั้นสำหรับการ์ดในหน้า list (ดู plotcraft/excerpts.py)
+    excerpt = models.CharField(max_length=200, blank=True, editable=False)
+
     def __str__(self):
         return self.name
 
@@ -250,6 +271,9 @@ class Item(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # ข้อความสั้นสำหรับการ์ดในหน้า list (ดู plotcraft/excerpts.py)
+    excerpt = models.CharField(max_length=200, blank=True, editable=False)
+
     def __str__(self):
         return self.name
 
@@ -287,6 +311,9 @@ class Scene(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # ข้อความสั้นสำหรับการ์ดในหน้า list (ดู plotcraft/excerpts.py)
+    excerpt = models.CharField(max_length=200, blank=True, editable=False)
+
     class Meta:
         ordering = ['order', 'created_at']
 
@@ -329,3 +356,159 @@ class TimelineEvent(models.Model):
 
     def __str__(self):
         return f"{self.time_label}: {self.title}"
+
+
+# ==================== RAG INDEX QUEUE ====================
+class RagIndexJob(models.Model):
+    """ งาน index ข้อมูลเข้า RAG ที่รอ worker (manage.py rag_worker) มาทำ
+        1 entity มีได้แค่ 1 แถว -> save ซ้ำๆ จะรวมเป็นงานเดียว (coalesce) """
+    ACTION_INDEX = 'index'
+    ACTION_DELETE = 'delete'
+    ACTION_CHOICES = [
+        (ACTION_INDEX, 'Index'),
+        (ACTION_DELETE, 'Delete'),
+    ]
+
+    STATUS_PENDING = 'pending'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'รอทำ'),
+        (STATUS_FAILED, 'ล้มเหลว (เกินจำนวนครั้งที่ลองใหม่)'),
+    ]
+
+    entity_type = models.CharField(max_length=20)
+    entity_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES, default=ACTION_INDEX)
+    owner_id = models.BigIntegerField(null=True, blank=True, help_text="เจ้าของข้อมูล (ใช้หา shard ตอนลบ เพราะ object หายไปแล้ว)")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    enqueued_at = models.DateTimeField()
+    first_enqueued_at = models.DateTimeField(null=True, blank=True, help_text="save ครั้งแรกของรอบนี้ (debounce รอได้ไม่เกิน RAG_QUEUE_DEBOUNCE_MAX_SECONDS)")
+    coalesced = models.PositiveIntegerField(default=0, help_text="จำนวน save ที่ถูกรวมเข้ามาในงานนี้ (index ที่ประหยัดไปได้)")
+    available_at = models.DateTimeField(help_text="เวลาที่ worker หยิบงานนี้ได้ (ใช้เลื่อนเวลาตอน retry / debounce)")
+    locked_until = models.DateTimeField(null=True, blank=True, help_text="worker จองงานไว้ถึงเวลานี้")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['entity_type', 'entity_id'], name='unique_rag_job_per_entity'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'available_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.action} {self.entity_type}#{self.entity_id} ({self.status})"
+
+
+class EmbeddingCacheEntry(models.Model):
+    """ cache ของ embedding ถาวร (key = hash ของข้อความที่ normalize แล้ว + ชื่อ model)
+        ข้อความเดิม -> ไม่ต้องรัน model ซ้ำ ดู plotcraft/embedding_cache.py """
+    key = models.CharField(max_length=64, unique=True)
+    model_name = models.CharField(max_length=200)
+    dimensions = models.PositiveIntegerField()
+    vector = models.BinaryField()
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.model_name}:{self.key[:12]}"
+
+
+# ==================== STORY SUMMARIES (ดู plotcraft/summaries.py) ====================
+class ChapterSummary(models.Model):
+    """ สรุปสั้นของตอน สร้างใหม่เฉพาะเมื่อ content_hash ของเนื้อหาเปลี่ยน """
+    chapter = models.OneToOneField(Chapter, on_delete=models.CASCADE, related_name='summary')
+    content_hash = models.CharField(max_length=64)
+    summary = models.TextField(blank=True)
+    model_name = models.CharField(max_length=100)
+    chapter_updated_at = models.DateTimeField(null=True, blank=True, help_text="updated_at ของตอนตอนที่ตรวจล่าสุด (ไม่เปลี่ยน = ไม่ต้องโหลดเนื้อหามา hash)")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Summary of chapter #{self.chapter_id}"
+
+
+class NovelSummary(models.Model):
+    """ เรื่องย่อแบบสะสม (rolling) ของทั้งเรื่อง สร้างจาก ChapterSummary ทีละช่วง
+        steps = [{"chapters": [[chapter_id, content_hash], ...], "summary": "เรื่องย่อหลังรวมช่วงนี้"}, ...]
+        แก้ตอนไหน -> รวมใหม่ตั้งแต่ช่วงที่มีตอนนั้นเป็นต้นไป ช่วงก่อนหน้าใช้ของเดิม """
+    novel = models.OneToOneField(Novel, on_delete=models.CASCADE, related_name='story_summary')
+    summary = models.TextField(blank=True)
+    steps = models.JSONField(default=list)
+    model_name = models.CharField(max_length=100)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Summary of novel #{self.novel_id}"
+
+
+# ==================== EDITOR CHAT SESSIONS (ดู plotcraft/chat_sessions.py) ====================
+class ChatSession(models.Model):
+    """ ห้องแชทกับพี่บก. เก็บทุก turn ไว้ แต่ prompt ใช้แค่ summary + turn ล่าสุดไม่กี่อัน
+        turn ที่เก่ากว่าจะถูกรวมเข้า summary ทีละชุดโดย worker (งาน chat_summary ในคิว) """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='chat_sessions')
+    novel = models.ForeignKey(Novel, on_delete=models.CASCADE, null=True, blank=True, related_name='chat_sessions')
+    title = models.CharField(max_length=200, blank=True)
+
+    summary = models.TextField(blank=True, help_text="สรุปบทสนทนาก่อนหน้า turn ที่ summary_until_id")
+    summary_until_id = models.BigIntegerField(default=0, help_text="id ของ ChatTurn ล่าสุดที่รวมเข้า summary แล้ว")
+    summarized_turns = models.PositiveIntegerField(default=0)
+    turn_count = models.PositiveIntegerField(default=0)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-updated_at', '-id']),
+        ]
+
+    def __str__(self):
+        return self.title or f"Chat #{self.pk}"
+
+
+class ChatTurn(models.Model):
+    """ 1 รอบคุย = ข้อความของนักเขียน + คำตอบของพี่บก. """
+    session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='turns')
+    message = models.TextField()
+    reply = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f"Turn #{self.pk} of chat #{self.session_id}"
+
+
+# ==================== GLOBAL SEARCH INDEX (ดู plotcraft/search_index.py) ====================
+class SearchDocument(models.Model):
+    """ ข้อความที่ค้นหาได้ของนิยาย/ตัวละคร/ฉาก/เหตุการณ์/สถานที่/ไอเท็ม 1 แถวต่อ 1 object (signals อัปเดตให้)
+        แยกเป็น 3 ช่องตามน้ำหนัก: title (ชื่อ) > keywords (ฉายา/บทบาท/ประเภท) > body (รายละเอียด)
+        บน MySQL มี FULLTEXT แบบ ngram parser ที่แต่ละช่องและทั้งสามช่องรวมกัน (สร้างใน migration) """
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    entity_type = models.CharField(max_length=20)
+    entity_id = models.BigIntegerField()
+    novel_id = models.BigIntegerField(null=True, blank=True)
+    parent_id = models.BigIntegerField(null=True, blank=True, help_text="object แม่ที่ใช้สร้างลิงก์ (timeline ของเหตุการณ์)")
+
+    title = models.CharField(max_length=255)
+    keywords = models.TextField(blank=True)
+    body = models.TextField(blank=True)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['entity_type', 'entity_id'], name='unique_search_document'),
+        ]
+        indexes = [
+            models.Index(fields=['owner', 'entity_type']),
+        ]
+
+    def __str__(self):
+        return f"{self.entity_type}#{self.entity_id}: {self.title}"
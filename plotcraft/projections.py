@@ -0,0 +1,75 @@
+# plotcraft/projections.py
+"""
+queryset แบบเบาสำหรับหน้า list/dashboard: .only() เฉพาะ field ที่ template ใช้จริง + excerpt ที่ตัดไว้แล้ว (excerpts.py)
+แต่ละแถวจึงเป็นแค่ไม่กี่ร้อยไบต์ ไม่ดึง synopsis / background / history / content ทั้งก้อนมาทิ้ง
+FK ที่การ์ดแสดงชื่อ -> select_related + .only() ชื่อของฝั่งนั้น (ไม่ยิง query ทีละแถว)
+
+ถ้าแก้ template ของหน้า list ให้แสดง field ใหม่ ต้องเพิ่มชื่อ field ที่นี่ด้วย
+(ไม่งั้น Django จะโหลด field ที่ถูก defer ทีละแถว -> N+1 query)
+"""
+from django.db.models import Count
+from django.db.models.functions import Left
+
+# ==================== HOME (dashboard) ====================
+HOME_NOVEL_FIELDS = ('id', 'title', 'excerpt', 'cover_image', 'category', 'status', 'updated_at')
+HOME_CHARACTER_FIELDS = ('id', 'name', 'role', 'excerpt', 'portrait', 'created_at')
+HOME_LOCATION_FIELDS = ('id', 'name', 'map_image', 'created_at')
+
+# ==================== LIST PAGES ====================
+NOVEL_LIST_FIELDS = ('id', 'title', 'excerpt', 'cover_image', 'category', 'updated_at', 'chapter_count')
+CHARACTER_LIST_FIELDS = ('id', 'name', 'alias', 'age', 'portrait', 'created_at', 'project__title')
+LOCATION_LIST_FIELDS = ('id', 'name', 'world_type', 'excerpt', 'map_image', 'created_at', 'project__title')
+ITEM_LIST_FIELDS = (
+    'id', 'name', 'category', 'excerpt', 'image', 'created_at',
+    'project__title', 'owner__name', 'location__name',
+)
+SCENE_LIST_FIELDS = (
+    'id', 'title', 'order', 'status', 'excerpt', 'created_at',
+    'project__title', 'pov_character__name', 'location__name',
+)
+SCENE_PROJECT_FIELDS = ('id', 'title')
+
+# การ์ดฉากแสดง goal / conflict แค่ truncatechars:80 -> ดึงมาแค่ส่วนต้นของข้อความ
+# (truncatechars ไม่นับสระบน/ล่างและวรรณยุกต์ไทย 80 ตัวที่เห็นจึงยาวกว่า 80 code point -> เผื่อไว้ 3 เท่า)
+SCENE_TEASER_LENGTH = 240
+
+
+def home_novels(queryset):
+    return queryset.only(*HOME_NOVEL_FIELDS)
+
+
+def home_characters(queryset):
+    return queryset.only(*HOME_CHARACTER_FIELDS)
+
+
+def home_locations(queryset):
+    return queryset.only(*HOME_LOCATION_FIELDS)
+
+
+def novel_cards(queryset):
+    return queryset.only(*NOVEL_LIST_FIELDS)
+
+
+def character_cards(queryset):
+    return queryset.select_related('project').only(*CHARACTER_LIST_FIELDS)
+
+
+def location_cards(queryset):
+    return queryset.select_related('project').only(*LOCATION_LIST_FIELDS)
+
+
+def item_cards(queryset):
+    return queryset.select_related('project', 'owner', 'location').only(*ITEM_LIST_FIELDS)
+
+
+def scene_cards(queryset):
+    return (
+        queryset.select_related('project', 'pov_character', 'location')
+        .only(*SCENE_LIST_FIELDS)
+        .annotate(goal_teaser=Left('goal', SCENE_TEASER_LENGTH), conflict_teaser=Left('conflict', SCENE_TEASER_LENGTH))
+    )
+
+
+def scene_projects(queryset):
+    """ แท็บนิยายของหน้าฉาก พร้อมจำนวนฉาก (แทน project.scenes.count ทีละเรื่อง) """
+    return queryset.only(*SCENE_PROJECT_FIELDS).annotate(scene_count=Count('scenes'))
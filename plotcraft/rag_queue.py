@@ -0,0 +1,355 @@
+# plotcraft/rag_queue.py
+"""
+คิวงาน index ข้อมูลเข้า RAG แบบทำเบื้องหลัง
+
+- signals เรียกแค่ enqueue_index / enqueue_delete (เขียนแถวเดียวลง DB แล้วจบ)
+- worker (python manage.py rag_worker) ดึงงานไป embed + บันทึกลง vector store (shard ของเจ้าของข้อมูล)
+- งานของ entity เดียวกันจะถูกรวมเป็นแถวเดียว (debounce: รอให้หยุดแก้ก่อนค่อยทำ) และถ้าพังจะถูก retry แบบ backoff
+- งาน index ที่หยิบมาในรอบเดียวกัน embed รวมกันครั้งเดียว + upsert เป็นก้อน
+- งานสรุปเรื่อง (novel_summary) ใช้คิวเดียวกัน แต่ debounce นานกว่า (ดู summaries.py)
+"""
+import logging
+import random
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Character, Chapter, Novel, Scene, RagIndexJob
+
+logger = logging.getLogger(__name__)
+
+
+# entity_type -> (Model, เมธอดใน RAGService, "type" ใน metadata ของเอกสาร)
+INDEXERS = {
+    'character': (Character, 'add_character_to_rag', 'character'),
+    'chapter': (Chapter, 'add_chapter_to_rag', 'content'),
+    'scene': (Scene, 'add_scene_to_rag', 'scene'),
+}
+
+# งานลบทั้งก้อน (bulk_delete.py): entity_type -> เมธอดใน RAGService ที่รับ (entity_id, owner_id)
+PURGES = {
+    'novel': 'delete_novel_from_rag',
+    'user': 'delete_owner_from_rag',
+}
+
+# งานที่ไม่ได้เขียนเอกสารลง vector store: entity_type -> เมธอดใน RAGService ที่รับ (entity_id, owner_id)
+TASKS = {
+    'novel_summary': 'refresh_story_summary',
+    'chat_summary': 'compact_chat_session',
+}
+
+# debounce เฉพาะประเภท (วินาที, วินาทีสูงสุด) เป็นชื่อ setting; ที่ไม่ระบุใช้ RAG_QUEUE_DEBOUNCE_*
+# สรุปเรื่องต้องเรียก LLM -> รอให้หยุดเขียนนานกว่า index
+DEBOUNCE = {
+    'novel_summary': ('RAG_SUMMARY_DEBOUNCE_SECONDS', 'RAG_SUMMARY_DEBOUNCE_MAX_SECONDS'),
+}
+
+# related fields ที่ตอนสร้างเอกสารต้องใช้ (กัน query ซ้ำทีละ field)
+SELECT_RELATED = {
+    'character': ('project', 'created_by'),
+    'chapter': ('novel__author',),
+    'scene': ('project', 'created_by', 'pov_character', 'location'),
+}
+PREFETCH_RELATED = {
+    'scene': ('characters',),
+}
+
+# ตัวนับสะสมของ worker (อยู่ใน shared cache -> /api/rag/metrics/ ของ web อ่านได้)
+METRICS = ('jobs', 'batches', 'coalesced', 'documents', 'embedded', 'unchanged')
+
+
+def entity_type_for(instance):
+    for entity_type, (model, _, _) in INDEXERS.items():
+        if isinstance(instance, model):
+            return entity_type
+    raise ValueError(f"ไม่รองรับการ index {type(instance).__name__}")
+
+
+# ==================== ฝั่ง Web (enqueue) ====================
+
+def enqueue_index(instance, previous_owner=None):
+    """ สั่งให้ worker (re)index entity นี้
+        previous_owner = เจ้าของก่อน save นี้ (ถ้าเปลี่ยน) -> worker ลบเอกสารเก่าออกจาก shard ของคนนั้นด้วย """
+    _enqueue(entity_type_for(instance), instance.pk, RagIndexJob.ACTION_INDEX, previous_owner)
+
+
+def enqueue_delete(instance):
+    """ สั่งให้ worker ลบ entity นี้ออกจาก RAG (ทับงาน index ที่ยังค้างอยู่) """
+    _enqueue(entity_type_for(instance), instance.pk, RagIndexJob.ACTION_DELETE, owner_for(instance))
+
+
+def enqueue_purge(entity_type, entity_id, owner_id):
+    """ สั่งให้ worker ลบเอกสารทั้งนิยาย/ทั้งบัญชีในครั้งเดียว (แทนงานลบทีละแถว) """
+    _enqueue(entity_type, entity_id, RagIndexJob.ACTION_DELETE, owner_id)
+
+
+def enqueue_summary(novel_id):
+    """ สั่งให้ worker อัปเดตสรุปตอน/เรื่องย่อของนิยายเรื่องนี้ (ทุกตอนของเรื่องรวมเป็นงานเดียว) """
+    enqueue_task('novel_summary', novel_id)
+
+
+def enqueue_task(entity_type, entity_id, owner_id=None):
+    """ ฝากงานใน TASKS (งาน LLM เบื้องหลังที่ไม่ได้เขียน vector store) """
+    _enqueue(entity_type, entity_id, RagIndexJob.ACTION_INDEX, owner_id)
+
+
+def owner_for(instance):
+    """ owner_id เดียวกับที่ RAGService ใส่ใน metadata -> worker ลบได้จาก shard เดียวโดยไม่ต้องไล่ทุก shard """
+    if isinstance(instance, Chapter):
+        return Novel.objects.filter(pk=instance.novel_id).values_list('author_id', flat=True).first()
+    return instance.created_by_id
+
+
+def stored_owner(instance):
+    """ เจ้าของตามแถวใน DB ก่อน save (None = แถวใหม่ หรือเจ้าของไม่เปลี่ยน) """
+    if instance._state.adding or instance.pk is None:
+        return None
+    if isinstance(instance, Chapter):
+        row = Chapter.objects.filter(pk=instance.pk).values_list('novel_id', 'novel__author_id').first()
+        if row is None or row[0] == instance.novel_id:
+            return None
+        previous = row[1]
+    else:
+        previous = type(instance).objects.filter(pk=instance.pk).values_list('created_by_id', flat=True).first()
+    return previous if previous != owner_for(instance) else None
+
+
+def _enqueue(entity_type, entity_id, action, owner_id=None):
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            job = (
+                RagIndexJob.objects.select_for_update()
+                .filter(entity_type=entity_type, entity_id=entity_id)
+                .first()
+            ) or RagIndexJob(entity_type=entity_type, entity_id=entity_id)
+            _merge(job, action, owner_id, now)
+            job.save()
+    except IntegrityError:
+        # อีก request สร้างแถวเดียวกันไปพร้อมกันพอดี -> รวมเข้ากับแถวนั้นแทน
+        with transaction.atomic():
+            job = RagIndexJob.objects.select_for_update().get(entity_type=entity_type, entity_id=entity_id)
+            _merge(job, action, owner_id, now)
+            job.save()
+
+
+def _merge(job, action, owner_id, now):
+    """ debounce: save ซ้ำระหว่างที่งานเดิมยังรออยู่ -> เลื่อนเวลาทำออกไป และทำแค่เวอร์ชันล่าสุดครั้งเดียว """
+    waiting = (
+        job.pk is not None
+        and job.status == RagIndexJob.STATUS_PENDING
+        and not (job.locked_until and job.locked_until > now)
+    )
+    if waiting:
+        job.coalesced += 1
+    else:
+        # งานใหม่ / worker กำลังทำเวอร์ชันก่อนอยู่ / เคยล้มเหลว -> เริ่มนับรอบใหม่
+        job.first_enqueued_at = now
+        if job.status == RagIndexJob.STATUS_FAILED:
+            job.coalesced = 0
+
+    if action == RagIndexJob.ACTION_INDEX and job.action == RagIndexJob.ACTION_INDEX and job.owner_id is not None:
+        # เจ้าของเปลี่ยนซ้ำก่อน worker มาทำ -> เอกสารยังอยู่ใน shard ของเจ้าของแรก
+        owner_id = job.owner_id
+    job.action = action
+    job.owner_id = owner_id
+    job.status = RagIndexJob.STATUS_PENDING
+    job.attempts = 0
+    job.last_error = ''
+    job.enqueued_at = now
+    if action == RagIndexJob.ACTION_INDEX:
+        # รอจนหยุดแก้ไป RAG_QUEUE_DEBOUNCE_SECONDS แต่ไม่เกิน MAX นับจาก save แรก (คนที่พิมพ์ไม่หยุดก็ยังได้ index)
+        delay, max_delay = DEBOUNCE.get(job.entity_type, ('RAG_QUEUE_DEBOUNCE_SECONDS', 'RAG_QUEUE_DEBOUNCE_MAX_SECONDS'))
+        latest = (job.first_enqueued_at or now) + timedelta(seconds=getattr(settings, max_delay))
+        job.available_at = min(now + timedelta(seconds=getattr(settings, delay)), latest)
+    else:
+        job.available_at = now
+
+
+# ==================== ฝั่ง Worker ====================
+
+def claim_jobs(limit):
+    """ จองงานที่ถึงเวลาทำแล้ว (ไม่ถือ row lock ระหว่างประมวลผล เพื่อไม่ให้ save ฝั่งเว็บต้องรอ) """
+    now = timezone.now()
+    lease = timedelta(seconds=settings.RAG_QUEUE_LEASE_SECONDS)
+
+    with transaction.atomic():
+        jobs = list(
+            RagIndexJob.objects.select_for_update(skip_locked=True)
+            .filter(status=RagIndexJob.STATUS_PENDING, available_at__lte=now)
+            .filter(Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+            .order_by('available_at')[:limit]
+        )
+        if jobs:
+            RagIndexJob.objects.filter(pk__in=[job.pk for job in jobs]).update(locked_until=now + lease)
+    return jobs
+
+
+def run_job(job, service):
+    if job.entity_type in PURGES:
+        getattr(service, PURGES[job.entity_type])(job.entity_id, owner_id=job.owner_id)
+        return
+    if job.entity_type in TASKS:
+        getattr(service, TASKS[job.entity_type])(job.entity_id, owner_id=job.owner_id)
+        return
+
+    model, add_method, doc_type = INDEXERS[job.entity_type]
+
+    if job.action == RagIndexJob.ACTION_DELETE:
+        service.delete_source_from_rag(doc_type, job.entity_id, owner_id=job.owner_id)
+        return
+
+    obj = (
+        model.objects.select_related(*SELECT_RELATED[job.entity_type])
+        .filter(pk=job.entity_id)
+        .first()
+    )
+    if obj is None:
+        # ถูกลบไปแล้ว -> งาน delete จะมาทับแถวนี้เอง ไม่ต้องทำอะไร
+        return
+
+    if job.owner_id is not None:
+        service.sync_sources([service.source_for(doc_type, obj)], moved_from=moved_from([job]))
+        return
+    getattr(service, add_method)(obj)
+
+
+def moved_from(jobs):
+    """ {(doc_type, source_id): เจ้าของเดิม} ของงาน index ที่เจ้าของเปลี่ยน (ดู enqueue_index) """
+    return {
+        (INDEXERS[job.entity_type][2], str(job.entity_id)): job.owner_id
+        for job in jobs if job.owner_id is not None
+    }
+
+
+def run_index_batch(jobs, service):
+    """ index หลาย entity ในรอบเดียว: โหลดทีละ type, embed ทุกข้อความที่เปลี่ยนในครั้งเดียว, upsert ทีละ shard """
+    sources = []
+    by_type = {}
+    for job in jobs:
+        by_type.setdefault(job.entity_type, []).append(job.entity_id)
+    for entity_type, ids in by_type.items():
+        model, _, doc_type = INDEXERS[entity_type]
+        objs = (
+            model.objects.select_related(*SELECT_RELATED[entity_type])
+            .prefetch_related(*PREFETCH_RELATED.get(entity_type, ()))
+            .in_bulk(ids)
+        )
+        # แถวที่ถูกลบไปแล้ว -> งาน delete จะมาทับแถวนี้เอง ไม่ต้องทำอะไร
+        sources.extend(service.source_for(doc_type, obj) for obj in objs.values())
+    return service.sync_sources(sources, moved_from=moved_from(jobs))
+
+
+def complete_job(job):
+    # ลบเฉพาะถ้าไม่มีการ enqueue ใหม่ระหว่างที่ทำอยู่ ไม่งั้นปล่อยให้รอบหน้าทำเวอร์ชันล่าสุด
+    deleted, _ = RagIndexJob.objects.filter(pk=job.pk, enqueued_at=job.enqueued_at).delete()
+    if not deleted:
+        # save ที่รวมไว้ก่อนหยิบงานถูกนับไปแล้ว เหลือไว้เฉพาะที่เข้ามาระหว่างทำ
+        RagIndexJob.objects.filter(pk=job.pk).update(locked_until=None, coalesced=F('coalesced') - job.coalesced)
+
+
+def fail_job(job, error):
+    attempts = job.attempts + 1
+    updates = {
+        'attempts': attempts,
+        'last_error': f"{type(error).__name__}: {error}",
+        'locked_until': None,
+    }
+    if attempts >= settings.RAG_QUEUE_MAX_ATTEMPTS:
+        updates['status'] = RagIndexJob.STATUS_FAILED
+        logger.error("RAG job %s gave up after %d attempts", job, attempts)
+    else:
+        updates['available_at'] = timezone.now() + timedelta(seconds=retry_delay(attempts))
+
+    updated = RagIndexJob.objects.filter(pk=job.pk, enqueued_at=job.enqueued_at).update(**updates)
+    if not updated:
+        # มีคน enqueue เวอร์ชันใหม่มาแล้ว -> เริ่มนับ attempts ใหม่ แค่ปลด lock
+        RagIndexJob.objects.filter(pk=job.pk).update(locked_until=None)
+
+
+def retry_delay(attempts):
+    """ exponential backoff + jitter (วินาที) """
+    base = settings.RAG_QUEUE_RETRY_BASE_SECONDS
+    delay = min(base * (2 ** (attempts - 1)), settings.RAG_QUEUE_RETRY_MAX_SECONDS)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def process_batch(service, limit=None):
+    """ ทำงาน 1 รอบ คืนค่าจำนวนงานที่หยิบมา """
+    jobs = claim_jobs(limit or settings.RAG_QUEUE_BATCH_SIZE)
+    index_jobs = [job for job in jobs if job.action == RagIndexJob.ACTION_INDEX and job.entity_type in INDEXERS]
+    single_jobs = [job for job in jobs if job not in index_jobs]
+    completed = []
+    stats = {}
+
+    if index_jobs:
+        try:
+            stats = run_index_batch(index_jobs, service)
+        except Exception:
+            # entity เดียวพังไม่ควรลากทั้ง batch -> ทำทีละงานเพื่อหาตัวที่พังแล้ว retry เฉพาะตัวนั้น
+            logger.exception("RAG index batch of %d job(s) failed; retrying one by one", len(index_jobs))
+            single_jobs = index_jobs + single_jobs
+        else:
+            for job in index_jobs:
+                complete_job(job)
+            completed.extend(index_jobs)
+
+    for job in single_jobs:
+        try:
+            run_job(job, service)
+        except Exception as e:
+            logger.exception("RAG job %s failed (attempt %d)", job, job.attempts + 1)
+            fail_job(job, e)
+        else:
+            complete_job(job)
+            completed.append(job)
+
+    if jobs:
+        record_metrics(
+            jobs=len(completed),
+            batches=1,
+            coalesced=sum(job.coalesced for job in completed),
+            documents=stats.get('documents', 0),
+            embedded=stats.get('embedded', 0),
+            unchanged=stats.get('unchanged', 0),
+        )
+        logger.info("RAG worker handled %d job(s); embedding cache %s", len(jobs), service.embedding_cache.stats())
+    return len(jobs)
+
+
+def record_metrics(**counts):
+    for name, value in counts.items():
+        if not value:
+            continue
+        key = f"rag_queue:{name}"
+        try:
+            cache.incr(key, value)
+        except ValueError:
+            if not cache.add(key, value, timeout=None):
+                cache.incr(key, value)
+
+
+def queue_metrics():
+    """ ตัวนับสะสมของ worker; coalesced = จำนวน save ที่ไม่ต้อง index แยกเพราะถูกรวมเข้ากับงานที่รออยู่ """
+    values = cache.get_many([f"rag_queue:{name}" for name in METRICS])
+    metrics = {name: values.get(f"rag_queue:{name}", 0) for name in METRICS}
+    saves = metrics['jobs'] + metrics['coalesced']
+    metrics['coalesce_rate'] = round(metrics['coalesced'] / saves, 3) if saves else 0.0
+    return metrics
+
+
+def run_worker(service, once=False):
+    """ loop หลักของ worker; once=True จะทำจนคิวว่างแล้วจบ """
+    poll_seconds = settings.RAG_QUEUE_POLL_SECONDS
+    while True:
+        handled = process_batch(service)
+        if handled:
+            continue
+        if once:
+            return
+        time.sleep(poll_seconds)
@@ -0,0 +1,115 @@
+# plotcraft/rag_reconcile.py
+"""
+ตรวจและซ่อมส่วนที่ vector store ไม่ตรงกับ DB (python manage.py rag_reconcile)
+
+งาน index ที่พังหรือ cascade delete ที่ไม่ผ่าน signal ทำให้ข้อมูลสองฝั่งค่อยๆ เพี้ยน:
+- missing   : มีใน DB แต่ไม่มีเอกสารใน vector store
+- stale     : มีทั้งสองฝั่งแต่ข้อความ (content_hash) หรือ metadata ไม่ตรง
+- misplaced : เอกสารอยู่ผิด shard (เช่น เปลี่ยนเจ้าของ)
+- orphan    : มีใน vector store แต่ไม่มีแถวใน DB แล้ว
+
+อ่านทั้งสองฝั่งทีละหน้า (ไม่ embed อะไรตอนเทียบ) แล้วซ่อมเฉพาะส่วนต่างเป็น batch
+"""
+import time
+
+from .embedding_cache import content_hash
+from .rag_queue import INDEXERS
+from .rag_reindex import source_documents, source_queryset
+
+
+class Reconciler:
+    def __init__(self, service, batch_size=500, dry_run=False):
+        self.service = service
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+
+    def stored_documents(self, doc_type):
+        """ {doc_id: (shard, metadata)} ของเอกสาร type นี้จากทุก shard (อ่านแค่ metadata ไม่อ่าน vector) """
+        stored = {}
+        client = self.service.vector_client
+        for name in client.list_stores():
+            store = self.service.store_for_shard(name)
+            offset = 0
+            while True:
+                page = store.get(
+                    where={"type": INDEXERS[doc_type][2]}, include=["metadatas"],
+                    limit=self.batch_size, offset=offset,
+                )
+                if not page["ids"]:
+                    break
+                offset += len(page["ids"])
+                for doc_id, metadata in zip(page["ids"], page["metadatas"]):
+                    stored[doc_id] = (name, metadata or {})
+        return stored
+
+    def run(self, doc_type):
+        started = time.perf_counter()
+        stored = self.stored_documents(doc_type)
+        stats = {
+            'type': doc_type, 'db_docs': 0, 'store_docs': len(stored),
+            'missing': 0, 'stale': 0, 'misplaced': 0, 'orphans': 0,
+        }
+        upserts, updates, deletes = [], {}, {}
+
+        for obj in source_queryset(doc_type).iterator(chunk_size=self.batch_size):
+            for doc_id, content, metadata in source_documents(self.service, doc_type, obj):
+                stats['db_docs'] += 1
+                expected = {"content_hash": content_hash(content), **metadata}
+                shard = self.service.shard_name(expected.get("owner_id"))
+                found = stored.pop(doc_id, None)
+
+                if found is None:
+                    stats['missing'] += 1
+                    upserts.append((doc_id, content, metadata))
+                elif found[0] != shard:
+                    stats['misplaced'] += 1
+                    upserts.append((doc_id, content, metadata))
+                    deletes.setdefault(found[0], []).append((doc_id, found[1]))
+                elif found[1] != expected:
+                    stats['stale'] += 1
+                    if found[1].get("content_hash") == expected["content_hash"]:
+                        # ข้อความเดิม -> แก้ metadata อย่างเดียว ไม่ต้อง embed
+                        updates.setdefault(shard, []).append((doc_id, expected, found[1]))
+                    else:
+                        upserts.append((doc_id, content, metadata))
+
+                if len(upserts) >= self.batch_size:
+                    self.repair(upserts, updates, deletes)
+                    upserts, updates, deletes = [], {}, {}
+
+        # ที่เหลือใน stored คือเอกสารที่ไม่มีแถวใน DB แล้ว
+        for doc_id, (shard, metadata) in stored.items():
+            stats['orphans'] += 1
+            deletes.setdefault(shard, []).append((doc_id, metadata))
+        self.repair(upserts, updates, deletes)
+
+        drift = stats['missing'] + stats['stale'] + stats['misplaced'] + stats['orphans']
+        stats['drift'] = drift
+        stats['drift_ratio'] = round(drift / max(stats['db_docs'], stats['store_docs'], 1), 4)
+        stats['seconds'] = round(time.perf_counter() - started, 2)
+        return stats
+
+    def repair(self, upserts, updates, deletes):
+        if self.dry_run:
+            return
+        for start in range(0, len(upserts), self.batch_size):
+            self.service.upsert_documents(upserts[start:start + self.batch_size])
+
+        for shard, items in updates.items():
+            store = self.service.store_for_shard(shard)
+            for start in range(0, len(items), self.batch_size):
+                batch = items[start:start + self.batch_size]
+                store.update(ids=[doc_id for doc_id, _, _ in batch], metadatas=[new for _, new, _ in batch])
+                self._invalidate([old for _, _, old in batch] + [new for _, new, _ in batch])
+
+        for shard, items in deletes.items():
+            store = self.service.store_for_shard(shard)
+            for start in range(0, len(items), self.batch_size):
+                batch = items[start:start + self.batch_size]
+                store.delete(ids=[doc_id for doc_id, _ in batch])
+                self._invalidate([metadata for _, metadata in batch])
+
+    def _invalidate(self, metadatas):
+        for owner_id, novel_id in {(m.get("owner_id"), m.get("novel_id")) for m in metadatas}:
+            self.service.retrieval_cache.invalidate(owner_id, novel_id)
+
@@ -0,0 +1,140 @@
+# plotcraft/rag_reindex.py
+"""
+Rebuild vector index จาก DB ทั้งก้อน (python manage.py rag_reindex)
+
+- อ่านแถวด้วย iterator() ตามลำดับ pk -> ไม่โหลดทั้งตารางเข้าหน่วยความจำ
+- embed ทีละ batch ใหญ่ กระจายไปหลาย process (แต่ละ process โหลด model ของตัวเอง)
+  ข้อความที่เคย embed ด้วย model เดิมแล้วจะได้จาก embedding cache ไม่ต้องเข้า model ซ้ำ
+- upsert ทีละ batch แยกตาม shard แล้วจด pk ล่าสุดลง checkpoint -> ถ้าพังกลางทาง รันใหม่จะทำต่อจากเดิม
+"""
+import json
+import os
+import time
+
+from .models import Character, Chapter, Scene
+
+# type -> (Model, select_related, prefetch_related, field ที่ใช้กรองตาม user, field ที่ใช้กรองตามนิยาย)
+SOURCES = {
+    'character': (Character, ('project', 'created_by'), (), 'created_by_id', 'project_id'),
+    'chapter': (Chapter, ('novel__author',), (), 'novel__author_id', 'novel_id'),
+    'scene': (Scene, ('project', 'created_by', 'pov_character', 'location'), ('characters',),
+              'created_by_id', 'project_id'),
+}
+
+
+def source_queryset(doc_type, user_id=None, novel_id=None):
+    """ แถวใน DB ของ type นี้ เรียงตาม pk พร้อม related ที่ใช้สร้างเอกสาร """
+    model, select, prefetch, user_field, novel_field = SOURCES[doc_type]
+    qs = model.objects.select_related(*select).order_by('pk')
+    if prefetch:
+        qs = qs.prefetch_related(*prefetch)
+    if user_id:
+        qs = qs.filter(**{user_field: user_id})
+    if novel_id:
+        qs = qs.filter(**{novel_field: novel_id})
+    return qs
+
+
+def source_documents(service, doc_type, obj):
+    """ [(doc_id, ข้อความ, metadata), ...] ที่ควรมีใน vector store สำหรับแถวนี้ """
+    if doc_type == 'chapter':
+        return [(doc_id, content, metadata) for doc_id, (content, metadata) in
+                service.chapter_documents(obj).items()]
+    if doc_type == 'character':
+        return [service.character_document(obj)]
+    return [service.scene_document(obj)]
+
+
+# ==================== Checkpoint ====================
+
+class Checkpoint:
+    """ จด pk ล่าสุดที่ upsert เสร็จแล้วของแต่ละ type (เขียนแบบ atomic) """
+
+    def __init__(self, path, scope):
+        self.path = path
+        self.scope = scope
+        self.positions = {}
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            # เงื่อนไขไม่ตรงกับรอบที่แล้ว -> เริ่มใหม่ (ไม่งั้นจะข้ามแถวที่รอบก่อนไม่ได้ทำ)
+            if data.get('scope') == scope:
+                self.positions = data.get('positions', {})
+
+    def position(self, doc_type):
+        return self.positions.get(doc_type, 0)
+
+    def save(self, doc_type, last_pk):
+        self.positions[doc_type] = last_pk
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'scope': self.scope, 'positions': self.positions}, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        self.positions = {}
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# ==================== Reindex ====================
+
+class Reindexer:
+    def __init__(self, service, pool, checkpoint, batch_size=256, dry_run=False, log=print):
+        self.service = service
+        self.pool = pool
+        self.checkpoint = checkpoint
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.log = log
+        self.stats = {'rows': 0, 'documents': 0, 'embedded': 0, 'embed_seconds': 0.0, 'write_seconds': 0.0}
+
+    def queryset(self, doc_type, user_id=None, novel_id=None):
+        return source_queryset(doc_type, user_id, novel_id).filter(pk__gt=self.checkpoint.position(doc_type))
+
+    def embed(self, texts):
+        """ เรียกเฉพาะข้อความที่ไม่อยู่ใน embedding cache """
+        started = time.perf_counter()
+        try:
+            return self.pool.embed(texts)
+        finally:
+            self.stats['embed_seconds'] += time.perf_counter() - started
+
+    def run(self, doc_type, user_id=None, novel_id=None):
+        pending, sources, last_pk = [], [], None
+        for obj in self.queryset(doc_type, user_id, novel_id).iterator(chunk_size=self.batch_size):
+            pending.extend(source_documents(self.service, doc_type, obj))
+            sources.append(obj)
+            last_pk = obj.pk
+            if len(pending) >= self.batch_size:
+                self.flush(doc_type, pending, sources, last_pk)
+                pending, sources = [], []
+        if sources:
+            self.flush(doc_type, pending, sources, last_pk)
+
+    def flush(self, doc_type, documents, sources, last_pk):
+        self.stats['rows'] += len(sources)
+        self.stats['documents'] += len(documents)
+        if self.dry_run:
+            return
+
+        if doc_type == 'chapter':
+            # chunk ของเนื้อหาเก่าที่แก้ไปแล้วมี id ต่างจากของใหม่ -> ล้างทั้งตอนก่อนเขียน
+            by_owner = {}
+            for chapter in sources:
+                by_owner.setdefault(chapter.novel.author_id, []).append(chapter.pk)
+            started = time.perf_counter()
+            for owner_id, chapter_ids in by_owner.items():
+                self.service.delete_sources('content', chapter_ids, owner_id)
+            self.stats['write_seconds'] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        embed_before = self.stats['embed_seconds']
+        self.stats['embedded'] += self.service.upsert_documents(documents, embed_fn=self.embed)
+        elapsed = time.perf_counter() - started
+        self.stats['write_seconds'] += elapsed - (self.stats['embed_seconds'] - embed_before)
+
+        self.checkpoint.save(doc_type, last_pk)
+        self.log(f"  {doc_type}: up to pk {last_pk} ({self.stats['documents']} docs)")
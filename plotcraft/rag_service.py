@@ -1,151 +1,543 @@
 # rag_service.py
+# หมายเหตุ: import หนักๆ (torch / sentence-transformers / chromadb / langchain) อยู่ในเมธอดทั้งหมด
+# -> migrate, collectstatic, test และ process ที่ไม่ได้ใช้ AI จะไม่ต้องโหลด model เลย
+import asyncio
+import hashlib
+import logging
 import os
-import chromadb
+import sys
+import threading
+import time
+import uuid
+from contextlib import aclosing
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_google_genai import GoogleGenerativeAI
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, ObjectDoesNotExist
+from django.utils.functional import SimpleLazyObject
 from dotenv import load_dotenv
 
+from .chunking import chunk_text, html_to_text
+from .chat_sessions import compact_session, history_text, record_turn
+from .context_assembler import assemble_context, parse_quotas, truncate_tokens
+from .embedding_cache import EmbeddingCache, content_hash
+from .embeddings import embedding_model_id, load_embeddings
+from .llm_gateway import LLMGateway
+from .models import ChatSession, Novel, NovelSummary
+from .rag_queue import queue_metrics
+from .retrieval_cache import RetrievalCache
+from .single_flight import SingleFlight
+from .summaries import StorySummarizer
+from .vector_store import COLLECTION_NAME, open_vector_client
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+LLM_MODEL_NAME = "gemini-2.5-flash"
+
+
 class RAGService:
     def __init__(self):
         self.api_key = os.environ.get("GOOGLE_API_KEY")
-        
-        # 1. ตั้งค่า Model (เหมือนเดิม)
-        print("📥 Loading Embedding Model...")
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': False}
+        self.embedding_cache = EmbeddingCache(
+            embedding_model_id(),
+            max_entries=settings.RAG_EMBEDDING_CACHE_MAX_ENTRIES,
+            memory_entries=settings.RAG_EMBEDDING_CACHE_MEMORY_ENTRIES,
         )
+        # ข้อความแชทของผู้ใช้: LRU ในหน่วยความจำอย่างเดียว (ไม่ลงตาราง embedding cache)
+        self.query_cache = EmbeddingCache(embedding_model_id(), memory_entries=settings.RAG_QUERY_CACHE_ENTRIES)
+        self.retrieval_cache = RetrievalCache(ttl=settings.RAG_RETRIEVAL_CACHE_SECONDS)
 
-        if self.api_key:
-            self.llm = GoogleGenerativeAI(
-                model="gemini-2.5-flash",
-                google_api_key=self.api_key,
-                temperature=0.7
-            )
-        else:
-            self.llm = None
+        # ทุกอย่างด้านล่างโหลดตอนใช้งานครั้งแรก (ดู property ต่างๆ)
+        self._lock = threading.RLock()
+        self._embeddings = None
+        self._llm = None
+        self._llm_loaded = False
+        self._vector_client = None
+        self._shards = {}
+        # กดร่างฉากซ้ำ/พร้อมกัน -> ใช้งาน LLM ชิ้นเดียวกัน (ดู agenerate_scene_draft)
+        self._draft_flight = SingleFlight()
+
+    # ==================== Lazy resources ====================
+
+    @property
+    def embeddings(self):
+        """ 1. Embedding Model: โหลดใน process นี้ หรือเป็น client ของ embedding server (RAG_EMBEDDING_BACKEND) """
+        if self._embeddings is None:
+            with self._lock:
+                if self._embeddings is None:
+                    self._embeddings = load_embeddings()
+        return self._embeddings
+
+    @property
+    def llm(self):
+        if not self._llm_loaded:
+            with self._lock:
+                if not self._llm_loaded:
+                    if self.api_key:
+                        from langchain_google_genai import GoogleGenerativeAI
+
+                        # ทุกการเรียกผ่าน LLMGateway (จำกัดจำนวนพร้อมกัน / timeout / retry / circuit breaker)
+                        # จึงปิด retry ในตัว client ไม่ให้ retry ซ้อนกันสองชั้น
+                        self._llm = LLMGateway(GoogleGenerativeAI(
+                            model=LLM_MODEL_NAME,
+                            google_api_key=self.api_key,
+                            temperature=0.7,
+                            timeout=settings.RAG_LLM_TIMEOUT_SECONDS,
+                            max_retries=1,
+                        ))
+                    self._llm_loaded = True
+        return self._llm
+
+    @property
+    def vector_client(self):
+        """ 2. ที่เก็บ vector ตาม settings.RAG_VECTOR_STORE (ChromaDB server / ฝังใน process / NumPy flat index)
+            ถ้าเปิดไม่ได้จะ raise และลองใหม่ในการเรียกครั้งถัดไป """
+        if self._vector_client is None:
+            with self._lock:
+                if self._vector_client is None:
+                    try:
+                        self._vector_client = open_vector_client(
+                            settings.RAG_VECTOR_STORE, path=settings.RAG_VECTOR_STORE_PATH
+                        )
+                        logger.info("RAG vector store opened (%s)", settings.RAG_VECTOR_STORE)
+                    except Exception:
+                        logger.exception("Could not open the %s vector store", settings.RAG_VECTOR_STORE)
+                        raise
+        return self._vector_client
 
-        # 2. เชื่อมต่อ ChromaDB (เปลี่ยนชื่อ Collection เป็น plotcraft)
+    # ==================== Sharding ====================
+    # RAG_SHARDING='user' -> เอกสารของแต่ละ user อยู่ใน collection ของตัวเอง (plotcraft_u<owner_id>)
+    # query ของแชทจึงค้นเฉพาะข้อมูลของคนถาม ไม่โตตามจำนวน user ทั้งระบบ
+    # ย้ายข้อมูลเดิมด้วย python manage.py rag_reshard
+
+    def shard_name(self, owner_id):
+        if settings.RAG_SHARDING == 'none':
+            return COLLECTION_NAME
+        if settings.RAG_SHARDING != 'user':
+            raise ImproperlyConfigured(f"Unknown RAG_SHARDING: {settings.RAG_SHARDING!r}")
+        if not owner_id or str(owner_id) == "unknown":
+            return "plotcraft_unowned"
+        return f"plotcraft_u{owner_id}"
+
+    def store_for(self, owner_id):
+        """ store (collection) ที่เก็บเอกสารของ owner นี้ """
+        return self.store_for_shard(self.shard_name(owner_id))
+
+    def store_for_shard(self, name):
+        store = self._shards.get(name)
+        if store is None:
+            with self._lock:
+                store = self._shards.get(name)
+                if store is None:
+                    store = self._shards[name] = self.vector_client.store(name)
+        return store
+
+    def _stores_for(self, owner_id=None):
+        """ ไม่รู้เจ้าของ (เช่น งานลบเก่าที่ไม่มี owner_id) -> ต้องไล่ทุก shard """
+        if owner_id or settings.RAG_SHARDING == 'none':
+            return [self.store_for(owner_id)]
+        return [self.store_for_shard(name) for name in self.vector_client.list_stores()]
+
+    def warmup(self):
+        """ โหลด embedding model ไว้ล่วงหน้า (เรียกใน gunicorn master ก่อน fork -> worker ใช้ร่วมกันแบบ copy-on-write)
+            ตั้งใจไม่รัน inference ตรงนี้ เพราะ thread pool ของ torch ที่สร้างก่อน fork อาจทำให้ worker ค้าง """
+        return self.embeddings
+
+    def reset_connections(self):
+        """ เรียกหลัง fork: connection ของ ChromaDB ห้ามใช้ข้าม process """
+        with self._lock:
+            self._vector_client = None
+            self._shards = {}
+
+    def readiness(self):
+        """ สถานะความพร้อม (ไม่ทำให้โหลด model) ใช้กับ /api/rag/ready/ """
         try:
-            self.chroma_client = chromadb.HttpClient(
-                host=os.environ.get("CHROMA_HOST", "chroma_db"), 
-                port=int(os.environ.get("CHROMA_PORT", 8000))
+            self.vector_client.heartbeat()
+            vector_store = True
+        except Exception:
+            vector_store = False
+
+        embeddings_loaded = self._embeddings is not None
+        return {
+            'ready': vector_store and (embeddings_loaded or not settings.RAG_PRELOAD_MODEL),
+            'embeddings_loaded': embeddings_loaded,
+            'vector_store': vector_store,
+            'llm_configured': bool(self.api_key),
+        }
+
+    def metrics(self):
+        """ ตัวเลขภายใน (LLM gateway / cache / คิว) สำหรับ staff เท่านั้น ใช้กับ /api/rag/metrics/ """
+        return {
+            'llm': self._llm.metrics() if self._llm is not None else None,
+            'caches': {
+                'query_embeddings': self.query_cache.stats(),
+                'retrieval': self.retrieval_cache.stats(),
+            },
+            'queue': queue_metrics(),
+        }
+
+    def sync_sources(self, sources, moved_from=None):
+        """ ทำให้เอกสารใน vector store ตรงกับ entity ล่าสุด (ใช้ทั้งทีละตัวและทีละ batch จาก rag_worker)
+            sources = [(doc_type, source_id, owner_id, [(doc_id, ข้อความ, metadata), ...]), ...]
+            - ข้อความ + metadata เหมือนเดิม -> ข้ามเลย (ไม่ embed ไม่เขียน)
+            - เปลี่ยนแค่ metadata -> update metadata อย่างเดียว
+            - ข้อความเปลี่ยน/ใหม่ -> embed รวมกันทุก entity ในครั้งเดียว (ผ่าน cache) แล้ว upsert ทีละ shard
+            - เอกสารของ entity เดิมที่ไม่มีแล้ว (เช่น chunk ที่ถูกแก้) -> ลบ
+            - เจ้าของเปลี่ยน (moved_from = {(doc_type, source_id): owner_id เดิม} จากคิว) -> ลบออกจาก shard เดิม
+            "ข้อความเปลี่ยน" ดูจาก content_hash ใน metadata (ถ้าไม่ได้ใส่มาจะ hash ข้อความทั้งหมดให้)
+            คืน {'documents', 'embedded', 'updated', 'removed', 'unchanged'} """
+        stats = {'documents': 0, 'embedded': 0, 'updated': 0, 'removed': 0, 'unchanged': 0}
+        # เจ้าของที่เปลี่ยนโดยไม่ผ่านคิว (เช่น แก้ author ของนิยาย) ของเก่ายังค้าง -> rag_reconcile เก็บกวาดให้
+        shards, stale = {}, {}
+        for doc_type, source_id, owner_id, documents in sources:
+            name = self.shard_name(owner_id)
+            previous = (moved_from or {}).get((doc_type, str(source_id)))
+            if previous is not None and self.shard_name(previous) != name:
+                stale.setdefault(self.shard_name(previous), {}).setdefault(doc_type, []).append(str(source_id))
+            shard = shards.setdefault(name, {})
+            shard.setdefault(doc_type, {})[str(source_id)] = [
+                (doc_id, content, {"content_hash": content_hash(content), **metadata})
+                for doc_id, content, metadata in documents
+            ]
+
+        plans, to_embed, scopes = {}, [], set()
+        for name, by_type in shards.items():
+            store = self.store_for_shard(name)
+            plan = plans[name] = {'removed': [], 'updated': [], 'upserts': []}
+            for doc_type, by_source in by_type.items():
+                # 1 get ต่อ type ต่อ shard แทนการถามทีละเอกสาร
+                existing = store.get(
+                    where={"$and": [{"type": doc_type}, {"source_id": {"$in": list(by_source)}}]},
+                    include=["metadatas"],
+                )
+                stored = {doc_id: metadata or {} for doc_id, metadata in zip(existing["ids"], existing["metadatas"])}
+                wanted = set()
+                for documents in by_source.values():
+                    for doc_id, content, metadata in documents:
+                        wanted.add(doc_id)
+                        stats['documents'] += 1
+                        old = stored.get(doc_id)
+                        if old == metadata:
+                            stats['unchanged'] += 1
+                            continue
+                        scopes.add((metadata.get("owner_id"), metadata.get("novel_id")))
+                        if old is not None:
+                            # ย้ายนิยาย/เปลี่ยนเจ้าของ -> ผลค้นหาของขอบเขตเดิมก็ต้องเปลี่ยนด้วย
+                            scopes.add((old.get("owner_id"), old.get("novel_id")))
+                        if old is not None and old.get("content_hash") == metadata["content_hash"]:
+                            # ข้อความเดิมแต่ตำแหน่ง/ลำดับตอนเปลี่ยน -> แก้แค่ metadata
+                            plan['updated'].append((doc_id, metadata))
+                        else:
+                            plan['upserts'].append(len(to_embed))
+                            to_embed.append((doc_id, content, metadata))
+                for doc_id, metadata in stored.items():
+                    if doc_id not in wanted:
+                        plan['removed'].append(doc_id)
+                        scopes.add((metadata.get("owner_id"), metadata.get("novel_id")))
+
+        vectors = []
+        if to_embed:
+            vectors = self.embedding_cache.embed_documents(
+                [content for _, content, _ in to_embed], self.embeddings.embed_documents
             )
-            self.collection = self.chroma_client.get_or_create_collection(name="plotcraft_collection")
-            print("✅ RAG Service Initialized for Plotcraft")
-        except Exception as e:
-            print(f"❌ ChromaDB Error: {e}")
-            self.collection = None
 
-    def add_character_to_rag(self, char):
-        """ จดจำข้อมูลตัวละคร """
-        try:
-            # สร้างข้อความสรุปตัวละครจาก Field ใน models.py ของคุณ
-            content = f"""
-            [ข้อมูลตัวละคร]
-            ชื่อ: {char.name}
-            นามแฝง: {char.alias}
-            บทบาท: {char.role}
-            นิสัย: {char.personality}
-            ปูมหลัง: {char.background}
-            จุดแข็ง: {char.strengths}
-            จุดอ่อน: {char.weaknesses}
-            ทักษะ: {char.skills}
-            """
-            
-            self.collection.add(
-                documents=[content],
-                embeddings=[self.embeddings.embed_query(content)],
-                metadatas=[{
-                    "type": "character",
-                    "novel_id": str(char.project.id) if char.project else "unknown",
-                    "owner_id": str(char.created_by.id) if char.created_by else "unknown",
-                    "source_id": str(char.id)
-                }],
-                ids=[f"char_{char.id}"]
+        for name, plan in plans.items():
+            store = self.store_for_shard(name)
+            if plan['removed']:
+                store.delete(ids=plan['removed'])
+            if plan['upserts']:
+                docs = [to_embed[i] for i in plan['upserts']]
+                store.upsert(
+                    ids=[doc_id for doc_id, _, _ in docs],
+                    documents=[content for _, content, _ in docs],
+                    embeddings=[vectors[i] for i in plan['upserts']],
+                    metadatas=[metadata for _, _, metadata in docs],
+                )
+            if plan['updated']:
+                store.update(
+                    ids=[doc_id for doc_id, _ in plan['updated']],
+                    metadatas=[metadata for _, metadata in plan['updated']],
+                )
+            stats['removed'] += len(plan['removed'])
+            stats['updated'] += len(plan['updated'])
+            stats['embedded'] += len(plan['upserts'])
+
+        for name, by_type in stale.items():
+            store = self.store_for_shard(name)
+            for doc_type, source_ids in by_type.items():
+                where = {"$and": [{"type": doc_type}, {"source_id": {"$in": source_ids}}]}
+                existing = store.get(where=where, include=["metadatas"])
+                if not existing["ids"]:
+                    continue
+                store.delete(ids=existing["ids"])
+                stats['removed'] += len(existing["ids"])
+                scopes.update((m.get("owner_id"), m.get("novel_id")) for m in existing["metadatas"] if m)
+
+        for owner_id, novel_id in scopes:
+            self.retrieval_cache.invalidate(owner_id, novel_id)
+        return stats
+
+    def upsert_documents(self, documents, embed_fn=None):
+        """ เขียนเอกสารทีละมากๆ (ใช้ตอน rebuild index): embed ทั้งก้อนในครั้งเดียว แล้ว upsert แยกตาม shard
+            documents = [(doc_id, ข้อความ, metadata), ...] ; คืนจำนวนข้อความที่ต้องเข้า model จริง """
+        if not documents:
+            return 0
+        texts = [content for _, content, _ in documents]
+        misses_before = self.embedding_cache.misses
+        vectors = self.embedding_cache.embed_documents(texts, embed_fn or self.embeddings.embed_documents)
+
+        shards = {}
+        for (doc_id, content, metadata), vector in zip(documents, vectors):
+            metadata = {"content_hash": content_hash(content), **metadata}
+            batch = shards.setdefault(self.shard_name(metadata.get("owner_id")), {
+                "ids": [], "documents": [], "embeddings": [], "metadatas": [],
+            })
+            batch["ids"].append(doc_id)
+            batch["documents"].append(content)
+            batch["embeddings"].append(vector)
+            batch["metadatas"].append(metadata)
+
+        scopes = set()
+        for name, batch in shards.items():
+            self.store_for_shard(name).upsert(**batch)
+            scopes.update((m.get("owner_id"), m.get("novel_id")) for m in batch["metadatas"])
+        for owner_id, novel_id in scopes:
+            self.retrieval_cache.invalidate(owner_id, novel_id)
+        return self.embedding_cache.misses - misses_before
+
+    def delete_sources(self, doc_type, source_ids, owner_id):
+        """ ลบทุกเอกสารของหลาย entity ใน shard เดียว (ครั้งเดียว แทนการลบทีละตัว) """
+        if source_ids:
+            self.store_for(owner_id).delete(
+                where={"$and": [{"type": doc_type}, {"source_id": {"$in": [str(i) for i in source_ids]}}]}
             )
-            print(f"✅ RAG Added Character: {char.name} (Owner: {char.created_by.id})")
-        except Exception as e:
-            print(f"❌ Error adding character: {e}")
+
+    # ==================== เอกสารของแต่ละ entity ====================
+    # ใช้ร่วมกันระหว่าง add_*_to_rag (ทีละตัว) กับ rag_reindex (ทีละ batch)
+
+    def character_document(self, char):
+        """ (doc_id, ข้อความ, metadata) ของตัวละคร """
+        # สร้างข้อความสรุปตัวละครจาก Field ใน models.py ของคุณ
+        content = f"""
+        [ข้อมูลตัวละคร]
+        ชื่อ: {char.name}
+        นามแฝง: {char.alias}
+        บทบาท: {char.role}
+        นิสัย: {char.personality}
+        ปูมหลัง: {char.background}
+        จุดแข็ง: {char.strengths}
+        จุดอ่อน: {char.weaknesses}
+        ทักษะ: {char.skills}
+        """
+        return f"char_{char.id}", content, {
+            "type": "character",
+            "novel_id": str(char.project.id) if char.project else "unknown",
+            "owner_id": str(char.created_by.id) if char.created_by else "unknown",
+            "source_id": str(char.id)
+        }
+
+    def chapter_documents(self, chapter):
+        """ {doc_id: (ข้อความ, metadata)} ของทุก chunk ในตอน """
+        base_metadata = {
+            "type": "content",
+            "novel_id": str(chapter.novel.id),
+            "source_id": str(chapter.id),
+            "owner_id": str(chapter.novel.author.id),
+            "chapter_order": chapter.order,
+        }
+
+        # หั่นเนื้อหา -> id ของ chunk มาจาก hash ของเนื้อ chunk เอง ไม่รวม overlap
+        # (แทรกย่อหน้าใหม่ / แก้ท้าย chunk ก่อนหน้า chunk อื่นก็ยังได้ id เดิม ไม่ต้อง embed ใหม่)
+        chunks = chunk_text(
+            html_to_text(chapter.content),
+            max_chars=settings.RAG_CHUNK_MAX_CHARS,
+            overlap=settings.RAG_CHUNK_OVERLAP_CHARS,
+            min_chars=settings.RAG_CHUNK_MIN_CHARS,
+        )
+        documents = {}
+        for chunk in chunks:
+            content = f"[เนื้อเรื่อง] ตอน: {chapter.title}\n{chunk.text}"
+            chunk_hash = content_hash(f"[เนื้อเรื่อง] ตอน: {chapter.title}\n{chunk.body}")
+            doc_id = f"chap_{chapter.id}_{chunk_hash[:16]}"
+            if doc_id in documents:  # ย่อหน้าซ้ำกันเป๊ะในตอนเดียว
+                doc_id = f"{doc_id}_{chunk.index}"
+            documents[doc_id] = (content, {
+                **base_metadata,
+                "chunk_index": chunk.index,
+                "offset": chunk.start,
+                "content_hash": chunk_hash,
+            })
+        return documents
+
+    def scene_document(self, scene):
+        """ (doc_id, ข้อความ, metadata) ของโครงสร้างฉาก (Goal, Conflict, Outcome) """
+        # เตรียมข้อมูลให้ AI อ่านง่าย
+        pov = scene.pov_character.name if scene.pov_character else "ไม่ระบุ"
+        loc = scene.location.name if scene.location else "ไม่ระบุ"
+        chars = ", ".join([c.name for c in scene.characters.all()]) or "-"
+
+        content = f"""
+        [ข้อมูลฉาก]
+        ชื่อฉาก: {scene.title} (ลำดับที่ {scene.order})
+        สถานะ: {scene.get_status_display()}
+        สถานที่: {loc}
+        ตัวละครดำเนินเรื่อง (POV): {pov}
+        ตัวละครประกอบ: {chars}
+
+        🎯 เป้าหมาย (Goal): {scene.goal}
+        🚧 อุปสรรค (Conflict): {scene.conflict}
+        🏁 ผลลัพธ์ (Outcome): {scene.outcome}
+
+        📝 เนื้อหาบางส่วน:
+        {scene.content[:1000] if scene.content else "ยังไม่มีเนื้อหา"}
+        """
+        return f"scene_{scene.id}", content, {
+            "type": "scene",
+            "novel_id": str(scene.project.id) if scene.project else "unknown",
+            "owner_id": str(scene.created_by.id) if scene.created_by else "unknown",
+            "source_id": str(scene.id)
+        }
+
+    def source_for(self, doc_type, obj):
+        """ (doc_type ใน metadata, source_id, owner_id, เอกสารทั้งหมด) ของ entity สำหรับ sync_sources """
+        if doc_type == 'content':
+            documents = [(doc_id, content, metadata) for doc_id, (content, metadata) in
+                         self.chapter_documents(obj).items()]
+            # ตอนที่เนื้อหาว่างก็ยังต้องรู้ shard เพื่อลบ chunk เก่า
+            return doc_type, obj.id, obj.novel.author.id, documents
+        document = self.character_document(obj) if doc_type == 'character' else self.scene_document(obj)
+        return doc_type, obj.id, document[2]["owner_id"], [document]
+
+    def add_character_to_rag(self, char):
+        """ จดจำข้อมูลตัวละคร (ถ้า error จะ raise ออกไปให้ rag_queue retry) """
+        self.sync_sources([self.source_for('character', char)])
+        logger.info("Indexed character #%s", char.pk)
 
     def add_chapter_to_rag(self, chapter):
-        """ จดจำเนื้อหาในแต่ละตอน """
+        """ จดจำเนื้อหาในแต่ละตอน แบบแบ่ง chunk
+            embed เฉพาะ chunk ที่ข้อความเปลี่ยน และลบ chunk ที่ไม่มีแล้วออก """
+        stats = self.sync_sources([self.source_for('content', chapter)])
+        logger.info("Indexed chapter #%s: %d new, %d removed, %d unchanged chunks",
+                    chapter.pk, stats['embedded'], stats['removed'], stats['documents'] - stats['embedded'])
+
+    def _retrieve_context(self, user_query, novel_id=None, user_id=None):
+        """ ค้นข้อมูลนิยายที่เกี่ยวกับคำถาม (ต้องมี User ID เสมอเพื่อความปลอดภัย) ค้นไม่ได้ -> "" """
+        if not user_id:
+            return ""
         try:
-            # ตัดเนื้อหาถ้ายาวเกินไป (Optional) แต่ Gemini รองรับ Context ยาวได้พอสมควร
-            content = f"""
-            [เนื้อเรื่อง บทที่ {chapter.order}]
-            ชื่อตอน: {chapter.title}
-            เนื้อหา: {chapter.content}
-            """
-            
-            self.collection.add(
-                documents=[content],
-                embeddings=[self.embeddings.embed_query(content)],
-                metadatas=[{
-                    "type": "content",
-                    "novel_id": str(chapter.novel.id),
-                    "source_id": str(chapter.id),
-                    "owner_id": str(chapter.novel.author.id)
-                }],
-                ids=[f"chap_{chapter.id}"]
+            # คำถามเดิมในนิยายเดิม และเนื้อหายังไม่เปลี่ยน -> ใช้ผลค้นหาเดิม ไม่ต้อง embed/ถาม ChromaDB
+            cache_key, cached = self._cached_context(user_query, novel_id, user_id)
+            if cached is not None:
+                return cached
+            context_text = self._search_context(user_query, novel_id, user_id)
+            self.retrieval_cache.set(cache_key, context_text)
+            return context_text
+        except Exception:
+            logger.exception("RAG retrieval failed (user #%s, novel #%s)", user_id, novel_id)
+            return ""
+
+    async def _aretrieve_context(self, user_query, novel_id=None, user_id=None):
+        """ _retrieve_context สำหรับ event loop: cache (ตารางใน DB) ทำใน thread ของ request เหมือน ORM ทั่วไป
+            ส่วน embed (CPU) + vector store (blocking I/O) ไม่แตะ DB -> ย้ายไป thread pool แยกได้ """
+        if not user_id:
+            return ""
+        try:
+            cache_key, cached = await sync_to_async(self._cached_context)(user_query, novel_id, user_id)
+            if cached is not None:
+                return cached
+            context_text = await sync_to_async(self._search_context, thread_sensitive=False)(
+                user_query, novel_id, user_id
             )
-            print(f"✅ Added Chapter: {chapter.title}")
-        except Exception as e:
-             print(f"❌ Error adding chapter: {e}")
+            await sync_to_async(self.retrieval_cache.set)(cache_key, context_text)
+            return context_text
+        except Exception:
+            logger.exception("RAG retrieval failed (user #%s, novel #%s)", user_id, novel_id)
+            return ""
 
-    def chat_with_editor(self, user_query, novel_id=None, user_id=None):
-        """ ฟังก์ชันคุยกับพี่บก. (รวมร่าง: คุยเล่น + ตรวจงาน) """
-        print(f"💬 Chatting with Editor. Novel ID: {novel_id}, User ID: {user_id}")
-        
-        context_text = ""
-        
-        # ค้นหาข้อมูล (ต้องมี User ID เสมอเพื่อความปลอดภัย)
-        if user_id: 
-            try:
-                query_vector = self.embeddings.embed_query(user_query)
-                
-                # สร้างเงื่อนไขค้นหา (Where Clause)
-                where_conditions = []
-                
-                # 1. ต้องเป็นของ User คนนี้เท่านั้น (สำคัญที่สุด!)
-                where_conditions.append({"owner_id": str(user_id)})
-                
-                # 2. ถ้าระบุ Novel ID ก็กรองเพิ่ม
-                if novel_id:
-                    where_conditions.append({"novel_id": str(novel_id)})
-                
-                # รวมเงื่อนไข
-                if len(where_conditions) > 1:
-                    final_where = {"$and": where_conditions}
-                else:
-                    final_where = where_conditions[0]
-
-                results = self.collection.query(
-                    query_embeddings=[query_vector],
-                    n_results=3,
-                    where=final_where 
-                )
-                
-                docs = results['documents'][0]
-                if docs:
-                    context_text = "\n\n".join(docs)
-                    print(f"📚 Found {len(docs)} related docs")
-                    
-            except Exception as e:
-                print(f"RAG Error: {e}")
-
-        # 2. สร้าง Prompt เดียว ใช้ด้วยกันทั้งเว็บ
-        prompt = f"""
+    def _cached_context(self, user_query, novel_id, user_id):
+        cache_key = self.retrieval_cache.key_for(user_id, novel_id, user_query)
+        return cache_key, self.retrieval_cache.get(cache_key)
+
+    def _search_context(self, user_query, novel_id, user_id):
+        """ embed คำถาม + ค้น vector store + คัดให้อยู่ในงบ token (ไม่แตะ ORM / Django cache) """
+        query_vector = self.query_cache.embed_query(user_query, self.embeddings.embed_query, persist=False)
+
+        # สร้างเงื่อนไขค้นหา (Where Clause)
+        where_conditions = []
+
+        # 1. ต้องเป็นของ User คนนี้เท่านั้น (สำคัญที่สุด!)
+        where_conditions.append({"owner_id": str(user_id)})
+
+        # 2. ถ้าระบุ Novel ID ก็กรองเพิ่ม
+        if novel_id:
+            where_conditions.append({"novel_id": str(novel_id)})
+
+        # รวมเงื่อนไข
+        if len(where_conditions) > 1:
+            final_where = {"$and": where_conditions}
+        else:
+            final_where = where_conditions[0]
+
+        results = self.store_for(user_id).query(
+            query_embeddings=[query_vector],
+            n_results=settings.RAG_CONTEXT_CANDIDATES,
+            where=final_where
+        )
+
+        # คัด/ตัด candidate ให้อยู่ในงบ token (ดู context_assembler.py)
+        context = assemble_context(
+            results,
+            budget=settings.RAG_CONTEXT_TOKEN_BUDGET,
+            quotas=parse_quotas(settings.RAG_CONTEXT_QUOTAS),
+        )
+        if context.text:
+            stats = context.stats
+            logger.info("Context: %d/%d docs, ~%d tokens (budget %d, %d overlapping dropped) %s",
+                        stats['selected'], stats['candidates'], context.tokens, stats['budget'],
+                        stats['dropped_duplicate'], stats['tokens_by_type'])
+        return context.text
+
+    def semantic_search(self, user_query, user_id, n_results):
+        """ เอกสารของ user ที่ความหมายใกล้คำค้นที่สุด (ช่องค้นหารวม mode=semantic/hybrid)
+            embed คำค้นครั้งเดียว + query ครั้งเดียวใน shard ของ user
+            คืน [(doc_type, source_id, distance, ข้อความ)] ใกล้สุดก่อน 1 source เหลือ chunk ที่ใกล้สุดอันเดียว """
+        query_vector = self.query_cache.embed_query(user_query, self.embeddings.embed_query, persist=False)
+        results = self.store_for(user_id).query(
+            query_embeddings=[query_vector],
+            n_results=n_results,
+            where={"owner_id": str(user_id)},
+        )
+        documents = (results.get("documents") or [[]])[0]
+        metadatas = (results.get("metadatas") or [[]])[0] or [{}] * len(documents)
+        distances = (results.get("distances") or [[]])[0] or [0.0] * len(documents)
+
+        hits = []
+        seen = set()
+        for text, metadata, distance in sorted(zip(documents, metadatas, distances), key=lambda row: row[2]):
+            key = (metadata.get("type"), metadata.get("source_id"))
+            if key in seen or not str(key[1] or "").isdigit():
+                continue
+            seen.add(key)
+            hits.append((key[0], int(key[1]), distance, text))
+        return hits
+
+    def _build_chat_prompt(self, user_query, context_text, story_text="", history=""):
+        # Prompt เดียว ใช้ด้วยกันทั้งเว็บ
+        return f"""
         Role: คุณคือ "พี่บก." (Plotcraft Editor) รุ่นพี่ที่สนิทกับนักเขียน (User) มากๆ
         Personality: เก่ง สุภาพ ขี้เล่นนิดๆ ให้กำลังใจเก่ง และมีความรู้เรื่องนิยายแน่นปึ้ก
         
+        เรื่องราวที่ผ่านมา (เรื่องย่อถึงตอนล่าสุด):
+        {story_text if story_text else "ยังไม่มีเรื่องย่อ"}
+        
         บริบทนิยายที่กำลังคุยถึง (Context):
         {context_text if context_text else "ไม่ได้ระบุ หรือคุยเรื่องทั่วไป"}
         
+        บทสนทนาก่อนหน้าในห้องนี้:
+        {history if history else "ยังไม่มี (เพิ่งเริ่มคุย)"}
+        
         ข้อความจากน้องนักเขียน: 
         "{user_query}"
         
@@ -158,32 +550,141 @@ class RAGService:
         
         เริ่มตอบได้:
         """
+
+    def chat_with_editor(self, user_query, novel_id=None, user_id=None, session=None):
+        """ ฟังก์ชันคุยกับพี่บก. (รวมร่าง: คุยเล่น + ตรวจงาน)
+            session = ChatSession (ดู chat_sessions.py) -> จำบทสนทนาก่อนหน้า และบันทึก turn นี้ไว้ """
+        logger.info("Editor chat (novel #%s, user #%s)", novel_id, user_id)
+
+        prompt = self._prepare_chat_prompt(user_query, novel_id, user_id, session)
         
         try:
             if self.llm:
-                return self.llm.invoke(prompt)
+                reply = self.llm.invoke(prompt)
+                if session is not None:
+                    record_turn(session, user_query, reply)
+                return reply
             return "ระบบพี่ยังไม่พร้อมใช้งานครับ (No API Key)"
         except Exception as e:
+            logger.exception("Editor chat failed (novel #%s, user #%s)", novel_id, user_id)
             return f"โทษที พี่มึนหัวนิดหน่อย (Error: {str(e)})"
-    
-    def generate_scene_draft(self, scene):
-        """ ฟังก์ชันสำหรับช่วยร่างฉากนิยาย (Scene Drafter) """
-        print(f"✍️ Drafting Scene: {scene.title}")
-        
+
+    async def achat_with_editor(self, user_query, novel_id=None, user_id=None, session=None):
+        """ chat_with_editor แบบ async (ใช้ใน view ที่รันบน ASGI) """
+        logger.info("Editor chat, async (novel #%s, user #%s)", novel_id, user_id)
+
+        prompt = await self._aprepare_chat_prompt(user_query, novel_id, user_id, session)
+
         try:
-            # 1. เตรียมข้อมูลวัตถุดิบ (Raw Data)
-            pov_name = scene.pov_character.name if scene.pov_character else "ไม่ระบุ"
-            pov_desc = f"นิสัย: {scene.pov_character.personality}, รูปลักษณ์: {scene.pov_character.appearance}" if scene.pov_character else ""
-            
-            loc_name = scene.location.name if scene.location else "ไม่ระบุ"
-            loc_desc = f"สภาพแวดล้อม: {scene.location.terrain}, บรรยากาศ: {scene.location.climate}" if scene.location else ""
-            
-            other_chars = ", ".join([c.name for c in scene.characters.all()]) or "ไม่มี"
+            if self.llm:
+                reply = await self.llm.ainvoke(prompt)
+                if session is not None:
+                    await sync_to_async(record_turn)(session, user_query, reply)
+                return reply
+            return "ระบบพี่ยังไม่พร้อมใช้งานครับ (No API Key)"
+        except Exception as e:
+            logger.exception("Editor chat failed (novel #%s, user #%s)", novel_id, user_id)
+            return f"โทษที พี่มึนหัวนิดหน่อย (Error: {str(e)})"
+
+    async def astream_chat_with_editor(self, user_query, novel_id=None, user_id=None, session=None):
+        """ เหมือน achat_with_editor แต่ yield คำตอบทีละท่อนตามที่ Gemini ส่งมา
+            turn ถูกบันทึกเมื่อ stream จบครบเท่านั้น (client หลุดกลางทาง -> ไม่บันทึกคำตอบครึ่งๆ กลางๆ) """
+        logger.info("Editor chat, streaming (novel #%s, user #%s)", novel_id, user_id)
+
+        prompt = await self._aprepare_chat_prompt(user_query, novel_id, user_id, session)
+        on_complete = None
+        if session is not None:
+            on_complete = lambda reply: sync_to_async(record_turn)(session, user_query, reply)
+        # aclosing: ถูกปิดกลางทาง -> ปิด _astream_llm (และ stream ของ Gemini) ทันที ไม่รอ GC
+        async with aclosing(self._astream_llm(
+            prompt,
+            no_key_message="ระบบพี่ยังไม่พร้อมใช้งานครับ (No API Key)",
+            error_message="โทษที พี่มึนหัวนิดหน่อย (Error: {})",
+            on_complete=on_complete,
+        )) as chunks:
+            async for chunk in chunks:
+                yield chunk
+
+    def _prepare_chat_prompt(self, user_query, novel_id=None, user_id=None, session=None):
+        context_text = self._retrieve_context(user_query, novel_id, user_id)
+        story_text, history = self._story_and_history(novel_id, user_id, session)
+        return self._build_chat_prompt(user_query, context_text, story_text, history)
+
+    def _story_and_history(self, novel_id, user_id, session):
+        history = history_text(session) if session is not None else ""
+        return self.story_so_far(novel_id, user_id), history
+
+    def story_so_far(self, novel_id, user_id=None):
+        """ เรื่องย่อสะสมของนิยาย (ตัดให้อยู่ในงบ RAG_SUMMARY_TOKEN_BUDGET) ไม่มี -> "" """
+        if not novel_id or not user_id:
+            return ""
+        summary = (
+            NovelSummary.objects.filter(novel_id=novel_id, novel__author_id=user_id)
+            .values_list('summary', flat=True)
+            .first()
+        )
+        return truncate_tokens(summary, settings.RAG_SUMMARY_TOKEN_BUDGET) if summary else ""
+
+    def _novel_story(self, novel):
+        # views โหลด scene มาพร้อม select_related('project__story_summary') -> ไม่ query เพิ่มใน event loop
+        try:
+            summary = novel.story_summary.summary
+        except ObjectDoesNotExist:
+            return ""
+        return truncate_tokens(summary, settings.RAG_SUMMARY_TOKEN_BUDGET) if summary else ""
+
+    async def _aprepare_chat_prompt(self, user_query, novel_id=None, user_id=None, session=None):
+        # query DB ต้องอยู่ใน thread ของ request (connection ของ Django ผูกกับ thread; thread_sensitive=True)
+        # มีแค่ embed + vector store ใน _aretrieve_context ที่ไปทำใน thread pool แยก
+        context_text = await self._aretrieve_context(user_query, novel_id, user_id)
+        story_text, history = await sync_to_async(self._story_and_history)(novel_id, user_id, session)
+        return self._build_chat_prompt(user_query, context_text, story_text, history)
+
+    async def _astream_llm(self, prompt, no_key_message, error_message, on_complete=None):
+        """ yield token จาก llm.astream() และปิด stream ต้นทางเสมอ (เช่นตอน client ปิดหน้าไปกลางทาง)
+            on_complete(full_text) ถูกเรียกเมื่อ stream จบครบโดยไม่มี error เท่านั้น """
+        if not self.llm:
+            yield no_key_message
+            return
 
-            # 2. สร้าง Prompt สำหรับนักเขียนเงา
-            prompt = f"""
+        stream = None
+        parts = []
+        try:
+            stream = self.llm.astream(prompt)
+            async for chunk in stream:
+                if chunk:
+                    parts.append(chunk)
+                    yield chunk
+            if on_complete is not None:
+                await on_complete("".join(parts))
+        except (GeneratorExit, asyncio.CancelledError):
+            # client หลุด -> ASGI handler ยกเลิก response นี้ ไม่ต้องรอ Gemini ตอบจนจบ
+            logger.info("Client disconnected, LLM stream closed")
+            raise
+        except Exception as e:
+            logger.exception("LLM stream failed")
+            yield error_message.format(str(e))
+        finally:
+            if stream is not None and hasattr(stream, 'aclose'):
+                await stream.aclose()
+
+    def _build_scene_prompt(self, scene):
+        # 1. เตรียมข้อมูลวัตถุดิบ (Raw Data)
+        pov_name = scene.pov_character.name if scene.pov_character else "ไม่ระบุ"
+        pov_desc = f"นิสัย: {scene.pov_character.personality}, รูปลักษณ์: {scene.pov_character.appearance}" if scene.pov_character else ""
+        
+        loc_name = scene.location.name if scene.location else "ไม่ระบุ"
+        loc_desc = f"สภาพแวดล้อม: {scene.location.terrain}, บรรยากาศ: {scene.location.climate}" if scene.location else ""
+        
+        other_chars = ", ".join([c.name for c in scene.characters.all()]) or "ไม่มี"
+        story_text = self._novel_story(scene.project)
+
+        # 2. สร้าง Prompt สำหรับนักเขียนเงา
+        return f"""
             Role: คุณคือ "Ghostwriter" มืออาชีพ หน้าที่ของคุณคือร่างเนื้อหานิยาย (First Draft) จากโครงเรื่องที่กำหนดให้
             
+            📖 เรื่องราวที่ผ่านมา: {story_text or "ไม่มีข้อมูล"}
+            
             🏗️ โครงสร้างฉาก (Scene Structure):
             - ชื่อฉาก: {scene.title}
             - ตัวละครดำเนินเรื่อง (POV): {pov_name} ({pov_desc})
@@ -198,79 +699,171 @@ class RAGService:
             1. เขียนบรรยายในรูปแบบ "นิยาย" (Narrative) มุมมองบุคคลที่ 3 (หรือ 1 ตามความเหมาะสมของ POV)
             2. เริ่มต้นด้วยการบรรยายบรรยากาศสถานที่ (Setting the scene) ให้เห็นภาพ
             3. ใส่บทพูด (Dialogue) และการกระทำ (Action) ที่สะท้อนนิสัยตัวละคร
-            4. ดำเนินเรื่องให้เห็น "อุปสรรค" ที่ตัวละครต้องเจอ และจบลงที่ "ผลลัพธ์" ตามที่ระบุ
+            4. ดำเนินเรื่องให้เห็น "อุปสรรค" ที่ตัวละครต้องเจอ และจบลงที่ "ผลลัพธ์" ตามที่ระบุ (ต่อเนื่องกับเรื่องราวที่ผ่านมา)
             5. ไม่ต้องเขียนยาวมาก เอาแค่โครงร่างหลักๆ ประมาณ 300-500 คำ เพื่อให้นักเขียนไปเกลาต่อได้
             6. ใช้ภาษาไทยสละสลวย เหมาะกับการเป็นนิยาย
             
             เริ่มร่างเนื้อหา:
             """
+    
+    def generate_scene_draft(self, scene):
+        """ ฟังก์ชันสำหรับช่วยร่างฉากนิยาย (Scene Drafter) """
+        logger.info("Drafting scene #%s", scene.pk)
+
+        try:
+            prompt = self._build_scene_prompt(scene)
             
             if self.llm:
                 return self.llm.invoke(prompt)
             return "ระบบยังไม่พร้อมใช้งาน (No API Key)"
             
         except Exception as e:
-            print(f"Draft Error: {e}")
+            logger.exception("Scene draft failed (scene #%s)", scene.pk)
             return f"เกิดข้อผิดพลาดในการร่าง: {str(e)}"
-        
-    def add_scene_to_rag(self, scene):
-        """ จดจำข้อมูลโครงสร้างฉาก (Goal, Conflict, Outcome) """
+
+    def _draft_cache_key(self, scene, prompt):
+        # prompt รวมทุกอย่างที่มีผลกับร่างแล้ว (goal/conflict/outcome, POV, สถานที่, ตัวละครในฉาก)
+        digest = hashlib.sha256(f"{LLM_MODEL_NAME}\n{prompt}".encode("utf-8")).hexdigest()
+        return f"scene_draft:{scene.pk}:{digest}"
+
+    async def _cache_draft(self, key, draft):
+        await cache.aset(key, {'draft': draft, 'created_at': time.time()}, settings.RAG_DRAFT_CACHE_SECONDS)
+
+    async def agenerate_scene_draft(self, scene, fresh=False):
+        """ generate_scene_draft แบบ async + cache + single-flight คืน (draft, cached)
+            - ฉากไม่เปลี่ยนจากครั้งก่อน -> คืนร่างเดิมจาก cache ทันที (fresh=True เพื่อสั่งร่างใหม่)
+            - request ซ้ำที่มาพร้อมกัน (ทั้งใน process และข้าม worker) รอผลจากการเรียก LLM ครั้งเดียว
+            scene ต้องโหลดมาพร้อม select_related('pov_character', 'location') + prefetch_related('characters')
+            เพราะใน event loop เรียก ORM แบบ sync ไม่ได้ """
+        logger.info("Drafting scene #%s (async)", scene.pk)
+
         try:
-            # 1. เตรียมข้อมูลให้ AI อ่านง่าย
-            pov = scene.pov_character.name if scene.pov_character else "ไม่ระบุ"
-            loc = scene.location.name if scene.location else "ไม่ระบุ"
-            chars = ", ".join([c.name for c in scene.characters.all()]) or "-"
-            
-            content = f"""
-            [ข้อมูลฉาก]
-            ชื่อฉาก: {scene.title} (ลำดับที่ {scene.order})
-            สถานะ: {scene.get_status_display()}
-            สถานที่: {loc}
-            ตัวละครดำเนินเรื่อง (POV): {pov}
-            ตัวละครประกอบ: {chars}
-            
-            🎯 เป้าหมาย (Goal): {scene.goal}
-            🚧 อุปสรรค (Conflict): {scene.conflict}
-            🏁 ผลลัพธ์ (Outcome): {scene.outcome}
-            
-            📝 เนื้อหาบางส่วน:
-            {scene.content[:1000] if scene.content else "ยังไม่มีเนื้อหา"}
-            """
-            
-            # 2. บันทึกลง ChromaDB
-            self.collection.add(
-                documents=[content],
-                embeddings=[self.embeddings.embed_query(content)],
-                metadatas=[{
-                    "type": "scene",
-                    "novel_id": str(scene.project.id) if scene.project else "unknown",
-                    "owner_id": str(scene.created_by.id) if scene.created_by else "unknown",
-                    "source_id": str(scene.id)
-                }],
-                ids=[f"scene_{scene.id}"]
-            )
-            print(f"✅ RAG Added Scene: {scene.title}")
-            
+            prompt = self._build_scene_prompt(scene)
+            if not self.llm:
+                return "ระบบยังไม่พร้อมใช้งาน (No API Key)", False
+
+            key = self._draft_cache_key(scene, prompt)
+            if not fresh:
+                entry = await cache.aget(key)
+                if entry is not None:
+                    logger.info("Draft cache hit for scene #%s", scene.pk)
+                    return entry['draft'], True
+
+            not_before = time.time() if fresh else 0
+            draft = await self._draft_flight.run(key, lambda: self._agenerate_draft_once(key, prompt, not_before))
+            return draft, False
+
         except Exception as e:
-            print(f"❌ Error adding scene: {e}")
-        
-    def delete_data_from_rag(self, doc_id):
-        """ ฟังก์ชันลบข้อมูลออกจากสมอง AI """
+            logger.exception("Scene draft failed (scene #%s)", scene.pk)
+            return f"เกิดข้อผิดพลาดในการร่าง: {str(e)}", False
+
+    async def _agenerate_draft_once(self, key, prompt, not_before):
+        """ เรียก LLM จริง โดยถือ lock ใน cache กัน worker อื่นร่าง prompt เดียวกันซ้อน """
+        lock_key = f"{key}:lock"
+        token = uuid.uuid4().hex
+        waited = 0.0
+        while not await cache.aadd(lock_key, token, settings.RAG_DRAFT_LOCK_SECONDS):
+            # worker อื่นกำลังร่างอยู่ -> รอผลของมันแทนการยิง LLM ซ้ำ
+            await asyncio.sleep(0.5)
+            waited += 0.5
+            entry = await cache.aget(key)
+            if entry is not None and entry['created_at'] >= not_before:
+                return entry['draft']
+            if waited >= settings.RAG_DRAFT_LOCK_SECONDS:
+                break  # lock ค้าง (worker ตายกลางทาง) -> ร่างเองเลย
+
         try:
-            self.collection.delete(ids=[doc_id])
-            print(f"🗑️ Deleted from RAG: {doc_id}")
-        except Exception as e:
-            print(f"❌ Error deleting from RAG: {e}")
+            draft = await self.llm.ainvoke(prompt)
+            await self._cache_draft(key, draft)
+            return draft
+        finally:
+            if await cache.aget(lock_key) == token:
+                await cache.adelete(lock_key)
 
-    def generate_character_data(self, concept):
-        """ ช่วยคิด/แกะข้อมูลตัวละคร (รองรับทั้งบรีฟสั้นและยาว) """
-        import json
-        import re
-        
-        print(f"🎨 Processing Character Concept: {concept[:50]}...")
+    async def astream_scene_draft(self, scene, fresh=False):
+        """ ร่างฉากแบบ streaming (yield ทีละท่อน) เงื่อนไขเรื่อง scene และ cache เหมือน agenerate_scene_draft """
+        logger.info("Drafting scene #%s (streaming)", scene.pk)
+
+        prompt = self._build_scene_prompt(scene)
+        key = self._draft_cache_key(scene, prompt)
+        if not fresh and self.llm:
+            entry = await cache.aget(key)
+            if entry is not None:
+                logger.info("Draft cache hit for scene #%s", scene.pk)
+                yield entry['draft']
+                return
+
+        async with aclosing(self._astream_llm(
+            prompt,
+            no_key_message="ระบบยังไม่พร้อมใช้งาน (No API Key)",
+            error_message="เกิดข้อผิดพลาดในการร่าง: {}",
+            on_complete=lambda draft: self._cache_draft(key, draft),
+        )) as chunks:
+            async for chunk in chunks:
+                yield chunk
         
-        try:
-            prompt = f"""
+    def add_scene_to_rag(self, scene):
+        """ จดจำข้อมูลโครงสร้างฉาก (Goal, Conflict, Outcome) """
+        self.sync_sources([self.source_for('scene', scene)])
+        logger.info("Indexed scene #%s", scene.pk)
+
+    def refresh_story_summary(self, novel_id, owner_id=None):
+        """ อัปเดตสรุปตอนที่เนื้อหาเปลี่ยน + เรื่องย่อสะสมของนิยาย (งาน novel_summary ในคิว) """
+        if not self.llm:
+            logger.info("Skipped summary of novel #%s (no API key)", novel_id)
+            return None
+        novel = Novel.objects.filter(pk=novel_id).first()
+        if novel is None:
+            return None
+        stats = StorySummarizer(self.llm, LLM_MODEL_NAME).refresh(novel)
+        logger.info("Summary of novel #%s: %d chapters, %d LLM calls, %d steps refolded",
+                    novel.pk, stats['chapters'], stats['llm_calls'], stats['refolded_steps'])
+        return stats
+
+    def compact_chat_session(self, session_id, owner_id=None):
+        """ รวม turn เก่าของห้องแชทเข้า summary (งาน chat_summary ในคิว) """
+        session = ChatSession.objects.filter(pk=session_id).first()
+        if session is None or not self.llm:
+            return 0
+        folded = compact_session(session, self.llm)
+        logger.info("Chat #%s: folded %d turns into the summary", session_id, folded)
+        return folded
+
+    def delete_novel_from_rag(self, novel_id, owner_id=None):
+        """ ลบทุกเอกสารของนิยายเรื่องเดียวด้วย delete ครั้งเดียว (ตอนลบนิยาย) """
+        for store in self._stores_for(owner_id):
+            store.delete(where={"novel_id": str(novel_id)})
+        self.retrieval_cache.invalidate(owner_id, str(novel_id))
+        logger.info("Deleted novel #%s from RAG", novel_id)
+
+    def delete_owner_from_rag(self, user_id, owner_id=None):
+        """ ลบทุกเอกสารของผู้ใช้ (ตอนลบบัญชี): ถ้าแยก shard ตาม user ก็ทิ้งทั้ง collection """
+        owner_id = owner_id or user_id
+        name = self.shard_name(owner_id)
+        if name != COLLECTION_NAME and name in self.vector_client.list_stores():
+            with self._lock:
+                self._shards.pop(name, None)
+                self.vector_client.drop_store(name)
+        else:
+            self.store_for(owner_id).delete(where={"owner_id": str(owner_id)})
+        self.retrieval_cache.invalidate(str(owner_id))
+        logger.info("Deleted user #%s from RAG", owner_id)
+
+    def delete_source_from_rag(self, doc_type, source_id, owner_id=None):
+        """ ลบทุกเอกสารของ entity เดียว (เช่น ทุก chunk ของตอนนั้น) """
+        where = {"$and": [{"type": doc_type}, {"source_id": str(source_id)}]}
+        for store in self._stores_for(owner_id):
+            # ดู metadata ก่อนลบ (object ใน DB หายไปแล้ว) เพื่อรู้ว่าต้องล้าง cache ของนิยายไหน
+            existing = store.get(where=where, include=["metadatas"], limit=1)
+            if not existing["ids"]:
+                continue
+            store.delete(where=where)
+            for metadata in existing["metadatas"]:
+                self.retrieval_cache.invalidate(metadata.get("owner_id"), metadata.get("novel_id"))
+        logger.info("Deleted %s #%s from RAG", doc_type, source_id)
+
+    def _build_character_prompt(self, concept):
+        return f"""
             Role: คุณคือผู้ช่วยกรอกแบบฟอร์มตัวละครมืออาชีพ
             Input: "{concept}"
             
@@ -296,21 +889,71 @@ class RAGService:
                 "skills": "ทักษะและความสามารถ"
             }}
             """
+
+    def _parse_character_json(self, response):
+        import json
+        import re
+
+        # แกะ JSON (ใช้ Regex กันเหนียวเหมือนเดิม)
+        json_match = re.search(r'\{.*\}', response, re.DOTALL)
+        if json_match:
+            return json.loads(json_match.group(0))
+        else:
+            return json.loads(response)
+
+    def generate_character_data(self, concept):
+        """ ช่วยคิด/แกะข้อมูลตัวละคร (รองรับทั้งบรีฟสั้นและยาว) """
+        logger.info("Generating character data")
+
+        try:
+            prompt = self._build_character_prompt(concept)
             
             if self.llm:
-                response = self.llm.invoke(prompt)
-                
-                # แกะ JSON (ใช้ Regex กันเหนียวเหมือนเดิม)
-                json_match = re.search(r'\{.*\}', response, re.DOTALL)
-                if json_match:
-                    return json.loads(json_match.group(0))
-                else:
-                    return json.loads(response)
+                return self._parse_character_json(self.llm.invoke(prompt))
             
             return None
             
-        except Exception as e:
-            print(f"Gen Char Error: {e}")
+        except Exception:
+            logger.exception("Character generation failed")
+            return None
+
+    async def agenerate_character_data(self, concept):
+        """ generate_character_data แบบ async """
+        logger.info("Generating character data (async)")
+
+        try:
+            prompt = self._build_character_prompt(concept)
+
+            if self.llm:
+                return self._parse_character_json(await self.llm.ainvoke(prompt))
+
+            return None
+
+        except Exception:
+            logger.exception("Character generation failed")
             return None
-# สร้าง Instance รอไว้เรียกใช้
-rag_service = RAGService()
\ No newline at end of file
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_rag_service():
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = RAGService()
+    return _service
+
+
+def after_fork():
+    """ hook สำหรับ gunicorn post_fork (ดู gunicorn.conf.py) """
+    if _service is not None:
+        _service.reset_connections()
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(settings.RAG_TORCH_THREADS)
+
+
+# สร้าง Instance ตอนถูกใช้ครั้งแรก (import module นี้เฉยๆ ไม่โหลดอะไร)
+rag_service = SimpleLazyObject(get_rag_service)
\ No newline at end of file
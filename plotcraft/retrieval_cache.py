@@ -0,0 +1,66 @@
+# plotcraft/retrieval_cache.py
+"""
+Cache ผลค้นหา context ของแชทพี่บก. (อายุสั้น) ใน Django cache ที่ทุก worker ใช้ร่วมกัน
+
+key = (owner_id, novel_id, hash ของคำถามที่ normalize แล้ว) + "generation" ของขอบเขตนั้น
+- เมื่อ worker index/ลบเอกสารของนิยายไหน จะเพิ่ม generation ของนิยายนั้น (และของเจ้าของ)
+  -> key เดิมทั้งหมดของขอบเขตนั้นใช้ไม่ได้ทันที ไม่ต้องไล่ลบทีละ key
+- คำถามที่ไม่ระบุนิยาย (ค้นทุกเรื่องของ user) ผูกกับ generation ของเจ้าของ
+"""
+import threading
+
+from django.core.cache import cache
+
+from .embedding_cache import content_hash
+
+
+class RetrievalCache:
+    def __init__(self, ttl=120):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _scope(self, owner_id, novel_id):
+        return f"novel:{novel_id}" if novel_id else f"owner:{owner_id}"
+
+    def key_for(self, owner_id, novel_id, query):
+        generation = cache.get(f"rag_gen:{self._scope(owner_id, novel_id)}", 0)
+        return f"rag_ctx:{owner_id}:{novel_id or '*'}:{generation}:{content_hash(query)}"
+
+    def get(self, key):
+        value = cache.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if self.ttl > 0:
+            cache.set(key, value, self.ttl)
+
+    def invalidate(self, owner_id=None, novel_id=None):
+        """ เนื้อหาของนิยาย/เจ้าของเปลี่ยน -> ขยับ generation (ค่าเก่าจะหมดอายุไปเอง) """
+        scopes = []
+        if novel_id and novel_id != "unknown":
+            scopes.append(f"novel:{novel_id}")
+        if owner_id and owner_id != "unknown":
+            scopes.append(f"owner:{owner_id}")
+        for scope in scopes:
+            key = f"rag_gen:{scope}"
+            try:
+                cache.incr(key)
+            except ValueError:
+                # ยังไม่เคยมี -> เริ่มที่ 1 (ถ้ามีคนสร้างตัดหน้าก็ incr ต่อ)
+                if not cache.add(key, 1, timeout=None):
+                    cache.incr(key)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0,
+        }
@@ -0,0 +1,458 @@
+# plotcraft/search_index.py
+"""
+index สำหรับช่องค้นหารวม (global_search)
+
+เดิมค้นด้วย __icontains ที่ OR กันหลายสิบช่องข้าม 6 ตาราง -> บน MySQL เป็น LIKE '%...%' ไล่ทุกแถวทุก TextField
+ที่นี่ย่อแต่ละ object เป็น SearchDocument 1 แถว (signals อัปเดตตอน save/delete) แยกข้อความเป็น 3 ช่องตามน้ำหนัก
+- MySQL: MATCH ... AGAINST บน FULLTEXT (ngram parser) คะแนน = ผลรวมคะแนนแต่ละช่อง x FIELD_WEIGHTS
+- DB อื่น (sqlite ตอน dev) หรือคำที่สั้นกว่า ngram: LIKE บนตารางนี้ตารางเดียว ให้คะแนนตามช่องที่เจอคำ
+
+หน้าค้นหา = overview() (จำนวนต่อหมวด + หน้าแรกของทุกหมวด ใน 2 query) cache ต่อผู้ใช้ SEARCH_CACHE_SECONDS
+key ผูกกับ "generation" ของผู้ใช้ (แบบเดียวกับ retrieval_cache.py) แก้ข้อมูลเมื่อไร -> คำค้นเดิมคำนวณใหม่ทันที
+หน้าถัดไปของแต่ละหมวดโหลดทีหลังผ่าน search_page() แบบ keyset (score ที่ปัดเป็นจำนวนเต็ม, id)
+
+mode=semantic: ค้นตามความหมายจาก embedding ใน vector store (ตัวละคร/ฉาก/ตอน) ของผู้ใช้
+mode=hybrid: รวมอันดับจาก lexical + semantic ด้วย reciprocal rank fusion (RRF)
+
+ข้อมูลที่มีอยู่ก่อนเปิดใช้ migration 0010 สร้างแถวให้แล้ว ถ้า index เพี้ยน (แก้ DB ตรงๆ) -> python manage.py search_reindex
+"""
+import logging
+import re
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import BooleanField, Case, Count, F, IntegerField, Q, Value, When, Window
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+from django.urls import reverse
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .chunking import html_to_text
+from .context_assembler import compact
+from .embedding_cache import content_hash
+from .models import Chapter, Character, Item, Location, Novel, Scene, SearchDocument, TimelineEvent
+
+FIELD_WEIGHTS = {'title': 3, 'keywords': 2, 'body': 1}
+# คะแนน MATCH เป็นทศนิยม -> คูณแล้วปัดเป็นจำนวนเต็ม ใช้เรียง/แบ่งหน้าแบบ keyset ได้แม่นยำ
+# (เทียบ float ที่คำนวณใหม่ทุกครั้งกับค่าจาก cursor ตรงๆ ไม่ได้ แถวตรงรอยต่อหน้าจะหายหรือซ้ำ)
+SCORE_SCALE = 1000
+
+# ngram_token_size ของ MySQL (ค่า default) คำที่สั้นกว่านี้ FULLTEXT หาไม่เจอ -> ใช้ LIKE แทน
+NGRAM_SIZE = 2
+MAX_TERMS = 8
+SNIPPET_CHARS = 160
+BATCH_SIZE = 500
+
+# ตัวดำเนินการของ BOOLEAN MODE ที่ไม่ให้ผู้ใช้พิมพ์เข้ามาตรงๆ
+_OPERATORS = re.compile(r'[+\-<>()~*"@]')
+
+logger = logging.getLogger(__name__)
+
+# owner / novel / parent เป็น path แบบ ORM (ใช้ได้ทั้งใน filter และอ่านค่าจาก object)
+Source = namedtuple('Source', ['model', 'label', 'icon', 'url_name', 'owner', 'novel', 'parent', 'title', 'keywords', 'body'])
+
+SOURCES = {
+    'novel': Source(
+        Novel, 'นิยาย', '📚', 'plotcraft:novel_detail', 'author_id', 'id', None,
+        'title', (), ('synopsis',),
+    ),
+    'character': Source(
+        Character, 'ตัวละคร', '👤', 'plotcraft:character_detail', 'created_by_id', 'project_id', None,
+        'name', ('alias', 'role', 'occupation', 'species'),
+        ('appearance', 'personality', 'background', 'goals', 'strengths', 'weaknesses', 'skills', 'notes'),
+    ),
+    'scene': Source(
+        Scene, 'ฉาก', '🎬', 'plotcraft:scene_edit', 'created_by_id', 'project_id', None,
+        'title', ('goal', 'conflict', 'outcome'), ('content',),
+    ),
+    'timeline_event': Source(
+        TimelineEvent, 'เหตุการณ์', '⏳', 'plotcraft:timeline_detail',
+        'timeline__created_by_id', 'timeline__related_project_id', 'timeline_id',
+        'title', ('time_label',), ('description',),
+    ),
+    'location': Source(
+        Location, 'สถานที่', '🗺️', 'plotcraft:location_detail', 'created_by_id', 'project_id', None,
+        'name', ('world_type',),
+        ('terrain', 'climate', 'ecosystem', 'history', 'myths', 'politics', 'economy', 'culture', 'language'),
+    ),
+    'item': Source(
+        Item, 'ไอเท็ม', '🗡️', 'plotcraft:item_detail', 'created_by_id', 'project_id', None,
+        'name', ('category',), ('abilities', 'limitations', 'appearance', 'history'),
+    ),
+}
+ENTITY_TYPES = {source.model: entity_type for entity_type, source in SOURCES.items()}
+
+# ตอนมีแค่ใน vector store (เนื้อหายาว ไม่ได้ลง SearchDocument) -> เจอได้เฉพาะ mode semantic/hybrid
+SEMANTIC_SOURCES = {
+    'chapter': Source(
+        Chapter, 'ตอน', '📖', 'plotcraft:chapter_preview', 'novel__author_id', 'novel_id', None,
+        'title', (), ('content',),
+    ),
+}
+# type ใน metadata ของ vector store -> หมวดในหน้าค้นหา
+VECTOR_TYPES = {'character': 'character', 'scene': 'scene', 'content': 'chapter'}
+
+MODES = ('lexical', 'semantic', 'hybrid')
+
+Hit = namedtuple('Hit', ['entity_type', 'label', 'icon', 'url', 'title', 'snippet', 'score'])
+Category = namedtuple('Category', ['entity_type', 'label', 'icon', 'count', 'hits', 'next_after'])
+
+
+def _value(obj, path):
+    for name in path.split('__'):
+        if obj is None:
+            return None
+        obj = getattr(obj, name)
+    return obj
+
+
+def _text(obj, fields):
+    return "\n".join(filter(None, (html_to_text(str(getattr(obj, field) or "")) for field in fields)))
+
+
+def build_document(entity_type, obj):
+    source = SOURCES[entity_type]
+    return SearchDocument(
+        owner_id=_value(obj, source.owner),
+        entity_type=entity_type,
+        entity_id=obj.pk,
+        novel_id=_value(obj, source.novel),
+        parent_id=_value(obj, source.parent) if source.parent else None,
+        title=str(getattr(obj, source.title) or "")[:255],
+        keywords=_text(obj, source.keywords),
+        body=_text(obj, source.body),
+    )
+
+
+def _upsert(documents):
+    SearchDocument.objects.bulk_create(
+        documents,
+        update_conflicts=True,
+        unique_fields=['entity_type', 'entity_id'],
+        update_fields=['owner', 'novel_id', 'parent_id', 'title', 'keywords', 'body', 'updated_at'],
+    )
+
+
+def owner_of(obj):
+    return _value(obj, SOURCES[ENTITY_TYPES[type(obj)]].owner)
+
+
+def index_object(obj):
+    """ เพิ่ม/อัปเดตแถวของ object นี้ (upsert query เดียว) """
+    document = build_document(ENTITY_TYPES[type(obj)], obj)
+    if document.owner_id is None:
+        return
+    _upsert([document])
+    invalidate(document.owner_id)
+
+
+def remove_object(entity_type, entity_id, owner_id=None):
+    SearchDocument.objects.filter(entity_type=entity_type, entity_id=entity_id).delete()
+    if owner_id:
+        invalidate(owner_id)
+
+
+def remove_objects(entity_type, ids):
+    """ ids = list หรือ subquery ของ pk (ใช้ตอนลบแบบ bulk ที่ไม่ผ่าน signal) """
+    SearchDocument.objects.filter(entity_type=entity_type, entity_id__in=ids).delete()
+
+
+def reindex(owner_id=None, batch_size=BATCH_SIZE):
+    """ สร้างแถวใหม่ทั้งหมด (ของผู้ใช้คนเดียว หรือทุกคน) คืน {entity_type: จำนวน} """
+    counts = {}
+    for entity_type, source in SOURCES.items():
+        objects = source.model.objects.order_by('pk')
+        if source.owner.count('__'):
+            objects = objects.select_related(source.owner.rsplit('__', 1)[0])
+        stale = SearchDocument.objects.filter(entity_type=entity_type)
+        if owner_id is not None:
+            objects = objects.filter(**{source.owner: owner_id})
+            stale = stale.filter(owner_id=owner_id)
+
+        counts[entity_type] = 0
+        with transaction.atomic():
+            stale.delete()
+            batch = []
+            for obj in objects.iterator(chunk_size=batch_size):
+                batch.append(build_document(entity_type, obj))
+                if len(batch) >= batch_size:
+                    SearchDocument.objects.bulk_create(batch)
+                    counts[entity_type] += len(batch)
+                    batch = []
+            if batch:
+                SearchDocument.objects.bulk_create(batch)
+                counts[entity_type] += len(batch)
+    owners = [owner_id] if owner_id is not None else SearchDocument.objects.values_list('owner_id', flat=True).distinct()
+    for owner in owners:
+        invalidate(owner)
+    return counts
+
+
+def _generation_key(owner_id):
+    return f"search_gen:{owner_id}"
+
+
+def invalidate(owner_id):
+    """ ข้อมูลของผู้ใช้เปลี่ยน -> ขยับ generation ผลค้นหาที่ cache ไว้ของคนนี้ใช้ไม่ได้ทันที """
+    key = _generation_key(owner_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def query_terms(query):
+    """ คำค้นที่ตัดตัวดำเนินการ/คำซ้ำออกแล้ว (เว้นวรรค = ต้องเจอทุกคำ) """
+    terms = []
+    for term in _OPERATORS.sub(" ", query or "").split():
+        if term.lower() not in (t.lower() for t in terms):
+            terms.append(term)
+    return terms[:MAX_TERMS]
+
+
+def search(owner_id, query, entity_type=None):
+    """ queryset ของ SearchDocument ที่ตรงกับทุกคำ เรียงตาม score (มากไปน้อย) """
+    terms = query_terms(query)
+    documents = SearchDocument.objects.filter(owner_id=owner_id)
+    if entity_type:
+        documents = documents.filter(entity_type=entity_type)
+    if not terms:
+        return documents.none()
+
+    if connection.vendor == 'mysql' and min(len(term) for term in terms) >= NGRAM_SIZE:
+        against = " ".join(f'+"{term}"' for term in terms)
+        match = "MATCH({}) AGAINST (%s IN BOOLEAN MODE)"
+        score = " + ".join(f"{weight} * {match.format(field)}" for field, weight in FIELD_WEIGHTS.items())
+        score = f"CAST(ROUND(({score}) * {SCORE_SCALE}) AS SIGNED)"
+        documents = documents.filter(
+            RawSQL(match.format("title, keywords, body"), [against], output_field=BooleanField())
+        ).annotate(score=RawSQL(score, [against] * len(FIELD_WEIGHTS), output_field=IntegerField()))
+    else:
+        score = Value(0, output_field=IntegerField())
+        for term in terms:
+            documents = documents.filter(
+                Q(title__icontains=term) | Q(keywords__icontains=term) | Q(body__icontains=term)
+            )
+            for field, weight in FIELD_WEIGHTS.items():
+                score = score + Case(
+                    When(**{f'{field}__icontains': term}, then=Value(weight * SCORE_SCALE)),
+                    default=Value(0), output_field=IntegerField(),
+                )
+        # ชื่อที่ตรงกับคำค้นทั้งคำได้คะแนนเพิ่ม (FULLTEXT ได้ผลแบบนี้อยู่แล้วจากความถี่ของ ngram)
+        exact = Case(When(title__iexact=" ".join(terms), then=Value(1)), default=Value(0), output_field=IntegerField())
+        documents = documents.annotate(score=score + exact * FIELD_WEIGHTS['title'] * SCORE_SCALE)
+    return documents.order_by('-score', '-id')
+
+
+def _cursor(document):
+    return f"{document.score}:{document.pk}"
+
+
+def search_page(owner_id, query, entity_type, after=None, limit=None):
+    """ หน้าถัดไปของหมวดเดียว ต่อจาก cursor "<score (จำนวนเต็ม)>:<id>" ของผลสุดท้ายในหน้าก่อน คืน (hits, next_after)
+        (keyset ไม่ใช้ OFFSET -> หน้าลึกๆ ไม่ต้องไล่คะแนนแถวที่ข้ามไปซ้ำ) """
+    limit = limit or settings.SEARCH_PAGE_SIZE
+    documents = search(owner_id, query, entity_type)
+    if after:
+        score, _, last_id = after.rpartition(':')
+        if not (score.lstrip('-').isdigit() and last_id.isdigit()):
+            raise ValueError(f"cursor ไม่ถูกต้อง: {after}")
+        documents = documents.filter(Q(score__lt=int(score)) | Q(score=int(score), id__lt=int(last_id)))
+    rows = list(documents[:limit + 1])
+    next_after = _cursor(rows[limit - 1]) if len(rows) > limit else None
+    return to_hits(rows[:limit], query), next_after
+
+
+def overview(owner_id, query, mode='lexical', use_cache=True):
+    """ [Category] ทุกหมวดที่เจอ cache ต่อผู้ใช้ + คำค้น + mode SEARCH_CACHE_SECONDS วินาที
+        lexical: จำนวนทั้งหมด + หน้าแรก (GROUP BY 1 query + window function 1 query)
+        semantic/hybrid: ผลรวมไม่เกิน SEARCH_SEMANTIC_CANDIDATES อันดับแรก แสดงครบในหน้าเดียว """
+    terms = query_terms(query)
+    if not terms:
+        return []
+    key = None
+    if use_cache and settings.SEARCH_CACHE_SECONDS > 0:
+        generation = cache.get(_generation_key(owner_id), 0)
+        key = f"search:{owner_id}:{generation}:{mode}:{content_hash(' '.join(terms).lower())}"
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    if mode == 'lexical':
+        categories = _lexical_categories(owner_id, query)
+    else:
+        categories = _fused_categories(owner_id, query, mode)
+    if key:
+        cache.set(key, categories, settings.SEARCH_CACHE_SECONDS)
+    return categories
+
+
+def _lexical_categories(owner_id, query):
+    limit = settings.SEARCH_PAGE_SIZE
+    documents = search(owner_id, query)
+    counts = dict(documents.order_by().values_list('entity_type').annotate(total=Count('id')))
+    first_pages = {}
+    if counts:
+        ranked = documents.annotate(rank=Window(
+            RowNumber(), partition_by=[F('entity_type')], order_by=[F('score').desc(), F('id').desc()],
+        )).filter(rank__lte=limit)
+        for document in ranked:
+            first_pages.setdefault(document.entity_type, []).append(document)
+
+    categories = []
+    for entity_type, source in SOURCES.items():
+        if not counts.get(entity_type):
+            continue
+        rows = first_pages.get(entity_type, [])
+        categories.append(Category(
+            entity_type=entity_type,
+            label=source.label,
+            icon=source.icon,
+            count=counts[entity_type],
+            hits=to_hits(rows, query),
+            next_after=_cursor(rows[-1]) if rows and counts[entity_type] > len(rows) else None,
+        ))
+    return categories
+
+
+def _fused_categories(owner_id, query, mode):
+    limit = settings.SEARCH_SEMANTIC_CANDIDATES
+    rankings = []
+    if mode == 'hybrid':
+        documents = list(search(owner_id, query)[:limit])
+        rankings.append([((d.entity_type, d.entity_id), hit) for d, hit in zip(documents, to_hits(documents, query))])
+    rankings.append(semantic_hits(owner_id, query, limit))
+
+    grouped = {}
+    for (entity_type, _), hit in reciprocal_rank_fusion(rankings):
+        grouped.setdefault(entity_type, []).append(hit)
+    categories = []
+    for entity_type, source in {**SOURCES, **SEMANTIC_SOURCES}.items():
+        hits = grouped.get(entity_type)
+        if hits:
+            categories.append(Category(entity_type, source.label, source.icon, len(hits), hits, None))
+    return categories
+
+
+def reciprocal_rank_fusion(rankings, k=None):
+    """ rankings = [[(key, Hit), ...] ดีสุดก่อน, ...] -> [(key, Hit)] เรียงตามผลรวม 1 / (k + อันดับ)
+        key ที่อยู่หลาย ranking ใช้ Hit จาก ranking แรกที่เจอ (lexical มาก่อน -> snippet ไฮไลต์ตรงคำค้น) """
+    k = k or settings.SEARCH_RRF_K
+    scores = {}
+    hits = {}
+    for ranking in rankings:
+        for rank, (key, hit) in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            hits.setdefault(key, hit)
+    return [(key, hits[key]._replace(score=scores[key])) for key in sorted(scores, key=scores.get, reverse=True)]
+
+
+def semantic_hits(owner_id, query, limit):
+    """ [(key, Hit)] ใกล้สุดก่อน จาก vector store ของผู้ใช้ map กลับเป็นแถวใน DB ด้วย in_bulk ครั้งเดียวต่อประเภท
+        (vector ของแถวที่ลบไปแล้วแต่ worker ยังไม่ได้ลบ -> ไม่เจอใน DB ก็ตัดทิ้ง) """
+    from .rag_service import rag_service
+
+    try:
+        matches = rag_service.semantic_search(query, owner_id, limit)
+    except Exception:
+        # vector store / embedding ล่ม -> หน้าค้นหายังใช้ได้ (hybrid เหลือผลแบบคำตรงตัว)
+        logger.exception("Semantic search error")
+        return []
+
+    ids = {}
+    for doc_type, source_id, _, _ in matches:
+        if doc_type in VECTOR_TYPES:
+            ids.setdefault(VECTOR_TYPES[doc_type], []).append(source_id)
+    rows = {}
+    for entity_type, pks in ids.items():
+        source = _source(entity_type)
+        rows[entity_type] = (
+            source.model.objects.filter(**{source.owner: owner_id}).only('id', source.title).in_bulk(pks)
+        )
+
+    terms = query_terms(query)
+    ranking = []
+    for doc_type, source_id, distance, text in matches:
+        entity_type = VECTOR_TYPES.get(doc_type)
+        obj = rows.get(entity_type, {}).get(source_id)
+        if obj is None:
+            continue
+        source = _source(entity_type)
+        ranking.append(((entity_type, source_id), Hit(
+            entity_type=entity_type,
+            label=source.label,
+            icon=source.icon,
+            url=reverse(source.url_name, args=[source_id]),
+            title=highlight(str(getattr(obj, source.title) or ""), terms),
+            snippet=_vector_snippet(text, terms),
+            score=1.0 / (1.0 + max(distance or 0.0, 0.0)),
+        )))
+    return ranking
+
+
+def _source(entity_type):
+    return SOURCES.get(entity_type) or SEMANTIC_SOURCES[entity_type]
+
+
+def _vector_snippet(text, terms, width=SNIPPET_CHARS):
+    """ ต้นข้อความของ chunk ที่ใกล้ที่สุด (ตัดหัวข้อ [ข้อมูลตัวละคร] / [เนื้อเรื่อง] ตอน: ... ออก) """
+    lines = compact(text).splitlines()
+    if len(lines) > 1 and lines[0].startswith("["):
+        lines = lines[1:]
+    text = " ".join(" ".join(lines).split())
+    suffix = " …" if len(text) > width else ""
+    return mark_safe(f"{highlight(text[:width], terms)}{suffix}")
+
+
+def highlight(text, terms):
+    """ escape ข้อความแล้วครอบคำค้นด้วย <mark> """
+    if not terms:
+        return escape(text)
+    pattern = re.compile("|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+    parts = []
+    last = 0
+    for match in pattern.finditer(text):
+        parts.append(escape(text[last:match.start()]))
+        parts.append(f"<mark>{escape(match.group())}</mark>")
+        last = match.end()
+    parts.append(escape(text[last:]))
+    return mark_safe("".join(parts))
+
+
+def snippet(document, terms, width=SNIPPET_CHARS):
+    """ ข้อความรอบตำแหน่งแรกที่เจอคำค้น (จาก body ก่อน แล้วค่อย keywords) พร้อมไฮไลต์ """
+    for text in (document.body, document.keywords):
+        lowered = text.lower()
+        positions = [p for p in (lowered.find(term.lower()) for term in terms) if p >= 0]
+        if positions:
+            break
+    else:
+        text, positions = document.body or document.keywords, [0]
+
+    start = max(0, min(positions) - width // 3)
+    piece = " ".join(text[start:start + width].split())
+    prefix = "… " if start > 0 else ""
+    suffix = " …" if start + width < len(text) else ""
+    return mark_safe(f"{prefix}{highlight(piece, terms)}{suffix}")
+
+
+def to_hits(documents, query):
+    """ SearchDocument (หน้าที่แสดง) -> Hit พร้อมลิงก์และ snippet """
+    terms = query_terms(query)
+    hits = []
+    for document in documents:
+        source = SOURCES[document.entity_type]
+        hits.append(Hit(
+            entity_type=document.entity_type,
+            label=source.label,
+            icon=source.icon,
+            url=reverse(source.url_name, args=[document.parent_id if source.parent else document.entity_id]),
+            title=highlight(document.title, terms),
+            snippet=snippet(document, terms),
+            score=getattr(document, 'score', 0) / SCORE_SCALE,
+        ))
+    return hits
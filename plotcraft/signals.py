@@ -1,45 +1,147 @@
 # plotcraft/signals.py
-from django.db.models.signals import post_save, post_delete
+# signals แค่ "ฝากงาน" ไว้ในคิว (rag_queue) -> save เสร็จทันที
+# ส่วนการ embed + บันทึกลง ChromaDB ให้ worker (python manage.py rag_worker) ทำ
+# (ยกเว้น search index ของช่องค้นหารวม ซึ่งเป็นแค่ upsert แถวเดียว ทำเลยใน request)
+from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
-from .models import Character, Chapter, Scene # Import Scene เพิ่มเผื่ออนาคต
-from .rag_service import rag_service
+from .models import Character, Chapter, Item, Location, Novel, Scene, SearchDocument, Timeline, TimelineEvent
+from .rag_queue import enqueue_index, enqueue_delete, enqueue_summary, stored_owner
+from . import chapter_stats, excerpts, search_index
+
+# ==================== RAG OWNER (shard ของเจ้าของ) ====================
+OWNER_FIELDS = {Character: 'created_by', Scene: 'created_by', Chapter: 'novel'}
+
+@receiver(pre_save, sender=Character)
+@receiver(pre_save, sender=Scene)
+@receiver(pre_save, sender=Chapter)
+def remember_rag_owner(sender, instance, raw=False, update_fields=None, **kwargs):
+    """ เจ้าของเปลี่ยน (ย้ายตอนไปนิยายของคนอื่น / โอนตัวละคร) -> จำเจ้าของเดิมไว้ให้ worker ลบออกจาก shard เก่า """
+    instance._previous_rag_owner = None
+    if raw or (update_fields is not None and OWNER_FIELDS[sender] not in update_fields):
+        return
+    instance._previous_rag_owner = stored_owner(instance)
+
 
 # ==================== CHARACTER (ตัวละคร) ====================
 @receiver(post_save, sender=Character)
 def update_character_rag(sender, instance, created, **kwargs):
-    rag_service.add_character_to_rag(instance)
-    print(f"🔄 RAG Updated: Character '{instance.name}'")
+    enqueue_index(instance, getattr(instance, '_previous_rag_owner', None))
 
 @receiver(post_delete, sender=Character)
 def delete_character_rag(sender, instance, **kwargs):
-    # ✅ แก้จาก pass เป็นคำสั่งลบจริง
-    # ID ต้องตรงกับตอน add (ดูใน rag_service.py บรรทัดที่ 57)
-    rag_service.delete_data_from_rag(f"char_{instance.id}")
-    print(f"🗑️ RAG Deleted: Character '{instance.name}'")
+    enqueue_delete(instance)
 
 
 # ==================== CHAPTER (เนื้อหาตอน) ====================
 @receiver(post_save, sender=Chapter)
 def update_chapter_rag(sender, instance, created, **kwargs):
-    if instance.content: 
-        rag_service.add_chapter_to_rag(instance)
-        print(f"🔄 RAG Updated: Chapter '{instance.title}'")
+    # ส่งเข้าคิวแม้เนื้อหาว่าง -> worker จะลบ chunk เก่าที่ไม่มีแล้วออกให้
+    enqueue_index(instance, getattr(instance, '_previous_rag_owner', None))
+    enqueue_summary(instance.novel_id)
 
-# ✅ เพิ่มฟังก์ชันลบตอน (ของเดิมไม่มี)
 @receiver(post_delete, sender=Chapter)
 def delete_chapter_rag(sender, instance, **kwargs):
-    rag_service.delete_data_from_rag(f"chap_{instance.id}")
-    print(f"🗑️ RAG Deleted: Chapter '{instance.title}'")
+    enqueue_delete(instance)
+    enqueue_summary(instance.novel_id)
+
+
+# ==================== CHAPTER STATS (chapter_stats.py) ====================
+@receiver(pre_save, sender=Chapter)
+def compute_chapter_stats(sender, instance, raw=False, update_fields=None, **kwargs):
+    """ นับตัวอักษร/คำ/เวลาอ่านใหม่เมื่อ content ถูกบันทึก และย้ายยอดไปนิยายใหม่เมื่อตอนถูกย้ายเรื่อง
+        (save แบบ update_fields ที่ไม่มีทั้ง content และ novel -> ข้าม) """
+    instance._previous_stats = False
+    if raw:
+        return
+    recount = 'content' not in instance.get_deferred_fields() and (update_fields is None or 'content' in update_fields)
+    movable = update_fields is None or not update_fields.isdisjoint(('novel', 'novel_id'))
+    if not (recount or movable):
+        return
+    previous = None
+    if not instance._state.adding:
+        row = Chapter.objects.filter(pk=instance.pk).values_list('novel_id', *chapter_stats.STAT_FIELDS).first()
+        if row:
+            previous = (row[0], chapter_stats.ChapterStats(*row[1:]))
+    if recount:
+        chapter_stats.apply(instance)
+    elif previous is None or previous[0] == instance.novel_id:
+        return
+    else:
+        # ย้ายเรื่องโดยไม่ได้บันทึก content -> สถิติของตอนเท่าเดิม ย้ายยอดตามไปอย่างเดียว
+        for field, value in zip(chapter_stats.STAT_FIELDS, previous[1]):
+            setattr(instance, field, value)
+    instance._previous_stats = previous
+
+@receiver(post_save, sender=Chapter)
+def update_novel_stats(sender, instance, update_fields=None, **kwargs):
+    previous = getattr(instance, '_previous_stats', False)
+    if previous is False:
+        return
+    if update_fields is not None:
+        # save(update_fields=[..., 'content']) ไม่ได้บันทึกคอลัมน์สถิติให้
+        Chapter.objects.filter(pk=instance.pk).update(
+            **dict(zip(chapter_stats.STAT_FIELDS, chapter_stats.stats_of(instance)))
+        )
+    chapter_stats.saved(previous, instance)
+
+@receiver(post_delete, sender=Chapter)
+def delete_novel_stats(sender, instance, **kwargs):
+    chapter_stats.deleted(instance)
+
+# ==================== LIST EXCERPTS (excerpts.py) ====================
+@receiver(pre_save, sender=Novel)
+@receiver(pre_save, sender=Character)
+@receiver(pre_save, sender=Location)
+@receiver(pre_save, sender=Item)
+@receiver(pre_save, sender=Scene)
+def compute_excerpt(sender, instance, raw=False, update_fields=None, **kwargs):
+    """ ตัด excerpt ใหม่จาก field ต้นทาง (ข้ามถ้า field ต้นทางถูก defer หรือไม่อยู่ใน update_fields) """
+    sources = excerpts.sources_of(sender)
+    if raw or instance.get_deferred_fields().intersection(sources):
+        return
+    if update_fields is not None and not update_fields.intersection(sources):
+        return
+    excerpts.apply(instance)
+    if update_fields is not None and 'excerpt' not in update_fields:
+        # save(update_fields=[...]) ไม่ได้บันทึก excerpt ให้
+        sender.objects.filter(pk=instance.pk).update(excerpt=instance.excerpt)
 
 # ==================== SCENE (ฉาก) ====================
 @receiver(post_save, sender=Scene)
 def update_scene_rag(sender, instance, **kwargs):
-    """ เมื่อสร้างหรือแก้ฉาก -> ให้จำข้อมูลฉาก (Goal/Conflict) """
-    rag_service.add_scene_to_rag(instance) 
-    print(f"🔄 RAG Updated: Scene '{instance.title}'")
+    """ เมื่อสร้างหรือแก้ฉาก -> ฝากคิวให้จำข้อมูลฉาก (Goal/Conflict) """
+    enqueue_index(instance, getattr(instance, '_previous_rag_owner', None))
 
 @receiver(post_delete, sender=Scene)
 def delete_scene_rag(sender, instance, **kwargs):
-    """ เมื่อลบฉาก -> ให้ลืม """
-    rag_service.delete_data_from_rag(f"scene_{instance.id}")
-    print(f"🗑️ RAG Deleted: Scene '{instance.title}'")
\ No newline at end of file
+    """ เมื่อลบฉาก -> ฝากคิวให้ลืม """
+    enqueue_delete(instance)
+
+
+# ==================== GLOBAL SEARCH INDEX (search_index.py) ====================
+@receiver(post_save, sender=Novel)
+@receiver(post_save, sender=Character)
+@receiver(post_save, sender=Scene)
+@receiver(post_save, sender=TimelineEvent)
+@receiver(post_save, sender=Location)
+@receiver(post_save, sender=Item)
+def update_search_document(sender, instance, **kwargs):
+    search_index.index_object(instance)
+
+@receiver(post_delete, sender=Novel)
+@receiver(post_delete, sender=Character)
+@receiver(post_delete, sender=Scene)
+@receiver(post_delete, sender=TimelineEvent)
+@receiver(post_delete, sender=Location)
+@receiver(post_delete, sender=Item)
+def delete_search_document(sender, instance, **kwargs):
+    search_index.remove_object(search_index.ENTITY_TYPES[sender], instance.pk, search_index.owner_of(instance))
+
+@receiver(post_save, sender=Timeline)
+def update_timeline_search_documents(sender, instance, **kwargs):
+    """ ย้าย timeline ไปนิยายเรื่องอื่น -> เหตุการณ์ในนั้นย้ายตาม (ไม่ต้อง index ข้อความใหม่) """
+    moved = SearchDocument.objects.filter(entity_type='timeline_event', parent_id=instance.pk).update(
+        novel_id=instance.related_project_id
+    )
+    if moved:
+        search_index.invalidate(instance.created_by_id)
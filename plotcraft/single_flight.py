@@ -0,0 +1,34 @@
+# plotcraft/single_flight.py
+"""
+Single-flight: request ที่มี key เดียวกันและเข้ามาพร้อมกัน (กดซ้ำ, retry) ใช้งานชิ้นเดียวกัน
+
+- ใน process เดียวกัน: คนแรกสร้าง task คนที่ตามมา await task เดิม
+- ข้าม process (หลาย gunicorn worker): ใช้ cache.add() เป็น lock (ดู RAGService.agenerate_scene_draft)
+- task ถูก shield ไว้ -> client คนแรกปิดหน้าไป งานก็ยังเสร็จและคนอื่นยังได้ผล
+"""
+import asyncio
+
+
+class SingleFlight:
+    def __init__(self):
+        self._tasks = {}
+
+    async def run(self, key, coro_factory):
+        """ คืนผลของ coro_factory() โดยมีงานจริงแค่ชิ้นเดียวต่อ key ที่กำลังทำอยู่ """
+        # แยกตาม event loop: ถ้ารันแบบ WSGI แต่ละ request มี loop ของตัวเอง await task ข้าม loop ไม่ได้
+        flight_key = (id(asyncio.get_running_loop()), key)
+        task = self._tasks.get(flight_key)
+        if task is None:
+            task = asyncio.ensure_future(coro_factory())
+            self._tasks[flight_key] = task
+            task.add_done_callback(lambda t: self._done(flight_key, t))
+        return await asyncio.shield(task)
+
+    def in_flight(self):
+        return len(self._tasks)
+
+    def _done(self, flight_key, task):
+        if self._tasks.get(flight_key) is task:
+            del self._tasks[flight_key]
+        if not task.cancelled():
+            task.exception()  # กัน warning "exception was never retrieved" ถ้าทุกคนที่รออยู่หลุดไปหมดแล้ว
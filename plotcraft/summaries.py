@@ -0,0 +1,136 @@
+# plotcraft/summaries.py
+"""
+สรุปเรื่องแบบเป็นชั้น สำหรับให้ AI รู้ "เรื่องราวที่ผ่านมา" โดยไม่ต้องส่งเนื้อหาดิบทั้งเรื่อง
+
+- ChapterSummary: สรุปสั้นต่อตอน เรียก LLM ใหม่เฉพาะตอนที่ content_hash เปลี่ยน
+- NovelSummary: เรื่องย่อสะสม รวมสรุปตอนเข้าไปทีละช่วง (ช่วงละไม่เกิน RAG_SUMMARY_FOLD_CHAPTERS ตอน)
+  เก็บผลหลังรวมแต่ละช่วงไว้ -> เพิ่มตอนใหม่/แก้ตอนล่าสุด = เรียก LLM ครั้งเดียว
+  แก้ตอนกลางเรื่อง = รวมใหม่ตั้งแต่ช่วงนั้น ส่วนช่วงก่อนหน้าไม่ต้องทำใหม่
+
+worker เรียกผ่านงาน 'novel_summary' ในคิว (ดู rag_queue.py) ซึ่ง debounce นานกว่างาน index
+เพราะแต่ละรอบต้องเรียก LLM
+"""
+from django.conf import settings
+
+from .chunking import html_to_text
+from .embedding_cache import content_hash
+from .models import Chapter, ChapterSummary, NovelSummary
+
+CHAPTER_SUMMARY_WORDS = 120
+NOVEL_SUMMARY_WORDS = 350
+
+
+class StorySummarizer:
+    def __init__(self, llm, model_name):
+        self.llm = llm
+        self.model_name = model_name
+        self.calls = 0
+
+    def refresh(self, novel):
+        """ อัปเดตสรุปตอนที่เปลี่ยน แล้วรวมเรื่องย่อใหม่เฉพาะช่วงที่ได้รับผลกระทบ คืนค่าสถิติ """
+        chapters = list(
+            Chapter.objects.filter(novel=novel)
+            .only('id', 'title', 'order', 'updated_at')
+            .order_by('order', 'created_at')
+        )
+        summaries = self.refresh_chapters(chapters)
+        changed_steps = self.refresh_novel(novel, chapters, summaries)
+        return {'chapters': len(chapters), 'llm_calls': self.calls, 'refolded_steps': changed_steps}
+
+    def refresh_chapters(self, chapters):
+        """ คืน {chapter_id: ChapterSummary} ของทุกตอน (สร้าง/แก้เฉพาะตอนที่เนื้อหาเปลี่ยน) """
+        summaries = ChapterSummary.objects.in_bulk([c.pk for c in chapters], field_name='chapter_id')
+        # updated_at ไม่เปลี่ยน -> เนื้อหาไม่เปลี่ยน ไม่ต้องโหลด content มา hash ด้วยซ้ำ
+        stale = [
+            c for c in chapters
+            if c.pk not in summaries
+            or summaries[c.pk].chapter_updated_at != c.updated_at
+            or summaries[c.pk].model_name != self.model_name
+        ]
+        contents = dict(Chapter.objects.filter(pk__in=[c.pk for c in stale]).values_list('pk', 'content'))
+
+        for chapter in stale:
+            text = html_to_text(contents.get(chapter.pk, ''))
+            digest = content_hash(text)
+            summary = summaries.get(chapter.pk) or ChapterSummary(chapter=chapter)
+            if summary.content_hash != digest or summary.model_name != self.model_name:
+                # บันทึกทีละตอน: ถ้า worker ตายกลางทาง รอบหน้าไม่ต้องสรุปตอนที่ทำไปแล้วซ้ำ
+                summary.summary = self.summarize_chapter(chapter, text) if text else ""
+                summary.content_hash = digest
+                summary.model_name = self.model_name
+            summary.chapter_updated_at = chapter.updated_at
+            summary.save()
+            summaries[chapter.pk] = summary
+        return summaries
+
+    def refresh_novel(self, novel, chapters, summaries):
+        """ รวมเรื่องย่อใหม่ตั้งแต่ช่วงแรกที่ไม่ตรงกับลำดับตอน/สรุปปัจจุบัน คืนจำนวนช่วงที่ทำใหม่ """
+        story = NovelSummary.objects.filter(novel=novel).first() or NovelSummary(novel=novel)
+        steps = story.steps if story.model_name == self.model_name else []
+
+        sequence = [
+            [chapter.pk, summaries[chapter.pk].content_hash]
+            for chapter in chapters
+            if summaries[chapter.pk].summary
+        ]
+        kept = []
+        position = 0
+        for step in steps:
+            size = len(step['chapters'])
+            if sequence[position:position + size] != step['chapters']:
+                break
+            kept.append(step)
+            position += size
+
+        if len(kept) == len(steps) and position == len(sequence) and story.pk:
+            return 0
+        if kept and position < len(sequence) and len(kept[-1]['chapters']) < self.fold_size:
+            # ช่วงสุดท้ายยังไม่เต็ม -> รวมตอนใหม่เข้าช่วงเดิม (เรียก LLM เท่ากัน แต่จำนวนช่วงไม่งอกทีละตอน)
+            position -= len(kept.pop()['chapters'])
+
+        by_id = {chapter.pk: chapter for chapter in chapters}
+        rest = sequence[position:]
+        story.model_name = self.model_name
+        story.steps = kept
+        story.summary = kept[-1]['summary'] if kept else ""
+        for start in range(0, len(rest), self.fold_size):
+            group = rest[start:start + self.fold_size]
+            story.summary = self.fold(story.summary, [(by_id[pk], summaries[pk].summary) for pk, _ in group])
+            story.steps.append({'chapters': group, 'summary': story.summary})
+            story.save()
+        if not rest:
+            story.save()
+        return -(-len(rest) // self.fold_size)
+
+    @property
+    def fold_size(self):
+        return max(1, settings.RAG_SUMMARY_FOLD_CHAPTERS)
+
+    def summarize_chapter(self, chapter, text):
+        return self._invoke(f"""
+            สรุปเนื้อหาตอน "{chapter.title}" ของนิยายเรื่องนี้ให้สั้นที่สุด ไม่เกิน {CHAPTER_SUMMARY_WORDS} คำ
+            เน้นเหตุการณ์สำคัญ การเปลี่ยนแปลงของตัวละคร และปมที่ยังค้างอยู่ ไม่ต้องวิจารณ์ ไม่ต้องใช้ Markdown
+
+            เนื้อหา:
+            {text}
+            """)
+
+    def fold(self, summary, chapter_summaries):
+        new_chapters = "\n".join(
+            f"ตอนที่ {chapter.order} {chapter.title}: {text}" for chapter, text in chapter_summaries
+        )
+        return self._invoke(f"""
+            นี่คือเรื่องย่อของนิยายจนถึงตอนก่อนหน้า และสรุปของตอนถัดมา
+            เขียนเรื่องย่อรวมใหม่ตั้งแต่ต้นจนถึงตอนล่าสุด ไม่เกิน {NOVEL_SUMMARY_WORDS} คำ
+            ให้เหตุการณ์ล่าสุดละเอียดกว่าเหตุการณ์ช่วงต้น และคงชื่อตัวละคร/ปมที่ยังไม่คลี่คลายไว้ ไม่ต้องใช้ Markdown
+
+            เรื่องย่อเดิม:
+            {summary or "(ยังไม่มี เป็นช่วงแรกของเรื่อง)"}
+
+            ตอนถัดมา:
+            {new_chapters}
+            """)
+
+    def _invoke(self, prompt):
+        self.calls += 1
+        return str(self.llm.invoke(prompt)).strip()
@@ -1,3 +1,2134 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.template.defaultfilters import truncatechars
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.functional import empty
+
+from . import bulk_delete, chapter_stats, rag_queue, search_index
+from . import rag_service as rag_service_module
+from .chat_sessions import compact_session, history_text, list_sessions, open_session, record_turn
+from .chunking import chunk_text
+from .context_assembler import assemble_context, estimate_tokens, parse_quotas, truncate_tokens
+from .embedding_cache import EmbeddingCache
+from .embedding_server import EmbeddingBatcher, create_server
+from .embeddings import EMBEDDING_MODEL_NAME, EmbeddingPool, RemoteEmbeddings, embedding_model_id, load_embeddings, onnx_model_file
+from .excerpts import EXCERPT_LENGTH
+from .llm_gateway import CircuitBreaker, LLMGateway, LLMUnavailable
+from .models import (
+    Chapter, ChapterSummary, Character, ChatSession, ChatTurn, EmbeddingCacheEntry, Item, Location, Novel, NovelSummary, RagIndexJob,
+    Scene, SearchDocument, Timeline, TimelineEvent, User,
+)
+from .rag_reconcile import Reconciler
+from .rag_reindex import Checkpoint, Reindexer
+from .rag_service import RAGService
+from .retrieval_cache import RetrievalCache
+from .single_flight import SingleFlight
+from .summaries import StorySummarizer
+from .vector_store import FlatVectorStore, matches
+
+# ข้อความยาวๆ แทนต้นฉบับทั้งเรื่อง (ถ้าหน้า list ดึงคอลัมน์เหล่านี้มา query จะใหญ่ทันที)
+MANUSCRIPT = "กาลครั้งหนึ่งนานมาแล้ว " * 2000
+
+# คอลัมน์ใหญ่ที่หน้า list ห้าม SELECT (table -> columns)
+HEAVY_COLUMNS = {
+    'plotcraft_novel': ('synopsis',),
+    'plotcraft_character': ('background', 'personality', 'appearance', 'goals', 'notes'),
+    'plotcraft_location': ('terrain', 'history', 'culture'),
+    'plotcraft_item': ('abilities', 'appearance', 'history'),
+    'plotcraft_scene': ('content', 'outcome'),
+}
+
+
+class ExcerptTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('writer', password='pw')
+
+    def test_excerpt_is_plain_text_and_truncated(self):
+        novel = Novel.objects.create(author=self.user, title="เรื่องยาว", synopsis=f"<p>{MANUSCRIPT}</p>")
+        self.assertEqual(len(novel.excerpt), EXCERPT_LENGTH)
+        self.assertTrue(novel.excerpt.endswith('…'))
+        self.assertNotIn('<p>', novel.excerpt)
+        self.assertNotIn('  ', novel.excerpt)
+
+    def test_excerpt_falls_back_to_next_source(self):
+        character = Character.objects.create(created_by=self.user, name="อลิซ", background="  ", personality="ขี้สงสัย")
+        self.assertEqual(character.excerpt, "ขี้สงสัย")
+
+    def test_excerpt_follows_edits(self):
+        item = Item.objects.create(created_by=self.user, name="ดาบ", abilities="ตัดเหล็ก")
+        item.abilities = "ตัดได้ทุกอย่าง"
+        item.save(update_fields=['abilities'])
+        self.assertEqual(Item.objects.get(pk=item.pk).excerpt, "ตัดได้ทุกอย่าง")
+
+        Item.objects.filter(pk=item.pk).update(abilities="แก้ตรงๆ ใน DB")
+        item = Item.objects.only('id', 'name').get(pk=item.pk)
+        item.name = "ดาบเก่า"
+        item.save(update_fields=['name'])
+        self.assertEqual(Item.objects.get(pk=item.pk).excerpt, "ตัดได้ทุกอย่าง")
+
+
+class ListProjectionTests(TestCase):
+    """ หน้า list/dashboard ต้องไม่ SELECT คอลัมน์ใหญ่ และจำนวน query ต้องไม่โตตามจำนวนแถว """
+
+    def setUp(self):
+        self.user = User.objects.create_user('writer', password='pw')
+        self.client.force_login(self.user)
+
+    def add_rows(self, count):
+        for i in range(count):
+            novel = Novel.objects.create(author=self.user, title=f"นิยาย {i}", synopsis=MANUSCRIPT)
+            character = Character.objects.create(
+                created_by=self.user, project=novel, name=f"ตัวละคร {i}", background=MANUSCRIPT, notes=MANUSCRIPT
+            )
+            location = Location.objects.create(
+                created_by=self.user, project=novel, name=f"สถานที่ {i}", terrain=MANUSCRIPT, history=MANUSCRIPT
+            )
+            Item.objects.create(
+                created_by=self.user, project=novel, owner=character, location=location,
+                name=f"ไอเทม {i}", abilities=MANUSCRIPT,
+            )
+            Scene.objects.create(
+                created_by=self.user, project=novel, pov_character=character, location=location,
+                title=f"ฉาก {i}", goal=MANUSCRIPT, conflict=MANUSCRIPT, content=MANUSCRIPT,
+            )
+
+    def capture(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, [query['sql'] for query in queries.captured_queries]
+
+    def assert_light(self, url):
+        self.add_rows(2)
+        _, small = self.capture(url)
+        self.add_rows(3)
+        response, large = self.capture(url)
+
+        self.assertEqual(len(small), len(large), f"{url}: จำนวน query โตตามจำนวนแถว (N+1)")
+        for sql in large:
+            for table, columns in HEAVY_COLUMNS.items():
+                for column in columns:
+                    self.assertNotIn(f'"{table}"."{column}"', sql, f"{url} SELECT {table}.{column}")
+        self.assertLess(len(response.content), len(MANUSCRIPT.encode()), f"{url}: หน้า list มีเนื้อหาทั้งก้อน")
+        return response
+
+    def test_home(self):
+        response = self.assert_light(reverse('plotcraft:home'))
+        self.assertContains(response, "กาลครั้งหนึ่ง")
+
+    def test_novel_list(self):
+        self.assert_light(reverse('plotcraft:novel_list'))
+
+    def test_character_list(self):
+        self.assert_light(reverse('plotcraft:character_list'))
+
+    def test_location_list(self):
+        response = self.assert_light(reverse('plotcraft:location_list'))
+        self.assertContains(response, "นิยาย 0")
+
+    def test_item_list(self):
+        response = self.assert_light(reverse('plotcraft:item_list'))
+        self.assertContains(response, "ตัวละคร 0")
+
+    def test_scene_list(self):
+        response = self.assert_light(reverse('plotcraft:scene_list'))
+        self.assertContains(response, "POV: ตัวละคร 0")
+        self.assertContains(response, truncatechars(MANUSCRIPT, 80))
+
+
+# ==================== RAG: คิวงาน index (rag_queue.py) ====================
+
+class FakeEmbeddings:
+    """ แทน sentence-transformers: vector จาก hash ของข้อความ + นับจำนวนข้อความที่ถูก embed จริง """
+
+    def __init__(self):
+        self.embedded = []
+
+    def _vector(self, text):
+        digest = hashlib.sha256(text.encode()).digest()
+        return [byte / 255 for byte in digest[:8]]
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+
+class RAGTestCase(TestCase):
+    """ RAGService จริงบน flat vector store ในโฟลเดอร์ชั่วคราว (แยก shard ตาม user) + FakeEmbeddings """
+
+    def setUp(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        overrides = override_settings(RAG_VECTOR_STORE='flat', RAG_VECTOR_STORE_PATH=path, RAG_SHARDING='user')
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.service = RAGService()
+        self.embeddings = self.service._embeddings = FakeEmbeddings()
+        self.user = User.objects.create_user('writer', password='pw')
+
+    def use_llm(self, llm):
+        """ แทน Gemini ด้วย llm ปลอม (ไม่ผ่าน LLMGateway) """
+        self.service._llm = llm
+        self.service._llm_loaded = True
+        return llm
+
+    def install_service(self):
+        """ ให้ view / worker ที่ใช้ rag_service (SimpleLazyObject ระดับ module) ใช้ self.service """
+        saved = rag_service_module._service, rag_service_module.rag_service._wrapped
+        rag_service_module._service = self.service
+        rag_service_module.rag_service._wrapped = empty
+
+        def restore():
+            rag_service_module._service, rag_service_module.rag_service._wrapped = saved
+        self.addCleanup(restore)
+
+    def documents(self, owner_id, **where):
+        store = self.service.store_for(owner_id)
+        if not where:
+            return store.get(include=["metadatas"])["ids"]
+        return store.get(where=where, include=["metadatas"])["ids"]
+
+    def chapter_with(self, novel, content, **fields):
+        """ ตอนที่มีเนื้อหา โดยไม่ผ่านการนับคำตอน save (ไม่ต้องมี pythainlp ในเทสต์นี้) """
+        chapter = Chapter.objects.create(novel=novel, **fields)
+        Chapter.objects.filter(pk=chapter.pk).update(content=content)
+        return Chapter.objects.select_related('novel__author').get(pk=chapter.pk)
+
+
+class FailingService:
+    """ service ที่ embed ไม่ได้เสมอ (เช่น embedding server ล่ม) """
+    embedding_cache = FakeEmbeddings()
+    embedding_cache.stats = dict
+
+    def source_for(self, doc_type, obj):
+        return doc_type, obj.pk, None, []
+
+    def sync_sources(self, sources, moved_from=None):
+        raise ConnectionError("embedding server ไม่ตอบ")
+
+    def add_character_to_rag(self, char):
+        self.sync_sources([])
+
+
+class RagQueueTests(RAGTestCase):
+    """ save ซ้ำรวมเป็นงานเดียว (debounce) และงานที่พังถูก retry แบบ backoff จนเลิกเมื่อครบ MAX_ATTEMPTS """
+
+    def job_of(self, instance):
+        return RagIndexJob.objects.get(entity_type=rag_queue.entity_type_for(instance), entity_id=instance.pk)
+
+    @override_settings(RAG_QUEUE_DEBOUNCE_SECONDS=0)
+    def test_worker_indexes_latest_version_once(self):
+        character = Character.objects.create(created_by=self.user, name="อลิซ", personality="ขี้สงสัย")
+        character.personality = "กล้าหาญ"
+        character.save()
+
+        self.assertEqual(rag_queue.process_batch(self.service), 1)
+        self.assertFalse(RagIndexJob.objects.filter(entity_type='character').exists())
+        self.assertEqual(len(self.embeddings.embedded), 1)
+        self.assertIn("กล้าหาญ", self.embeddings.embedded[0])
+        self.assertEqual(self.documents(self.user.pk, type='character'), [f"char_{character.pk}"])
+        self.assertEqual(rag_queue.queue_metrics()['coalesced'], 1)
+
+    @override_settings(RAG_QUEUE_DEBOUNCE_SECONDS=0, RAG_QUEUE_MAX_ATTEMPTS=2)
+    def test_failed_job_is_retried_with_backoff_then_gives_up(self):
+        character = Character.objects.create(created_by=self.user, name="อลิซ")
+
+        with self.assertLogs('plotcraft.rag_queue', 'ERROR'):
+            rag_queue.process_batch(FailingService())
+        job = self.job_of(character)
+        self.assertEqual(job.status, RagIndexJob.STATUS_PENDING)
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNone(job.locked_until)
+        self.assertIn("ConnectionError", job.last_error)
+        self.assertGreater(job.available_at, timezone.now())
+        self.assertEqual(rag_queue.process_batch(FailingService()), 0)
+
+        RagIndexJob.objects.filter(pk=job.pk).update(available_at=timezone.now())
+        with self.assertLogs('plotcraft.rag_queue', 'ERROR'):
+            rag_queue.process_batch(FailingService())
+        job = self.job_of(character)
+        self.assertEqual(job.status, RagIndexJob.STATUS_FAILED)
+        self.assertEqual(job.attempts, 2)
+
+        # แก้ข้อมูลใหม่ -> งานที่เลิกไปแล้วกลับมารอทำ นับ attempts ใหม่
+        character.save()
+        job = self.job_of(character)
+        self.assertEqual((job.status, job.attempts), (RagIndexJob.STATUS_PENDING, 0))
+
+    @override_settings(RAG_QUEUE_RETRY_BASE_SECONDS=5, RAG_QUEUE_RETRY_MAX_SECONDS=60)
+    def test_retry_delay_grows_and_is_capped(self):
+        for attempts, full in ((1, 5), (2, 10), (3, 20), (4, 40), (5, 60), (10, 60)):
+            delay = rag_queue.retry_delay(attempts)
+            self.assertGreaterEqual(delay, full * 0.5)
+            self.assertLessEqual(delay, full)
+
+
+# ==================== Embedding cache (embedding_cache.py) ====================
+
+class EmbeddingCacheTests(TestCase):
+    """ ข้อความเดิมไม่เข้า model ซ้ำ (ทั้งจาก LRU และจากตาราง) และตารางถูกจำกัดขนาดด้วยการไล่แถวที่ไม่ได้ใช้นานสุด """
+
+    def setUp(self):
+        self.model = FakeEmbeddings()
+
+    def test_hits_come_from_memory_then_table(self):
+        cache = EmbeddingCache('minilm')
+        first = cache.embed_documents(["ฝนตก", "แดดออก", "ฝนตก"], self.model.embed_documents)
+        self.assertEqual(self.model.embedded, ["ฝนตก", "แดดออก"])
+        self.assertEqual(first[0], first[2])
+        self.assertEqual(EmbeddingCacheEntry.objects.count(), 2)
+
+        # ช่องว่าง/ขึ้นบรรทัดต่างกันถือเป็นข้อความเดียวกัน
+        cache.embed_documents(["  ฝนตก\n"], self.model.embed_documents)
+        self.assertEqual(len(self.model.embedded), 2)
+        self.assertEqual(cache.stats()['hits'], 2)
+
+        # process ใหม่ (LRU ว่าง) -> อ่านจากตาราง ไม่เข้า model
+        fresh = EmbeddingCache('minilm')
+        with self.assertNumQueries(2):
+            vectors = fresh.embed_documents(["แดดออก"], self.model.embed_documents)
+        self.assertEqual(len(self.model.embedded), 2)
+        for stored, original in zip(vectors[0], first[1]):
+            self.assertAlmostEqual(stored, original, places=6)
+
+    def test_model_name_is_part_of_the_key(self):
+        EmbeddingCache('minilm').embed_documents(["ฝนตก"], self.model.embed_documents)
+        EmbeddingCache('minilm@onnx-int8').embed_documents(["ฝนตก"], self.model.embed_documents)
+        self.assertEqual(len(self.model.embedded), 2)
+
+    def test_query_cache_stays_in_memory(self):
+        cache = EmbeddingCache('minilm', memory_entries=2)
+        for text in ("หนึ่ง", "สอง", "สาม", "หนึ่ง"):
+            cache.embed_query(text, self.model.embed_query, persist=False)
+        self.assertFalse(EmbeddingCacheEntry.objects.exists())
+        # LRU จุได้ 2 -> "หนึ่ง" ถูกไล่ออกไปแล้ว ต้อง embed ใหม่
+        self.assertEqual(cache.stats()['misses'], 4)
+        self.assertEqual(cache.stats()['memory_entries'], 2)
+
+    def test_evicts_least_recently_used(self):
+        cache = EmbeddingCache('minilm', max_entries=3)
+        cache.embed_documents([f"ข้อความ {i}" for i in range(5)], self.model.embed_documents)
+        EmbeddingCacheEntry.objects.update(last_used_at=timezone.now() - timedelta(days=1))
+        EmbeddingCache('minilm').embed_documents(["ข้อความ 0", "ข้อความ 1"], self.model.embed_documents)
+
+        self.assertEqual(cache.evict(), 2)
+        kept = EmbeddingCache('minilm')
+        kept.embed_documents(["ข้อความ 0", "ข้อความ 1"], self.model.embed_documents)
+        self.assertEqual(kept.stats()['hits'], 2)
+        self.assertEqual(EmbeddingCacheEntry.objects.count(), 3)
+        self.assertEqual(cache.evict(), 0)
+
+
+class IdempotentUpsertTests(RAGTestCase):
+    """ index ซ้ำโดยไม่มีอะไรเปลี่ยน -> ไม่ embed ไม่เขียน; เปลี่ยนแค่ metadata -> update อย่างเดียว """
+
+    def test_reindexing_unchanged_character_does_nothing(self):
+        character = Character.objects.create(created_by=self.user, name="อลิซ", personality="ขี้สงสัย")
+        self.service.add_character_to_rag(character)
+        self.service.add_character_to_rag(character)
+        self.assertEqual(len(self.embeddings.embedded), 1)
+        self.assertEqual(self.service.sync_sources([self.service.source_for('character', character)])['unchanged'], 1)
+
+        novel = Novel.objects.create(author=self.user, title="เรื่องใหม่")
+        character.project = novel
+        stats = self.service.sync_sources([self.service.source_for('character', character)])
+        self.assertEqual((stats['embedded'], stats['updated']), (0, 1))
+        self.assertEqual(len(self.documents(self.user.pk, novel_id=str(novel.pk))), 1)
+
+
+# ==================== Chunk ของตอน (chunking.py) ====================
+
+class ChunkingTests(RAGTestCase):
+    """ chunk ไม่เกิน max_chars (รวม overlap) ตัดที่ขอบย่อหน้า และแก้ย่อหน้าเดียว -> embed ใหม่แค่ chunk นั้น """
+
+    PARAGRAPHS = [f"ย่อหน้าที่ {i} " + "ฝนตกหนักทั้งคืน " * 15 for i in range(4)]
+
+    def test_chunks_fit_max_chars_including_overlap(self):
+        text = "\n".join(self.PARAGRAPHS + ["ประโยคยาวไม่มีช่องว่างเลย" * 60])
+        chunks = chunk_text(text, max_chars=400, overlap=80, min_chars=200)
+
+        self.assertGreater(len(chunks), len(self.PARAGRAPHS))
+        self.assertEqual([chunk.index for chunk in chunks], list(range(len(chunks))))
+        for chunk in chunks:
+            self.assertLessEqual(len(chunk.text), 400)
+        for chunk, paragraph in zip(chunks, self.PARAGRAPHS):
+            # ย่อหน้ายาวพอ -> chunk จบที่ขอบย่อหน้าพอดี
+            self.assertTrue(chunk.text.endswith(paragraph.strip()))
+            self.assertEqual(text[chunk.start:chunk.start + len(paragraph)], paragraph)
+        # chunk ถัดไปขึ้นต้นด้วยท้ายของ chunk ก่อน (overlap)
+        self.assertIn(chunks[1].text[:40], self.PARAGRAPHS[0])
+
+    def test_short_paragraphs_are_grouped(self):
+        chunks = chunk_text("บทนำ\nสั้น\nมาก", max_chars=400, overlap=80, min_chars=200)
+        self.assertEqual([chunk.text for chunk in chunks], ["บทนำ\nสั้น\nมาก"])
+        self.assertEqual(chunk_text("", max_chars=400, overlap=80), [])
+
+    def test_overlap_must_leave_room(self):
+        with self.assertRaises(ValueError):
+            chunk_text("ข้อความ", max_chars=80, overlap=80)
+
+    def test_editing_one_paragraph_reembeds_only_its_chunk(self):
+        novel = Novel.objects.create(author=self.user, title="ฝนพรำ")
+        chapter = self.chapter_with(novel, "\n".join(self.PARAGRAPHS), title="ตอนที่ 1")
+        stats = self.service.sync_sources([self.service.source_for('content', chapter)])
+        self.assertEqual((stats['embedded'], stats['removed']), (4, 0))
+        before = set(self.documents(self.user.pk, type='content'))
+
+        # แก้ประโยคสุดท้ายของ chunk กลางเรื่อง (ส่วนที่ chunk ถัดไปยืมไปเป็น overlap) ความยาวเท่าเดิม
+        head, _, tail = self.PARAGRAPHS[1].rpartition("ฝนตกหนักทั้งคืน")
+        edited = list(self.PARAGRAPHS)
+        edited[1] = f"{head}ลมพัดแรงทั้งวัน{tail}"
+        self.assertEqual(len(edited[1]), len(self.PARAGRAPHS[1]))
+        Chapter.objects.filter(pk=chapter.pk).update(content="\n".join(edited))
+        chapter.refresh_from_db()
+        self.embeddings.embedded.clear()
+        stats = self.service.sync_sources([self.service.source_for('content', chapter)])
+
+        self.assertEqual(stats, {'documents': 4, 'embedded': 1, 'updated': 0, 'removed': 1, 'unchanged': 3})
+        self.assertEqual(len(self.embeddings.embedded), 1)
+        self.assertIn("ย่อหน้าที่ 1", self.embeddings.embedded[0])
+        self.assertIn("ลมพัดแรงทั้งวัน", self.embeddings.embedded[0])
+        after = set(self.documents(self.user.pk, type='content'))
+        self.assertEqual(len(before & after), 3)
+
+        # chunk ต่อไปก็ยังหาเจอด้วย id เดิม (id ไม่รวม overlap) แม้ overlap ของมันจะเปลี่ยนไปแล้ว
+        chunks = chunk_text("\n".join(edited), max_chars=400, overlap=80, min_chars=200)
+        self.assertIn("ลมพัดแรงทั้งวัน", chunks[2].text)
+        self.assertNotIn("ลมพัดแรงทั้งวัน", chunks[2].body)
+
+    def test_reordering_chapter_updates_metadata_without_embedding(self):
+        novel = Novel.objects.create(author=self.user, title="ฝนพรำ")
+        chapter = self.chapter_with(novel, "\n".join(self.PARAGRAPHS), title="ตอนที่ 1")
+        self.service.sync_sources([self.service.source_for('content', chapter)])
+        self.embeddings.embedded.clear()
+
+        chapter.order = 5
+        stats = self.service.sync_sources([self.service.source_for('content', chapter)])
+        self.assertEqual((stats['embedded'], stats['updated']), (0, 4))
+        self.assertEqual(self.embeddings.embedded, [])
+
+
+# ==================== โหลด RAGService แบบ lazy (rag_service.py) ====================
+
+# library หนักๆ ที่ต้องไม่ถูก import แค่เพราะ import app / สร้าง RAGService
+HEAVY_MODULES = ('torch', 'sentence_transformers', 'langchain_huggingface', 'chromadb', 'onnxruntime')
+
+
+class LazyServiceTests(RAGTestCase):
+    """ import app / สร้าง service / readiness ต้องไม่โหลด model และหลัง fork ต้องเปิด connection ใหม่ """
+
+    def test_import_does_not_load_heavy_modules(self):
+        script = (
+            "import sys, django; django.setup()\n"
+            "from plotcraft import views, rag_service\n"
+            "rag_service.RAGService()\n"
+            f"print('loaded:', *(m for m in {HEAVY_MODULES!r} if m in sys.modules))\n"
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', script], capture_output=True, text=True, env=os.environ.copy(), check=True,
+        )
+        self.assertEqual(result.stdout.strip().splitlines()[-1], "loaded:")
+
+    def test_construction_and_readiness_load_nothing(self):
+        service = RAGService()
+        self.assertIsNone(service._embeddings)
+        self.assertIsNone(service._vector_client)
+
+        status = service.readiness()
+        self.assertEqual(
+            status,
+            {'ready': True, 'embeddings_loaded': False, 'vector_store': True, 'llm_configured': bool(service.api_key)},
+        )
+        self.assertIsNone(service._embeddings)
+        with override_settings(RAG_PRELOAD_MODEL=True):
+            self.assertFalse(service.readiness()['ready'])
+
+    def test_service_is_built_once_on_first_use(self):
+        self.install_service()
+        rag_service_module._service = None
+        self.assertIs(rag_service_module.rag_service._wrapped, empty)
+        first = rag_service_module.get_rag_service()
+        self.assertIs(rag_service_module.get_rag_service(), first)
+        self.assertIs(rag_service_module.rag_service.embedding_cache, first.embedding_cache)
+
+    def test_after_fork_reopens_connections_but_keeps_model(self):
+        self.install_service()
+        store = self.service.store_for(self.user.pk)
+        self.assertIsNotNone(self.service._vector_client)
+
+        rag_service_module.after_fork()
+        self.assertIsNone(self.service._vector_client)
+        self.assertEqual(self.service._shards, {})
+        self.assertIs(self.service._embeddings, self.embeddings)
+        self.assertIsNot(self.service.store_for(self.user.pk), store)
+
+    def test_ready_endpoint_exposes_only_flags(self):
+        self.install_service()
+        response = self.client.get(reverse('plotcraft:rag_ready'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()), {'ready', 'embeddings_loaded', 'vector_store', 'llm_configured'})
+        self.assertTrue(all(isinstance(value, bool) for value in response.json().values()))
+
+        self.assertEqual(self.client.get(reverse('plotcraft:rag_metrics')).status_code, 302)
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+        self.assertEqual(set(self.client.get(reverse('plotcraft:rag_metrics')).json()), {'llm', 'caches', 'queue'})
+
+
+# ==================== Embedding server (embedding_server.py) ====================
+
+class EmbeddingServerTests(SimpleTestCase):
+    """ request ที่มาพร้อมกันรวมเป็น batch เดียว (ไม่เกิน max_batch) และ client คุยกับ server ผ่าน unix socket ได้ """
+
+    def setUp(self):
+        self.model = FakeEmbeddings()
+        self.calls = []
+
+    def embed(self, texts):
+        self.calls.append(list(texts))
+        return self.model.embed_documents(texts)
+
+    def test_concurrent_requests_share_one_batch(self):
+        batcher = EmbeddingBatcher(self.embed, max_batch=64, window_ms=200)
+        futures = [batcher.submit([f"ข้อความ {i}", f"อีกข้อความ {i}"]) for i in range(3)]
+        results = [future.result(timeout=5) for future in futures]
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(len(self.calls[0]), 6)
+        for i, vectors in enumerate(results):
+            self.assertEqual(vectors, [self.model._vector(f"ข้อความ {i}"), self.model._vector(f"อีกข้อความ {i}")])
+        metrics = batcher.metrics()
+        self.assertEqual((metrics['requests'], metrics['batches'], metrics['max_batch_size']), (3, 1, 6))
+
+    def test_batch_closes_at_max_batch(self):
+        batcher = EmbeddingBatcher(self.embed, max_batch=2, window_ms=200)
+        futures = [batcher.submit([f"ข้อความ {i}"]) for i in range(3)]
+        for future in futures:
+            future.result(timeout=5)
+        self.assertEqual([len(call) for call in self.calls], [2, 1])
+
+    def test_failure_reaches_every_request_in_the_batch(self):
+        def broken(texts):
+            raise RuntimeError("model ล่ม")
+
+        batcher = EmbeddingBatcher(broken, window_ms=200)
+        futures = [batcher.submit(["ก"]), batcher.submit(["ข"])]
+        with self.assertLogs('plotcraft.embedding_server', 'ERROR'):
+            for future in futures:
+                with self.assertRaises(RuntimeError):
+                    future.result(timeout=5)
+        self.assertEqual(batcher.metrics()['errors'], 1)
+
+    def test_remote_client_over_unix_socket(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        url = f"unix://{path}/embed.sock"
+        server = create_server(url, EmbeddingBatcher(self.embed, window_ms=5), 'minilm')
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        client = RemoteEmbeddings(url, timeout=5)
+        self.assertEqual(client.embed_documents(["ฝนตก", "แดดออก"]), self.model.embed_documents(["ฝนตก", "แดดออก"]))
+        self.assertEqual(client.embed_query("ฝนตก"), self.model._vector("ฝนตก"))
+        self.assertEqual(client.embed_documents([]), [])
+        self.assertEqual(client.metrics()['texts'], 3)
+        with self.assertRaisesMessage(RuntimeError, "400"):
+            client._request('POST', '/embed', {'texts': "ไม่ใช่ list"})
+
+
+# ==================== ONNX backend (embeddings.py) ====================
+
+class OnnxModelIdTests(SimpleTestCase):
+    """ model id (key ของ embedding cache) ต้องบอก int8 / fp32 ตามไฟล์ที่ export ไว้จริง """
+
+    def setUp(self):
+        self.model_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.model_dir, ignore_errors=True)
+        overrides = override_settings(RAG_ONNX_MODEL_DIR=self.model_dir, RAG_EMBEDDING_SERVER_BACKEND='onnx')
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def export(self, name):
+        open(os.path.join(self.model_dir, name), 'wb').close()
+
+    def test_variant_follows_exported_file(self):
+        self.assertEqual(embedding_model_id('onnx'), f"{EMBEDDING_MODEL_NAME}@onnx")
+
+        self.export('model.onnx')
+        self.assertEqual(embedding_model_id('onnx'), f"{EMBEDDING_MODEL_NAME}@onnx-fp32")
+        self.assertEqual(onnx_model_file(self.model_dir).name, 'model.onnx')
+
+        self.export('model_quantized.onnx')
+        self.assertEqual(embedding_model_id('onnx'), f"{EMBEDDING_MODEL_NAME}@onnx-int8")
+        self.assertEqual(onnx_model_file(self.model_dir).name, 'model_quantized.onnx')
+
+    def test_remote_uses_server_backend(self):
+        self.export('model.onnx')
+        self.assertEqual(embedding_model_id('remote'), f"{EMBEDDING_MODEL_NAME}@onnx-fp32")
+        with override_settings(RAG_EMBEDDING_SERVER_BACKEND='local'):
+            self.assertEqual(embedding_model_id('remote'), EMBEDDING_MODEL_NAME)
+        self.assertEqual(embedding_model_id('local'), EMBEDDING_MODEL_NAME)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ImproperlyConfigured):
+            load_embeddings('gpu')
+
+
+# ==================== Streaming (SSE) ====================
+
+class StreamingLLM:
+    """ แทน Gemini: ตอบ parts ทีละท่อน (ainvoke ใช้เวลา delay วินาที) จดทุก prompt และนับว่า stream ถูกปิดกี่ครั้ง """
+
+    def __init__(self, *parts, delay=0):
+        self.parts = list(parts) or ["พี่ว่า", "ดีแล้ว", "นะ"]
+        self.delay = delay
+        self.prompts = []
+        self.closed = 0
+
+    def invoke(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        return "".join(self.parts)
+
+    async def ainvoke(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        await asyncio.sleep(self.delay)
+        return "".join(self.parts)
+
+    async def astream(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        try:
+            for part in self.parts:
+                await asyncio.sleep(0)
+                yield part
+        finally:
+            self.closed += 1
+
+
+def sse_events(body):
+    """ body ของ text/event-stream -> [(event, data)] (ข้าม comment) """
+    events = []
+    for block in body.decode('utf-8').split("\n\n"):
+        lines = [line for line in block.splitlines() if line and not line.startswith(':')]
+        if not lines:
+            continue
+        fields = dict(line.split(': ', 1) for line in lines)
+        events.append((fields.get('event', 'message'), json.loads(fields['data'])))
+    return events
+
+
+class StreamingTests(RAGTestCase):
+    """ แชท/ร่างฉากแบบ SSE: header ออกก่อน, ส่งทีละท่อน, ปิดด้วย done และปิด stream ของ LLM เมื่อ client หลุด """
+
+    def setUp(self):
+        super().setUp()
+        self.install_service()
+        self.llm = self.use_llm(StreamingLLM())
+        self.novel = Novel.objects.create(author=self.user, title="ฝนพรำ")
+        self.scene = Scene.objects.create(created_by=self.user, project=self.novel, title="ฉากเปิด", goal="หนีออกจากเมือง")
+
+    async def stream(self, url, payload):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post(url, payload, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream; charset=utf-8')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        body = b"".join([chunk async for chunk in response.streaming_content])
+        self.assertTrue(body.startswith(b": stream-start\n\n"))
+        return sse_events(body)
+
+    async def test_chat_stream(self):
+        events = await self.stream(reverse('plotcraft:ai_chat_stream'), {'message': "ช่วยด้วย", 'novel_id': self.novel.pk})
+
+        self.assertEqual(events[0][0], 'meta')
+        session = await ChatSession.objects.aget(pk=events[0][1]['session_id'])
+        self.assertEqual(session.novel_id, self.novel.pk)
+        self.assertEqual([data['delta'] for event, data in events[1:-1]], self.llm.parts)
+        self.assertEqual(events[-1], ('done', {}))
+        self.assertIn("ช่วยด้วย", self.llm.prompts[0])
+        self.assertEqual(self.llm.closed, 1)
+
+        turn = await ChatTurn.objects.aget(session=session)
+        self.assertEqual((turn.message, turn.reply), ("ช่วยด้วย", "".join(self.llm.parts)))
+
+    async def test_scene_draft_stream_is_cached(self):
+        url = reverse('plotcraft:ai_generate_scene_stream', args=[self.scene.pk])
+        first = await self.stream(url, {})
+        self.assertEqual([data['delta'] for event, data in first[:-1]], self.llm.parts)
+        self.assertIn("หนีออกจากเมือง", self.llm.prompts[0])
+
+        # ร่างเดิมส่งกลับเป็นท่อนเดียว ไม่เรียก LLM ซ้ำ
+        second = await self.stream(url, {})
+        self.assertEqual(second, [('message', {'delta': "".join(self.llm.parts)}), ('done', {})])
+        self.assertEqual(len(self.llm.prompts), 1)
+
+        await self.stream(url, {'fresh': True})
+        self.assertEqual(len(self.llm.prompts), 2)
+
+    async def test_other_users_scene_is_not_found(self):
+        other = await User.objects.acreate(username='neighbour')
+        await self.async_client.aforce_login(other)
+        response = await self.async_client.post(
+            reverse('plotcraft:ai_generate_scene_stream', args=[self.scene.pk]), {}, content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.llm.prompts, [])
+
+    async def test_client_disconnect_closes_llm_stream(self):
+        chunks = self.service.astream_chat_with_editor("ช่วยด้วย", user_id=self.user.pk)
+        self.assertEqual(await anext(chunks), self.llm.parts[0])
+        await chunks.aclose()
+        self.assertEqual(self.llm.closed, 1)
+        self.assertFalse(await ChatTurn.objects.aexists())
+
+
+class AsyncViewTests(RAGTestCase):
+    """ view แบบ async: ORM/cache ทำใน thread ของ request มีแค่ embed + vector store ที่ออกไป thread pool """
+
+    def setUp(self):
+        super().setUp()
+        self.install_service()
+        self.llm = self.use_llm(StreamingLLM("ลองให้อลิซ", "ลังเลก่อน"))
+        self.novel = Novel.objects.create(author=self.user, title="ฝนพรำ")
+        NovelSummary.objects.create(novel=self.novel, summary="อลิซหนีออกจากบ้าน", model_name="fake")
+        character = Character.objects.create(created_by=self.user, project=self.novel, name="อลิซ", personality="ขี้สงสัย")
+        self.service.sync_sources([self.service.source_for('character', character)])
+
+    async def post(self, name, payload, *args):
+        await self.async_client.aforce_login(self.user)
+        return await self.async_client.post(reverse(f'plotcraft:{name}', args=args), payload, content_type='application/json')
+
+    async def test_chat_general_builds_prompt_from_context_story_and_history(self):
+        first = await self.post('ai_chat_general', {'message': "อลิซเป็นคนยังไง", 'novel_id': self.novel.pk})
+        self.assertEqual(first.json()['reply'], "ลองให้อลิซลังเลก่อน")
+        session_id = first.json()['session_id']
+
+        await self.post('ai_chat_general', {'message': "แล้วต่อไปล่ะ", 'session_id': session_id})
+        prompt = self.llm.prompts[1]
+        self.assertIn("ขี้สงสัย", prompt)
+        self.assertIn("อลิซหนีออกจากบ้าน", prompt)
+        self.assertIn("อลิซเป็นคนยังไง", prompt)
+        self.assertEqual(await ChatTurn.objects.filter(session_id=session_id).acount(), 2)
+
+    async def test_orm_runs_on_request_thread(self):
+        # thread ที่ sync_to_async (thread_sensitive) ใช้ = thread เดียวกับ DB connection ของ test
+        request_thread = await sync_to_async(threading.get_ident)()
+        threads = {}
+
+        def record(name):
+            method = getattr(self.service, name)
+
+            def wrapper(*args):
+                threads[name] = threading.get_ident()
+                return method(*args)
+            setattr(self.service, name, wrapper)
+
+        for name in ('_cached_context', '_search_context', '_story_and_history'):
+            record(name)
+        response = await self.post('ai_chat_general', {'message': "อลิซเป็นคนยังไง", 'novel_id': self.novel.pk})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(threads['_cached_context'], request_thread)
+        self.assertEqual(threads['_story_and_history'], request_thread)
+        self.assertNotEqual(threads['_search_context'], request_thread)
+
+    async def test_retrieval_failure_is_logged(self):
+        def broken(*args):
+            raise RuntimeError("vector store down")
+        self.service._search_context = broken
+
+        with self.assertLogs('plotcraft.rag_service', 'ERROR') as logs:
+            response = await self.post('ai_chat_general', {'message': "อลิซเป็นคนยังไง", 'novel_id': self.novel.pk})
+        self.assertEqual(response.json()['reply'], "ลองให้อลิซลังเลก่อน")
+        self.assertIn("vector store down", "\n".join(logs.output))
+
+    async def test_generate_scene_returns_cached_draft(self):
+        scene = await Scene.objects.acreate(created_by=self.user, project=self.novel, title="ฉากเปิด", goal="หนี")
+
+        first = await self.post('ai_generate_scene', {}, scene.pk)
+        second = await self.post('ai_generate_scene', {}, scene.pk)
+        self.assertEqual(first.json(), {'draft': "ลองให้อลิซลังเลก่อน", 'cached': False})
+        self.assertEqual(second.json(), {'draft': "ลองให้อลิซลังเลก่อน", 'cached': True})
+        self.assertEqual(len(self.llm.prompts), 1)
+
+    def test_chat_sessions_and_turns(self):
+        session = ChatSession.objects.create(user=self.user, novel=self.novel, title="เรื่องอลิซ")
+        for i in range(3):
+            record_turn(session, f"ถาม {i}", f"ตอบ {i}")
+        other = ChatSession.objects.create(user=User.objects.create(username='neighbour'), title="ของคนอื่น")
+        self.client.force_login(self.user)
+
+        sessions = self.client.get(reverse('plotcraft:chat_sessions')).json()
+        self.assertEqual([row['id'] for row in sessions['sessions']], [session.pk])
+
+        url = reverse('plotcraft:chat_session_turns', args=[session.pk])
+        page = self.client.get(url, {'limit': 2}).json()
+        self.assertEqual(page['session']['turn_count'], 3)
+        self.assertEqual([turn['message'] for turn in page['turns']], ["ถาม 1", "ถาม 2"])
+        rest = self.client.get(url, {'limit': 2, 'before': page['next_before']}).json()
+        self.assertEqual([turn['message'] for turn in rest['turns']], ["ถาม 0"])
+        self.assertIsNone(rest['next_before'])
+
+        self.assertEqual(self.client.get(reverse('plotcraft:chat_session_turns', args=[other.pk])).status_code, 404)
+
+
+# ==================== Scene drafts (single_flight.py) ====================
+
+class SingleFlightTests(SimpleTestCase):
+    """ key เดียวกันที่เข้ามาพร้อมกันได้ผลจากงานชิ้นเดียว """
+
+    def test_concurrent_callers_share_one_task(self):
+        flight = SingleFlight()
+        calls = []
+
+        async def work(key):
+            calls.append(key)
+            await asyncio.sleep(0.01)
+            return f"ร่าง {key}"
+
+        async def main():
+            results = await asyncio.gather(*(flight.run(key, lambda key=key: work(key)) for key in "aab"))
+            return results, flight.in_flight()
+
+        results, in_flight = asyncio.run(main())
+        self.assertEqual(results, ["ร่าง a", "ร่าง a", "ร่าง b"])
+        self.assertEqual(sorted(calls), ["a", "b"])
+        self.assertEqual(in_flight, 0)
+
+    def test_errors_reach_every_waiter(self):
+        flight = SingleFlight()
+
+        async def work():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("LLM ล่ม")
+
+        async def main():
+            return await asyncio.gather(flight.run('a', work), flight.run('a', work), return_exceptions=True)
+
+        self.assertEqual([str(e) for e in asyncio.run(main())], ["LLM ล่ม", "LLM ล่ม"])
+
+    def test_cancelled_caller_does_not_cancel_the_work(self):
+        flight = SingleFlight()
+
+        async def work():
+            await asyncio.sleep(0.05)
+            return "เสร็จ"
+
+        async def main():
+            first = asyncio.ensure_future(flight.run('a', work))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            return await flight.run('a', work)
+
+        self.assertEqual(asyncio.run(main()), "เสร็จ")
+
+
+class SceneDraftTests(RAGTestCase):
+    """ agenerate_scene_draft: ฉากเดิม -> ร่างเดิมจาก cache, กดพร้อมกัน -> เรียก LLM ครั้งเดียว """
+
+    def setUp(self):
+        super().setUp()
+        self.llm = self.use_llm(StreamingLLM("ร่าง", "ฉาก", delay=0.05))
+        novel = Novel.objects.create(author=self.user, title="ฝนพรำ")
+        self.scene = Scene.objects.create(created_by=self.user, project=novel, title="ฉากเปิด", goal="หนีออกจากเมือง")
+
+    async def load_scene(self):
+        # เหมือน views._get_owned_scene: โหลดทุกอย่างที่ prompt ใช้มาก่อน
+        return await (
+            Scene.objects.select_related('pov_character', 'location', 'project__story_summary')
+            .prefetch_related('characters')
+            .aget(pk=self.scene.pk)
+        )
+
+    async def test_concurrent_requests_share_one_llm_call(self):
+        scene = await self.load_scene()
+        results = await asyncio.gather(*(self.service.agenerate_scene_draft(scene) for _ in range(3)))
+
+        self.assertEqual(results, [("ร่างฉาก", False)] * 3)
+        self.assertEqual(len(self.llm.prompts), 1)
+        self.assertEqual(self.service._draft_flight.in_flight(), 0)
+
+    async def test_unchanged_scene_is_served_from_cache(self):
+        scene = await self.load_scene()
+        self.assertEqual(await self.service.agenerate_scene_draft(scene), ("ร่างฉาก", False))
+        self.assertEqual(await self.service.agenerate_scene_draft(scene), ("ร่างฉาก", True))
+        self.assertEqual(len(self.llm.prompts), 1)
+
+        # fresh -> ร่างใหม่ทับของเดิม
+        self.assertEqual(await self.service.agenerate_scene_draft(scene, fresh=True), ("ร่างฉาก", False))
+        self.assertEqual(len(self.llm.prompts), 2)
+
+        # แก้ฉาก -> prompt เปลี่ยน -> key ใหม่
+        await Scene.objects.filter(pk=scene.pk).aupdate(goal="กลับบ้าน")
+        self.assertEqual(await self.service.agenerate_scene_draft(await self.load_scene()), ("ร่างฉาก", False))
+        self.assertEqual(len(self.llm.prompts), 3)
+
+    async def test_waits_for_draft_of_another_worker(self):
+        scene = await self.load_scene()
+        prompt = self.service._build_scene_prompt(scene)
+        key = self.service._draft_cache_key(scene, prompt)
+        # worker อื่นถือ lock อยู่และร่างเสร็จแล้ว
+        self.assertTrue(await cache.aadd(f"{key}:lock", "other-worker", 60))
+        await self.service._cache_draft(key, "ร่างจาก worker อื่น")
+
+        self.assertEqual(await self.service._agenerate_draft_once(key, prompt, 0), "ร่างจาก worker อื่น")
+        self.assertEqual(self.llm.prompts, [])
+        self.assertEqual(await cache.aget(f"{key}:lock"), "other-worker")
+
+
+# ==================== Retrieval cache (retrieval_cache.py) ====================
+
+class RetrievalCacheTests(RAGTestCase):
+    """ ผลค้นหา context ถูกใช้ซ้ำจนกว่าเอกสารในขอบเขตนั้น (นิยาย/เจ้าของ) จะเปลี่ยน """
+
+    def test_invalidate_moves_only_its_scopes(self):
+        retrieval = RetrievalCache()
+        keys = lambda: [retrieval.key_for(1, 10, "ถาม"), retrieval.key_for(1, 20, "ถาม"), retrieval.key_for(1, None, "ถาม")]
+        before = keys()
+        self.assertEqual(len(set(before)), 3)
+
+        retrieval.invalidate(owner_id="1", novel_id="10")
+        after = keys()
+        self.assertNotEqual(after[0], before[0])
+        self.assertEqual(after[1], before[1])  # นิยายเรื่องอื่นไม่กระทบ
+        self.assertNotEqual(after[2], before[2])  # คำถามข้ามทุกเรื่องของเจ้าของ
+
+        retrieval.invalidate(owner_id="unknown", novel_id="unknown")
+        self.assertEqual(keys(), after)
+
+    def test_hit_and_miss_counts(self):
+        retrieval = RetrievalCache()
+        key = retrieval.key_for(1, 10, "ถาม")
+        self.assertIsNone(retrieval.get(key))
+        retrieval.set(key, "บริบท")
+        self.assertEqual(retrieval.get(key), "บริบท")
+        self.assertEqual(retrieval.stats(), {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+        RetrievalCache(ttl=0).set(key, "ไม่เก็บ")
+        self.assertEqual(retrieval.get(key), "บริบท")
+
+    def test_indexing_a_novel_invalidates_its_context(self):
+        novel = Novel.objects.create(author=self.user, title="ฝนพรำ")
+        alice = Character.objects.create(created_by=self.user, project=novel, name="อลิซ", personality="ขี้สงสัย")
+        self.service.sync_sources([self.service.source_for('character', alice)])
+        searches = []
+        search = self.service._search_context
+        self.service._search_context = lambda *args: searches.append(args) or search(*args)
+
+        first = self.service._retrieve_context("ใครอยู่ในเรื่อง", novel.pk, self.user.pk)
+        self.assertIn("อลิซ", first)
+        self.assertEqual(self.service._retrieve_context("ใครอยู่ในเรื่อง", novel.pk, self.user.pk), first)
+        self.assertEqual(len(searches), 1)
+
+        bob = Character.objects.create(created_by=self.user, project=novel, name="บ็อบ", personality="ใจร้อน")
+        self.service.sync_sources([self.service.source_for('character', bob)])
+        self.service._retrieve_context("ใครอยู่ในเรื่อง", novel.pk, self.user.pk)
+        self.assertEqual(len(searches), 2)
+
+        # นิยายเรื่องอื่นของเจ้าของเดียวกันไม่เกี่ยว -> ยังได้จาก cache
+        other = Novel.objects.create(author=self.user, title="แดดจ้า")
+        carol = Character.objects.create(created_by=self.user, project=other, name="แครอล")
+        self.service.sync_sources([self.service.source_for('character', carol)])
+        self.service._retrieve_context("ใครอยู่ในเรื่อง", novel.pk, self.user.pk)
+        self.assertEqual(len(searches), 2)
+
+
+# ==================== Flat vector store (vector_store.py) ====================
+
+class MatchesTests(SimpleTestCase):
+    """ where แบบ Chroma ที่ flat store รองรับ """
+
+    METADATA = {"owner_id": "1", "novel_id": "10", "type": "content", "chunk": 3}
+
+    def test_operators(self):
+        cases = [
+            ({}, True),
+            ({"owner_id": "1"}, True),
+            ({"owner_id": "2"}, False),
+            ({"chunk": {"$eq": 3}}, True),
+            ({"type": {"$ne": "scene"}}, True),
+            ({"type": {"$in": ["scene", "character"]}}, False),
+            ({"type": {"$nin": ["scene", "character"]}}, True),
+            ({"chunk": {"$gt": 3}}, False),
+            ({"chunk": {"$gte": 3, "$lt": 4}}, True),
+            ({"chunk": {"$lte": 2}}, False),
+            ({"missing": {"$gt": 0}}, False),
+            ({"missing": {"$ne": "x"}}, True),
+            ({"$and": [{"owner_id": "1"}, {"novel_id": "10"}]}, True),
+            ({"$and": [{"owner_id": "1"}, {"novel_id": "20"}]}, False),
+            ({"$or": [{"novel_id": "20"}, {"type": "content"}]}, True),
+            ({"$or": [{"novel_id": "20"}, {"type": "scene"}]}, False),
+            ({"$and": [{"owner_id": "1"}, {"$or": [{"chunk": {"$lt": 1}}, {"novel_id": "10"}]}]}, True),
+        ]
+        for where, expected in cases:
+            with self.subTest(where=where):
+                self.assertIs(matches(self.METADATA, where), expected)
+
+    def test_unknown_operator(self):
+        with self.assertRaises(ValueError):
+            matches(self.METADATA, {"chunk": {"$regex": "3"}})
+
+
+class FlatVectorStoreTests(SimpleTestCase):
+    """ เขียนเป็น generation ใหม่ทุกครั้ง อีก instance (อีก process) เห็นของใหม่เอง """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path, ignore_errors=True)
+        self.store = FlatVectorStore(self.path)
+        self.store.upsert(
+            ids=["a", "b", "c"],
+            embeddings=[[0.0, 0.0], [1.0, 0.0], [0.0, 3.0]],
+            documents=["ก", "ข", "ค"],
+            metadatas=[{"novel_id": "1"}, {"novel_id": "1"}, {"novel_id": "2"}],
+        )
+
+    def test_query_orders_by_distance_within_where(self):
+        result = self.store.query([[0.9, 0.0]], n_results=2)
+        self.assertEqual(result["ids"], [["b", "a"]])
+        self.assertAlmostEqual(result["distances"][0][0], 0.01, places=5)
+
+        result = self.store.query([[0.0, 2.9]], n_results=5, where={"novel_id": "1"}, include=("documents",))
+        self.assertEqual(result["ids"], [["a", "b"]])
+        self.assertEqual(result["documents"], [["ก", "ข"]])
+        self.assertIsNone(result["metadatas"])
+
+    def test_get_update_and_delete(self):
+        self.assertEqual(self.store.get(where={"novel_id": "1"}, limit=1, offset=1)["ids"], ["b"])
+        self.store.update(ids=["b", "missing"], metadatas=[{"novel_id": "2"}, {}])
+        self.assertEqual(self.store.get(where={"novel_id": "2"})["ids"], ["b", "c"])
+
+        self.store.delete(where={"novel_id": "2"})
+        self.assertEqual(self.store.get()["ids"], ["a"])
+        self.assertEqual(self.store.count(), 1)
+
+    def test_other_instance_sees_new_generation(self):
+        reader = FlatVectorStore(self.path)
+        self.assertEqual(reader.count(), 3)
+
+        self.store.upsert(ids=["a", "d"], embeddings=[[5.0, 5.0], [2.0, 2.0]], documents=["ก ใหม่", "ง"])
+        self.assertEqual(reader.get(ids=["a", "d"])["documents"], ["ก ใหม่", "ง"])
+        self.assertEqual(reader.query([[5.0, 5.0]], n_results=1)["ids"], [["a"]])
+
+
+# ==================== Shard routing (rag_service.py) ====================
+
+@override_settings(RAG_QUEUE_DEBOUNCE_SECONDS=0)
+class ShardRoutingTests(RAGTestCase):
+    """ เอกสารอยู่ใน shard ของเจ้าของ ค้นได้เฉพาะของตัวเอง และย้าย shard ตามเมื่อเจ้าของเปลี่ยน """
+
+    def setUp(self):
+        super().setUp()
+        self.other = User.objects.create_user('neighbour', password='pw')
+
+    def test_shard_names(self):
+        self.assertEqual(self.service.shard_name(7), "plotcraft_u7")
+        self.assertEqual(self.service.shard_name("unknown"), "plotcraft_unowned")
+        self.assertEqual(self.service.shard_name(None), "plotcraft_unowned")
+        with override_settings(RAG_SHARDING='none'):
+            self.assertEqual(self.service.shard_name(7), rag_service_module.COLLECTION_NAME)
+        with override_settings(RAG_SHARDING='novel'), self.assertRaises(ImproperlyConfigured):
+            self.service.shard_name(7)
+
+    def test_documents_stay_in_owner_shard(self):
+        mine = Character.objects.create(created_by=self.user, name="อลิซ")
+        theirs = Character.objects.create(created_by=self.other, name="บ็อบ")
+        rag_queue.run_worker(self.service, once=True)
+
+        self.assertEqual(self.documents(self.user.pk), [f"char_{mine.pk}"])
+        self.assertEqual(self.documents(self.other.pk), [f"char_{theirs.pk}"])
+        self.assertNotIn("บ็อบ", self.service._retrieve_context("ใครบ้าง", None, self.user.pk))
+
+    def test_owner_change_moves_documents(self):
+        character = Character.objects.create(created_by=self.user, name="อลิซ")
+        rag_queue.run_worker(self.service, once=True)
+
+        character.created_by = self.other
+        character.save()
+        self.assertEqual(RagIndexJob.objects.get(entity_type='character').owner_id, self.user.pk)
+        rag_queue.run_worker(self.service, once=True)
+
+        self.assertEqual(self.documents(self.user.pk), [])
+        self.assertEqual(self.documents(self.other.pk), [f"char_{character.pk}"])
+
+    def test_owner_changing_twice_before_the_worker_runs(self):
+        third = User.objects.create_user('third', password='pw')
+        novel = Novel.objects.create(author=self.user, title="ฝนพรำ")
+        scene = Scene.objects.create(created_by=self.user, project=novel, title="ฉากเปิด")
+        rag_queue.run_worker(self.service, once=True)
+
+        for owner in (self.other, third):
+            scene.created_by = owner
+            scene.save()
+        # เอกสารยังอยู่ใน shard ของเจ้าของแรก -> งานต้องจำเจ้าของแรกไว้
+        self.assertEqual(RagIndexJob.objects.get(entity_type='scene').owner_id, self.user.pk)
+        job = RagIndexJob.objects.get(entity_type='scene')
+        rag_queue.run_job(job, self.service)
+
+        self.assertEqual(self.documents(self.user.pk), [])
+        self.assertEqual(self.documents(self.other.pk), [])
+        self.assertEqual(self.documents(third.pk), [f"scene_{scene.pk}"])
+
+    def test_chapter_moved_to_another_authors_novel(self):
+        mine = Novel.objects.create(author=self.user, title="ฝนพรำ")
+        theirs = Novel.objects.create(author=self.other, title="แดดจ้า")
+        chapter = self.chapter_with(mine, "<p>ฝนตกทั้งคืน</p>", title="ตอนแรก")
+        rag_queue.run_worker(self.service, once=True)
+        self.assertTrue(self.documents(self.user.pk, type='content'))
+
+        chapter.novel = theirs
+        chapter.save(update_fields=['novel'])
+        rag_queue.run_worker(self.service, once=True)
+
+        self.assertEqual(self.documents(self.user.pk, type='content'), [])
+        self.assertTrue(self.documents(self.other.pk, type='content'))
+
+    def test_unchanged_owner_is_not_recorded(self):
+        first = Novel.objects.create(author=self.user, title="ฝนพรำ")
+        second = Novel.objects.create(author=self.user, title="ภาคต่อ")
+        chapter = self.chapter_with(first, "<p>ฝนตกทั้งคืน</p>", title="ตอนแรก")
+        chapter.novel = second
+        chapter.save(update_fields=['novel'])
+        self.assertIsNone(RagIndexJob.objects.get(entity_type='chapter').owner_id)
+
+        character = Character.objects.create(created_by=self.user, name="อลิซ")
+        with self.assertNumQueries(0):
+            rag_queue.stored_owner(Character(created_by=self.user, name="ใหม่"))
+        character.name = "อลิซา"
+        character.save(update_fields=['name'])
+        self.assertIsNone(RagIndexJob.objects.get(entity_type='character').owner_id)
+
+
+# ==================== Reindex (rag_reindex.py) ====================
+
+class ReindexTests(RAGTestCase):
+    """ rebuild ทีละ batch พร้อม checkpoint: พังกลางทางแล้วรันใหม่ทำต่อจากแถวถัดไป """
+
+    def setUp(self):
+        super().setUp()
+        self.checkpoint_path = os.path.join(tempfile.mkdtemp(), 'reindex.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.checkpoint_path), ignore_errors=True)
+        self.characters = [
+            Character.objects.create(created_by=self.user, name=f"ตัวละคร {i}", personality=f"นิสัย {i}")
+            for i in range(5)
+        ]
+
+    def reindexer(self, embed_fn=None, scope=None, **kwargs):
+        checkpoint = Checkpoint(self.checkpoint_path, scope or {'types': ['character']})
+        pool = EmbeddingPool(0, embed_fn or self.embeddings.embed_documents)
+        return Reindexer(self.service, pool, checkpoint, batch_size=2, log=lambda message: None, **kwargs)
+
+    def test_resumes_after_a_failed_batch(self):
+        batches = []
+
+        def flaky(texts):
+            batches.append(texts)
+            if len(batches) == 2:
+                raise ConnectionError("embedding server ไม่ตอบ")
+            return self.embeddings.embed_documents(texts)
+
+        with self.assertRaises(ConnectionError):
+            self.reindexer(flaky).run('character')
+        self.assertEqual(len(self.documents(self.user.pk)), 2)
+
+        resumed = self.reindexer()
+        self.assertEqual(resumed.checkpoint.position('character'), self.characters[1].pk)
+        resumed.run('character')
+        self.assertEqual(resumed.stats['rows'], 3)
+        self.assertEqual(len(self.documents(self.user.pk)), 5)
+        self.assertEqual(resumed.checkpoint.position('character'), self.characters[-1].pk)
+
+    def test_other_scope_starts_over(self):
+        self.reindexer().run('character')
+        other = self.reindexer(scope={'types': ['character'], 'user': self.user.pk})
+        self.assertEqual(other.checkpoint.position('character'), 0)
+
+        other.checkpoint.clear()
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+
+    def test_dry_run_counts_without_writing(self):
+        dry = self.reindexer(dry_run=True)
+        dry.run('character')
+        self.assertEqual((dry.stats['rows'], dry.stats['documents']), (5, 5))
+        self.assertEqual(self.documents(self.user.pk), [])
+        self.assertEqual(self.embeddings.embedded, [])
+
+    def test_chapter_reindex_drops_chunks_of_old_content(self):
+        novel = Novel.objects.create(author=self.user, title="ฝนพรำ")
+        chapter = self.chapter_with(novel, "<p>ฝนตกทั้งคืน</p>", title="ตอนแรก")
+        self.service.add_chapter_to_rag(chapter)
+        Chapter.objects.filter(pk=chapter.pk).update(content="<p>แดดออกแล้ว</p>")
+
+        self.reindexer(scope={'types': ['chapter']}).run('chapter')
+        documents = self.service.store_for(self.user.pk).get(where={"type": "content"})["documents"]
+        self.assertEqual(len(documents), 1)
+        self.assertIn("แดดออกแล้ว", documents[0])
+
+    def test_command_clears_checkpoint_when_done(self):
+        self.install_service()
+        call_command('rag_reindex', type=['character'], workers=0, checkpoint=self.checkpoint_path, stdout=StringIO())
+        self.assertEqual(len(self.documents(self.user.pk)), 5)
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+
+
+# ==================== Reconcile (rag_reconcile.py) ====================
+
+class ReconcileTests(RAGTestCase):
+    """ นับและซ่อมส่วนที่ vector store ไม่ตรงกับ DB โดย embed เฉพาะเอกสารที่ข้อความเปลี่ยน """
+
+    def setUp(self):
+        super().setUp()
+        self.other = User.objects.create_user('neighbour', password='pw')
+        self.novel = Novel.objects.create(author=self.user, title="ฝนพรำ")
+        names = ("ครบ", "แก้นิสัย", "ย้ายเรื่อง", "โอนเจ้าของ", "ถูกลบ")
+        self.characters = {
+            name: Character.objects.create(created_by=self.user, name=name, personality="ขี้สงสัย") for name in names
+        }
+        self.service.sync_sources([self.service.source_for('character', c) for c in self.characters.values()])
+
+        # ความเพี้ยนที่ไม่ผ่าน signal/คิว
+        missing = Character.objects.create(created_by=self.user, name="ยังไม่ index")
+        Character.objects.filter(pk=self.characters["แก้นิสัย"].pk).update(personality="กล้าหาญ")
+        Character.objects.filter(pk=self.characters["ย้ายเรื่อง"].pk).update(project=self.novel)
+        Character.objects.filter(pk=self.characters["โอนเจ้าของ"].pk).update(created_by=self.other)
+        Character.objects.filter(pk=self.characters["ถูกลบ"].pk).delete()
+        self.missing = missing
+        self.embeddings.embedded.clear()
+
+    def test_dry_run_counts_drift_without_repairing(self):
+        stats = Reconciler(self.service, dry_run=True).run('character')
+        self.assertEqual(
+            {key: stats[key] for key in ('db_docs', 'store_docs', 'missing', 'stale', 'misplaced', 'orphans', 'drift')},
+            {'db_docs': 5, 'store_docs': 5, 'missing': 1, 'stale': 2, 'misplaced': 1, 'orphans': 1, 'drift': 5},
+        )
+        self.assertEqual(stats['drift_ratio'], 1.0)
+        self.assertEqual(len(self.documents(self.user.pk)), 5)
+        self.assertEqual(self.embeddings.embedded, [])
+
+    def test_repair_makes_store_match_db(self):
+        Reconciler(self.service, batch_size=2).run('character')
+
+        # embed เฉพาะข้อความที่ไม่เคยเห็น (ย้ายเรื่อง = แก้ metadata, โอนเจ้าของ = ได้จาก embedding cache)
+        self.assertEqual(len(self.embeddings.embedded), 2)
+        mine = {c.pk for c in self.characters.values()} - {self.characters["โอนเจ้าของ"].pk, self.characters["ถูกลบ"].pk}
+        self.assertEqual(sorted(self.documents(self.user.pk)), sorted(f"char_{pk}" for pk in mine | {self.missing.pk}))
+        self.assertEqual(self.documents(self.other.pk), [f"char_{self.characters['โอนเจ้าของ'].pk}"])
+        moved = self.service.store_for(self.user.pk).get(ids=[f"char_{self.characters['ย้ายเรื่อง'].pk}"])
+        self.assertEqual(moved["metadatas"][0]["novel_id"], str(self.novel.pk))
+
+        stats = Reconciler(self.service).run('character')
+        self.assertEqual((stats['drift'], stats['drift_ratio']), (0, 0.0))
+
+    def test_command_reports_json(self):
+        self.install_service()
+        out = StringIO()
+        call_command('rag_reconcile', type=['character'], dry_run=True, json=True, stdout=out)
+        [stats] = json.loads(out.getvalue())
+        self.assertEqual((stats['type'], stats['drift']), ('character', 5))
+
+
+# ==================== Bulk delete (bulk_delete.py) ====================
+
+class BulkDeleteTests(RAGTestCase):
+    """ ลบนิยาย/บัญชี: แถวใน DB, เอกสารใน vector store และ search index ต้องหายหมด แต่ของคนอื่น/เรื่องอื่นอยู่ครบ """
+
+    def setUp(self):
+        super().setUp()
+        self.novel = self.add_novel(self.user, "นิยายที่จะลบ")
+        self.other_novel = self.add_novel(self.user, "นิยายที่เก็บไว้")
+        self.other_user = User.objects.create_user('neighbour', password='pw')
+        self.neighbour_novel = self.add_novel(self.other_user, "นิยายของคนอื่น")
+
+    def add_novel(self, user, title):
+        novel = Novel.objects.create(author=user, title=title, synopsis="เรื่องย่อ")
+        character = Character.objects.create(created_by=user, project=novel, name=f"ตัวเอกของ {title}")
+        location = Location.objects.create(created_by=user, project=novel, name=f"เมืองของ {title}")
+        scene = Scene.objects.create(
+            created_by=user, project=novel, pov_character=character, location=location, title=f"ฉากของ {title}",
+        )
+        scene.characters.add(character)
+        chapter = self.chapter_with(novel, "\n".join(ChunkingTests.PARAGRAPHS), title=f"ตอนของ {title}")
+        self.service.sync_sources([
+            self.service.source_for('content', chapter),
+            self.service.source_for('character', character),
+            self.service.source_for('scene', Scene.objects.select_related('project', 'created_by').get(pk=scene.pk)),
+        ])
+        return novel
+
+    def run_worker(self):
+        # งาน index ที่ signals ฝากไว้ยังไม่ถึงเวลา (debounce) -> รอบนี้มีแค่งานลบ
+        rag_queue.process_batch(self.service)
+
+    def test_delete_novel(self):
+        novel_id = self.novel.pk
+        children = {
+            'chapter': list(Chapter.objects.filter(novel=self.novel).values_list('pk', flat=True)),
+            'character': list(Character.objects.filter(project=self.novel).values_list('pk', flat=True)),
+            'scene': list(Scene.objects.filter(project=self.novel).values_list('pk', flat=True)),
+        }
+        bulk_delete.delete_novel(self.novel)
+
+        self.assertFalse(Novel.objects.filter(pk=novel_id).exists())
+        for model, field in ((Chapter, 'novel_id'), (Character, 'project_id'), (Scene, 'project_id')):
+            self.assertFalse(model.objects.filter(**{field: novel_id}).exists(), model.__name__)
+        for entity_type, ids in children.items():
+            # งาน index ที่ค้างในคิวของแถวที่ลบไปแล้วไม่ต้องทำ
+            self.assertFalse(RagIndexJob.objects.filter(entity_type=entity_type, entity_id__in=ids).exists())
+        self.assertEqual(
+            list(RagIndexJob.objects.filter(action=RagIndexJob.ACTION_DELETE).values_list('entity_type', 'entity_id')),
+            [('novel', novel_id)],
+        )
+        # สถานที่ไม่ถูกลบ แค่หลุดจากนิยาย
+        self.assertEqual(
+            list(SearchDocument.objects.filter(owner_id=self.user.pk, novel_id=None).values_list('entity_type', flat=True)),
+            ['location'],
+        )
+        self.assertFalse(SearchDocument.objects.filter(novel_id=novel_id).exists())
+
+        self.run_worker()
+        self.assertEqual(self.documents(self.user.pk, novel_id=str(novel_id)), [])
+        self.assertEqual(len(self.documents(self.user.pk, novel_id=str(self.other_novel.pk))), 6)
+        self.assertEqual(len(self.documents(self.other_user.pk)), 6)
+        self.assertFalse(RagIndexJob.objects.filter(action=RagIndexJob.ACTION_DELETE).exists())
+
+    def test_delete_novel_queries_do_not_grow(self):
+        with CaptureQueriesContext(connection) as small:
+            bulk_delete.delete_novel(self.other_novel)
+        for i in range(5):
+            character = Character.objects.create(created_by=self.user, project=self.novel, name=f"ตัวประกอบ {i}")
+            Scene.objects.create(created_by=self.user, project=self.novel, pov_character=character, title=f"ฉาก {i}")
+            Chapter.objects.create(novel=self.novel, title=f"ตอน {i}")
+        with CaptureQueriesContext(connection) as large:
+            bulk_delete.delete_novel(self.novel)
+        self.assertEqual(len(small), len(large))
+
+    def add_catalog(self, user, novel, count):
+        """ สถานที่/ไอเท็ม/timeline ที่ Collector เคยลบทีละแถว (ส่ง signal ต่อแถว) """
+        for i in range(count):
+            location = Location.objects.create(created_by=user, project=novel, name=f"ป่า {i}")
+            Item.objects.create(created_by=user, project=novel, location=location, name=f"ดาบ {i}")
+            timeline = Timeline.objects.create(created_by=user, related_project=novel, title=f"ยุค {i}")
+            TimelineEvent.objects.create(timeline=timeline, title=f"สงคราม {i}")
+
+    def test_delete_account(self):
+        user_id = self.user.pk
+        self.add_catalog(self.user, self.novel, 2)
+        # ของคนอื่นที่อ้างถึงนิยาย/สถานที่ของ user นี้ -> แค่หลุดการอ้างอิง
+        neighbour_item = Item.objects.create(
+            created_by=self.other_user, project=self.novel, location=Location.objects.filter(created_by=self.user).first(),
+            name="โล่",
+        )
+        with CaptureQueriesContext(connection) as queries:
+            bulk_delete.delete_account(self.user)
+        self.assertLess(len(queries), 90)
+
+        self.assertFalse(User.objects.filter(pk=user_id).exists())
+        self.assertFalse(Novel.objects.filter(author_id=user_id).exists())
+        self.assertFalse(Character.objects.filter(created_by_id=user_id).exists())
+        self.assertFalse(Scene.objects.filter(created_by_id=user_id).exists())
+        self.assertFalse(Chapter.objects.filter(novel__author_id=user_id).exists())
+        for model in (Location, Item, Timeline):
+            self.assertFalse(model.objects.filter(created_by_id=user_id).exists(), model.__name__)
+        self.assertFalse(TimelineEvent.objects.filter(timeline__created_by_id=user_id).exists())
+        neighbour_item.refresh_from_db()
+        self.assertEqual((neighbour_item.project_id, neighbour_item.location_id), (None, None))
+        self.assertFalse(SearchDocument.objects.filter(owner_id=user_id).exists())
+        self.assertEqual(
+            list(RagIndexJob.objects.filter(action=RagIndexJob.ACTION_DELETE).values_list('entity_type', 'entity_id')),
+            [('user', user_id)],
+        )
+
+        self.run_worker()
+        self.assertNotIn(self.service.shard_name(user_id), self.service.vector_client.list_stores())
+        self.assertEqual(len(self.documents(self.other_user.pk)), 6)
+        self.assertTrue(SearchDocument.objects.filter(owner_id=self.other_user.pk, entity_type='novel').exists())
+
+
+
+    def test_delete_account_queries_do_not_grow(self):
+        self.add_catalog(self.other_user, self.neighbour_novel, 1)
+        with CaptureQueriesContext(connection) as small:
+            bulk_delete.delete_account(self.other_user)
+        self.add_catalog(self.user, self.novel, 5)
+        for i in range(5):
+            self.add_novel(self.user, f"เรื่องสั้น {i}")
+        with CaptureQueriesContext(connection) as large:
+            bulk_delete.delete_account(self.user)
+        self.assertEqual(len(small), len(large))
+
+
+# ==================== Debounce + micro-batching (rag_queue.py) ====================
+
+class IndexBatchingTests(RAGTestCase):
+    """ save ถี่ๆ รวมเป็นงานเดียว (แต่ไม่เลื่อนเกิน MAX) และงานในรอบเดียวกัน embed รวมกันครั้งเดียว """
+
+    def job_of(self, instance):
+        return RagIndexJob.objects.get(entity_type=rag_queue.entity_type_for(instance), entity_id=instance.pk)
+
+    def test_saves_coalesce_into_one_job(self):
+        character = Character.objects.create(created_by=self.user, name="อลิซ")
+        first = self.job_of(character)
+        for personality in ("ขี้สงสัย", "กล้าหาญ", "ใจร้อน"):
+            character.personality = personality
+            character.save()
+
+        job = self.job_of(character)
+        self.assertEqual(RagIndexJob.objects.filter(entity_type='character').count(), 1)
+        self.assertEqual(job.coalesced, 3)
+        self.assertEqual(job.first_enqueued_at, first.first_enqueued_at)
+        self.assertGreater(job.available_at, timezone.now())
+
+    @override_settings(RAG_QUEUE_DEBOUNCE_SECONDS=30, RAG_QUEUE_DEBOUNCE_MAX_SECONDS=60)
+    def test_debounce_is_capped_from_the_first_save(self):
+        character = Character.objects.create(created_by=self.user, name="อลิซ")
+        first = self.job_of(character).first_enqueued_at
+        # ผ่านไป 50 วินาทีแล้วยังพิมพ์อยู่ -> รอได้อีกแค่ 10 วินาที ไม่ใช่ 30
+        RagIndexJob.objects.filter(pk=self.job_of(character).pk).update(first_enqueued_at=first - timedelta(seconds=50))
+        character.save()
+        job = self.job_of(character)
+        self.assertEqual(job.available_at, job.first_enqueued_at + timedelta(seconds=60))
+
+    @override_settings(RAG_QUEUE_DEBOUNCE_SECONDS=0)
+    def test_batch_embeds_once_across_entities(self):
+        novel = Novel.objects.create(author=self.user, title="ฝนพรำ")
+        characters = [Character.objects.create(created_by=self.user, project=novel, name=f"ตัวละคร {i}") for i in range(3)]
+        self.chapter_with(novel, "<p>ฝนตกทั้งคืน</p>", title="ตอนแรก")
+        calls = []
+        embed = self.embeddings.embed_documents
+        self.embeddings.embed_documents = lambda texts: calls.append(len(texts)) or embed(texts)
+
+        # 3 ตัวละคร + ตอน (งานสรุปเรื่องยังไม่ถึงเวลา: debounce นานกว่า)
+        self.assertEqual(rag_queue.process_batch(self.service), 4)
+        self.assertEqual(calls, [4])
+        self.assertEqual(len(self.documents(self.user.pk, type='character')), len(characters))
+        self.assertEqual(rag_queue.queue_metrics()['batches'], 1)
+
+    @override_settings(RAG_QUEUE_DEBOUNCE_SECONDS=0)
+    def test_failing_batch_falls_back_to_one_job_at_a_time(self):
+        good = Character.objects.create(created_by=self.user, name="อลิซ")
+        bad = Character.objects.create(created_by=self.user, name="บ็อบ")
+        embed = self.embeddings.embed_documents
+
+        def embed_unless_bob(texts):
+            if any("บ็อบ" in text for text in texts):
+                raise ConnectionError("embedding server ไม่ตอบ")
+            return embed(texts)
+        self.embeddings.embed_documents = embed_unless_bob
+
+        with self.assertLogs('plotcraft.rag_queue', 'ERROR'):
+            rag_queue.process_batch(self.service)
+        self.assertEqual(self.documents(self.user.pk), [f"char_{good.pk}"])
+        self.assertFalse(RagIndexJob.objects.filter(entity_type='character', entity_id=good.pk).exists())
+        self.assertEqual(self.job_of(bad).attempts, 1)
+
+
+# ==================== Context assembler (context_assembler.py) ====================
+
+def query_results(*documents):
+    """ documents = [(ข้อความ, metadata, distance), ...] -> รูปเดียวกับผลของ vector_store.query """
+    return {
+        "documents": [[text for text, _, _ in documents]],
+        "metadatas": [[metadata for _, metadata, _ in documents]],
+        "distances": [[distance for _, _, distance in documents]],
+    }
+
+
+class ContextAssemblerTests(SimpleTestCase):
+    """ context อยู่ในงบ token รวมและโควตาของแต่ละประเภท ไม่มี chunk ซ้ำ และเรียงอ่านต่อกันได้ """
+
+    def chunk(self, chapter, index, text, distance=0.1, order=1):
+        metadata = {"type": "content", "source_id": str(chapter), "chunk_index": index, "chapter_order": order}
+        return f"[เนื้อเรื่อง] ตอน: {chapter}\n{text}", metadata, distance
+
+    def character(self, name, text, distance=0.1):
+        return f"[ข้อมูลตัวละคร]\nชื่อ: {name}\n{text}", {"type": "character", "source_id": name}, distance
+
+    def test_token_helpers(self):
+        self.assertEqual(estimate_tokens("a" * 40), 11)
+        self.assertEqual(estimate_tokens("ก" * 25), 11)
+        self.assertEqual(parse_quotas("character=0.3, content=0.6,junk"), {'character': 0.3, 'content': 0.6})
+        text = " ".join(["คำ"] * 200)
+        self.assertEqual(truncate_tokens("สั้น", 50), "สั้น")
+        self.assertLessEqual(estimate_tokens(truncate_tokens(text, 40)), 42)
+
+    def test_budget_and_quotas(self):
+        # ข้อความไม่ซ้ำกัน (~65 token ต่อเอกสาร) จะได้ไม่ถูกตัดทิ้งเพราะซ้ำ
+        text = lambda seed: " ".join(hashlib.sha256(f"{seed}-{i}".encode()).hexdigest()[:20] for i in range(12))
+        results = query_results(
+            *(self.character(f"ตัวละคร {i}", text(f"c{i}"), distance=0.05) for i in range(3)),
+            *(self.chunk(7, i, text(f"p{i}"), distance=0.2) for i in range(0, 20, 2)),
+        )
+        context = assemble_context(results, budget=300, quotas={'character': 0.25, 'content': 1.0})
+
+        self.assertLessEqual(context.tokens, 300 + 2)  # + " …" ของท่อนที่ถูกตัด
+        self.assertLessEqual(context.stats['tokens_by_type']['character'], 75 + 2)
+        self.assertGreater(context.stats['tokens_by_type']['content'], 0)
+        self.assertGreater(context.stats['dropped_budget'], 0)
+        self.assertEqual(context.tokens, sum(context.stats['tokens_by_type'].values()))
+
+    def test_duplicates_and_overlap_are_dropped(self):
+        first = "อลิซเดินเข้าป่าตอนพลบค่ำ เธอได้ยินเสียงหมาป่าหอนอยู่ไกลๆ"
+        second = "เธอได้ยินเสียงหมาป่าหอนอยู่ไกลๆ จึงรีบปีนขึ้นต้นไม้ใหญ่"
+        results = query_results(
+            self.chunk(7, 1, second, distance=0.1),
+            self.chunk(7, 0, first, distance=0.2),
+            self.chunk(9, 0, first, distance=0.3),  # ข้อความซ้ำจากตอนอื่น
+            self.character("อลิซ", "ขี้สงสัย", distance=0.4),
+        )
+        context = assemble_context(results, budget=1000, quotas={})
+
+        self.assertEqual(context.stats['dropped_duplicate'], 1)
+        self.assertEqual(context.text, "\n\n".join([
+            "[ข้อมูลตัวละคร]\nชื่อ: อลิซ\nขี้สงสัย",
+            "[เนื้อเรื่อง] ตอน: 7",
+            first,
+            "จึงรีบปีนขึ้นต้นไม้ใหญ่",
+        ]))
+
+    def test_empty_results(self):
+        context = assemble_context({"documents": [[]], "metadatas": [[]], "distances": [[]]}, budget=100, quotas={})
+        self.assertEqual((context.text, context.tokens, context.stats['selected']), ("", 0, 0))
+
+
+# ==================== Story summaries (summaries.py) ====================
+
+class SummaryLLM:
+    """ LLM ปลอมของ summarizer: ตอบเป็นเลขลำดับการเรียก และจดว่าเป็นการสรุปตอนหรือการรวมเรื่องย่อ """
+
+    def __init__(self):
+        self.calls = []
+
+    def invoke(self, prompt):
+        kind = 'chapter' if "สรุปเนื้อหาตอน" in prompt else 'fold'
+        self.calls.append(kind)
+        return f" {kind} {len(self.calls)} "
+
+
+@override_settings(RAG_SUMMARY_FOLD_CHAPTERS=2)
+class StorySummaryTests(TestCase):
+    """ เรียก LLM เฉพาะตอนที่เนื้อหาเปลี่ยน และรวมเรื่องย่อใหม่เฉพาะช่วงตั้งแต่ตอนที่เปลี่ยน """
+
+    def setUp(self):
+        self.user = User.objects.create_user('writer', password='pw')
+        self.novel = Novel.objects.create(author=self.user, title="ฝนพรำ")
+        self.chapters = [self.add_chapter(order) for order in range(1, 4)]
+        self.llm = SummaryLLM()
+
+    def add_chapter(self, order):
+        chapter = Chapter.objects.create(novel=self.novel, title=f"ตอนที่ {order}", order=order)
+        self.edit(chapter, f"<p>เหตุการณ์ของตอน {order}</p>")
+        return chapter
+
+    def edit(self, chapter, content):
+        # update() ไม่ผ่าน save -> ไม่ต้องตัดคำ แต่ต้องขยับ updated_at เองเหมือนการบันทึกจริง
+        Chapter.objects.filter(pk=chapter.pk).update(content=content, updated_at=timezone.now())
+
+    def refresh(self, model_name="gemini"):
+        self.llm.calls.clear()
+        return StorySummarizer(self.llm, model_name).refresh(self.novel)
+
+    def story(self):
+        return NovelSummary.objects.get(novel=self.novel)
+
+    def test_first_run_summarizes_everything(self):
+        stats = self.refresh()
+        self.assertEqual(stats, {'chapters': 3, 'llm_calls': 5, 'refolded_steps': 2})
+        self.assertEqual(self.llm.calls, ['chapter'] * 3 + ['fold'] * 2)
+        story = self.story()
+        self.assertEqual(story.summary, "fold 5")
+        self.assertEqual([len(step['chapters']) for step in story.steps], [2, 1])
+        self.assertEqual(ChapterSummary.objects.get(chapter=self.chapters[0]).summary, "chapter 1")
+
+        self.assertEqual(self.refresh()['llm_calls'], 0)
+
+    def test_editing_refolds_from_the_edited_step(self):
+        self.refresh()
+
+        self.edit(self.chapters[2], "<p>ตอนจบแบบใหม่</p>")
+        self.assertEqual(self.refresh()['refolded_steps'], 1)
+        self.assertEqual(self.llm.calls, ['chapter', 'fold'])
+
+        self.edit(self.chapters[0], "<p>เปิดเรื่องใหม่</p>")
+        self.assertEqual(self.refresh()['refolded_steps'], 2)
+        self.assertEqual(self.llm.calls, ['chapter', 'fold', 'fold'])
+
+    def test_new_chapter_joins_the_unfinished_step(self):
+        self.refresh()
+        self.add_chapter(4)
+        self.refresh()
+        self.assertEqual(self.llm.calls, ['chapter', 'fold'])
+        self.assertEqual([len(step['chapters']) for step in self.story().steps], [2, 2])
+
+    def test_saves_without_content_change_cost_nothing(self):
+        self.refresh()
+        Chapter.objects.filter(pk=self.chapters[1].pk).update(updated_at=timezone.now())
+        self.assertEqual(self.refresh()['llm_calls'], 0)
+
+        # เปลี่ยน model -> สรุปใหม่ทั้งหมด
+        self.assertEqual(self.refresh(model_name="gemini-next")['llm_calls'], 5)
+
+
+# ==================== Chat sessions (chat_sessions.py) ====================
+
+@override_settings(RAG_CHAT_RECENT_TURNS=2, RAG_CHAT_FOLD_TURNS=3, RAG_CHAT_HISTORY_TOKEN_BUDGET=1000)
+class ChatSessionTests(TestCase):
+    """ ห้องแชทจำ turn ล่าสุดแบบคำต่อคำ ที่เก่ากว่านั้นถูกรวมเป็น summary โดย worker """
+
+    def setUp(self):
+        self.user = User.objects.create_user('writer', password='pw')
+        self.novel = Novel.objects.create(author=self.user, title="ฝนพรำ")
+        self.session = open_session(self.user.pk, novel_id=self.novel.pk, first_message="ช่วยคิดฉากเปิดหน่อย")
+
+    def chat(self, count, start=0):
+        for i in range(start, start + count):
+            record_turn(self.session, f"ถาม {i}", f"ตอบ {i}")
+
+    def test_open_session_is_scoped_to_the_user(self):
+        other = User.objects.create_user('neighbour', password='pw')
+        self.assertEqual((self.session.novel_id, self.session.title), (self.novel.pk, "ช่วยคิดฉากเปิดหน่อย"))
+        self.assertIsNone(open_session(other.pk, novel_id=self.novel.pk).novel_id)
+        self.assertEqual(open_session(self.user.pk, session_id=self.session.pk), self.session)
+        with self.assertRaises(ChatSession.DoesNotExist):
+            open_session(other.pk, session_id=self.session.pk)
+
+    def test_enough_turns_enqueue_a_summary(self):
+        self.chat(4)
+        self.assertFalse(RagIndexJob.objects.filter(entity_type='chat_summary').exists())
+        self.chat(1, start=4)
+        job = RagIndexJob.objects.get(entity_type='chat_summary')
+        self.assertEqual((job.entity_id, job.owner_id), (self.session.pk, self.user.pk))
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.turn_count, 5)
+
+    def test_compaction_keeps_recent_turns_verbatim(self):
+        self.chat(5)
+        llm = StreamingLLM("น้องอยากให้ฉากเปิดมืดๆ")
+        self.assertEqual(compact_session(self.session, llm), 3)
+        self.assertIn("ถาม 2", llm.prompts[0])
+        self.assertNotIn("ถาม 3", llm.prompts[0])
+
+        self.session.refresh_from_db()
+        self.assertEqual((self.session.summary, self.session.summarized_turns), ("น้องอยากให้ฉากเปิดมืดๆ", 3))
+        self.assertEqual(history_text(self.session), "\n".join([
+            "(สรุปที่คุยกันก่อนหน้านี้) น้องอยากให้ฉากเปิดมืดๆ",
+            "น้อง: ถาม 3", "พี่บก.: ตอบ 3",
+            "น้อง: ถาม 4", "พี่บก.: ตอบ 4",
+        ]))
+        # ยังไม่มี turn ใหม่พอให้รวม -> ไม่เรียก LLM
+        self.assertEqual(compact_session(self.session, llm), 0)
+        self.assertEqual(len(llm.prompts), 1)
+
+    @override_settings(RAG_CHAT_HISTORY_TOKEN_BUDGET=30)
+    def test_history_drops_oldest_turns_over_budget(self):
+        self.chat(4)
+        history = history_text(self.session)
+        self.assertIn("ถาม 3", history)
+        self.assertNotIn("ถาม 0", history)
+
+    def test_list_sessions_pages_by_cursor(self):
+        older = [open_session(self.user.pk, first_message=f"ห้อง {i}") for i in range(2)]
+        for minutes, session in enumerate([*older, self.session]):
+            ChatSession.objects.filter(pk=session.pk).update(updated_at=timezone.now() + timedelta(minutes=minutes))
+
+        page, cursor = list_sessions(self.user.pk, limit=2)
+        self.assertEqual([row['id'] for row in page], [self.session.pk, older[1].pk])
+        rest, end = list_sessions(self.user.pk, before=cursor, limit=2)
+        self.assertEqual(([row['id'] for row in rest], end), ([older[0].pk], None))
+
+        self.assertEqual([row['id'] for row in list_sessions(self.user.pk, novel_id=self.novel.pk)[0]], [self.session.pk])
+        with self.assertRaises(ValueError):
+            list_sessions(self.user.pk, before="ไม่ใช่ cursor")
+
+
+# ==================== LLM gateway (llm_gateway.py) ====================
+
+class FakeLLM:
+    """ แทน GoogleGenerativeAI: ทำตาม script ทีละครั้ง (Exception = raise, ตัวเลข = หน่วงกี่วินาทีแล้วตอบ) """
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.calls = 0
+
+    def _next(self):
+        self.calls += 1
+        return self.script.pop(0) if self.script else "ตอบแล้ว"
+
+    def invoke(self, prompt, **kwargs):
+        step = self._next()
+        if isinstance(step, Exception):
+            raise step
+        if isinstance(step, float):
+            time.sleep(step)
+            return "ช้าไป"
+        return step
+
+    async def ainvoke(self, prompt, **kwargs):
+        step = self._next()
+        if isinstance(step, Exception):
+            raise step
+        if isinstance(step, float):
+            await asyncio.sleep(step)
+            return "ช้าไป"
+        return step
+
+
+class ServiceUnavailable(Exception):
+    """ ชื่อเดียวกับ error 503 ของ google.api_core """
+    code = 503
+
+
+@override_settings(
+    RAG_LLM_MAX_ATTEMPTS=3, RAG_LLM_RETRY_BASE_SECONDS=0.01, RAG_LLM_TIMEOUT_SECONDS=0.2,
+    RAG_LLM_DEADLINE_SECONDS=5, RAG_LLM_QUEUE_TIMEOUT_SECONDS=1,
+    RAG_LLM_BREAKER_MIN_CALLS=3, RAG_LLM_BREAKER_FAILURE_RATIO=0.5, RAG_LLM_BREAKER_COOLDOWN_SECONDS=0.2,
+)
+class LLMGatewayTests(TestCase):
+    """ retry เฉพาะ error ชั่วคราว, timeout ต่อครั้ง, และ circuit breaker ที่เปิดเมื่อพังติดกันแล้วปิดเองหลัง cooldown """
+
+    def test_transient_errors_are_retried(self):
+        llm = FakeLLM(ServiceUnavailable("ไม่ว่าง"), ConnectionError("หลุด"), "สำเร็จ")
+        gateway = LLMGateway(llm)
+        self.assertEqual(gateway.invoke("สวัสดี"), "สำเร็จ")
+        self.assertEqual(llm.calls, 3)
+        metrics = gateway.metrics()
+        self.assertEqual((metrics['attempts'], metrics['retries'], metrics['failed'], metrics['succeeded']), (3, 2, 2, 1))
+
+    def test_permanent_errors_are_not_retried(self):
+        llm = FakeLLM(ValueError("prompt ผิด"))
+        gateway = LLMGateway(llm)
+        with self.assertRaises(ValueError):
+            gateway.invoke("สวัสดี")
+        self.assertEqual(llm.calls, 1)
+        self.assertEqual(gateway.breaker.state, 'closed')
+
+    def test_gives_up_after_max_attempts(self):
+        llm = FakeLLM(*[ConnectionError("หลุด")] * 5)
+        with self.assertRaises(ConnectionError):
+            LLMGateway(llm).invoke("สวัสดี")
+        self.assertEqual(llm.calls, 3)
+
+    @override_settings(RAG_LLM_MAX_ATTEMPTS=2)
+    def test_timeout_then_retry(self):
+        llm = FakeLLM(1.0, "ทันเวลา")
+        gateway = LLMGateway(llm)
+        started = time.monotonic()
+        self.assertEqual(gateway.invoke("สวัสดี"), "ทันเวลา")
+        self.assertLess(time.monotonic() - started, 0.9)
+        self.assertEqual(gateway.metrics()['timeouts'], 1)
+
+    @override_settings(RAG_LLM_MAX_ATTEMPTS=1)
+    def test_async_timeout(self):
+        gateway = LLMGateway(FakeLLM(1.0))
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(gateway.ainvoke("สวัสดี"))
+        metrics = gateway.metrics()
+        self.assertEqual((metrics['timeouts'], metrics['in_flight']), (1, 0))
+
+    @override_settings(RAG_LLM_MAX_ATTEMPTS=1)
+    def test_breaker_opens_and_recovers(self):
+        llm = FakeLLM(*[ServiceUnavailable("ไม่ว่าง")] * 3)
+        gateway = LLMGateway(llm)
+        for _ in range(3):
+            with self.assertRaises(ServiceUnavailable):
+                gateway.invoke("สวัสดี")
+        self.assertEqual(gateway.breaker.state, 'open')
+
+        with self.assertRaises(LLMUnavailable):
+            gateway.invoke("สวัสดี")
+        with self.assertRaises(LLMUnavailable):
+            asyncio.run(gateway.ainvoke("สวัสดี"))
+        self.assertEqual(llm.calls, 3)
+        self.assertEqual(gateway.metrics()['rejected'], 2)
+
+        time.sleep(0.25)
+        self.assertEqual(gateway.invoke("สวัสดี"), "ตอบแล้ว")
+        self.assertEqual(gateway.breaker.state, 'closed')
+        self.assertEqual(gateway.metrics()['breaker_trips'], 1)
+
+    @override_settings(RAG_LLM_MAX_CONCURRENCY=1, RAG_LLM_QUEUE_TIMEOUT_SECONDS=0.1, RAG_LLM_TIMEOUT_SECONDS=1)
+    def test_full_queue_is_rejected(self):
+        gateway = LLMGateway(FakeLLM(0.5, "คิวสอง"))
+
+        async def both():
+            return await asyncio.gather(gateway.ainvoke("หนึ่ง"), gateway.ainvoke("สอง"), return_exceptions=True)
+
+        first, second = asyncio.run(both())
+        self.assertEqual(first, "ช้าไป")
+        self.assertIsInstance(second, LLMUnavailable)
+
+    @override_settings(RAG_LLM_MAX_ATTEMPTS=1, RAG_LLM_TIMEOUT_SECONDS=1, RAG_LLM_BREAKER_COOLDOWN_SECONDS=5)
+    def test_in_flight_success_after_trip_keeps_breaker_open(self):
+        # ครั้งแรกค้างอยู่ใน Gemini ระหว่างที่อีกสามครั้งพังจน breaker เปิด แล้วค่อยตอบสำเร็จทีหลัง
+        llm = FakeLLM(0.3, *[ServiceUnavailable("ไม่ว่าง")] * 3)
+        gateway = LLMGateway(llm)
+
+        async def calls():
+            return await asyncio.gather(*[gateway.ainvoke("สวัสดี") for _ in range(4)], return_exceptions=True)
+
+        slow, *failures = asyncio.run(calls())
+        self.assertEqual(slow, "ช้าไป")
+        self.assertTrue(all(isinstance(e, ServiceUnavailable) for e in failures))
+        self.assertEqual(gateway.breaker.state, 'open')
+        with self.assertRaises(LLMUnavailable):
+            gateway.invoke("สวัสดี")
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    """ ตอน open/half-open มีแค่ตั๋วของครั้งทดลองที่เปลี่ยนสถานะได้ """
+
+    def tripped(self):
+        breaker = CircuitBreaker(window=60, min_calls=3, failure_ratio=0.5, cooldown=0.1)
+        for _ in range(3):
+            breaker.record(False, breaker.allow())
+        self.assertEqual(breaker.state, 'open')
+        return breaker
+
+    def test_stale_results_do_not_move_open_breaker(self):
+        breaker = self.tripped()
+        opened_at = breaker._opened_at
+        breaker.record(True)
+        breaker.record(False)
+        self.assertEqual((breaker.state, breaker._opened_at), ('open', opened_at))
+
+    def test_only_probe_closes_half_open_breaker(self):
+        breaker = self.tripped()
+        time.sleep(0.15)
+        probe = breaker.allow()
+        self.assertTrue(probe)
+        self.assertFalse(breaker.allow())
+
+        # การเรียกที่ถูกปล่อยไปก่อนเปิดเพิ่งจบ -> ไม่นับ
+        breaker.record(True)
+        self.assertEqual(breaker.state, 'half_open')
+        breaker.record(True, probe)
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_expired_probe_is_ignored(self):
+        breaker = self.tripped()
+        time.sleep(0.15)
+        stale = breaker.allow()
+        time.sleep(0.15)
+        probe = breaker.allow()
+        self.assertIsNot(stale, probe)
+
+        breaker.record(True, stale)
+        self.assertEqual(breaker.state, 'half_open')
+        breaker.record(False, probe)
+        self.assertEqual(breaker.state, 'open')
+        self.assertEqual(breaker.trips, 1)
+
+
+# ==================== ค้นหารวม (search_index.py) ====================
+
+class SearchPageTests(TestCase):
+    """ เรียงตามคะแนน (ชื่อ > keyword > เนื้อหา) และแบ่งหน้าแบบ keyset โดยไม่มีแถวซ้ำหรือหาย """
+
+    def setUp(self):
+        self.user = User.objects.create_user('writer', password='pw')
+        other = User.objects.create_user('neighbour', password='pw')
+        Character.objects.create(created_by=other, name="มังกรของคนอื่น")
+        self.exact = Character.objects.create(created_by=self.user, name="มังกร")
+        self.in_title = [Character.objects.create(created_by=self.user, name=f"มังกรตัวที่ {i}") for i in range(5)]
+        self.in_keywords = [
+            Character.objects.create(created_by=self.user, name=f"นักรบ {i}", species="มังกร") for i in range(4)
+        ]
+        self.in_body = [
+            Character.objects.create(created_by=self.user, name=f"ชาวบ้าน {i}", background="เคยเห็นมังกร") for i in range(6)
+        ]
+        Character.objects.create(created_by=self.user, name="ไม่เกี่ยว", background="ไม่มีอะไร")
+
+    def pages(self, limit):
+        pages, after = [], None
+        while True:
+            hits, after = search_index.search_page(self.user.pk, "มังกร", 'character', after=after, limit=limit)
+            pages.append(hits)
+            if after is None:
+                return pages
+
+    def url_of(self, character):
+        return reverse('plotcraft:character_detail', args=[character.pk])
+
+    def test_ranking(self):
+        hits, _ = search_index.search_page(self.user.pk, "มังกร", 'character', limit=100)
+        self.assertEqual(hits[0].url, self.url_of(self.exact))
+        self.assertEqual([hit.score for hit in hits], sorted((hit.score for hit in hits), reverse=True))
+        groups = [self.in_title, self.in_keywords, self.in_body]
+        expected = [self.exact] + [character for group in groups for character in reversed(group)]
+        self.assertEqual([hit.url for hit in hits], [self.url_of(character) for character in expected])
+        self.assertEqual({hit.score for hit in hits[-len(self.in_body):]}, {1.0})
+
+    def test_keyset_pages_cover_every_hit_once(self):
+        for limit in (1, 3, 4, 16, 50):
+            pages = self.pages(limit)
+            urls = [hit.url for page in pages for hit in page]
+            self.assertEqual(len(urls), 16, limit)
+            self.assertEqual(len(set(urls)), 16, limit)
+            self.assertTrue(all(len(page) <= limit for page in pages))
+            self.assertEqual(urls, [hit.url for hit in search_index.search_page(
+                self.user.pk, "มังกร", 'character', limit=100)[0]])
+
+    def test_snippet_is_highlighted_and_escaped(self):
+        Character.objects.create(created_by=self.user, name="กิเลน", background="<b>ตำนาน</b> " + "ก" * 300 + " กิเลนบินได้")
+        hit, = search_index.search_page(self.user.pk, "กิเลน", 'character')[0]
+        self.assertEqual(hit.title, "<mark>กิเลน</mark>")
+        self.assertTrue(hit.snippet.startswith("… "))
+        self.assertIn("<mark>กิเลน</mark>บินได้", hit.snippet)
+        self.assertEqual(search_index.highlight("<b>กิเลน</b>", ["กิเลน"]), "&lt;b&gt;<mark>กิเลน</mark>&lt;/b&gt;")
+
+    def test_bad_cursor(self):
+        for after in ("abc", "1.5:3", "3:x"):
+            with self.assertRaises(ValueError):
+                search_index.search_page(self.user.pk, "มังกร", 'character', after=after)
+
+
+@override_settings(SEARCH_PAGE_SIZE=3, SEARCH_CACHE_SECONDS=60)
+class GroupedSearchTests(TestCase):
+    """ หน้าค้นหา: จำนวน + หน้าแรกของทุกหมวดจาก cache ต่อผู้ใช้ หน้าถัดไปโหลดทีละหมวดผ่าน htmx """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('writer', password='pw')
+        self.characters = [Character.objects.create(created_by=self.user, name=f"ฟีนิกซ์ {i}") for i in range(7)]
+        self.items = [Item.objects.create(created_by=self.user, name=f"ขนฟีนิกซ์ {i}") for i in range(2)]
+        self.client.force_login(self.user)
+
+    def test_overview_counts_and_first_pages(self):
+        categories = {c.entity_type: c for c in search_index.overview(self.user.pk, "ฟีนิกซ์", use_cache=False)}
+        self.assertEqual(set(categories), {'character', 'item'})
+        character, item = categories['character'], categories['item']
+        self.assertEqual((character.count, len(character.hits)), (7, 3))
+        self.assertEqual((item.count, len(item.hits), item.next_after), (2, 2, None))
+
+        # ต่อจากหน้าแรกด้วย cursor ได้ครบทุกแถว ไม่ซ้ำ
+        urls, after = [hit.url for hit in character.hits], character.next_after
+        while after:
+            hits, after = search_index.search_page(self.user.pk, "ฟีนิกซ์", 'character', after=after)
+            urls += [hit.url for hit in hits]
+        expected = {reverse('plotcraft:character_detail', args=[c.pk]) for c in self.characters}
+        self.assertEqual((len(urls), set(urls)), (7, expected))
+
+    @override_settings(SEARCH_CACHE_SECONDS=0)
+    def test_overview_is_two_queries(self):
+        with self.assertNumQueries(2):
+            search_index.overview(self.user.pk, "ฟีนิกซ์")
+
+    def test_repeated_search_is_cached_until_user_data_changes(self):
+        first = search_index.overview(self.user.pk, "ฟีนิกซ์")
+        # แก้ index ตรงๆ (ไม่ผ่าน signal) -> ยังได้ผลเดิมจาก cache
+        SearchDocument.objects.filter(owner=self.user, entity_type='item').delete()
+        self.assertEqual(search_index.overview(self.user.pk, "ฟีนิกซ์ "), first)
+        # ผู้ใช้อื่นไม่ได้ใช้ cache ของคนนี้
+        other = User.objects.create_user('neighbour', password='pw')
+        self.assertEqual(search_index.overview(other.pk, "ฟีนิกซ์"), [])
+
+        Character.objects.create(created_by=self.user, name="ฟีนิกซ์ ใหม่")
+        counts = {c.entity_type: c.count for c in search_index.overview(self.user.pk, "ฟีนิกซ์")}
+        self.assertEqual(counts, {'character': 8})
+
+    def test_search_page_and_more_partial(self):
+        response = self.client.get(reverse('plotcraft:global_search'), {'q': "ฟีนิกซ์"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total'], 9)
+        character = response.context['categories'][0]
+        self.assertContains(response, "ดูเพิ่มเติม", count=1)
+
+        more = reverse('plotcraft:global_search_more')
+        response = self.client.get(more, {'q': "ฟีนิกซ์", 'type': 'character', 'after': character.next_after})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['hits']), 3)
+        self.assertIsNotNone(response.context['next_after'])
+
+        for params in ({'q': "ฟีนิกซ์", 'type': 'chapter'}, {'q': "", 'type': 'item'},
+                       {'q': "ฟีนิกซ์", 'type': 'item', 'after': "x:1"}):
+            self.assertEqual(self.client.get(more, params).status_code, 400)
+
+
+@override_settings(RAG_QUEUE_DEBOUNCE_SECONDS=0, SEARCH_CACHE_SECONDS=0)
+class SemanticSearchTests(RAGTestCase):
+    """ mode=semantic/hybrid: embed คำค้นครั้งเดียว ค้นใน shard ของผู้ใช้ map กลับด้วย in_bulk แล้วรวมอันดับด้วย RRF """
+
+    def setUp(self):
+        super().setUp()
+        self.install_service()
+        self.queries = []
+        embed_query = self.embeddings.embed_query
+        self.embeddings.embed_query = lambda text: self.queries.append(text) or embed_query(text)
+
+        self.novel = Novel.objects.create(author=self.user, title="ฝนพรำ")
+        self.dragon = Character.objects.create(created_by=self.user, name="มังกรเฒ่า")
+        self.knight = Character.objects.create(created_by=self.user, name="อัศวิน", background="ผู้พิทักษ์ปราสาท")
+        self.chapter = self.chapter_with(self.novel, "<p>ไฟลุกท่วมหมู่บ้าน</p>", title="ตอนไฟไหม้", order=1)
+        other = User.objects.create_user('neighbour', password='pw')
+        Character.objects.create(created_by=other, name="มังกรของคนอื่น")
+        rag_queue.run_worker(self.service, once=True)
+        self.service.sync_sources([self.service.source_for('content', self.chapter)])
+
+    def categories(self, query, mode):
+        return {c.entity_type: c for c in search_index.overview(self.user.pk, query, mode)}
+
+    def url_of(self, name, obj):
+        return reverse(name, args=[obj.pk])
+
+    def test_reciprocal_rank_fusion(self):
+        hit = lambda name: search_index.Hit('character', '', '', name, name, '', 0)
+        fused = search_index.reciprocal_rank_fusion([
+            [('a', hit("lexical a")), ('b', hit("lexical b"))],
+            [('b', hit("semantic b")), ('c', hit("semantic c"))],
+        ], k=60)
+        self.assertEqual([key for key, _ in fused], ['b', 'a', 'c'])
+        self.assertEqual(fused[0][1].title, "lexical b")
+        self.assertAlmostEqual(fused[0][1].score, 1 / 62 + 1 / 61)
+
+    def test_semantic_mode_maps_hits_back_to_rows(self):
+        # ลบแล้วแต่ worker ยังไม่ได้ลบ vector -> ไม่เจอใน in_bulk ก็ตัดทิ้ง
+        self.knight.delete()
+        with CaptureQueriesContext(connection) as queries:
+            categories = self.categories("สัตว์พ่นไฟ", 'semantic')
+
+        self.assertEqual(self.queries, ["สัตว์พ่นไฟ"])
+        self.assertEqual(set(categories), {'character', 'chapter'})
+        self.assertEqual([hit.url for hit in categories['character'].hits],
+                         [self.url_of('plotcraft:character_detail', self.dragon)])
+        self.assertEqual([hit.url for hit in categories['chapter'].hits],
+                         [self.url_of('plotcraft:chapter_preview', self.chapter)])
+        self.assertIn("ไฟลุกท่วมหมู่บ้าน", categories['chapter'].hits[0].snippet)
+        self.assertEqual(sum('plotcraft_character' in q['sql'] for q in queries.captured_queries), 1)
+        self.assertEqual(sum('plotcraft_chapter' in q['sql'] for q in queries.captured_queries), 1)
+
+    def test_hybrid_prefers_lexical_hit_and_keeps_semantic_only_rows(self):
+        categories = self.categories("มังกร", 'hybrid')
+        characters = categories['character'].hits
+        self.assertEqual(characters[0].url, self.url_of('plotcraft:character_detail', self.dragon))
+        self.assertEqual(characters[0].title, "<mark>มังกร</mark>เฒ่า")
+        self.assertEqual(len(characters), 2)
+        self.assertIn('chapter', categories)
+
+    def test_semantic_failure_falls_back_to_lexical(self):
+        def broken(*args, **kwargs):
+            raise ConnectionError("embedding server ล่ม")
+        self.service.semantic_search = broken
+
+        with self.assertLogs('plotcraft.search_index', 'ERROR'):
+            self.assertEqual(self.categories("มังกร", 'semantic'), {})
+        with self.assertLogs('plotcraft.search_index', 'ERROR'):
+            hybrid = self.categories("มังกร", 'hybrid')
+        self.assertEqual(list(hybrid), ['character'])
+        self.assertEqual(hybrid['character'].count, 1)
+
+    def test_mode_on_search_page(self):
+        self.client.force_login(self.user)
+        url = reverse('plotcraft:global_search')
+        response = self.client.get(url, {'q': "มังกร", 'mode': 'hybrid'})
+        self.assertEqual(response.context['mode'], 'hybrid')
+        self.assertEqual(response.context['total'], 3)
+        response = self.client.get(url, {'q': "มังกร", 'mode': 'vector'})
+        self.assertEqual((response.context['mode'], response.context['total']), ('lexical', 1))
+
+
+# ==================== สถิติของตอน (chapter_stats.py) ====================
+
+class ChapterStatsTests(TestCase):
+    """ ยอดรวมของนิยายต้องตรงกับผลรวมของทุกตอน ทั้งตอนสร้าง ลบ และย้ายตอนไปนิยายเรื่องอื่น """
+
+    def setUp(self):
+        self.user = User.objects.create_user('writer', password='pw')
+        self.source = Novel.objects.create(author=self.user, title="เรื่องเดิม")
+        self.target = Novel.objects.create(author=self.user, title="เรื่องใหม่")
+
+    def add_chapter(self, novel, stats):
+        """ ตอนที่มีสถิติแล้ว (ตั้งค่าตรงๆ ไม่ต้องนับคำด้วย pythainlp) """
+        chapter = Chapter.objects.create(novel=novel, title="ตอน")
+        Chapter.objects.filter(pk=chapter.pk).update(**dict(zip(chapter_stats.STAT_FIELDS, stats)))
+        chapter_stats.recount_novel(novel.pk)
+        return Chapter.objects.get(pk=chapter.pk)
+
+    def assert_totals(self, novel, chapters, stats):
+        totals = Novel.objects.values_list('chapter_count', *chapter_stats.STAT_FIELDS).get(pk=novel.pk)
+        self.assertEqual(totals, (chapters, *stats))
+        chapter_stats.recount_novel(novel.pk)
+        self.assertEqual(Novel.objects.values_list('chapter_count', *chapter_stats.STAT_FIELDS).get(pk=novel.pk), totals)
+
+    def test_create_and_delete(self):
+        Chapter.objects.create(novel=self.source, title="ตอนว่าง")
+        self.assert_totals(self.source, 1, (0, 0, 0))
+        chapter = self.add_chapter(self.source, (500, 120, 1))
+        self.add_chapter(self.source, (300, 80, 1))
+        self.assert_totals(self.source, 3, (800, 200, 2))
+
+        chapter.delete()
+        self.assert_totals(self.source, 2, (300, 80, 1))
+
+    def test_move_with_update_fields(self):
+        chapter = self.add_chapter(self.source, (500, 120, 1))
+        self.add_chapter(self.source, (300, 80, 1))
+
+        chapter.novel = self.target
+        chapter.save(update_fields=['novel'])
+        self.assertEqual(chapter_stats.stats_of(Chapter.objects.get(pk=chapter.pk)), (500, 120, 1))
+        self.assert_totals(self.source, 1, (300, 80, 1))
+        self.assert_totals(self.target, 1, (500, 120, 1))
+
+    def test_move_with_full_save(self):
+        chapter = self.add_chapter(self.source, (0, 0, 0))
+        chapter.novel = self.target
+        chapter.save()
+        self.assert_totals(self.source, 0, (0, 0, 0))
+        self.assert_totals(self.target, 1, (0, 0, 0))
+
+    def test_saves_without_content_or_novel_do_not_touch_totals(self):
+        chapter = self.add_chapter(self.source, (500, 120, 1))
+        chapter.title = "ชื่อใหม่"
+        chapter.save(update_fields=['title'])
+        Chapter.objects.only('id', 'title', 'novel').get(pk=chapter.pk).save()
+        self.assert_totals(self.source, 1, (500, 120, 1))
+        self.assert_totals(self.target, 0, (0, 0, 0))
+
+    def test_edit_and_move_in_one_save(self):
+        """ saved(): แก้เนื้อหาพร้อมย้ายเรื่อง -> เรื่องเดิมหักยอดเก่า เรื่องใหม่บวกยอดใหม่ """
+        chapter = self.add_chapter(self.source, (100, 10, 1))
+        self.add_chapter(self.source, (300, 80, 1))
+        previous = (self.source.pk, chapter_stats.stats_of(chapter))
+
+        Chapter.objects.filter(pk=chapter.pk).update(novel=self.target, char_count=250, word_count=40)
+        chapter.refresh_from_db()
+        chapter_stats.saved(previous, chapter)
+        self.assert_totals(self.source, 1, (300, 80, 1))
+        self.assert_totals(self.target, 1, (250, 40, 1))
+
+        chapter.delete()
+        self.assert_totals(self.target, 0, (0, 0, 0))
+
+    def test_novel_detail_reads_stored_stats(self):
+        self.add_chapter(self.source, (500, 120, 1))
+        self.add_chapter(self.source, (300, 80, 2))
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('plotcraft:novel_detail', args=[self.source.pk]))
+        self.assertContains(response, "(2 ตอน · 200 คำ · อ่านราว 3 นาที)")
+        self.assertContains(response, "500 อักขระ · 120 คำ · 1 นาที")
+        self.assertFalse(any('"plotcraft_chapter"."content"' in q['sql'] for q in queries.captured_queries))
 
-# Create your tests here.
@@ -14,6 +14,7 @@ urlpatterns = [
     path('profile/', views.profile, name='profile'),
     path('quickguide/', auth_views.TemplateView.as_view(template_name='Quickguide.html'), name='quickguide'),
     path('search/', views.global_search, name='global_search'),
+    path('search/more/', views.global_search_more, name='global_search_more'),
 
     # ==================== NOVELS ====================
     path('notes/', views.novel_list, name='novel_list'),
@@ -66,5 +67,11 @@ urlpatterns = [
     # ==================== RAG-ASSISTED WRITING ====================
     path('api/chat/general/', views.ai_chat_general, name='ai_chat_general'),
     path('api/generate-scene/<int:scene_id>/', views.ai_generate_scene, name='ai_generate_scene'),
+    path('api/chat/stream/', views.ai_chat_stream, name='ai_chat_stream'),
+    path('api/chat/sessions/', views.chat_sessions, name='chat_sessions'),
+    path('api/chat/sessions/<int:session_id>/turns/', views.chat_session_turns, name='chat_session_turns'),
+    path('api/generate-scene/<int:scene_id>/stream/', views.ai_generate_scene_stream, name='ai_generate_scene_stream'),
     path('api/generate-character/', views.ai_generate_character, name='ai_generate_character'),
+    path('api/rag/ready/', views.rag_ready, name='rag_ready'),
+    path('api/rag/metrics/', views.rag_metrics, name='rag_metrics'),
 ]
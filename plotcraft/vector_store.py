@@ -0,0 +1,425 @@
+# plotcraft/vector_store.py
+"""
+Vector store ที่ RAGService ใช้ เลือกด้วย settings.RAG_VECTOR_STORE
+
+- "chroma_http"       : ChromaDB server (container chroma_db) แบบเดิม
+- "chroma_persistent" : ChromaDB แบบฝังใน process (PersistentClient) เก็บไฟล์ที่ RAG_VECTOR_STORE_PATH
+- "flat"              : NumPy flat index (brute force) + กรอง metadata เอง ไม่ต้องมี chromadb เลย
+                        เหมาะกับ deployment เล็กๆ / benchmark / รัน offline
+
+open_vector_client() คืน client ที่เปิด store (= collection) ตามชื่อได้ -> ใช้ทำ shard ต่อ user (ดู RAGService.store_for)
+ทุก store มี method ชุดเดียวกับ Chroma collection ที่โค้ดเราใช้ (get / upsert / update / delete / query / count)
+และคืนค่าหน้าตาเดียวกับ Chroma -> RAGService ไม่ต้องรู้ว่าข้างหลังเป็นอะไร
+"""
+import fcntl
+import json
+import os
+import shutil
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+from django.core.exceptions import ImproperlyConfigured
+
+COLLECTION_NAME = "plotcraft_collection"
+# ทุก collection ของเราขึ้นต้นแบบนี้ (ทั้งตัวรวมเดิมและ shard ต่อ user)
+COLLECTION_PREFIX = "plotcraft_"
+
+
+def open_vector_client(backend, path=None):
+    """ client ของที่เก็บ vector 1 ตัว ซึ่งมีได้หลาย collection (store) """
+    if backend == 'chroma_http':
+        import chromadb
+
+        return ChromaVectorClient(chromadb.HttpClient(
+            host=os.environ.get("CHROMA_HOST", "chroma_db"),
+            port=int(os.environ.get("CHROMA_PORT", 8000))
+        ))
+    if backend == 'chroma_persistent':
+        import chromadb
+
+        return ChromaVectorClient(chromadb.PersistentClient(path=str(path)))
+    if backend == 'flat':
+        return FlatVectorClient(path)
+    raise ImproperlyConfigured(f"Unknown RAG_VECTOR_STORE: {backend!r}")
+
+
+class ChromaVectorClient:
+    def __init__(self, client):
+        self.client = client
+
+    def store(self, name=COLLECTION_NAME):
+        return ChromaVectorStore(self.client, name)
+
+    def list_stores(self):
+        # chromadb < 0.6 คืน Collection object, ตั้งแต่ 0.6 คืนชื่อ
+        names = [getattr(c, "name", c) for c in self.client.list_collections()]
+        return sorted(name for name in names if name.startswith(COLLECTION_PREFIX))
+
+    def drop_store(self, name):
+        self.client.delete_collection(name)
+
+    def heartbeat(self):
+        self.client.heartbeat()
+
+
+class FlatVectorClient:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def store(self, name=COLLECTION_NAME):
+        return FlatVectorStore(self.path / name)
+
+    def list_stores(self):
+        return sorted(
+            p.name for p in self.path.iterdir()
+            if p.is_dir() and p.name.startswith(COLLECTION_PREFIX)
+        )
+
+    def drop_store(self, name):
+        shutil.rmtree(self.path / name, ignore_errors=True)
+
+    def heartbeat(self):
+        if not os.access(self.path, os.W_OK):
+            raise OSError(f"Vector store path is not writable: {self.path}")
+
+
+class VectorStore(ABC):
+    """ interface กลาง (ชื่อ argument และรูปแบบผลลัพธ์ตาม Chroma collection)
+        backend ที่ขาด method ไหน -> สร้าง object ไม่ได้ตั้งแต่แรก (TypeError) ไม่ใช่ไปพังตอน query """
+
+    @abstractmethod
+    def get(self, ids=None, where=None, include=("metadatas", "documents"), limit=None, offset=None):
+        ...
+
+    @abstractmethod
+    def upsert(self, ids, embeddings, documents=None, metadatas=None):
+        ...
+
+    @abstractmethod
+    def update(self, ids, metadatas=None, documents=None, embeddings=None):
+        ...
+
+    @abstractmethod
+    def delete(self, ids=None, where=None):
+        ...
+
+    @abstractmethod
+    def query(self, query_embeddings, n_results=10, where=None, include=("metadatas", "documents", "distances")):
+        ...
+
+    @abstractmethod
+    def count(self):
+        ...
+
+
+class ChromaVectorStore(VectorStore):
+    def __init__(self, client, collection_name=COLLECTION_NAME):
+        self.client = client
+        self.collection = client.get_or_create_collection(name=collection_name)
+
+    def get(self, ids=None, where=None, include=("metadatas", "documents"), limit=None, offset=None):
+        return self.collection.get(ids=ids, where=where, include=list(include), limit=limit, offset=offset)
+
+    def upsert(self, ids, embeddings, documents=None, metadatas=None):
+        self.collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def update(self, ids, metadatas=None, documents=None, embeddings=None):
+        self.collection.update(ids=ids, metadatas=metadatas, documents=documents, embeddings=embeddings)
+
+    def delete(self, ids=None, where=None):
+        self.collection.delete(ids=ids, where=where)
+
+    def query(self, query_embeddings, n_results=10, where=None, include=("metadatas", "documents", "distances")):
+        return self.collection.query(
+            query_embeddings=query_embeddings, n_results=n_results, where=where, include=list(include)
+        )
+
+    def count(self):
+        return self.collection.count()
+
+
+# ==================== NumPy flat index ====================
+
+def matches(metadata, where):
+    """ รองรับ where ของ Chroma ส่วนที่ใช้กันจริง: ค่าตรงๆ, $eq $ne $in $nin $gt $gte $lt $lte, $and, $or """
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches(metadata, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(metadata, sub) for sub in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for op, expected in condition.items():
+                if not _compare(op, value, expected):
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+def _compare(op, value, expected):
+    if op == "$eq":
+        return value == expected
+    if op == "$ne":
+        return value != expected
+    if op == "$in":
+        return value in expected
+    if op == "$nin":
+        return value not in expected
+    if value is None:
+        return False
+    if op == "$gt":
+        return value > expected
+    if op == "$gte":
+        return value >= expected
+    if op == "$lt":
+        return value < expected
+    if op == "$lte":
+        return value <= expected
+    raise ValueError(f"Unsupported where operator: {op}")
+
+
+class FlatVectorStore(VectorStore):
+    """ เก็บทุก vector ใน matrix เดียว (float32) แล้ว brute-force หา L2 distance (เท่ากับ default ของ Chroma)
+
+        ไฟล์ใน directory:
+        - vectors-<gen>.npy : matrix ของ embedding (เปิดแบบ mmap)
+        - index-<gen>.json  : ids / documents / metadatas ตามลำดับแถว
+        - CURRENT           : gen ล่าสุด (เขียนแบบ atomic)
+        ทุกการเขียนสร้าง gen ใหม่ทั้งชุด -> process อื่น (web worker) ที่อ่านอยู่ไม่เจอไฟล์ครึ่งๆ กลางๆ
+        และจะโหลดใหม่เองเมื่อเห็นว่า CURRENT เปลี่ยน ส่วนการเขียนข้าม process กันด้วย flock
+    """
+
+    def __init__(self, path):
+        import numpy as np
+
+        self.np = np
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._generation = None
+        self._ids = []
+        self._documents = []
+        self._metadatas = []
+        self._positions = {}
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+
+    # ---------- อ่าน ----------
+
+    def get(self, ids=None, where=None, include=("metadatas", "documents"), limit=None, offset=None):
+        with self._lock:
+            self._refresh()
+            rows = self._select(ids, where)
+            rows = rows[offset or 0:]
+            if limit is not None:
+                rows = rows[:limit]
+            return self._result(rows, include)
+
+    def query(self, query_embeddings, n_results=10, where=None, include=("metadatas", "documents", "distances")):
+        np = self.np
+        with self._lock:
+            self._refresh()
+            rows = self._select(None, where)
+            result = {key: [] for key in ("ids", "documents", "metadatas", "distances")}
+            for vector in query_embeddings:
+                if rows and len(self._vectors):
+                    candidates = np.asarray(self._vectors[rows])
+                    q = np.asarray(vector, dtype=np.float32)
+                    distances = ((candidates - q) ** 2).sum(axis=1)
+                    k = min(n_results, len(rows))
+                    top = np.argpartition(distances, k - 1)[:k] if k < len(rows) else np.arange(len(rows))
+                    top = top[np.argsort(distances[top], kind="stable")]
+                    picked = [rows[i] for i in top]
+                    picked_distances = [float(distances[i]) for i in top]
+                else:
+                    picked, picked_distances = [], []
+                result["ids"].append([self._ids[i] for i in picked])
+                result["documents"].append([self._documents[i] for i in picked] if "documents" in include else None)
+                result["metadatas"].append([self._metadatas[i] for i in picked] if "metadatas" in include else None)
+                result["distances"].append(picked_distances if "distances" in include else None)
+            for key in ("documents", "metadatas", "distances"):
+                if key not in include:
+                    result[key] = None
+            return result
+
+    def count(self):
+        with self._lock:
+            self._refresh()
+            return len(self._ids)
+
+    # ---------- เขียน ----------
+
+    def upsert(self, ids, embeddings, documents=None, metadatas=None):
+        documents = documents or [None] * len(ids)
+        metadatas = metadatas or [None] * len(ids)
+        with self._write() as state:
+            for doc_id, embedding, document, metadata in zip(ids, embeddings, documents, metadatas):
+                row = state.positions.get(doc_id)
+                if row is None:
+                    state.positions[doc_id] = len(state.ids)
+                    state.ids.append(doc_id)
+                    state.documents.append(document)
+                    state.metadatas.append(metadata or {})
+                    state.appended.append(embedding)
+                else:
+                    state.documents[row] = document
+                    state.metadatas[row] = metadata or {}
+                    state.set_vector(row, embedding)
+                state.dirty = True
+
+    def update(self, ids, metadatas=None, documents=None, embeddings=None):
+        with self._write() as state:
+            for i, doc_id in enumerate(ids):
+                row = state.positions.get(doc_id)
+                if row is None:
+                    continue
+                if metadatas is not None:
+                    state.metadatas[row] = metadatas[i] or {}
+                if documents is not None:
+                    state.documents[row] = documents[i]
+                if embeddings is not None:
+                    state.set_vector(row, embeddings[i])
+                state.dirty = True
+
+    def delete(self, ids=None, where=None):
+        ids = set(ids) if ids is not None else None
+        with self._write() as state:
+            keep = [
+                row for row, doc_id in enumerate(state.ids)
+                if not ((ids is None or doc_id in ids) and (where is None or matches(state.metadatas[row], where)))
+            ]
+            if len(keep) != len(state.ids):
+                state.keep_rows(keep)
+
+    # ---------- ภายใน ----------
+
+    def _select(self, ids, where):
+        if ids is not None:
+            rows = [self._positions[doc_id] for doc_id in ids if doc_id in self._positions]
+        else:
+            rows = range(len(self._ids))
+        return [row for row in rows if matches(self._metadatas[row], where)]
+
+    def _result(self, rows, include):
+        return {
+            "ids": [self._ids[row] for row in rows],
+            "documents": [self._documents[row] for row in rows] if "documents" in include else None,
+            "metadatas": [self._metadatas[row] for row in rows] if "metadatas" in include else None,
+            "embeddings": [self._vectors[row].tolist() for row in rows] if "embeddings" in include else None,
+        }
+
+    def _current_generation(self):
+        try:
+            return int((self.path / "CURRENT").read_text())
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _refresh(self):
+        """ โหลดไฟล์ใหม่ถ้า process อื่นเขียน gen ใหม่ไปแล้ว """
+        generation = self._current_generation()
+        if generation == self._generation:
+            return
+        if generation == 0:
+            self._ids, self._documents, self._metadatas = [], [], []
+            self._vectors = self.np.zeros((0, 0), dtype=self.np.float32)
+        else:
+            index = json.loads((self.path / f"index-{generation}.json").read_text(encoding="utf-8"))
+            self._ids = index["ids"]
+            self._documents = index["documents"]
+            self._metadatas = index["metadatas"]
+            self._vectors = self.np.load(self.path / f"vectors-{generation}.npy", mmap_mode="r")
+        self._positions = {doc_id: row for row, doc_id in enumerate(self._ids)}
+        self._generation = generation
+
+    def _write(self):
+        return _FlatWrite(self)
+
+    def _commit(self, state):
+        generation = self._current_generation() + 1
+        self.np.save(self.path / f"vectors-{generation}.npy", state.matrix())
+        index = {"ids": state.ids, "documents": state.documents, "metadatas": state.metadatas}
+        (self.path / f"index-{generation}.json").write_text(json.dumps(index, ensure_ascii=False), encoding="utf-8")
+
+        tmp = self.path / "CURRENT.tmp"
+        tmp.write_text(str(generation))
+        os.replace(tmp, self.path / "CURRENT")
+
+        # ลบ gen เก่า (process ที่ mmap ไฟล์เก่าอยู่ยังอ่านต่อได้จนกว่าจะโหลดใหม่)
+        for old in self.path.glob("*-*.*"):
+            stem = old.stem.rsplit("-", 1)[-1]
+            if stem.isdigit() and int(stem) < generation - 1:
+                old.unlink(missing_ok=True)
+
+
+class _FlatState:
+    """ สำเนาที่แก้ได้ของ store ระหว่างเขียน (vector เดิมเป็น numpy, ที่เพิ่มใหม่เก็บเป็น list ไว้ต่อท้ายทีเดียว) """
+
+    def __init__(self, store):
+        self.np = store.np
+        self.ids = list(store._ids)
+        self.documents = list(store._documents)
+        self.metadatas = list(store._metadatas)
+        self.positions = dict(store._positions)
+        self.vectors = self.np.array(store._vectors, dtype=self.np.float32) if len(store._ids) else None
+        self.appended = []
+        self.dirty = False
+
+    def set_vector(self, row, embedding):
+        existing = len(self.vectors) if self.vectors is not None else 0
+        if row < existing:
+            self.vectors[row] = embedding
+        else:
+            self.appended[row - existing] = embedding
+
+    def keep_rows(self, keep):
+        self.matrix_in_place()
+        self.ids = [self.ids[row] for row in keep]
+        self.documents = [self.documents[row] for row in keep]
+        self.metadatas = [self.metadatas[row] for row in keep]
+        self.vectors = self.vectors[keep] if self.vectors is not None else None
+        self.positions = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        self.dirty = True
+
+    def matrix_in_place(self):
+        if self.appended:
+            new_rows = self.np.asarray(self.appended, dtype=self.np.float32)
+            self.vectors = new_rows if self.vectors is None else self.np.vstack([self.vectors, new_rows])
+            self.appended = []
+
+    def matrix(self):
+        self.matrix_in_place()
+        if self.vectors is None:
+            return self.np.zeros((0, 0), dtype=self.np.float32)
+        return self.vectors
+
+
+class _FlatWrite:
+    """ context manager: lock ข้าม process -> โหลดล่าสุด -> ให้แก้ -> เขียน gen ใหม่ (ถ้ามีอะไรเปลี่ยน) """
+
+    def __init__(self, store):
+        self.store = store
+
+    def __enter__(self):
+        self.store._lock.acquire()
+        self.lock_file = open(self.store.path / "LOCK", "w")
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        self.store._refresh()
+        self.state = _FlatState(self.store)
+        return self.state
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None and self.state.dirty:
+                self.store._commit(self.state)
+                self.store._refresh()
+        finally:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+            self.lock_file.close()
+            self.store._lock.release()
+        return False
@@ -1,16 +1,17 @@
 import os
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, logout
-from django.db.models import Q
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse, HttpResponseForbidden, HttpResponse
+from django.http import JsonResponse, HttpResponseForbidden, HttpResponse, StreamingHttpResponse, Http404
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
 from django.conf.urls.static import static
 from django.urls import reverse
 import json
+from asgiref.sync import sync_to_async
 
 import io
 from django.template.loader import render_to_string
@@ -23,7 +24,7 @@ from django.utils.encoding import escape_uri_path
 
 from .models import (
     Novel, Chapter, Character, Location, Item,
-    Scene, Timeline, TimelineEvent, Profile, User
+    Scene, Timeline, TimelineEvent, Profile, User, ChatSession
 )
 from .forms import (
     UserForm, RegisterForm, ProfileForm, NovelForm, ChapterForm,
@@ -31,6 +32,9 @@ from .forms import (
 )
 
 from .rag_service import rag_service
+from .bulk_delete import delete_account, delete_novel
+from .chat_sessions import list_sessions, list_turns, open_session
+from . import projections, search_index
 
 
 # ==================== AUTHENTICATION & PROFILE (from myapp) ====================
@@ -42,13 +46,18 @@ def landing(request):
 def home(request):
     max_items = 3
     if request.user.is_authenticated:
-        characters = Character.objects.filter(created_by=request.user).order_by('-created_at')[:max_items]
-        novels = Novel.objects.filter(author=request.user).order_by('-updated_at')[:max_items]
-        locations = Location.objects.filter(created_by=request.user).order_by('-created_at')[:max_items]
+        characters = Character.objects.filter(created_by=request.user)
+        novels = Novel.objects.filter(author=request.user)
+        locations = Location.objects.filter(created_by=request.user)
     else:
-        characters = Character.objects.all().order_by('-created_at')[:max_items]
-        novels = Novel.objects.all().order_by('-updated_at')[:max_items]
-        locations = Location.objects.all().order_by('-created_at')[:max_items]
+        characters = Character.objects.all()
+        novels = Novel.objects.all()
+        locations = Location.objects.all()
+
+    # การ์ดบน dashboard ใช้แค่ชื่อ/รูป/excerpt (ดู projections.py)
+    characters = projections.home_characters(characters).order_by('-created_at')[:max_items]
+    novels = projections.home_novels(novels).order_by('-updated_at')[:max_items]
+    locations = projections.home_locations(locations).order_by('-created_at')[:max_items]
 
     return render(request, 'home.html', {
         'characters': characters,
@@ -85,7 +94,7 @@ def profile(request):
         if 'delete_account' in request.POST:
             user = request.user
             logout(request)
-            user.delete()
+            delete_account(user)
             return redirect('plotcraft:landing')
 
         u_form = UserForm(request.POST, instance=request.user)
@@ -105,67 +114,49 @@ def profile(request):
 
 @login_required
 def global_search(request):
-    query = request.GET.get('q', '')
-    results = {}
-    
-    if query:
-        results['projects'] = Novel.objects.filter(
-            Q(title__icontains=query) | Q(synopsis__icontains=query),
-            author=request.user
-        )
-
-        results['characters'] = Character.objects.filter(
-            Q(name__icontains=query) | 
-            Q(background__icontains=query) | 
-            Q(personality__icontains=query) |
-            Q(appearance__icontains=query) |
-            Q(alias__icontains=query),
-            created_by=request.user
-        )
-
-        results['scenes'] = Scene.objects.filter(
-            Q(title__icontains=query) | 
-            Q(content__icontains=query),
-            created_by=request.user
-        )
-
-        results['timeline_events'] = TimelineEvent.objects.filter(
-            Q(title__icontains=query) | 
-            Q(description__icontains=query),
-            timeline__created_by=request.user
-        )
+    """ ค้นหาทุกอย่างของผู้ใช้จาก search index (search_index.py): จำนวน + หน้าแรกของแต่ละหมวด
+        (cache ต่อผู้ใช้) หน้าถัดไปโหลดทีละหมวดผ่าน global_search_more (htmx)
+        mode=semantic/hybrid ค้นตามความหมายจาก embedding (hybrid = รวมกับผลแบบคำตรงตัวด้วย RRF) """
+    query = request.GET.get('q', '').strip()
+    mode = request.GET.get('mode', 'lexical')
+    if mode not in search_index.MODES:
+        mode = 'lexical'
+    categories = search_index.overview(request.user.id, query, mode) if query else []
+    return render(request, 'search_results.html', {
+        'query': query,
+        'mode': mode,
+        'modes': [('lexical', 'คำตรงตัว'), ('semantic', 'ความหมาย'), ('hybrid', 'ผสม')],
+        'categories': categories,
+        'total': sum(category.count for category in categories),
+    })
 
-        results['locations'] = Location.objects.filter(
-            Q(name__icontains=query) |
-            Q(history__icontains=query) |
-            Q(terrain__icontains=query) |
-            Q(climate__icontains=query) |
-            Q(ecosystem__icontains=query) |
-            Q(myths__icontains=query) |
-            Q(culture__icontains=query) |
-            Q(politics__icontains=query) |
-            Q(economy__icontains=query) |
-            Q(language__icontains=query),
-            created_by=request.user
-        )
 
-        results['items'] = Item.objects.filter(
-            Q(name__icontains=query) |
-            Q(appearance__icontains=query) |
-            Q(history__icontains=query) |
-            Q(abilities__icontains=query) |
-            Q(limitations__icontains=query),
-            created_by=request.user
+@login_required
+def global_search_more(request):
+    """ partial ผลค้นหาหน้าถัดไปของหมวดเดียว (keyset: after = cursor จากหน้าก่อน) """
+    query = request.GET.get('q', '').strip()
+    entity_type = request.GET.get('type', '')
+    if not query or entity_type not in search_index.SOURCES:
+        return HttpResponse(status=400)
+    try:
+        hits, next_after = search_index.search_page(
+            request.user.id, query, entity_type, after=request.GET.get('after') or None,
         )
-
-    return render(request, 'search_results.html', {'query': query, 'results': results})
+    except ValueError:
+        return HttpResponse(status=400)
+    return render(request, 'search_hits.html', {
+        'query': query,
+        'entity_type': entity_type,
+        'hits': hits,
+        'next_after': next_after,
+    })
 
 
 # ==================== NOVEL & CHAPTER ====================
 
 @login_required
 def novel_list(request):
-    novels = Novel.objects.filter(author=request.user).order_by('-updated_at')
+    novels = projections.novel_cards(Novel.objects.filter(author=request.user)).order_by('-updated_at')
     return render(request, 'notes/novel_list.html', {'novels': novels})
 
 
@@ -199,7 +190,8 @@ def novel_edit(request, pk):
 @login_required
 def novel_detail(request, pk):
     novel = get_object_or_404(Novel, pk=pk, author=request.user)
-    chapters = novel.chapters.all().order_by('order')
+    # สถิติอยู่ในคอลัมน์แล้ว (chapter_stats.py) ไม่ต้องโหลดเนื้อหาทุกตอนมาแค่นับตัวอักษร
+    chapters = novel.chapters.defer('content').order_by('order')
     return render(request, 'notes/novel_detail.html', {'novel': novel, 'chapters': chapters})
 
 
@@ -207,7 +199,7 @@ def novel_detail(request, pk):
 def novel_delete(request, pk):
     novel = get_object_or_404(Novel, pk=pk, author=request.user)
     if request.method == 'POST':
-        novel.delete()
+        delete_novel(novel)
         return redirect('plotcraft:novel_list')
     return render(request, 'notes/novel_confirm_delete.html', {'novel': novel})
 
@@ -278,7 +270,7 @@ def change_chapter_status(request, chapter_id, status):
     elif status == 'draft':
         chapter.is_draft = True
         
-    chapter.save()
+    chapter.save(update_fields=['is_draft', 'updated_at'])
     
     # ส่งค่ากลับไปบอกหน้าเว็บว่าทำสำเร็จแล้ว
     return JsonResponse({'success': True, 'is_draft': chapter.is_draft})
@@ -319,7 +311,7 @@ def worldbuilding_overview(request):
 
 @login_required
 def character_list(request):
-    base_characters = Character.objects.filter(created_by=request.user)
+    base_characters = projections.character_cards(Character.objects.filter(created_by=request.user))
     
     project_id = request.GET.get('project')
     if project_id:
@@ -421,7 +413,7 @@ def location_create(request):
 
 @login_required
 def location_list(request):
-    locations = Location.objects.filter(created_by=request.user).order_by('-created_at')
+    locations = projections.location_cards(Location.objects.filter(created_by=request.user)).order_by('-created_at')
     return render(request, 'worldbuilding/location_list.html', {'locations': locations})
 
 
@@ -488,7 +480,7 @@ def item_create(request):
 
 @login_required
 def item_list(request):
-    items = Item.objects.filter(created_by=request.user).order_by('-created_at')
+    items = projections.item_cards(Item.objects.filter(created_by=request.user)).order_by('-created_at')
     return render(request, 'worldbuilding/item_list.html', {'items': items})
 
 
@@ -534,8 +526,8 @@ def item_edit(request, pk):
 
 @login_required
 def scene_list(request):
-    projects = Novel.objects.filter(author=request.user)
-    scenes = Scene.objects.filter(created_by=request.user).order_by('order')
+    projects = projections.scene_projects(Novel.objects.filter(author=request.user))
+    scenes = projections.scene_cards(Scene.objects.filter(created_by=request.user)).order_by('order')
     
     selected_project_id = request.GET.get('project')
     selected_project = None
@@ -741,24 +733,44 @@ def timeline_event_delete(request, pk):
 
 
 # ==================== RAG SERVICE INTEGRATION ====================
+# view ที่รอ Gemini เป็น async ทั้งหมด (รันบน ASGI: gunicorn + UvicornWorker)
+# ระหว่างรอ LLM worker ยังรับ request อื่น (หน้า CRUD) ต่อได้ ไม่ถูกจองทั้งตัวเหมือน sync worker
+
+async def _get_owned_scene(scene_id, user):
+    """ ดึง Scene พร้อมทุกอย่างที่ prompt ต้องใช้ (ใน async view ห้าม lazy-load relation) """
+    try:
+        return await Scene.objects.select_related(
+            'pov_character', 'location', 'project__story_summary'
+        ).prefetch_related('characters').aget(
+            pk=scene_id, project__author=user
+        )
+    except Scene.DoesNotExist:
+        raise Http404("No Scene matches the given query.")
+
+def _wants_fresh(request):
+    """ ผู้ใช้สั่ง "ร่างใหม่" (ไม่เอาร่างเดิมใน cache): ?fresh=1 หรือ {"fresh": true} """
+    if request.GET.get('fresh') in ('1', 'true'):
+        return True
+    try:
+        return bool(json.loads(request.body or b'{}').get('fresh'))
+    except (ValueError, AttributeError):
+        return False
 
 @csrf_exempt
 @login_required
-def ai_generate_scene(request, scene_id):
+async def ai_generate_scene(request, scene_id):
     """ API สำหรับกดปุ่ม 'Generate Draft' """
     if request.method == "POST":
         # 1. ดึงข้อมูล Scene มา (ต้องเป็นเจ้าของเท่านั้น)
         # หมายเหตุ: ใน models.py ของคุณ Scene ไม่ได้ผูกกับ User โดยตรง แต่ผูกผ่าน Project -> Owner
         # ดังนั้นต้องเช็คผ่าน project__owner
-        scene = get_object_or_404(Scene, pk=scene_id, project__author=request.user)
-        
-        # 2. เรียก AI ให้ร่างให้
-        draft_content = rag_service.generate_scene_draft(scene)
+        scene = await _get_owned_scene(scene_id, await request.auser())
         
-        # 3. ส่งเนื้อหากลับไป
+        # 2. เรียก AI ให้ร่างให้ (ฉากเดิมไม่เปลี่ยน -> ได้ร่างเดิมจาก cache เว้นแต่ส่ง fresh มา)
         try:
-             draft_content = rag_service.generate_scene_draft(scene)
-             return JsonResponse({'draft': draft_content})
+             draft_content, cached = await rag_service.agenerate_scene_draft(scene, fresh=_wants_fresh(request))
+             # 3. ส่งเนื้อหากลับไป
+             return JsonResponse({'draft': draft_content, 'cached': cached})
         except Exception as e:
              return JsonResponse({'error': str(e)}, status=500)
 
@@ -766,28 +778,132 @@ def ai_generate_scene(request, scene_id):
 
 @csrf_exempt
 @login_required
-def ai_chat_general(request):
+async def ai_chat_general(request):
     if request.method == "POST":
         try:
             data = json.loads(request.body)
             user_message = data.get('message', '')
-            novel_id = data.get('novel_id')
+            user = await request.auser()
+            session = await _open_chat_session(user, data, user_message)
             
-            reply = rag_service.chat_with_editor(
+            reply = await rag_service.achat_with_editor(
                 user_message, 
-                novel_id=novel_id, 
-                user_id=request.user.id
+                novel_id=session.novel_id, 
+                user_id=user.id,
+                session=session
             )
             
-            return JsonResponse({'reply': reply})
+            return JsonResponse({'reply': reply, 'session_id': session.pk})
+        except ChatSession.DoesNotExist:
+            return JsonResponse({'error': 'ไม่พบห้องแชทนี้'}, status=404)
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
     
     return JsonResponse({'error': 'Method not allowed'}, status=405)
 
+def _sse_response(chunks, meta=None):
+    """ ส่งข้อความจาก async generator ออกไปเป็น Server-Sent Events (data: {"delta": ...}) ทีละท่อน
+        meta (ถ้ามี) ถูกส่งก่อนเป็น event: meta เช่น session_id ของห้องแชท """
+    async def events():
+        try:
+            # ส่ง comment ไปก่อนให้ header ออกทันที ไม่ต้องรอ retrieval/token แรก
+            yield ": stream-start\n\n"
+            if meta:
+                yield f"event: meta\ndata: {json.dumps(meta)}\n\n"
+            async for chunk in chunks:
+                yield f"data: {json.dumps({'delta': chunk}, ensure_ascii=False)}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        finally:
+            # client หลุด -> ASGI handler ยกเลิก response -> ปิด stream ของ LLM ต่อให้ด้วย
+            await chunks.aclose()
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream; charset=utf-8')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # กัน nginx buffer ทั้งก้อน
+    return response
+
 @csrf_exempt
 @login_required
-def ai_generate_character(request):
+async def ai_chat_stream(request):
+    """ เหมือน ai_chat_general แต่ตอบกลับเป็น stream (SSE) """
+    if request.method != "POST":
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    try:
+        data = json.loads(request.body)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    user = await request.auser()
+    message = data.get('message', '')
+    try:
+        session = await _open_chat_session(user, data, message)
+    except ChatSession.DoesNotExist:
+        return JsonResponse({'error': 'ไม่พบห้องแชทนี้'}, status=404)
+    return _sse_response(rag_service.astream_chat_with_editor(
+        message,
+        novel_id=session.novel_id,
+        user_id=user.id,
+        session=session
+    ), meta={'session_id': session.pk})
+
+async def _open_chat_session(user, data, message):
+    """ ห้องแชทที่ส่ง session_id มา (ต้องเป็นของ user) หรือห้องใหม่ผูกกับ novel_id """
+    return await sync_to_async(open_session)(
+        user.id, session_id=data.get('session_id'), novel_id=data.get('novel_id'), first_message=message
+    )
+
+def _page_limit(request, default=20, maximum=100):
+    try:
+        return max(1, min(int(request.GET.get('limit', default)), maximum))
+    except ValueError:
+        return default
+
+@login_required
+async def chat_sessions(request):
+    """ รายการห้องแชทของผู้ใช้ (ใหม่สุดก่อน) ?novel_id=&before=<cursor>&limit= """
+    user = await request.auser()
+    try:
+        sessions, next_before = await sync_to_async(list_sessions)(
+            user.id, novel_id=request.GET.get('novel_id'), before=request.GET.get('before'),
+            limit=_page_limit(request),
+        )
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'sessions': sessions, 'next_before': next_before})
+
+@login_required
+async def chat_session_turns(request, session_id):
+    """ ประวัติของห้องแชท ทีละหน้าจากใหม่ไปเก่า ?before=<turn id>&limit= (ใช้ resume ห้องเดิม) """
+    user = await request.auser()
+    try:
+        session = await ChatSession.objects.aget(pk=session_id, user=user)
+    except ChatSession.DoesNotExist:
+        raise Http404("No ChatSession matches the given query.")
+    try:
+        turns, next_before = await sync_to_async(list_turns)(
+            session, before=request.GET.get('before'), limit=_page_limit(request),
+        )
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({
+        'session': {'id': session.pk, 'title': session.title, 'novel_id': session.novel_id,
+                    'turn_count': session.turn_count},
+        'turns': turns,
+        'next_before': next_before,
+    })
+
+@csrf_exempt
+@login_required
+async def ai_generate_scene_stream(request, scene_id):
+    """ เหมือน ai_generate_scene แต่ส่งร่างกลับมาทีละท่อน (SSE) """
+    if request.method != "POST":
+        return JsonResponse({'error': 'Invalid method'}, status=405)
+    scene = await _get_owned_scene(scene_id, await request.auser())
+    return _sse_response(rag_service.astream_scene_draft(scene, fresh=_wants_fresh(request)))
+
+@csrf_exempt
+@login_required
+async def ai_generate_character(request):
     """ API สำหรับ Gen ข้อมูลตัวละคร """
     if request.method == "POST":
         try:
@@ -795,7 +911,7 @@ def ai_generate_character(request):
             concept = data.get('concept', '')
             
             # เรียก AI
-            char_data = rag_service.generate_character_data(concept)
+            char_data = await rag_service.agenerate_character_data(concept)
             
             if char_data:
                 return JsonResponse({'success': True, 'data': char_data})
@@ -805,4 +921,17 @@ def ai_generate_character(request):
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
     
-    return JsonResponse({'error': 'Method not allowed'}, status=405)
\ No newline at end of file
+    return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+
+def rag_ready(request):
+    """ Readiness check ของระบบ AI (ใช้กับ healthcheck ของ docker / load balancer) ไม่ต้อง login
+        -> ตอบแค่ ready + สถานะแต่ละส่วนแบบ true/false ตัวเลขภายในอยู่ที่ rag_metrics """
+    status = rag_service.readiness()
+    return JsonResponse(status, status=200 if status['ready'] else 503)
+
+
+@staff_member_required
+def rag_metrics(request):
+    """ ตัวเลขของ LLM gateway (จำนวนที่ล้มเหลว / latency / สถานะ breaker), hit rate ของ cache และคิว index """
+    return JsonResponse(rag_service.metrics())